@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+合成の単位の決め方のシミュレーション.
+
+区切りごとに1回ずつ合成する従来の分割と, AdaptiveChunkerでまとめた分割を, 合成時間と再生時間のモデルで
+比較する. 合成は投入順に1つずつ, 再生は合成が終わり直前の再生が終わった時点で始まるとして,
+最初の音声までの時間, 合成の要求数, 再生の途切れの合計, 読み終わるまでの時間を出す.
+チャンカーは初期値のままのものと, 合成時間を観測して較正したものを並べる.
+
+    python benchmarks/bench_chunker.py
+    python benchmarks/bench_chunker.py --overhead 0.5 --sec-per-char 0.05 --speed-scale 1.2
+"""
+
+import argparse
+import random
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'src'))
+
+from corpora import CORPUS_SIZES, make_chat_text, make_pasted_log
+
+import utilities.text_utilities as txtutl
+
+CHARS_PER_SEC = 6.0
+UNPUNCTUATED_PHRASE = 'きょうはとてもいい天気なので東京タワーまで散歩に行こうと思っていますがみなさんはどうしますか'
+
+
+def simulate(texts: list[str], overhead: float, sec_per_char: float, speed_scale: float) -> tuple[float, float, float]:
+    """
+    Simulate the synthesis and the playback of the texts.
+
+    Args:
+        texts (list[str]): 1回ずつ合成する文章
+        overhead (float): 1回の合成の文字数によらない時間[秒]
+        sec_per_char (float): 1文字あたりの合成時間[秒]
+        speed_scale (float): 話速
+
+    Returns:
+        tuple[float, float, float]: 最初の音声までの時間, 再生の途切れの合計, 読み終わるまでの時間[秒]
+    """
+    synthesis_end = 0.0
+    playback_end = None
+    first_audio = 0.0
+    stall = 0.0
+    for text in texts:
+        synthesis_end += overhead + sec_per_char * len(text)
+        if playback_end is None:
+            first_audio = synthesis_end
+            playback_start = synthesis_end
+        else:
+            stall += max(synthesis_end - playback_end, 0.0)
+            playback_start = max(synthesis_end, playback_end)
+        playback_end = playback_start + len(text) / (CHARS_PER_SEC * speed_scale)
+    return first_audio, stall, playback_end or 0.0
+
+
+def make_texts() -> dict[str, str]:
+    """
+    Make the texts of the chat, the paste, the log and the text without split marks.
+
+    Returns:
+        dict[str, str]: 名前と文章の辞書
+    """
+    rng = random.Random(0)
+    unpunctuated = ''.join(UNPUNCTUATED_PHRASE[rng.randint(0, 10) :] for _ in range(8))
+    return {
+        'message': make_chat_text(CORPUS_SIZES['message']),
+        'paste': make_chat_text(CORPUS_SIZES['paste']),
+        'log': make_pasted_log(CORPUS_SIZES['paste']),
+        'no_marks': unpunctuated,
+    }
+
+
+def main() -> None:
+    """
+    Run the simulation and print the results.
+    """
+    parser = argparse.ArgumentParser(description='合成の単位の決め方のシミュレーション')
+    parser.add_argument('--overhead', type=float, default=0.25, help='1回の合成の固定の時間[秒]')
+    parser.add_argument('--sec-per-char', type=float, default=0.03, help='1文字あたりの合成時間[秒]')
+    parser.add_argument('--speed-scale', type=float, default=1.2, help='話速')
+    args = parser.parse_args()
+
+    word_marks = txtutl.WordMarks()
+    calibrated = txtutl.AdaptiveChunker(chars_per_sec=CHARS_PER_SEC)
+    rng = random.Random(0)
+    for _ in range(200):
+        char_count = rng.randint(2, 120)
+        calibrated.observe(char_count, args.overhead + args.sec_per_char * char_count)
+    splitters = {
+        'segments': lambda segments: [segment for segment, _ in segments],
+        'prior': txtutl.AdaptiveChunker(chars_per_sec=CHARS_PER_SEC).chunk_segments,
+        'calibrated': calibrated.chunk_segments,
+    }
+
+    print(
+        f'{"text":>9} {"split":>11} {"requests":>9} {"first[s]":>9} {"first_len":>10} {"stall[s]":>9} {"total[s]":>9}',
+    )
+    for name, text in make_texts().items():
+        segments = list(word_marks.iter_segments(text, 'URL省略'))
+        for split_name, split in splitters.items():
+            if split_name == 'segments':
+                texts = split(segments)
+            else:
+                texts = split(segments, args.speed_scale)
+            first_audio, stall, total = simulate(texts, args.overhead, args.sec_per_char, args.speed_scale)
+            print(
+                f'{name:>9} {split_name:>11} {len(texts):>9} {first_audio:>9.2f} {len(texts[0]):>10} '
+                f'{stall:>9.2f} {total:>9.2f}',
+            )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+"""
+Google TTSのクライアントのベンチマーク.
+
+プロセス内で動かす偽のgRPCサーバ(SynthesizeSpeechに固定の音声を返す)を相手に,
+同期クライアントをスレッドで並べる場合と, 非同期クライアントで1つのチャンネルに多重化する場合の
+1メッセージ分の区切り(セグメント)をまとめて合成する時間を比べる.
+
+    python benchmarks/bench_google_tts.py
+    python benchmarks/bench_google_tts.py --segments 1 4 16 --latency-ms 50
+"""
+
+import argparse
+import asyncio
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'src'))
+
+import grpc
+import stub_engine
+from google.auth.credentials import AnonymousCredentials
+from google.cloud import texttospeech
+from google.cloud.texttospeech_v1.services.text_to_speech.transports import (
+    TextToSpeechGrpcAsyncIOTransport,
+    TextToSpeechGrpcTransport,
+)
+
+from tts.google_tts_wrapper import AsyncGoogleTTSWrapper, GoogleTTSWrapper
+
+SERVICE_NAME = 'google.cloud.texttospeech.v1.TextToSpeech'
+TTS_CONFIGS = {'USE_TTS': 'GOOGLE', 'GOOGLE': {'SPEAKER_ID': 1, 'SPEED_SCALE': 1.25, 'VOLUME_SCALE': 1.0}}
+REPEAT = 5
+
+
+async def start_fake_server(latency: float, clip_duration: float) -> tuple[grpc.aio.Server, str]:
+    """
+    Start the fake Text-to-Speech gRPC server.
+
+    Args:
+        latency (float): 各リクエストに加える遅延[秒]
+        clip_duration (float): 返す音声の長さ[秒]
+
+    Returns:
+        tuple[grpc.aio.Server, str]: 起動したサーバと, ポートを含むアドレス
+    """
+    audio_content = stub_engine.make_silent_wav(clip_duration)
+
+    async def synthesize_speech(
+        request: texttospeech.SynthesizeSpeechRequest,  # noqa: ARG001
+        context: grpc.aio.ServicerContext,  # noqa: ARG001
+    ) -> texttospeech.SynthesizeSpeechResponse:
+        await asyncio.sleep(latency)
+        return texttospeech.SynthesizeSpeechResponse(audio_content=audio_content)
+
+    handler = grpc.method_handlers_generic_handler(
+        SERVICE_NAME,
+        {
+            'SynthesizeSpeech': grpc.unary_unary_rpc_method_handler(
+                synthesize_speech,
+                request_deserializer=texttospeech.SynthesizeSpeechRequest.deserialize,
+                response_serializer=texttospeech.SynthesizeSpeechResponse.serialize,
+            ),
+        },
+    )
+    server = grpc.aio.server()
+    server.add_generic_rpc_handlers((handler,))
+    port = server.add_insecure_port('127.0.0.1:0')
+    await server.start()
+    return server, f'127.0.0.1:{port}'
+
+
+def make_sync_wrapper(address: str) -> GoogleTTSWrapper:
+    """
+    Make the synchronous wrapper connected to the fake server.
+
+    Args:
+        address (str): 偽のサーバのアドレス
+
+    Returns:
+        GoogleTTSWrapper: 偽のサーバに繋いだ同期クライアント
+    """
+    wrapper = GoogleTTSWrapper.__new__(GoogleTTSWrapper)
+    transport = TextToSpeechGrpcTransport(channel=grpc.insecure_channel(address))
+    # NOTE: 認証情報を探しに行かないよう, __init__を通さずに偽のサーバに繋いだクライアントを持たせる.
+    wrapper.client = texttospeech.TextToSpeechClient(transport=transport)
+    wrapper.speakers_name_dict = {}
+    wrapper.synthesis_params = {}
+    return wrapper
+
+
+def make_async_wrapper(address: str) -> AsyncGoogleTTSWrapper:
+    """
+    Make the asynchronous wrapper connected to the fake server.
+
+    Args:
+        address (str): 偽のサーバのアドレス
+
+    Returns:
+        AsyncGoogleTTSWrapper: 偽のサーバに繋いだ非同期クライアント
+    """
+    transport = TextToSpeechGrpcAsyncIOTransport(
+        channel=grpc.aio.insecure_channel(address),
+        credentials=AnonymousCredentials(),
+    )
+    return AsyncGoogleTTSWrapper(client=texttospeech.TextToSpeechAsyncClient(transport=transport))
+
+
+async def synthesize_sync(wrapper: GoogleTTSWrapper, segment_count: int) -> float:
+    """
+    Synthesize the segments with the synchronous client on threads, as the bot would without the async client.
+
+    Args:
+        wrapper (GoogleTTSWrapper): 同期クライアント
+        segment_count (int): セグメント数
+
+    Returns:
+        float: 全セグメントの合成に掛かった時間[秒]
+    """
+
+    def synthesize(text: str) -> bytes:
+        audio_query = wrapper.generate_audio_query(text, TTS_CONFIGS)
+        return wrapper.generate_voice(audio_query, TTS_CONFIGS)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[asyncio.to_thread(synthesize, f'セグメント{i}') for i in range(segment_count)])
+    return time.perf_counter() - start
+
+
+async def synthesize_async(wrapper: AsyncGoogleTTSWrapper, segment_count: int) -> float:
+    """
+    Synthesize the segments concurrently with the asynchronous client.
+
+    Args:
+        wrapper (AsyncGoogleTTSWrapper): 非同期クライアント
+        segment_count (int): セグメント数
+
+    Returns:
+        float: 全セグメントの合成に掛かった時間[秒]
+    """
+
+    async def synthesize(text: str) -> bytes:
+        audio_query = await wrapper.generate_audio_query(text, TTS_CONFIGS)
+        return await wrapper.generate_voice(audio_query, TTS_CONFIGS)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[synthesize(f'セグメント{i}') for i in range(segment_count)])
+    return time.perf_counter() - start
+
+
+async def main() -> None:
+    """
+    Run the benchmark and print the results.
+    """
+    parser = argparse.ArgumentParser(description='Google TTSのクライアントのベンチマーク')
+    parser.add_argument('--segments', type=int, nargs='+', default=[1, 8, 32], help='同時に合成するセグメント数')
+    parser.add_argument('--latency-ms', type=float, default=20.0, help='偽のサーバの応答遅延[ミリ秒]')
+    parser.add_argument('--clip-sec', type=float, default=1.0, help='返す音声の長さ[秒]')
+    args = parser.parse_args()
+
+    server, address = await start_fake_server(args.latency_ms / 1000, args.clip_sec)
+    sync_wrapper = make_sync_wrapper(address)
+    async_wrapper = make_async_wrapper(address)
+    # NOTE: 接続の確立を計測から外すためのウォームアップ.
+    await synthesize_sync(sync_wrapper, 1)
+    await synthesize_async(async_wrapper, 1)
+
+    print(f'{"segments":>9} {"sync+threads[ms]":>17} {"async[ms]":>10}')
+    for segment_count in args.segments:
+        sync_times = [await synthesize_sync(sync_wrapper, segment_count) for _ in range(REPEAT)]
+        async_times = [await synthesize_async(async_wrapper, segment_count) for _ in range(REPEAT)]
+        print(
+            f'{segment_count:>9} {statistics.median(sync_times) * 1000:>17.1f} '
+            f'{statistics.median(async_times) * 1000:>10.1f}',
+        )
+
+    sync_wrapper.client.transport.close()
+    await async_wrapper.close()
+    await server.stop(None)
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
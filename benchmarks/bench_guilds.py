@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+"""
+多数のギルドを想定したギルドごとの状態と再生キューのベンチマーク.
+
+Discordに繋がず, 偽のギルドとボイスクライアントで次を計る.
+  - ギルドの状態1件あたりのメモリ(再生キュー無し/有り)
+  - 全ギルドに読み上げを投入したときのクリップのスループット
+  - 1つのギルドに大量に投入されているときの, 他のギルドの待ち時間
+
+    python benchmarks/bench_guilds.py
+    python benchmarks/bench_guilds.py --guilds 1000 --clips 5 --synthesis-ms 20
+"""
+
+import argparse
+import asyncio
+import functools
+import statistics
+import sys
+import time
+import tracemalloc
+from collections.abc import Callable
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'src'))
+
+import stub_engine
+
+from yomiagecode.guild_state import GuildStates
+
+CONFIGS = {
+    'DISCORD': {'TARGET_TEXT_CHANNEL': 1, 'TARGET_VOICE_CHANNEL': 2},
+    'TTS': {'USE_TTS': 'VOICEVOX'},
+    'FFMPEG': {'FADE_LEN': 0.01},
+    'PLAYBACK': {'PREFETCH_DEPTH': 2, 'SYNTHESIS_CONCURRENCY': 2},
+}
+CLIP = stub_engine.make_silent_wav(0.1)
+
+
+class FakeVoiceClient:
+    """
+    The voice client which finishes playback immediately.
+    """
+
+    def is_connected(self) -> bool:
+        """
+        Always connected.
+        """
+        return True
+
+    def play(self, source: object, after: Callable[[Exception | None], None]) -> None:  # noqa: ARG002
+        """
+        Finish the playback at once.
+        """
+        after(None)
+
+
+class FakeGuild:
+    """
+    The guild with only the attributes used by the guild state and the scheduler.
+    """
+
+    __slots__ = ('id', 'voice_client')
+
+    def __init__(self, guild_id: int) -> None:
+        """
+        Initialize the fake guild.
+
+        Args:
+            guild_id (int): ギルドID
+        """
+        self.id = guild_id
+        self.voice_client = FakeVoiceClient()
+
+
+async def synthesize(synthesis_sec: float) -> bytes:
+    """
+    Pretend to synthesize a clip.
+
+    Args:
+        synthesis_sec (float): 合成に掛かる時間[秒]
+
+    Returns:
+        bytes: 音声データ
+    """
+    await asyncio.sleep(synthesis_sec)
+    return CLIP
+
+
+async def measure_memory(guild_count: int) -> tuple[float, float]:
+    """
+    Measure the memory per guild state without and with the playback scheduler.
+
+    Args:
+        guild_count (int): ギルド数
+
+    Returns:
+        tuple[float, float]: 1ギルドあたりのバイト数(再生キュー無し, 有り)
+    """
+    guilds = [FakeGuild(i) for i in range(guild_count)]
+    guild_states = GuildStates(CONFIGS)
+
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    for guild in guilds:
+        guild_states.get(guild)
+    after_states = tracemalloc.get_traced_memory()[0]
+    for guild in guilds:
+        guild_states.scheduler(guild)
+    after_schedulers = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    await guild_states.close()
+    return (after_states - before) / guild_count, (after_schedulers - before) / guild_count
+
+
+async def measure_throughput(guild_count: int, clips_per_guild: int, synthesis_sec: float) -> tuple[float, float]:
+    """
+    Submit clips to every guild and measure the throughput.
+
+    Args:
+        guild_count (int): ギルド数
+        clips_per_guild (int): 1ギルドあたりのクリップ数
+        synthesis_sec (float): 1クリップの合成時間[秒]
+
+    Returns:
+        tuple[float, float]: 1秒あたりのクリップ数と, 全体の所要時間[秒]
+    """
+    guilds = [FakeGuild(i) for i in range(guild_count)]
+    guild_states = GuildStates(CONFIGS)
+
+    start = time.perf_counter()
+    for _ in range(clips_per_guild):
+        for guild in guilds:
+            guild_states.scheduler(guild).submit(functools.partial(synthesize, synthesis_sec))
+    await asyncio.gather(*[guild_states.scheduler(guild).wait_idle() for guild in guilds])
+    elapsed = time.perf_counter() - start
+
+    await guild_states.close()
+    return guild_count * clips_per_guild / elapsed, elapsed
+
+
+async def measure_fairness(guild_count: int, busy_clips: int, synthesis_sec: float) -> tuple[float, float]:
+    """
+    Measure how long quiet guilds wait while one guild has a long queue.
+
+    Args:
+        guild_count (int): 静かなギルドの数
+        busy_clips (int): 忙しいギルドに投入するクリップ数
+        synthesis_sec (float): 1クリップの合成時間[秒]
+
+    Returns:
+        tuple[float, float]: 静かなギルドの1クリップの所要時間の中央値と最大値[秒]
+    """
+    busy_guild = FakeGuild(-1)
+    quiet_guilds = [FakeGuild(i) for i in range(guild_count)]
+    guild_states = GuildStates(CONFIGS)
+
+    for _ in range(busy_clips):
+        guild_states.scheduler(busy_guild).submit(functools.partial(synthesize, synthesis_sec))
+
+    async def quiet_clip(guild: FakeGuild) -> float:
+        start = time.perf_counter()
+        guild_states.scheduler(guild).submit(functools.partial(synthesize, synthesis_sec))
+        await guild_states.scheduler(guild).wait_idle()
+        return time.perf_counter() - start
+
+    waits = await asyncio.gather(*[quiet_clip(guild) for guild in quiet_guilds])
+    await guild_states.close()
+    return statistics.median(waits), max(waits)
+
+
+async def main() -> None:
+    """
+    Run the benchmark and print the results.
+    """
+    parser = argparse.ArgumentParser(description='多数のギルドを想定したベンチマーク')
+    parser.add_argument('--guilds', type=int, nargs='+', default=[10, 100, 1000], help='ギルド数')
+    parser.add_argument('--clips', type=int, default=5, help='1ギルドあたりのクリップ数')
+    parser.add_argument('--synthesis-ms', type=float, default=20.0, help='1クリップの合成時間[ミリ秒]')
+    args = parser.parse_args()
+    synthesis_sec = args.synthesis_ms / 1000
+
+    header = f'{"guilds":>8} {"state[B]":>10} {"+queue[B]":>10} {"clips/s":>10} {"total[s]":>9}'
+    print(f'{header} {"quiet p50/max[ms]":>18}')
+    for guild_count in args.guilds:
+        state_bytes, scheduler_bytes = await measure_memory(guild_count)
+        clips_per_sec, elapsed = await measure_throughput(guild_count, args.clips, synthesis_sec)
+        quiet_median, quiet_max = await measure_fairness(guild_count, guild_count * args.clips, synthesis_sec)
+        print(
+            f'{guild_count:>8} {state_bytes:>10.0f} {scheduler_bytes:>10.0f} {clips_per_sec:>10.0f} {elapsed:>9.2f} '
+            f'{quiet_median * 1000:>8.1f}/{quiet_max * 1000:<9.1f}',
+        )
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
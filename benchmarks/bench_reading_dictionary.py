@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+読み辞書の置き換えのマイクロベンチマーク.
+
+登録数100, 1千, 1万の辞書で, 単語ごとにstr.replaceを掛ける素朴な置き換えと
+ReadingDictionary.replace(Aho-Corasickで1回だけ走査)を1発言, 長文の貼り付けの長さの文章で比較する.
+あわせて辞書の構築と, 実行中に1語追加した後の最初の置き換えに掛かる時間も計る.
+
+    python benchmarks/bench_reading_dictionary.py
+    python benchmarks/bench_reading_dictionary.py --entries 100 1000 10000 100000
+"""
+
+import argparse
+import itertools
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'src'))
+
+from corpora import CORPUS_SIZES, make_chat_text
+
+import utilities.text_utilities as txtutl
+
+KATAKANA = ''.join(chr(code) for code in range(ord('ァ'), ord('ン') + 1))
+ALPHABET = 'abcdefghijklmnopqrstuvwxyz'
+REPEAT = 5
+
+
+def make_entries(count: int, seed: int = 0) -> dict[str, str]:
+    """
+    Make the dictionary entries of English words and katakana names.
+
+    Args:
+        count (int): 登録数
+        seed (int): 乱数のシード
+
+    Returns:
+        dict[str, str]: 単語 -> 読み
+    """
+    rng = random.Random(seed)
+    entries = {}
+    while len(entries) < count:
+        letters = ALPHABET if rng.random() < 0.5 else KATAKANA  # noqa: PLR2004
+        word = ''.join(rng.choice(letters) for _ in range(rng.randint(3, 8)))
+        entries[word] = ''.join(rng.choice(KATAKANA) for _ in range(rng.randint(3, 8)))
+    return entries
+
+
+def make_text(size: int, entries: dict[str, str], seed: int = 0) -> str:
+    """
+    Make a chat like text which includes some of the dictionary words.
+
+    Args:
+        size (int): 文字数
+        entries (dict[str, str]): 辞書の登録内容
+        seed (int): 乱数のシード
+
+    Returns:
+        str: 単語を含むチャット風の文章
+    """
+    rng = random.Random(seed)
+    words = list(entries)
+    chat_text = make_chat_text(size, seed)
+    # NOTE: 40文字に1語程度の割合で辞書の単語を混ぜる.
+    parts = []
+    for i in range(0, len(chat_text), 40):
+        parts += [chat_text[i : i + 40], rng.choice(words)]
+    return ''.join(parts)[:size]
+
+
+def naive_replace(text: str, entries: dict[str, str]) -> str:
+    """
+    Replace the words one by one, as url2alternative_text style rewriting would.
+
+    Args:
+        text (str): 読み上げる文章
+        entries (dict[str, str]): 辞書の登録内容
+
+    Returns:
+        str: 単語を読みに置き換えた文章
+    """
+    for word, reading in entries.items():
+        text = text.replace(word, reading)
+    return text
+
+
+def measure(func: callable) -> float:
+    """
+    Measure the best elapsed time of the function.
+
+    Args:
+        func (callable): 計測する関数
+
+    Returns:
+        float: 最短の実行時間[秒]
+    """
+    best = float('inf')
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main() -> None:
+    """
+    Run the benchmark and print the results.
+    """
+    parser = argparse.ArgumentParser(description='読み辞書の置き換えのベンチマーク')
+    parser.add_argument('--entries', type=int, nargs='+', default=[100, 1_000, 10_000], help='辞書の登録数')
+    args = parser.parse_args()
+
+    print(
+        f'{"entries":>8} {"text":>8} {"naive[ms]":>10} {"automaton[ms]":>14} {"speedup":>8} '
+        f'{"build[ms]":>10} {"add+1st[ms]":>12}',
+    )
+    # NOTE: 毎回別の単語を追加して新しい節点を増やし, 次の置き換えで失敗遷移を計算し直させる.
+    added_words = itertools.count()
+    for count in args.entries:
+        entries = make_entries(count)
+        start = time.perf_counter()
+        dictionary = txtutl.ReadingDictionary()
+        for word, reading in entries.items():
+            dictionary.add(word, reading)
+        dictionary.replace('')
+        build_time = time.perf_counter() - start
+
+        for name in ('message', 'paste'):
+            text = make_text(CORPUS_SIZES[name], entries)
+            naive_time = measure(lambda t=text, e=entries: naive_replace(t, e))
+            automaton_time = measure(lambda t=text, d=dictionary: d.replace(t))
+
+            def add_and_replace(t: str = text, d: txtutl.ReadingDictionary = dictionary) -> None:
+                word = f'新しい単語{next(added_words)}'
+                d.add(word, 'あたらしいたんご')
+                d.replace(t)
+                d.remove(word)
+
+            add_time = measure(add_and_replace)
+            print(
+                f'{count:>8} {name:>8} {naive_time * 1000:>10.3f} {automaton_time * 1000:>14.3f} '
+                f'{naive_time / automaton_time:>7.1f}x {build_time * 1000:>10.1f} {add_time * 1000:>12.1f}',
+            )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+メッセージ分割処理のマイクロベンチマーク.
+
+旧実装(1文字ずつ文字列連結し, バッファ全体にURL検索を掛けるループ)と
+WordMarks.iter_segmentsを2千文字, 2万文字の入力で比較する.
+
+    python benchmarks/bench_segmenter.py
+"""
+
+import re
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'src'))
+
+from corpora import make_chat_text, make_pasted_log
+
+import utilities.text_utilities as txtutl
+
+SIZES = [2_000, 20_000]
+REPEAT = 5
+
+
+def legacy_split(text: str, alternative_text: str = 'URL') -> list[str]:
+    """
+    The segmentation loop of on_message before the single-pass segmenter.
+
+    Args:
+        text (str): 分割する文章
+        alternative_text (str): URLの代替テキスト
+
+    Returns:
+        list[str]: 分割した文章
+    """
+    punctuation_marks = ['，', '．', '、', '。', ',', '.']
+    exclamation_marks = ['!', '！']
+    question_marks = ['?', '？']
+    new_line_marks = ['\n', '\r']
+    space_marks = [' ', '　']
+    url_pattern = r'http[s]?://\S+'
+
+    segments = []
+    text_buffer = ''
+    is_make_voice = False
+    for letter in text:
+        is_p = letter in punctuation_marks
+        is_e = letter in exclamation_marks
+        is_q = letter in question_marks
+        is_n = letter in new_line_marks
+        is_s = letter in space_marks
+        is_sp = is_p or is_e or is_q or is_n or is_s
+        is_including_url = len(re.findall(url_pattern, text_buffer)) > 0
+        if not is_sp and is_make_voice and len(text_buffer) > 0:
+            for url in re.findall(url_pattern, text_buffer):
+                text_buffer = text_buffer.replace(url, alternative_text)
+            segments.append(text_buffer)
+            is_make_voice = False
+            text_buffer = ''
+
+        if not is_n:
+            text_buffer = text_buffer + letter
+
+        if is_sp and not is_including_url:
+            is_make_voice = True
+
+        if is_including_url and is_s:
+            is_make_voice = True
+
+    segments.append(text_buffer)
+    return segments
+
+
+def measure(func: callable, text: str) -> float:
+    """
+    Measure the best elapsed time of the function.
+
+    Args:
+        func (callable): 計測する関数
+        text (str): 入力文章
+
+    Returns:
+        float: 最短の実行時間[秒]
+    """
+    best = float('inf')
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        func(text)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main() -> None:
+    """
+    Run the benchmark and print the results.
+    """
+    word_marks = txtutl.WordMarks()
+
+    def segmenter(text: str) -> list[tuple[str, str]]:
+        return list(word_marks.iter_segments(text, 'URL'))
+
+    print(f'{"corpus":>8} {"size":>8} {"legacy[ms]":>12} {"segmenter[ms]":>14} {"speedup":>8}')
+    for corpus, make_text in (('chat', make_chat_text), ('log', make_pasted_log)):
+        for size in SIZES:
+            text = make_text(size)
+            legacy_time = measure(legacy_split, text)
+            segmenter_time = measure(segmenter, text)
+            print(
+                f'{corpus:>8} {size:>8} {legacy_time * 1000:>12.3f} {segmenter_time * 1000:>14.3f} '
+                f'{legacy_time / segmenter_time:>7.1f}x',
+            )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+"""
+合成しながら再生する場合と, 合成し終えてから再生する場合の最初の音が出るまでの時間のベンチマーク.
+
+スタブのVOICEVOXエンジンに同じ合成時間を与え, 一方は合成し終えてから全体を返し,
+もう一方は合成時間を分けてchunkedで返す. Discordには繋がず, 音声ソースから最初の20msを読めるまでを計る.
+
+続けて, 合成しながら返す音声をdiscord.pyのAudioPlayerで再生し, 送信の間隔を計る.
+送信は偽のボイスクライアントで記録する. 間隔が20msから外れたフレーム(詰めて送った数と遅れた数)と,
+合成が追いつかず無音で埋めたフレームの数を出す. 合成が再生より遅い場合は無音で埋めても間隔は保たれる.
+
+    python benchmarks/bench_streaming.py
+    python benchmarks/bench_streaming.py --synthesis-ms 500 1500 --clip-sec 5 --chunks 20
+    python benchmarks/bench_streaming.py --pacing-synthesis-ms 1000 6000
+"""
+
+import argparse
+import asyncio
+import itertools
+import statistics
+import sys
+import time
+from pathlib import Path
+from typing import Any
+
+import discord
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'src'))
+
+import stub_engine
+
+import utilities.sound_utilities as sndutl
+import yomiagecode.discord_functions as discordfunc
+import yomiagecode.tts_functions as ttsfunc
+from tts.audio_query_cache import AudioQueryCache
+from tts.voicevox_wrapper import AsyncVoicevoxWrapper
+
+CONFIGS = {
+    'TTS': {'USE_TTS': 'VOICEVOX', 'STREAMING': True, 'VOICEVOX': {'SPEAKER_ID': 1}},
+    'FFMPEG': {'FADE_LEN': 0.01},
+}
+REPEAT = 5
+TEXT = 'ベンチマーク'
+FRAME_SEC = 0.02
+# NOTE: 20msからこれ以上ずれた送信間隔を, 詰めて送った, または遅れたとみなす.
+PACING_TOLERANCE_SEC = 0.01
+
+
+class PacingVoiceClient:
+    """
+    The fake voice client which records when the audio player sends each frame.
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop) -> None:
+        """
+        Initialize the fake voice client.
+
+        Args:
+            loop (asyncio.AbstractEventLoop): 発話状態の通知を受けるイベントループ
+        """
+        # NOTE: AudioPlayerはclient.client.loopとclient.ws.speakを使うので, 自身で兼ねる.
+        self.client = self
+        self.ws = self
+        self.loop = loop
+        self.send_times: list[float] = []
+
+    async def speak(self, state: Any) -> None:  # noqa: ANN401
+        """
+        Ignore the speaking state.
+        """
+
+    def is_connected(self) -> bool:
+        """
+        Always connected.
+        """
+        return True
+
+    def send_audio_packet(self, data: bytes, *, encode: bool = True) -> None:  # noqa: ARG002
+        """
+        Record the time of the PCM frame. The silence sent after the playback is ignored.
+        """
+        if encode:
+            self.send_times.append(time.perf_counter())
+
+
+async def first_frame_of_clip(client: AsyncVoicevoxWrapper) -> float:
+    """
+    Synthesize the whole clip, convert it and read the first frame.
+
+    Args:
+        client (AsyncVoicevoxWrapper): 合成し終えてから返すエンジンに繋いだクライアント
+
+    Returns:
+        float: 最初のフレームを読めるまでの時間[秒]
+    """
+    start = time.perf_counter()
+    audio_query = await client.generate_audio_query(TEXT, CONFIGS['TTS'])
+    voice_data = await client.generate_voice(audio_query, CONFIGS['TTS'])
+    source = discordfunc.PcmAudioSource(sndutl.prepare_discord_pcm(voice_data, CONFIGS['FFMPEG']['FADE_LEN']))
+    await asyncio.to_thread(source.read)
+    return time.perf_counter() - start
+
+
+async def first_frame_of_stream(client: AsyncVoicevoxWrapper, jitter_buffer_sec: float) -> float:
+    """
+    Stream the clip through the jitter buffer and read the first frame.
+
+    Args:
+        client (AsyncVoicevoxWrapper): 合成しながら返すエンジンに繋いだクライアント
+        jitter_buffer_sec (float): 再生を始める前に溜める音声の長さ[秒]
+
+    Returns:
+        float: 最初のフレームを読めるまでの時間[秒]
+    """
+    start = time.perf_counter()
+    stream = await ttsfunc.make_sound(TEXT, client, CONFIGS['TTS'])
+    source = discordfunc.StreamingPcmAudioSource(jitter_buffer_sec=jitter_buffer_sec)
+    feeder = asyncio.create_task(discordfunc.feed_streaming_source(source, stream.iter_chunks(), CONFIGS))
+    await source.wait_ready()
+    source.read()
+    elapsed = time.perf_counter() - start
+    source.cleanup()
+    await feeder
+    # NOTE: 次の計測に持ち越さないよう, 合成の残りを受け取り終えるまで待つ.
+    async for _ in stream.iter_chunks():
+        pass
+    return elapsed
+
+
+async def pacing_of_stream(client: AsyncVoicevoxWrapper, jitter_buffer_sec: float) -> tuple[int, int, int, float]:
+    """
+    Play the streamed clip with the audio player of discord.py and check the interval of the frames.
+
+    Args:
+        client (AsyncVoicevoxWrapper): 合成しながら返すエンジンに繋いだクライアント
+        jitter_buffer_sec (float): 再生を始める前に溜める音声の長さ[秒]
+
+    Returns:
+        tuple[int, int, int, float]: 送ったフレーム数, 間隔が外れたフレーム数, 無音で埋めたフレーム数,
+            最大の送信間隔[秒]
+    """
+    loop = asyncio.get_running_loop()
+    stream = await ttsfunc.make_sound(TEXT, client, CONFIGS['TTS'])
+    source = discordfunc.StreamingPcmAudioSource(jitter_buffer_sec=jitter_buffer_sec)
+    feeder = asyncio.create_task(discordfunc.feed_streaming_source(source, stream.iter_chunks(), CONFIGS))
+    await source.wait_ready()
+
+    finished = loop.create_future()
+    voice_client = PacingVoiceClient(loop)
+    player = discord.player.AudioPlayer(
+        source,
+        voice_client,
+        after=lambda _: loop.call_soon_threadsafe(finished.set_result, None),
+    )
+    player.start()
+    await finished
+    await feeder
+
+    send_times = voice_client.send_times
+    intervals = [later - earlier for earlier, later in itertools.pairwise(send_times)]
+    off_pace = sum(1 for interval in intervals if abs(interval - FRAME_SEC) > PACING_TOLERANCE_SEC)
+    return len(send_times), off_pace, source.underrun_count, max(intervals, default=0.0)
+
+
+async def measure_pacing(synthesis_sec: float, clip_sec: float, chunks: int, jitter_buffer_sec: float) -> None:
+    """
+    Measure and print the pacing of the streamed playback.
+
+    Args:
+        synthesis_sec (float): 1クリップの合成時間[秒]
+        clip_sec (float): 音声の長さ[秒]
+        chunks (int): 合成しながら返す場合の分割数
+        jitter_buffer_sec (float): 再生を始める前に溜める音声の長さ[秒]
+    """
+    with (
+        stub_engine.StubVoicevoxEngine(clip_duration=clip_sec) as warmup,
+        stub_engine.StubVoicevoxEngine(latency=synthesis_sec, clip_duration=clip_sec, stream_chunks=chunks) as stream,
+    ):
+        # NOTE: 合成時間が長いとaudio_queryの遅延がタイムアウトを超えるので, 遅延の無いエンジンでキャッシュに載せる.
+        query_cache = AudioQueryCache()
+        warmup_client = AsyncVoicevoxWrapper(warmup.address, query_cache=query_cache)
+        await warmup_client.generate_audio_query(TEXT, CONFIGS['TTS'])
+        await warmup_client.close()
+        stream_client = AsyncVoicevoxWrapper(stream.address, query_cache=query_cache)
+        frames, off_pace, underruns, max_interval = await pacing_of_stream(stream_client, jitter_buffer_sec)
+        await stream_client.close()
+
+    print(
+        f'{synthesis_sec * 1000:>14.0f} {frames:>7} {off_pace:>9} {underruns:>10} {max_interval * 1000:>16.1f}',
+    )
+
+
+async def measure(synthesis_sec: float, clip_sec: float, chunks: int, jitter_buffer_sec: float) -> tuple[float, float]:
+    """
+    Measure the median time to the first frame of both ways.
+
+    Args:
+        synthesis_sec (float): 1クリップの合成時間[秒]
+        clip_sec (float): 音声の長さ[秒]
+        chunks (int): 合成しながら返す場合の分割数
+        jitter_buffer_sec (float): 再生を始める前に溜める音声の長さ[秒]
+
+    Returns:
+        tuple[float, float]: 最初のフレームまでの時間の中央値(合成後に再生, 合成しながら再生)[秒]
+    """
+    with (
+        stub_engine.StubVoicevoxEngine(latency=synthesis_sec, clip_duration=clip_sec) as clip_engine,
+        stub_engine.StubVoicevoxEngine(latency=synthesis_sec, clip_duration=clip_sec, stream_chunks=chunks) as stream,
+    ):
+        # NOTE: スタブはaudio_queryにも遅延を加えるので, 計測前にキャッシュに載せて合成の時間だけを比べる.
+        query_cache = AudioQueryCache()
+        clip_client = AsyncVoicevoxWrapper(clip_engine.address, query_cache=query_cache)
+        stream_client = AsyncVoicevoxWrapper(stream.address, query_cache=query_cache)
+        await clip_client.generate_audio_query(TEXT, CONFIGS['TTS'])
+
+        clip_times = [await first_frame_of_clip(clip_client) for _ in range(REPEAT)]
+        stream_times = [await first_frame_of_stream(stream_client, jitter_buffer_sec) for _ in range(REPEAT)]
+        await clip_client.close()
+        await stream_client.close()
+
+    return statistics.median(clip_times), statistics.median(stream_times)
+
+
+async def main() -> None:
+    """
+    Run the benchmark and print the results.
+    """
+    parser = argparse.ArgumentParser(description='合成しながら再生する場合の最初の音までの時間のベンチマーク')
+    parser.add_argument('--synthesis-ms', type=float, nargs='+', default=[200.0, 1000.0], help='合成時間[ミリ秒]')
+    parser.add_argument('--clip-sec', type=float, default=3.0, help='音声の長さ[秒]')
+    parser.add_argument('--chunks', type=int, default=10, help='合成しながら返す場合の分割数')
+    parser.add_argument('--jitter-buffer-ms', type=float, default=200.0, help='ジッタバッファ[ミリ秒]')
+    parser.add_argument(
+        '--pacing-synthesis-ms',
+        type=float,
+        nargs='+',
+        default=[1000.0, 6000.0],
+        help='送信間隔を計る合成時間[ミリ秒]',
+    )
+    args = parser.parse_args()
+
+    print(f'{"synthesis[ms]":>14} {"clip[ms]":>10} {"stream[ms]":>11} {"speedup":>8}')
+    for synthesis_ms in args.synthesis_ms:
+        clip_sec, stream_sec = await measure(
+            synthesis_ms / 1000,
+            args.clip_sec,
+            args.chunks,
+            args.jitter_buffer_ms / 1000,
+        )
+        speedup = clip_sec / stream_sec
+        print(f'{synthesis_ms:>14.0f} {clip_sec * 1000:>10.1f} {stream_sec * 1000:>11.1f} {speedup:>7.1f}x')
+
+    print()
+    print(f'{"synthesis[ms]":>14} {"frames":>7} {"off_pace":>9} {"underruns":>10} {"max_interval[ms]":>16}')
+    for synthesis_ms in args.pacing_synthesis_ms:
+        await measure_pacing(synthesis_ms / 1000, args.clip_sec, args.chunks, args.jitter_buffer_ms / 1000)
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+ベンチマーク用の日本語チャット風コーパス.
+
+乱数のシードを固定しているので, 同じサイズなら毎回同じ文章になる.
+"""
+
+import random
+
+CHAT_PHRASES = [
+    'おはようございます',
+    'それな',
+    '草',
+    'w',
+    '今日のランクマきつすぎる',
+    'ちょっと待って、今行く！',
+    'それってどういうこと？',
+    '了解です。',
+    'あとで見ておきます',
+    '参考: https://example.com/articles/12345?ref=discord',
+    'ｗｗｗ',
+    'まじか…',
+    'お疲れさまでした！！',
+    '次の試合は21時から',
+    'このBGMいいよね',
+]
+SEPARATORS = ['', ' ', '　', '\n', '。', '、']
+
+# NOTE: 1発言の典型的な長さ, 長文の貼り付け, ログの大量貼り付けを想定したサイズ.
+CORPUS_SIZES = {'message': 40, 'paste': 2_000, 'log': 20_000}
+
+
+def make_chat_text(size: int, seed: int = 0) -> str:
+    """
+    Make a Japanese chat like text of the given length.
+
+    Args:
+        size (int): 文字数
+        seed (int): 乱数のシード
+
+    Returns:
+        str: チャット風の文章
+    """
+    rng = random.Random(seed)
+    parts = []
+    length = 0
+    while length < size:
+        part = rng.choice(CHAT_PHRASES) + rng.choice(SEPARATORS)
+        parts.append(part)
+        length += len(part)
+    return ''.join(parts)[:size]
+
+
+def make_pasted_log(size: int) -> str:
+    """
+    Make a pasted log like text which has few split marks.
+
+    Args:
+        size (int): 文字数
+
+    Returns:
+        str: 区切り文字がほとんど無いログ風の文章
+    """
+    line = 'ERROR:ConnectionResetError[https://example.com/api/v1/status?id=42]リトライします\n'
+    return (line * (size // len(line) + 1))[:size]
+
+
+def make_corpora() -> dict[str, str]:
+    """
+    Make the chat corpora of every size.
+
+    Returns:
+        dict[str, str]: コーパス名と文章の辞書
+    """
+    return {name: make_chat_text(size) for name, size in CORPUS_SIZES.items()}
@@ -0,0 +1,346 @@
+#!/usr/bin/env python3
+"""
+テキスト処理, 音声処理, TTSクライアントのホットパスのマイクロベンチマーク.
+
+ネットワークに出ずに動く. VOICEVOXはプロセス内のスタブエンジンを相手に計る.
+結果はJSONに保存し, 以前の結果と比較して遅くなったケースを報告する.
+
+    python benchmarks/run_benchmarks.py
+    python benchmarks/run_benchmarks.py --output base.json
+    python benchmarks/run_benchmarks.py --compare base.json --threshold 0.1
+    python benchmarks/run_benchmarks.py --filter text.
+
+比較で遅くなったケースがあれば終了コード1で終わる.
+"""
+
+import argparse
+import asyncio
+import contextlib
+import datetime as dt
+import json
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from collections.abc import Callable
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'src'))
+
+import corpora
+import stub_engine
+
+import utilities.sound_utilities as sndutl
+import utilities.text_utilities as txtutl
+import yomiagecode.discord_functions as discordfunc
+from tts.synthesizer_pool import SynthesizerPool
+from tts.voicevox_wrapper import AsyncVoicevoxWrapper, VoicevoxWrapper
+
+RESULTS_DIR = Path(__file__).resolve().parent / 'results'
+# NOTE: AzureのシンセサイザのTLS/WebSocketの確立に見立てた待ち時間.
+FAKE_CONNECT_SEC = 0.005
+TTS_CONFIGS = {'USE_TTS': 'VOICEVOX', 'VOICEVOX': {'SPEAKER_ID': 1, 'SPEED_SCALE': 1.2, 'VOLUME_SCALE': 0.4}}
+CONFIGS = {'FFMPEG': {'FADE_LEN': 0.05}}
+
+# NOTE: (ケース名, 計測する関数, 1ラウンドの呼び出し回数). 関数がNoneの場合は環境が無いので飛ばす.
+BenchmarkCase = tuple[str, Callable[[], object] | None, int]
+
+
+def text_cases() -> list[BenchmarkCase]:
+    """
+    Make the cases of the text utilities.
+
+    Returns:
+        list[BenchmarkCase]: ベンチマークケースのリスト
+    """
+    word_marks = txtutl.WordMarks()
+    url_controller = txtutl.URLcontroller()
+    texts = corpora.make_corpora()
+
+    def check_letters(text: str) -> None:
+        for letter in text:
+            word_marks.check_letter(letter)
+
+    cases = []
+    for name, text in texts.items():
+        number = max(1, 20_000 // len(text))
+        cases += [
+            (f'text.check_letter[{name}]', lambda t=text: check_letters(t), number),
+            (f'text.split_text_for_voice[{name}]', lambda t=text: word_marks.split_text_for_voice(t), number),
+            (f'text.iter_segments[{name}]', lambda t=text: list(word_marks.iter_segments(t, 'URL')), number),
+            (f'text.url2alternative_text[{name}]', lambda t=text: url_controller.url2alternative_text(t), number),
+        ]
+    return cases
+
+
+def audio_cases(work_dir: Path) -> list[BenchmarkCase]:
+    """
+    Make the cases of the audio utilities and the audio source setup.
+
+    Args:
+        work_dir (Path): 一時ファイルを書き出すディレクトリ
+
+    Returns:
+        list[BenchmarkCase]: ベンチマークケースのリスト
+    """
+    clips = {'1s': stub_engine.make_silent_wav(1.0), '10s': stub_engine.make_silent_wav(10.0)}
+    wav_file = str(work_dir / 'clip_1s.wav')
+    sndutl.generate_wav(clips['1s'], wav_file)
+
+    def generate_temp_wav(data: bytes) -> None:
+        sndutl.remove_temp_wav(sndutl.generate_temp_wav(data))
+
+    def ffmpeg_source() -> None:
+        # NOTE: 以前のplay_soundと同じく, ffprobeで長さを取りFFmpegプロセスを起動するまでを計る.
+        discordfunc._make_ffmpeg_audio_source(wav_file, CONFIGS['FFMPEG']['FADE_LEN']).cleanup()  # noqa: SLF001
+
+    has_ffmpeg = shutil.which('ffmpeg') is not None and shutil.which('ffprobe') is not None
+    cases = []
+    for name, data in clips.items():
+        cases += [
+            (f'audio.generate_wav[{name}]', lambda d=data: sndutl.generate_wav(d, str(work_dir / 'out.wav')), 20),
+            (f'audio.generate_temp_wav[{name}]', lambda d=data: generate_temp_wav(d), 20),
+            (f'audio.prepare_discord_pcm[{name}]', lambda d=data: sndutl.prepare_discord_pcm(d, 0.05), 10),
+            (f'audio.make_audio_source.pcm[{name}]', lambda d=data: discordfunc.make_audio_source(d, CONFIGS), 10),
+        ]
+    for name, duration in (('1s', 1.0), ('10s', 10.0)):
+        ogg_opus = stub_engine.make_silent_ogg_opus(duration)
+        cases.append(
+            (
+                f'audio.make_audio_source.ogg_opus[{name}]',
+                lambda d=ogg_opus: discordfunc.make_audio_source(d, CONFIGS),
+                10,
+            ),
+        )
+    cases += [
+        ('audio.make_audio_source.pcm_file[1s]', lambda: discordfunc.make_audio_source(wav_file, CONFIGS), 10),
+        ('audio.make_audio_source.ffmpeg[1s]', ffmpeg_source if has_ffmpeg else None, 3),
+    ]
+    return cases
+
+
+def tts_cases(
+    engine: stub_engine.StubVoicevoxEngine,
+    loop: asyncio.AbstractEventLoop,
+    stack: contextlib.ExitStack,
+) -> list[BenchmarkCase]:
+    """
+    Make the cases of the VOICEVOX clients against the stub engine.
+
+    Args:
+        engine (stub_engine.StubVoicevoxEngine): 起動済みのスタブエンジン
+        loop (asyncio.AbstractEventLoop): 非同期クライアントを動かすイベントループ
+        stack (contextlib.ExitStack): 計測後にクライアントを閉じるためのExitStack
+
+    Returns:
+        list[BenchmarkCase]: ベンチマークケースのリスト
+    """
+    text = corpora.make_chat_text(corpora.CORPUS_SIZES['message'])
+    sync_client = VoicevoxWrapper(engine.address)
+    async_client = AsyncVoicevoxWrapper(engine.address, max_connections=8)
+    stack.callback(lambda: loop.run_until_complete(async_client.close()))
+
+    def sync_request() -> None:
+        audio_query = sync_client.generate_audio_query(text, TTS_CONFIGS)
+        sync_client.generate_voice(audio_query, TTS_CONFIGS)
+
+    async def async_request() -> None:
+        audio_query = await async_client.generate_audio_query(text, TTS_CONFIGS)
+        await async_client.generate_voice(audio_query, TTS_CONFIGS)
+
+    async def async_concurrent() -> None:
+        await asyncio.gather(*[async_request() for _ in range(8)])
+
+    return [
+        ('tts.voicevox_sync.request', sync_request, 20),
+        ('tts.voicevox_sync.batch8', lambda: sync_client.generate_voices_batch([text] * 8, TTS_CONFIGS), 5),
+        ('tts.voicevox_async.request', lambda: loop.run_until_complete(async_request()), 20),
+        ('tts.voicevox_async.concurrent8', lambda: loop.run_until_complete(async_concurrent()), 5),
+        (
+            'tts.voicevox_async.batch8',
+            lambda: loop.run_until_complete(async_client.generate_voices_batch([text] * 8, TTS_CONFIGS)),
+            5,
+        ),
+    ]
+
+
+def synthesizer_pool_cases() -> list[BenchmarkCase]:
+    """
+    Make the cases of the synthesizer pool with a fake synthesizer whose connection takes FAKE_CONNECT_SEC.
+
+    Returns:
+        list[BenchmarkCase]: ベンチマークケースのリスト
+    """
+    pool = SynthesizerPool(lambda _: object(), lambda _: time.sleep(FAKE_CONNECT_SEC), max_per_key=2)
+    pool.warm_up('voice')
+
+    def per_utterance() -> None:
+        # NOTE: 以前のAzureWrapperのように発話ごとにシンセサイザを作って接続する.
+        synthesizer = object()
+        time.sleep(FAKE_CONNECT_SEC)
+        del synthesizer
+
+    def pooled() -> None:
+        with pool.acquire('voice'):
+            pass
+
+    return [
+        ('tts.synthesizer_pool.per_utterance', per_utterance, 20),
+        ('tts.synthesizer_pool.pooled', pooled, 1000),
+    ]
+
+
+def measure(func: Callable[[], object], number: int, rounds: int) -> dict[str, float | int]:
+    """
+    Measure the time per call of the function.
+
+    Args:
+        func (Callable[[], object]): 計測する関数
+        number (int): 1ラウンドの呼び出し回数
+        rounds (int): ラウンド数
+
+    Returns:
+        dict[str, float | int]: 1回あたりの実行時間[マイクロ秒]の統計
+    """
+    func()  # NOTE: 初回のimportやコネクション確立を計測から外すためのウォームアップ.
+    times = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        times.append((time.perf_counter() - start) / number * 1e6)
+
+    return {
+        'median_us': statistics.median(times),
+        'min_us': min(times),
+        'mean_us': statistics.fmean(times),
+        'number': number,
+        'rounds': rounds,
+    }
+
+
+def run(name_filter: str, rounds: int) -> dict[str, dict]:
+    """
+    Run the benchmark cases and print the results.
+
+    Args:
+        name_filter (str): この文字列を名前に含むケースだけを実行する
+        rounds (int): ラウンド数
+
+    Returns:
+        dict[str, dict]: ケース名と計測結果の辞書
+    """
+    results = {}
+    with contextlib.ExitStack() as stack:
+        loop = asyncio.new_event_loop()
+        stack.callback(loop.close)
+        work_dir = stack.enter_context(tempfile.TemporaryDirectory())
+        engine = stack.enter_context(stub_engine.StubVoicevoxEngine())
+        cases = text_cases() + audio_cases(Path(work_dir)) + tts_cases(engine, loop, stack) + synthesizer_pool_cases()
+        print(f'{"case":<48} {"median[us]":>12} {"min[us]":>12}')
+        for name, func, number in cases:
+            if name_filter not in name:
+                continue
+            if func is None:
+                print(f'{name:<48} {"skipped":>12}')
+                results[name] = {'skipped': True}
+                continue
+
+            result = measure(func, number, rounds)
+            results[name] = result
+            print(f'{name:<48} {result["median_us"]:>12.1f} {result["min_us"]:>12.1f}')
+    return results
+
+
+def compare(results: dict[str, dict], baseline: dict[str, dict], threshold: float) -> list[str]:
+    """
+    Compare the medians with the baseline and print the ratios.
+
+    Args:
+        results (dict[str, dict]): 今回の計測結果
+        baseline (dict[str, dict]): 比較元の計測結果
+        threshold (float): この割合を超えて遅くなったケースを劣化とする. (ex. 0.1は10%)
+
+    Returns:
+        list[str]: 劣化したケース名のリスト
+    """
+    regressions = []
+    print(f'\n{"case":<48} {"baseline[us]":>12} {"current[us]":>12} {"ratio":>7}')
+    for name, result in results.items():
+        base = baseline.get(name, {})
+        if 'median_us' not in result or 'median_us' not in base:
+            continue
+
+        ratio = result['median_us'] / base['median_us']
+        mark = ''
+        if ratio > 1 + threshold:
+            mark = '  REGRESSION'
+            regressions.append(name)
+        elif ratio < 1 - threshold:
+            mark = '  improved'
+        print(f'{name:<48} {base["median_us"]:>12.1f} {result["median_us"]:>12.1f} {ratio:>6.2f}x{mark}')
+    return regressions
+
+
+def get_git_revision() -> str | None:
+    """
+    Get the short commit hash of the working tree.
+
+    Returns:
+        str | None: コミットハッシュ. gitが使えない場合はNone.
+    """
+    try:
+        completed = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],  # noqa: S607
+            capture_output=True,
+            check=True,
+            text=True,
+            cwd=Path(__file__).resolve().parent,
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return completed.stdout.strip()
+
+
+def main() -> None:
+    """
+    Parse the arguments, run the benchmarks, save the results and compare them.
+    """
+    parser = argparse.ArgumentParser(description='yomiagecodeのマイクロベンチマーク')
+    parser.add_argument('--output', type=Path, help='結果を保存するJSONファイル. 省略時はbenchmarks/results/')
+    parser.add_argument('--compare', type=Path, help='比較元の結果JSONファイル')
+    parser.add_argument('--threshold', type=float, default=0.1, help='劣化とみなす中央値の増加率')
+    parser.add_argument('--filter', default='', help='この文字列を名前に含むケースだけを実行する')
+    parser.add_argument('--rounds', type=int, default=7, help='各ケースのラウンド数')
+    args = parser.parse_args()
+
+    results = run(args.filter, args.rounds)
+    now = dt.datetime.now(tz=dt.UTC)
+    report = {
+        'meta': {
+            'timestamp': now.isoformat(),
+            'git_revision': get_git_revision(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+        },
+        'results': results,
+    }
+
+    output = args.output or RESULTS_DIR / f'{now:%Y%m%dT%H%M%SZ}.json'
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2, ensure_ascii=False), encoding='utf-8')
+    print(f'\nSaved results to {output}')
+
+    if args.compare is not None:
+        baseline = json.loads(args.compare.read_text(encoding='utf-8'))['results']
+        regressions = compare(results, baseline, args.threshold)
+        if len(regressions) > 0:
+            print(f'\n{len(regressions)} regression(s): {", ".join(regressions)}')
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+"""
+ベンチマーク用にプロセス内で動かすVOICEVOXエンジンのスタブ.
+
+/audio_query, /synthesis, /multi_synthesis, /speakers, /versionに固定の応答を返す.
+合成の中身は計らず, クライアント側のリクエストのオーバーヘッドだけを計るためのもの.
+stream_chunksを指定すると, /synthesisは合成しながら返すエンジンのように遅延を分けてchunkedで返す.
+"""
+
+import io
+import json
+import struct
+import threading
+import time
+import wave
+import zipfile
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import TracebackType
+from typing import Self
+from urllib.parse import parse_qs, urlparse
+
+STUB_FRAME_RATE = 24000
+# NOTE: 20msの無音を表すOpusパケット(CELT, fullband, 1フレーム).
+OPUS_SILENT_PACKET = b'\xf8\xff\xfe'
+
+
+def make_silent_wav(duration: float = 1.0, frame_rate: int = STUB_FRAME_RATE) -> bytes:
+    """
+    Make a silent mono 16bit wav like the output of VOICEVOX.
+
+    Args:
+        duration (float): 音声の長さ[秒]
+        frame_rate (int): サンプリングレート
+
+    Returns:
+        bytes: wavデータ
+    """
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as wav_file:
+        wav_file.setnchannels(1)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(frame_rate)
+        wav_file.writeframes(b'\x00\x00' * int(duration * frame_rate))
+    return buffer.getvalue()
+
+
+def _ogg_crc(data: bytes) -> int:
+    """
+    Calculate the CRC32 of an Ogg page with the polynomial 0x04c11db7, not reflected.
+
+    Args:
+        data (bytes): CRC欄を0にしたページ
+
+    Returns:
+        int: CRC32
+    """
+    crc = 0
+    for byte in data:
+        crc ^= byte << 24
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x04C11DB7) if crc & 0x80000000 else crc << 1
+            crc &= 0xFFFFFFFF
+    return crc
+
+
+def _ogg_page(packets: list[bytes], granule_position: int, sequence: int, header_type: int = 0) -> bytes:
+    """
+    Make an Ogg page holding whole packets.
+
+    Args:
+        packets (list[bytes]): ページに入れるパケット. 各255バイト未満
+        granule_position (int): ページ末尾のgranule position
+        sequence (int): ページ番号
+        header_type (int): 0x02で先頭, 0x04で末尾のページ
+
+    Returns:
+        bytes: Oggページ
+    """
+    segments = bytes(len(packet) for packet in packets)
+    header = struct.pack('<4sBBqIIIB', b'OggS', 0, header_type, granule_position, 1, sequence, 0, len(segments))
+    page = header + segments + b''.join(packets)
+    return page[:22] + struct.pack('<I', _ogg_crc(page)) + page[26:]
+
+
+def make_silent_ogg_opus(duration: float = 1.0) -> bytes:
+    """
+    Make a silent mono Ogg/Opus like the output of Azure or Google TTS.
+
+    Args:
+        duration (float): 音声の長さ[秒]
+
+    Returns:
+        bytes: Ogg/Opusデータ
+    """
+    pre_skip = 312
+    opus_head = struct.pack('<8sBBHIhB', b'OpusHead', 1, 1, pre_skip, 48000, 0, 0)
+    opus_tags = struct.pack('<8sI4sI', b'OpusTags', 4, b'stub', 0)
+    pages = [_ogg_page([opus_head], 0, 0, 0x02), _ogg_page([opus_tags], 0, 1)]
+    packet_count = int(duration / 0.02)
+    # NOTE: 1ページに50パケット(1秒)ずつ入れる.
+    for start in range(0, packet_count, 50):
+        count = min(50, packet_count - start)
+        is_last = start + count >= packet_count
+        granule_position = pre_skip + (start + count) * 960
+        pages.append(_ogg_page([OPUS_SILENT_PACKET] * count, granule_position, len(pages), 0x04 if is_last else 0))
+    return b''.join(pages)
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    """
+    The request handler of the stub engine.
+    """
+
+    protocol_version = 'HTTP/1.1'
+    # NOTE: ヘッダと本体が別々に送られるので, Nagleと遅延ACKで1往復40ms待たされないようにする.
+    disable_nagle_algorithm = True
+    server: '_StubServer'
+
+    def log_message(self, format: str, *args: object) -> None:  # noqa: A002
+        """
+        Suppress the access log.
+        """
+
+    def do_GET(self) -> None:
+        """
+        Answer /version and /speakers.
+        """
+        path = urlparse(self.path).path
+        if path == '/version':
+            self._send(b'"0.0.0-stub"', 'application/json')
+        elif path == '/speakers':
+            speakers = [{'name': 'stub', 'styles': [{'id': 1, 'name': 'normal'}]}]
+            self._send(json.dumps(speakers).encode(), 'application/json')
+        else:
+            self.send_error(404)
+
+    def do_POST(self) -> None:
+        """
+        Answer /audio_query, /synthesis and /multi_synthesis.
+        """
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        url = urlparse(self.path)
+        if url.path == '/synthesis' and self.server.stream_chunks > 0:
+            self._send_chunked(self.server.wav_data, 'audio/wav')
+            return
+
+        if self.server.latency > 0:
+            time.sleep(self.server.latency)
+
+        if url.path == '/audio_query':
+            text = parse_qs(url.query).get('text', [''])[0]
+            audio_query = {'accent_phrases': [], 'speedScale': 1.0, 'volumeScale': 1.0, 'kana': text}
+            self._send(json.dumps(audio_query, ensure_ascii=False).encode(), 'application/json')
+        elif url.path == '/synthesis':
+            self._send(self.server.wav_data, 'audio/wav')
+        elif url.path == '/multi_synthesis':
+            buffer = io.BytesIO()
+            with zipfile.ZipFile(buffer, 'w') as zip_file:
+                for i, _ in enumerate(json.loads(body)):
+                    zip_file.writestr(f'{i + 1:03}.wav', self.server.wav_data)
+            self._send(buffer.getvalue(), 'application/zip')
+        else:
+            self.send_error(404)
+
+    def _send(self, body: bytes, content_type: str) -> None:
+        """
+        Send the response with keep-alive.
+        """
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_chunked(self, body: bytes, content_type: str) -> None:
+        """
+        Send the response in chunks, spreading the latency between them.
+        """
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        chunk_size = -(-len(body) // self.server.stream_chunks)
+        for start in range(0, len(body), chunk_size):
+            time.sleep(self.server.latency / self.server.stream_chunks)
+            chunk = body[start : start + chunk_size]
+            self.wfile.write(f'{len(chunk):x}\r\n'.encode() + chunk + b'\r\n')
+            self.wfile.flush()
+        self.wfile.write(b'0\r\n\r\n')
+
+
+class _StubServer(ThreadingHTTPServer):
+    """
+    The HTTP server of the stub engine.
+    """
+
+    daemon_threads = True
+    latency = 0.0
+    stream_chunks = 0
+    wav_data = b''
+
+
+class StubVoicevoxEngine:
+    """
+    The stub VOICEVOX engine running on a background thread.
+
+    Use it as a context manager:
+
+        with StubVoicevoxEngine() as engine:
+            client = VoicevoxWrapper(engine.address)
+    """
+
+    def __init__(self, latency: float = 0.0, clip_duration: float = 1.0, stream_chunks: int = 0) -> None:
+        """
+        Initialize the stub engine.
+
+        Args:
+            latency (float): 各リクエストに加える遅延[秒]
+            clip_duration (float): 返す音声の長さ[秒]
+            stream_chunks (int): 0より大きい場合, /synthesisの応答をこの数に分け, 遅延も分けて返す. Defaults to 0.
+        """
+        self._server = _StubServer(('127.0.0.1', 0), _StubHandler)
+        self._server.latency = latency
+        self._server.stream_chunks = stream_chunks
+        self._server.wav_data = make_silent_wav(clip_duration)
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def address(self) -> str:
+        """
+        The address with port of the stub engine, such as '127.0.0.1:50021'.
+        """
+        host, port = self._server.server_address[:2]
+        return f'{host}:{port}'
+
+    def __enter__(self) -> Self:
+        """
+        Start serving.
+        """
+        self._thread.start()
+        return self
+
+    def __exit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc_value: BaseException | None,
+        traceback: TracebackType | None,
+    ) -> None:
+        """
+        Stop serving.
+        """
+        self._server.shutdown()
+        self._server.server_close()
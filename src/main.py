@@ -5,16 +5,31 @@ bot起動時はこのmain.pyを実行する.
 """
 
 import asyncio
+import datetime as dt
+import functools
+import logging
 import os
+import time
 
 import discord
 from discord.ext import commands
 
 import utilities.config_utilities as confutl
-import utilities.sound_utilities as sndutl
+import utilities.metrics_utilities as metutl
 import utilities.text_utilities as txtutl
 import yomiagecode.discord_functions as discordfunc
 import yomiagecode.tts_functions as ttsfunc
+from tts.voice_profile import get_voice_profile
+from yomiagecode.guild_state import GuildStates
+from yomiagecode.playback_scheduler import SynthesisJob
+from yomiagecode.presynthesis import get_presynthesizer
+from yomiagecode.speech_queue import Utterance
+from yomiagecode.synthesis_workers import get_worker_pool
+
+CONFIG_FILE_NAME = './data/config.yaml'
+JOIN_ANNOUNCEMENT = '{}さんが参加しました'
+LEAVE_ANNOUNCEMENT = '{}さんが退出しました'
+DICTIONARY_PERMISSION_TEXT = '読み辞書の編集にはサーバー管理の権限が必要です'
 
 # other
 WEATHER_API_KEY = os.getenv('OPEN_WEATHER_MAP_API_KEY')
@@ -23,17 +38,225 @@ GOOGLE_CSE_ID = os.getenv('GOOGLE_CUSTOM_SEARCH_CSE_ID')
 
 if __name__ == '__main__':
     # configファイルを読み込む
-    configs = confutl.load_config('./data/config.yaml')
+    configs = confutl.load_config(CONFIG_FILE_NAME)
 
     # Discord bot permission settings
     intents = discord.Intents.default()
     intents.message_content = True  # permission to retrieve message content
     intents.voice_states = True
-    discord_client = commands.Bot(command_prefix=configs['DISCORD']['COMMAND_PREFIX'], intents=intents)
+    # NOTE: 表示名の変更(on_member_update)を受け取るには, Developer PortalでServer Members Intentを有効にする.
+    intents.members = configs['DISCORD'].get('MEMBERS_INTENT', False)
+    # NOTE: 多数のギルドで動かす場合はAUTO_SHARDでゲートウェイ接続をシャードに分ける.
+    bot_class = commands.AutoShardedBot if configs['DISCORD'].get('AUTO_SHARD', False) else commands.Bot
+    discord_client = bot_class(command_prefix=configs['DISCORD']['COMMAND_PREFIX'], intents=intents)
 
     # TTS settings
-    tts_client = ttsfunc.get_tts_client(configs['TTS'])
-    sound_controller = sndutl.SoundController()
+    # NOTE: WORKERS.ENABLEの場合は合成と音声の前処理をワーカープロセスで行い, このプロセスはキャッシュと再生だけ行う.
+    worker_pool = get_worker_pool(configs)
+    if worker_pool is not None:
+        query_cache = None
+        tts_client = worker_pool
+    else:
+        query_cache = ttsfunc.get_audio_query_cache(configs['TTS'])
+        tts_client = ttsfunc.get_tts_client(configs['TTS'], query_cache)
+    sound_cache = ttsfunc.get_sound_cache(configs['TTS'])
+    reading_dictionary = ttsfunc.get_reading_dictionary(configs['TTS'])
+    chunker = ttsfunc.get_chunker(configs['TTS'])
+    guild_states = GuildStates(configs, worker_pool)
+    word_marks = txtutl.WordMarks()
+    url_controller = txtutl.URLcontroller()
+    background_tasks = set()
+
+    def is_guild_busy(guild: discord.Guild) -> bool:
+        """
+        Check the guild is reading aloud, to put off the pre-synthesis for it.
+
+        Args:
+            guild (discord.Guild): 対象のギルド
+
+        Returns:
+            bool: 合成または再生中か判定
+        """
+        scheduler = guild_states.find_scheduler(guild)
+        return scheduler is not None and not scheduler.is_idle()
+
+    presynthesizer = get_presynthesizer(configs, tts_client, sound_cache, is_guild_busy)
+
+    def read_aloud(
+        guild: discord.Guild,
+        text: str,
+        author: discord.Member | None = None,
+        message: discord.Message | None = None,
+        message_started_at: float | None = None,
+    ) -> None:
+        """
+        Append the text to the speech queue of the guild.
+
+        Args:
+            guild (discord.Guild): The guild to play the voice.
+            text (str): The text to be read aloud.
+            author (discord.Member | None): The author of the message, whose name is read before the text.
+                None for the announcements of the bot. Defaults to None.
+            message (discord.Message | None): The message of the text, to cancel it when deleted or edited.
+                Defaults to None.
+            message_started_at (float | None): The time.perf_counter() when the message arrived. Defaults to None.
+        """
+        tts_configs = guild_states.get(guild).tts_configs
+        utterance = Utterance(
+            text,
+            functools.partial(make_jobs, tts_configs=tts_configs),
+            author_id=author.id if author is not None else None,
+            author_name=to_reading(author.display_name) if author is not None else None,
+            message_id=message.id if message is not None else None,
+            message_started_at=message_started_at,
+        )
+        guild_states.scheduler(guild).submit_utterance(utterance)
+
+    def to_reading(text: str) -> str:
+        """
+        Rewrite the words in the text to their readings by the reading dictionary.
+
+        Args:
+            text (str): 読み上げる文章
+
+        Returns:
+            str: 単語を読みに置き換えた文章. 辞書が無効の場合はそのまま.
+        """
+        if reading_dictionary is None:
+            return text
+        return reading_dictionary.replace(text)
+
+    def presynthesize(guild: discord.Guild, display_name: str, *, with_join: bool = True) -> None:
+        """
+        Ask to synthesize the name and the join/leave announcements of the member in the background.
+
+        Args:
+            guild (discord.Guild): 読み上げるギルド
+            display_name (str): メンバーの表示名
+            with_join (bool): 参加の読み上げも合成するか. Defaults to True.
+        """
+        if presynthesizer is None:
+            return
+
+        user_name = to_reading(display_name)
+        texts = [user_name, LEAVE_ANNOUNCEMENT.format(user_name)]
+        if with_join:
+            texts.append(JOIN_ANNOUNCEMENT.format(user_name))
+        presynthesizer.request(texts, guild_states.get(guild).tts_configs, guild)
+
+    def presynthesize_channel(channel: discord.VoiceChannel) -> None:
+        """
+        Ask to synthesize the clips of the members of the voice channel and the recent authors of the guild.
+
+        Args:
+            channel (discord.VoiceChannel): ボットが接続したボイスチャンネル
+        """
+        if presynthesizer is None:
+            return
+
+        for voice_member in channel.members:
+            if not voice_member.bot:
+                presynthesize(channel.guild, voice_member.display_name, with_join=False)
+        for display_name in presynthesizer.recent_authors(channel.guild.id):
+            presynthesize(channel.guild, display_name)
+
+    def make_jobs(utterance: Utterance, tts_configs: dict) -> list[SynthesisJob]:
+        """
+        Split the utterance into the synthesis jobs when it leaves the speech queue.
+
+        Args:
+            utterance (Utterance): 読み上げる発話
+            tts_configs (dict): 発話を投入した時点のギルドのTTS用のconfig辞書
+
+        Returns:
+            list[SynthesisJob]: 名前と区間ごとの合成処理
+        """
+        if presynthesizer is not None and utterance.author_name is None and len(utterance.texts) == 1:
+            # NOTE: 参加/退出の読み上げは合成しておいた1つのクリップをそのまま再生する.
+            job = presynthesizer.job(utterance.texts[0], tts_configs)
+            if job is not None:
+                return [job]
+
+        alternative_text = tts_configs['ALTERNATIVE_TEXT']
+        with metutl.observe_stage('segmentation'):
+            segments = [
+                (segment, kind)
+                for text in utterance.texts
+                for segment, kind in word_marks.iter_segments(text, alternative_text)
+            ]
+            if chunker is not None:
+                # NOTE: 最初は短く切って読み上げ開始を早め, 以降は再生中に合成が間に合う長さまでまとめる.
+                speed_scale = get_voice_profile(tts_configs).speed_scale(tts_configs['USE_TTS'])
+                texts = chunker.chunk_segments(segments, speed_scale)
+            elif len(utterance.texts) > 1:
+                # NOTE: まとめた同じ発言者の短いメッセージは, 区切りで間を空けて1回で合成する.
+                texts = [
+                    ''.join(
+                        segment + txtutl.PAUSE_TEXT if kind in ('end', 'new_line') else segment
+                        for segment, kind in segments
+                    ),
+                ]
+            else:
+                texts = [segment for segment, _ in segments]
+        if utterance.author_name is not None:
+            texts.insert(0, utterance.author_name)
+
+        def make_sound(text: str) -> SynthesisJob:
+            job = presynthesizer.job(text, tts_configs) if presynthesizer is not None else None
+            return job or functools.partial(ttsfunc.make_sound, text, tts_client, tts_configs, sound_cache)
+
+        if not tts_configs.get('BATCH_SYNTHESIS', False):
+            return [make_sound(text) for text in texts]
+
+        # NOTE: 名前と最初の区間だけは単独で合成して読み上げ開始を早め, 残りはまとめて合成する.
+        head_count = 2 if utterance.author_name is not None else 1
+        batch_size = tts_configs.get('MAX_BATCH_SIZE', 8)
+        jobs = [make_sound(text) for text in texts[:head_count]]
+        jobs += [
+            functools.partial(ttsfunc.make_sounds, texts[i : i + batch_size], tts_client, tts_configs, sound_cache)
+            for i in range(head_count, len(texts), batch_size)
+        ]
+        return jobs
+
+    def reload_configs(new_configs: dict) -> None:
+        """
+        Swap in the reloaded configs without reconnecting.
+
+        Args:
+            new_configs (dict): 読み直したconfig辞書
+        """
+        new_configs, kept_keys = confutl.merge_reloaded_configs(configs, new_configs)
+        if len(kept_keys) > 0:
+            logging.warning('Changes of %s take effect after restart', ', '.join(kept_keys))
+        # NOTE: 最上位の値を1回のupdateで差し替えるので, 他のスレッドからも古いか新しいかのどちらかの節が見える.
+        configs.update(new_configs)
+        guild_states.reload(configs)
+        logging.info('Reloaded configuration')
+
+    @discord_client.event
+    async def setup_hook() -> None:
+        """
+        Start the background tasks: idle guild eviction, config reload, and the metrics endpoint and log if enabled.
+        """
+        idle_timeout = configs['DISCORD'].get('GUILD_IDLE_TIMEOUT_SEC', 30 * 60)
+        background_tasks.add(asyncio.create_task(guild_states.evict_idle_periodically(idle_timeout)))
+
+        watch_configs = configs.get('CONFIG_RELOAD', {})
+        if watch_configs.get('ENABLE', True):
+            watcher = confutl.ConfigWatcher(CONFIG_FILE_NAME, reload_configs, watch_configs.get('INTERVAL_SEC', 2.0))
+            background_tasks.add(asyncio.create_task(watcher.watch()))
+
+        metrics_configs = configs.get('METRICS', {})
+        if metrics_configs.get('ENABLE', False):
+            await metutl.start_metrics_server(
+                host=metrics_configs.get('HOST', '127.0.0.1'),
+                port=metrics_configs.get('PORT', 9464),
+            )
+        if metrics_configs.get('LOG_INTERVAL_SEC', 0) > 0:
+            task = asyncio.create_task(
+                metutl.log_metrics_periodically(interval_sec=metrics_configs['LOG_INTERVAL_SEC']),
+            )
+            background_tasks.add(task)
 
     @discord_client.command()
     async def join(
@@ -45,7 +268,7 @@ if __name__ == '__main__':
         Args:
             ctx (commands.Context): The context of the command invocation.
         """
-        is_target_text_channel = ctx.channel.name == configs['DISCORD']['TARGET_TEXT_CHANNEL']
+        is_target_text_channel = guild_states.get(ctx.guild).is_text_channel(ctx.channel)
         is_user_in_voice_channel = ctx.message.author.voice is not None
         if is_target_text_channel:
             if is_user_in_voice_channel:
@@ -66,7 +289,7 @@ if __name__ == '__main__':
         Args:
             ctx (commands.Context): The context of the command invocation.
         """
-        is_target_text_channel = ctx.channel.name == configs['DISCORD']['TARGET_TEXT_CHANNEL']
+        is_target_text_channel = guild_states.get(ctx.guild).is_text_channel(ctx.channel)
         is_bot_in_voice_channel = ctx.message.guild.voice_client is not None
         if is_target_text_channel:
             if is_bot_in_voice_channel:
@@ -77,6 +300,104 @@ if __name__ == '__main__':
                 send_text = 'ボイスチャンネルには入っていません'
                 await discordfunc.send_message(ctx.message.channel, send_text)
 
+    @discord_client.command()
+    async def skip(
+        ctx: commands.Context,
+    ) -> None:
+        """
+        Skip the message being read aloud.
+
+        Args:
+            ctx (commands.Context): The context of the command invocation.
+        """
+        if not guild_states.get(ctx.guild).is_text_channel(ctx.channel):
+            return
+
+        scheduler = guild_states.find_scheduler(ctx.guild)
+        if scheduler is not None and scheduler.skip():
+            send_text = '読み上げをスキップしました'
+        else:
+            send_text = '読み上げ中のメッセージはありません'
+        await discordfunc.send_message(ctx.message.channel, send_text)
+
+    @discord_client.command()
+    async def stop(
+        ctx: commands.Context,
+    ) -> None:
+        """
+        Stop reading aloud and drop all the waiting messages.
+
+        Args:
+            ctx (commands.Context): The context of the command invocation.
+        """
+        if not guild_states.get(ctx.guild).is_text_channel(ctx.channel):
+            return
+
+        scheduler = guild_states.find_scheduler(ctx.guild)
+        cancelled_count = scheduler.stop() if scheduler is not None else 0
+        if cancelled_count > 0:
+            send_text = f'読み上げを停止し, {cancelled_count}件のメッセージを取り消しました'
+        else:
+            send_text = '読み上げ中のメッセージはありません'
+        await discordfunc.send_message(ctx.message.channel, send_text)
+
+    @discord_client.command()
+    async def add_word(
+        ctx: commands.Context,
+        word: str,
+        reading: str,
+    ) -> None:
+        """
+        Add the word and its reading to the reading dictionary.
+
+        NOTE: 読み辞書は全てのギルドで共有するので, サーバー管理権限を持つユーザーだけが編集できる.
+
+        Args:
+            ctx (commands.Context): The context of the command invocation.
+            word (str): 置き換える単語
+            reading (str): 読み
+        """
+        if not guild_states.get(ctx.guild).is_text_channel(ctx.channel):
+            return
+
+        if reading_dictionary is None:
+            send_text = '読み辞書は無効になっています'
+        elif not ctx.author.guild_permissions.manage_guild:
+            send_text = DICTIONARY_PERMISSION_TEXT
+        else:
+            reading_dictionary.add(word, reading)
+            await asyncio.to_thread(reading_dictionary.save)
+            send_text = f'{word} の読みを {reading} で登録しました'
+        await discordfunc.send_message(ctx.message.channel, send_text)
+
+    @discord_client.command()
+    async def remove_word(
+        ctx: commands.Context,
+        word: str,
+    ) -> None:
+        """
+        Remove the word from the reading dictionary.
+
+        NOTE: add_wordと同じく, サーバー管理権限を持つユーザーだけが編集できる.
+
+        Args:
+            ctx (commands.Context): The context of the command invocation.
+            word (str): 削除する単語
+        """
+        if not guild_states.get(ctx.guild).is_text_channel(ctx.channel):
+            return
+
+        if reading_dictionary is None:
+            send_text = '読み辞書は無効になっています'
+        elif not ctx.author.guild_permissions.manage_guild:
+            send_text = DICTIONARY_PERMISSION_TEXT
+        elif reading_dictionary.remove(word):
+            await asyncio.to_thread(reading_dictionary.save)
+            send_text = f'{word} の読みを削除しました'
+        else:
+            send_text = f'{word} は登録されていません'
+        await discordfunc.send_message(ctx.message.channel, send_text)
+
     @discord_client.event
     async def on_voice_state_update(
         member: discord.Member,
@@ -86,27 +407,29 @@ if __name__ == '__main__':
         """
         Event handler for when user join a voice channel.
         """
+        # ボットが接続した場合は, ボイスチャンネルのメンバーと最近の発言者の名前と参加/退出を合成しておく
+        if member.id == discord_client.user.id:
+            if after.channel is not None and before.channel != after.channel:
+                presynthesize_channel(after.channel)
+            return
+
         # ボットの動作は無視
         if member.bot:
             return
 
         # ユーザがVCに参加した場合
         if after.channel is not None:
-            is_channel_matched = after.channel.id == configs['DISCORD']['TARGET_VOICE_CHANNEL']
+            is_channel_matched = guild_states.get(after.channel.guild).is_voice_channel(after.channel)
         else:
             is_channel_matched = False
         if before.channel is None and after.channel is not None and is_channel_matched:
             if not after.channel.guild.voice_client:
                 await after.channel.connect()
 
-            sound_controller = sndutl.SoundController()
-            user_name = member.display_name
-            content = user_name + 'さんが参加しました'
-            sound_file_name = await ttsfunc.make_sound_file(content, tts_client, configs['TTS'])
-            sound_controller = discordfunc.play_voice(after.channel.guild, sound_controller, sound_file_name, configs)
-            while not sound_controller.is_finish_all_thread():
-                await asyncio.sleep(0.1)
-                sound_controller.thread_control()
+            user_name = to_reading(member.display_name)
+            content = JOIN_ANNOUNCEMENT.format(user_name)
+            read_aloud(after.channel.guild, content)
+            presynthesize(after.channel.guild, member.display_name, with_join=False)
 
         # ユーザVCから離脱した場合
         elif before.channel is not None and after.channel is None:
@@ -115,19 +438,9 @@ if __name__ == '__main__':
                 await asyncio.sleep(0.1)
 
             else:
-                sound_controller = sndutl.SoundController()
-                user_name = member.display_name
-                content = user_name + 'さんが退出しました'
-                sound_file_name = await ttsfunc.make_sound_file(content, tts_client, configs['TTS'])
-                sound_controller = discordfunc.play_voice(
-                    before.channel.guild,
-                    sound_controller,
-                    sound_file_name,
-                    configs,
-                )
-                while not sound_controller.is_finish_all_thread():
-                    await asyncio.sleep(0.1)
-                    sound_controller.thread_control()
+                user_name = to_reading(member.display_name)
+                content = LEAVE_ANNOUNCEMENT.format(user_name)
+                read_aloud(before.channel.guild, content)
 
     @discord_client.event
     async def on_message(
@@ -139,8 +452,13 @@ if __name__ == '__main__':
         Args:
             message (discord.Message): The received message object.
         """
+        message_started_at = time.perf_counter()
+        if message.guild is None:
+            return
+
         is_human = not message.author.bot
-        is_target_text_channel = message.channel.id == configs['DISCORD']['TARGET_TEXT_CHANNEL']
+        guild_state = guild_states.get(message.guild)
+        is_target_text_channel = guild_state.is_text_channel(message.channel)
         is_voice_in = message.guild.voice_client is not None
         if len(message.content) > 0:
             is_command = message.content[0] == configs['DISCORD']['COMMAND_PREFIX']
@@ -148,49 +466,112 @@ if __name__ == '__main__':
             return
 
         if is_human and is_target_text_channel and not is_command and is_voice_in:
-            sound_controller = sndutl.SoundController()
-            user_name = message.author.display_name
-            sound_file_name = await ttsfunc.make_sound_file(user_name, tts_client, configs['TTS'])
-            sound_controller = discordfunc.play_voice(message.guild, sound_controller, sound_file_name, configs)
-
-            word_marks = txtutl.WordMarks()
-            url_ctrl = txtutl.URLcontroller()
-            text_buffer = ''
-            is_make_voice = False
-            message_text = message.content
-            for letter in message_text:
-                is_sp, is_p, is_e, is_q, is_n, is_s = word_marks.check_letter(letter)
-                is_including_url = url_ctrl.is_including_url(text_buffer)
-                if not is_sp and is_make_voice and len(text_buffer) > 0:
-                    text_buffer = url_ctrl.url2alternative_text(text_buffer, configs['TTS']['ALTERNATIVE_TEXT'])
-                    sound_file_name = await ttsfunc.make_sound_file(text_buffer, tts_client, configs['TTS'])
-                    sound_controller = discordfunc.play_voice(
-                        message.guild,
-                        sound_controller,
-                        sound_file_name,
-                        configs,
-                    )
-
-                    is_make_voice = False
-                    text_buffer = ''
-                    await asyncio.sleep(0.1)
-
-                if not is_n:
-                    text_buffer = text_buffer + letter
-
-                if is_sp and not is_including_url:
-                    is_make_voice = True
-
-                if is_including_url and is_s:
-                    is_make_voice = True
-
-            text_buffer = url_ctrl.url2alternative_text(text_buffer, configs['TTS']['ALTERNATIVE_TEXT'])
-            sound_file_name = await ttsfunc.make_sound_file(text_buffer, tts_client, configs['TTS'])
-            sound_controller = discordfunc.play_voice(message.guild, sound_controller, sound_file_name, configs)
-            while not sound_controller.is_finish_all_thread():
-                await asyncio.sleep(0.1)
-                sound_controller.thread_control()
+            if presynthesizer is not None:
+                presynthesizer.note_author(message.guild.id, message.author.id, message.author.display_name)
+            text = message.content
+            if reading_dictionary is not None:
+                # NOTE: 区切り文字を含む単語も置き換えられるよう分割前に置き換える.
+                #       URLの中の単語は置き換えないよう, 先にURLを代替テキストにする.
+                alternative_text = guild_state.tts_configs['ALTERNATIVE_TEXT']
+                with metutl.STAGE_SECONDS.time(stage='normalization', guild=str(message.guild.id)):
+                    text = to_reading(url_controller.url2alternative_text(text, alternative_text))
+            # NOTE: 分割と合成は待ち行列から取り出す時に行うので, 捨てられたメッセージは合成しない.
+            read_aloud(message.guild, text, message.author, message, message_started_at)
+
+            return
+
+        if is_command:
+            await discord_client.process_commands(message)
 
+    @discord_client.event
+    async def on_typing(
+        channel: discord.abc.Messageable,
+        user: discord.User | discord.Member,
+        when: dt.datetime,  # noqa: ARG001
+    ) -> None:
+        """
+        Event handler for typing. Synthesizes the name of the author before the message arrives.
+
+        Args:
+            channel (discord.abc.Messageable): The channel where the user is typing.
+            user (discord.User | discord.Member): The typing user.
+            when (dt.datetime): When the typing started.
+        """
+        guild = getattr(channel, 'guild', None)
+        if presynthesizer is None or guild is None or user.bot or guild.voice_client is None:
+            return
+        if not guild_states.get(guild).is_text_channel(channel):
+            return
+
+        presynthesizer.note_author(guild.id, user.id, user.display_name)
+        presynthesize(guild, user.display_name)
+
+    @discord_client.event
+    async def on_member_update(
+        before: discord.Member,
+        after: discord.Member,
+    ) -> None:
+        """
+        Event handler for member updates. Synthesizes the new name of the member who may be read aloud.
+
+        NOTE: DISCORD.MEMBERS_INTENTが有効な場合だけ届く.
+
+        Args:
+            before (discord.Member): The member object before the update.
+            after (discord.Member): The member object after the update.
+        """
+        if presynthesizer is None or after.bot or before.display_name == after.display_name:
+            return
+        if after.guild.voice_client is None:
+            return
+
+        is_in_voice = after.voice is not None and after.voice.channel is not None
+        if is_in_voice or presynthesizer.is_recent_author(after.guild.id, after.id):
+            if not is_in_voice:
+                presynthesizer.note_author(after.guild.id, after.id, after.display_name)
+            presynthesize(after.guild, after.display_name, with_join=not is_in_voice)
+
+    @discord_client.event
+    async def on_message_delete(
+        message: discord.Message,
+    ) -> None:
+        """
+        Event handler for deleted messages. Cancels the reading of the message.
+
+        Args:
+            message (discord.Message): The deleted message object.
+        """
+        if message.guild is None:
             return
 
+        scheduler = guild_states.find_scheduler(message.guild)
+        if scheduler is not None:
+            scheduler.cancel_message(message.id)
+
+    @discord_client.event
+    async def on_message_edit(
+        before: discord.Message,
+        after: discord.Message,
+    ) -> None:
+        """
+        Event handler for edited messages. Cancels the reading of the message which is not read yet.
+
+        Args:
+            before (discord.Message): The message object before the edit.
+            after (discord.Message): The message object after the edit.
+        """
+        # NOTE: URLの埋め込みが展開された場合も編集イベントが届くので, 本文が変わった場合だけ取り消す.
+        if after.guild is None or before.content == after.content:
+            return
+
+        scheduler = guild_states.find_scheduler(after.guild)
+        if scheduler is not None:
+            scheduler.cancel_message(after.id)
+
     discord_client.run(configs['DISCORD']['API_KEY'])
+    if worker_pool is not None:
+        worker_pool.shutdown()
+    if sound_cache is not None:
+        sound_cache.save_index()
+    if query_cache is not None:
+        query_cache.save()
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+SoundCacheのメモリとディスクの2段のキャッシュのテスト.
+"""
+
+from __future__ import annotations
+
+import threading
+import time
+from pathlib import Path
+
+from utilities.cache_utilities import SoundCache
+
+
+def test_disk_hit_after_memory_eviction(tmp_path: Path) -> None:
+    cache = SoundCache(str(tmp_path), max_memory_bytes=100)
+    cache.put('a', b'a' * 80)
+    cache.put('b', b'b' * 80)
+
+    assert 'a' not in cache.memory_entries
+    assert cache.get('a') == b'a' * 80
+    assert cache.get('a') == b'a' * 80
+    assert cache.counters['disk_hits'] == 1
+    assert cache.counters['memory_hits'] == 1
+
+
+def test_disk_tier_evicts_least_recently_used_files(tmp_path: Path) -> None:
+    cache = SoundCache(str(tmp_path), max_disk_bytes=200)
+    for key in ('a', 'b', 'c'):
+        cache.put(key, key.encode() * 80)
+
+    assert cache.get('a') is None
+    assert not (tmp_path / 'a.wav').exists()
+    assert cache.get_file('c') == str(tmp_path / 'c.wav')
+
+
+def test_lost_file_is_a_miss(tmp_path: Path) -> None:
+    cache = SoundCache(str(tmp_path), max_memory_bytes=0)
+    file_name = cache.put('a', b'a')
+    Path(file_name).unlink()
+
+    assert cache.get('a') is None
+    assert 'a' not in cache.disk_entries
+    assert cache.counters['misses'] == 1
+
+
+def test_expired_file_is_deleted_on_lookup(tmp_path: Path) -> None:
+    cache = SoundCache(str(tmp_path), max_memory_bytes=0, max_age_sec=0.01)
+    file_name = cache.put('a', b'a')
+    time.sleep(0.02)
+
+    assert cache.get_file('a') is None
+    assert not Path(file_name).exists()
+
+
+def test_expired_entry_is_not_served_from_memory(tmp_path: Path) -> None:
+    cache = SoundCache(str(tmp_path), max_age_sec=0.01)
+    file_name = cache.put('a', b'a')
+    assert 'a' in cache.memory_entries
+    time.sleep(0.02)
+
+    assert cache.get('a') is None
+    assert 'a' not in cache.memory_entries
+    assert cache.memory_bytes == 0
+    assert not Path(file_name).exists()
+
+
+def test_index_is_reloaded(tmp_path: Path) -> None:
+    cache = SoundCache(str(tmp_path))
+    cache.put('a', b'a' * 10, '.ogg')
+    cache.save_index()
+
+    reloaded = SoundCache(str(tmp_path))
+
+    assert reloaded.get_file('a') == str(tmp_path / 'a.ogg')
+    assert reloaded.get('a') == b'a' * 10
+
+
+def test_concurrent_puts_and_gets_keep_sizes_consistent(tmp_path: Path) -> None:
+    cache = SoundCache(str(tmp_path), max_memory_bytes=500, max_disk_bytes=1000)
+
+    def use(worker: int) -> None:
+        for i in range(50):
+            key = f'{worker}-{i % 10}'
+            cache.put(key, bytes(40))
+            cache.get(key)
+
+    threads = [threading.Thread(target=use, args=(worker,)) for worker in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert cache.disk_bytes == sum(entry['size'] for entry in cache.disk_entries.values())
+    assert cache.disk_bytes <= cache.max_disk_bytes
+    assert cache.memory_bytes == sum(map(len, cache.memory_entries.values()))
@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+"""
+HedgedTTSWrapperのヘッジとサーキットブレーカーのテスト.
+
+偽のAsyncTTSWrapperのバックエンドで, 応答の遅さと失敗を組み合わせて確認する.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import time
+from typing import Any
+
+import pytest
+
+from tts.hedged_wrapper import HedgedAudioQuery, HedgedTTSWrapper, TTSBackend
+from tts.tts_wrapper import AsyncTTSWrapper
+
+
+class FakeBackend(AsyncTTSWrapper):
+    """
+    The fake TTS backend which answers after the delay, or fails.
+    """
+
+    def __init__(self, name: str, delay: float = 0.0, *, fails: bool = False) -> None:
+        """
+        Initialize the fake backend.
+
+        Args:
+            name (str): 返す音声データに含める名前
+            delay (float): 応答までの秒数. Defaults to 0.0.
+            fails (bool): 応答の代わりにRuntimeErrorを送出するか. Defaults to False.
+        """
+        self.client = []
+        self.speakers_name_dict = {}
+        self.name = name
+        self.delay = delay
+        self.fails = fails
+        self.calls = 0
+        self.cancelled = 0
+
+    async def generate_audio_query(self, text: str, tts_configs: dict[str, Any] | None = None) -> str:  # noqa: ARG002
+        """
+        Return the text as the audio query.
+        """
+        return text
+
+    async def generate_voice(self, audio_query: str, tts_configs: dict[str, Any] | None = None) -> bytes:  # noqa: ARG002
+        """
+        Answer the name and the text after the delay.
+        """
+        self.calls += 1
+        try:
+            await asyncio.sleep(self.delay)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+
+        if self.fails:
+            raise_message = f'{self.name} failed'
+            raise RuntimeError(raise_message)
+        return f'{self.name}:{audio_query}'.encode()
+
+
+def make_backend(client: FakeBackend, **kwargs: Any) -> TTSBackend:  # noqa: ANN401
+    """
+    Make the backend state of the fake backend with short delays.
+    """
+    options = {'default_delay': 0.05, 'min_delay': 0.01, 'failure_threshold': 3, 'reset_timeout': 30.0} | kwargs
+    return TTSBackend(client.name, client, **options)
+
+
+def observe_latencies(backend: TTSBackend, latency: float, count: int = 20) -> None:
+    """
+    Record the successful requests so that the p95 is estimated.
+    """
+    for _ in range(count):
+        backend.record_success(latency)
+
+
+async def synthesize(wrapper: HedgedTTSWrapper, text: str = 'テスト') -> tuple[bytes, HedgedAudioQuery]:
+    """
+    Synthesize the text and return the voice data with the audio query.
+    """
+    audio_query = await wrapper.generate_audio_query(text)
+    return await wrapper.generate_voice(audio_query), audio_query
+
+
+def test_primary_serves_within_p95() -> None:
+    primary = FakeBackend('primary', delay=0.01)
+    secondary = FakeBackend('secondary')
+    primary_backend = make_backend(primary)
+    observe_latencies(primary_backend, 0.2)
+    wrapper = HedgedTTSWrapper([primary_backend, make_backend(secondary)])
+
+    voice_data, audio_query = asyncio.run(synthesize(wrapper))
+
+    assert voice_data == 'primary:テスト'.encode()
+    assert audio_query.served_by == 'primary'
+    assert audio_query.is_primary
+    assert secondary.calls == 0
+
+
+def test_hedge_fires_after_p95() -> None:
+    primary = FakeBackend('primary', delay=1.0)
+    secondary = FakeBackend('secondary', delay=0.01)
+    primary_backend = make_backend(primary)
+    observe_latencies(primary_backend, 0.05)
+    wrapper = HedgedTTSWrapper([primary_backend, make_backend(secondary)])
+
+    start = time.perf_counter()
+    voice_data, audio_query = asyncio.run(synthesize(wrapper))
+    elapsed = time.perf_counter() - start
+
+    assert primary_backend.hedge_delay() == pytest.approx(0.05)
+    assert voice_data == 'secondary:テスト'.encode()
+    assert audio_query.served_by == 'secondary'
+    assert not audio_query.is_primary
+    assert elapsed < 0.5
+    assert primary.cancelled == 1
+
+
+def test_hedge_waits_default_delay_without_latencies() -> None:
+    primary = FakeBackend('primary', delay=0.02)
+    secondary = FakeBackend('secondary')
+    primary_backend = make_backend(primary, default_delay=0.5)
+    wrapper = HedgedTTSWrapper([primary_backend, make_backend(secondary)])
+
+    _, audio_query = asyncio.run(synthesize(wrapper))
+
+    assert primary_backend.p95() is None
+    assert audio_query.served_by == 'primary'
+    assert secondary.calls == 0
+
+
+def test_failure_falls_over_to_next_backend() -> None:
+    primary = FakeBackend('primary', fails=True)
+    secondary = FakeBackend('secondary')
+    wrapper = HedgedTTSWrapper([make_backend(primary), make_backend(secondary)])
+
+    voice_data, audio_query = asyncio.run(synthesize(wrapper))
+
+    assert voice_data == 'secondary:テスト'.encode()
+    assert audio_query.served_by == 'secondary'
+    assert not audio_query.is_primary
+
+
+def test_circuit_opens_after_consecutive_failures() -> None:
+    primary = FakeBackend('primary', fails=True)
+    secondary = FakeBackend('secondary')
+    primary_backend = make_backend(primary, failure_threshold=3)
+    wrapper = HedgedTTSWrapper([primary_backend, make_backend(secondary)])
+
+    for _ in range(3):
+        asyncio.run(synthesize(wrapper))
+    assert primary_backend.opened_at is not None
+
+    _, audio_query = asyncio.run(synthesize(wrapper))
+
+    assert primary.calls == 3
+    assert secondary.calls == 4
+    assert audio_query.served_by == 'secondary'
+
+
+def test_circuit_probes_once_and_closes_on_success() -> None:
+    primary = FakeBackend('primary', fails=True)
+    secondary = FakeBackend('secondary')
+    primary_backend = make_backend(primary, failure_threshold=1, reset_timeout=0.05)
+    wrapper = HedgedTTSWrapper([primary_backend, make_backend(secondary)])
+    asyncio.run(synthesize(wrapper))
+    assert primary_backend.opened_at is not None
+    assert not primary_backend.is_available()
+
+    time.sleep(0.06)
+    assert primary_backend.is_available()
+    assert primary_backend.is_available()
+    assert not primary_backend.is_probing
+    primary_backend.record_start()
+    assert primary_backend.is_probing
+    assert not primary_backend.is_available()
+
+    primary_backend.is_probing = False
+    primary.fails = False
+    _, audio_query = asyncio.run(synthesize(wrapper))
+
+    assert audio_query.served_by == 'primary'
+    assert audio_query.is_primary
+    assert primary_backend.opened_at is None
+    assert not primary_backend.is_probing
+
+
+def test_half_open_fallback_is_probed_after_primary_answers() -> None:
+    primary = FakeBackend('primary', delay=0.01)
+    secondary = FakeBackend('secondary', fails=True)
+    primary_backend = make_backend(primary, default_delay=0.2)
+    secondary_backend = make_backend(secondary, failure_threshold=1, reset_timeout=0.05)
+    secondary_backend.record_failure()
+    time.sleep(0.06)
+    wrapper = HedgedTTSWrapper([primary_backend, secondary_backend])
+
+    for _ in range(3):
+        _, audio_query = asyncio.run(synthesize(wrapper))
+        assert audio_query.served_by == 'primary'
+
+    assert secondary.calls == 0
+    assert not secondary_backend.is_probing
+    assert secondary_backend.is_available()
+
+    primary.delay = 1.0
+    secondary.fails = False
+    _, audio_query = asyncio.run(synthesize(wrapper))
+
+    assert secondary.calls == 1
+    assert audio_query.served_by == 'secondary'
+    assert secondary_backend.opened_at is None
+
+
+def test_failed_probe_reopens_circuit() -> None:
+    primary = FakeBackend('primary', fails=True)
+    secondary = FakeBackend('secondary')
+    primary_backend = make_backend(primary, failure_threshold=1, reset_timeout=0.05)
+    wrapper = HedgedTTSWrapper([primary_backend, make_backend(secondary)])
+    asyncio.run(synthesize(wrapper))
+    opened_at = primary_backend.opened_at
+
+    time.sleep(0.06)
+    _, audio_query = asyncio.run(synthesize(wrapper))
+
+    assert primary.calls == 2
+    assert audio_query.served_by == 'secondary'
+    assert primary_backend.opened_at is not None
+    assert primary_backend.opened_at > opened_at
+    assert not primary_backend.is_available()
+
+
+def test_all_circuits_open_tries_every_backend() -> None:
+    primary = FakeBackend('primary')
+    secondary = FakeBackend('secondary')
+    backends = [make_backend(primary), make_backend(secondary)]
+    for backend in backends:
+        backend.opened_at = time.monotonic()
+    wrapper = HedgedTTSWrapper(backends)
+
+    _, audio_query = asyncio.run(synthesize(wrapper))
+
+    assert audio_query.served_by == 'primary'
+    assert audio_query.is_primary
+
+
+def test_all_backends_failing_raises_runtime_error() -> None:
+    primary = FakeBackend('primary', fails=True)
+    secondary = FakeBackend('secondary', fails=True)
+    wrapper = HedgedTTSWrapper([make_backend(primary), make_backend(secondary)])
+
+    with pytest.raises(RuntimeError, match='primary: primary failed, secondary: secondary failed'):
+        asyncio.run(synthesize(wrapper))
+    assert primary.calls == 1
+    assert secondary.calls == 1
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+名前と参加/退出の読み上げを合成しておく処理のテスト.
+
+偽のバックエンドを束ねたHedgedTTSWrapperで, 置き場に置くクリップを確認する.
+"""
+
+from __future__ import annotations
+
+import asyncio
+
+from tests.test_hedged_wrapper import FakeBackend, make_backend
+from tts.hedged_wrapper import HedgedTTSWrapper
+from utilities.cache_utilities import SoundCache
+from yomiagecode.presynthesis import ClipStore, PreSynthesizer
+
+TTS_CONFIGS = {'USE_TTS': 'FAKE', 'FAKE': {}}
+
+
+class FakeGuild:
+    """
+    The fake guild which only has an ID.
+    """
+
+    id = 1
+
+
+async def presynthesize(presynthesizer: PreSynthesizer, texts: list[str]) -> None:
+    """
+    Request the texts and wait until all of them are synthesized.
+    """
+    presynthesizer.request(texts, TTS_CONFIGS, FakeGuild())
+    # NOTE: 合成しておく処理は完了を通知しないので, 待ちが無くなるまで見に行く.
+    while presynthesizer.stats()['pending'] > 0 or len(presynthesizer._pending_keys) > 0:  # noqa: ASYNC110, SLF001
+        await asyncio.sleep(0.01)
+
+
+def test_primary_voice_is_stored() -> None:
+    primary = FakeBackend('primary')
+    wrapper = HedgedTTSWrapper([make_backend(primary), make_backend(FakeBackend('secondary'))])
+    presynthesizer = PreSynthesizer(wrapper, ClipStore())
+
+    asyncio.run(presynthesize(presynthesizer, ['ずんだ']))
+
+    assert presynthesizer.clip_store.get(SoundCache.make_key('ずんだ', TTS_CONFIGS)) == 'primary:ずんだ'.encode()
+    assert presynthesizer.counters['rendered'] == 1
+
+
+def test_fallback_voice_is_not_stored() -> None:
+    primary = FakeBackend('primary', fails=True)
+    wrapper = HedgedTTSWrapper([make_backend(primary), make_backend(FakeBackend('secondary'))])
+    presynthesizer = PreSynthesizer(wrapper, ClipStore())
+
+    asyncio.run(presynthesize(presynthesizer, ['ずんだ']))
+
+    assert len(presynthesizer.clip_store) == 0
+    assert presynthesizer.job('ずんだ', TTS_CONFIGS) is None
+    assert presynthesizer.counters['rendered'] == 0
+    assert presynthesizer.counters['fallback'] == 1
+
+
+def test_clip_store_evicts_least_recently_used() -> None:
+    clip_store = ClipStore(max_entries=2)
+    clip_store.put('a', b'a')
+    clip_store.put('b', b'b')
+    clip_store.get('a')
+    clip_store.put('c', b'c')
+
+    assert 'a' in clip_store
+    assert 'b' not in clip_store
+    assert clip_store.stats()['evictions'] == 1
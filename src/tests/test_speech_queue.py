@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+"""
+SpeechQueueの同じ文章の発話をまとめる方針のテスト.
+"""
+
+from __future__ import annotations
+
+from yomiagecode.speech_queue import SpeechQueue, Utterance
+
+
+def make_utterance(text: str, author_id: int | None) -> Utterance:
+    """
+    Make the utterance of the text which is never synthesized.
+    """
+    return Utterance(text, lambda _: [], author_id=author_id)
+
+
+def test_repeated_message_of_same_author_is_collapsed() -> None:
+    queue = SpeechQueue()
+    queue.put(make_utterance('おはよう', 1))
+    queue.put(make_utterance('おはよう', 1))
+
+    assert len(queue) == 1
+    assert queue.stats()['collapsed'] == 1
+
+
+def test_same_message_of_other_author_is_kept() -> None:
+    queue = SpeechQueue()
+    queue.put(make_utterance('おはよう', 1))
+    queue.put(make_utterance('おはよう', 2))
+
+    assert len(queue) == 2
+    assert queue.stats()['collapsed'] == 0
+
+
+def test_repeated_system_announcement_is_collapsed() -> None:
+    queue = SpeechQueue()
+    queue.put(make_utterance('ずんださんが参加しました', None))
+    queue.put(make_utterance('ずんださんが参加しました', None))
+
+    assert len(queue) == 1
@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+"""
+合成しながら再生する処理のテスト.
+
+チャンクに分けて返す偽のバックエンドで, VoiceStream, キャッシュへの保存, ストリーミングの音声ソースを確認する.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import io
+import time
+import wave
+from typing import TYPE_CHECKING, Any
+
+import discord
+import pytest
+
+import utilities.sound_utilities as sndutl
+import yomiagecode.discord_functions as discordfunc
+import yomiagecode.tts_functions as ttsfunc
+from tts.hedged_wrapper import HedgedTTSWrapper, TTSBackend
+from tts.tts_wrapper import AsyncTTSWrapper
+from utilities.cache_utilities import SoundCache
+
+if TYPE_CHECKING:
+    from collections.abc import AsyncIterator, Iterator
+    from pathlib import Path
+
+FRAME_RATE = 24000
+FRAME_SIZE = discord.opus.Encoder.FRAME_SIZE
+TTS_CONFIGS = {'USE_TTS': 'FAKE', 'STREAMING': True, 'FAKE': {}}
+CONFIGS = {'FFMPEG': {'FADE_LEN': 0.01}}
+
+
+def make_streaming_header() -> bytes:
+    """
+    Make the wav header whose sizes are unknown, like the one sent at the start of a stream.
+    """
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as wav_file:
+        wav_file.setnchannels(1)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(FRAME_RATE)
+    return buffer.getvalue()
+
+
+class FakeChunkedBackend(AsyncTTSWrapper):
+    """
+    The fake TTS backend which streams 1 second of wav in chunks.
+    """
+
+    supports_streaming = True
+
+    def __init__(self, chunks: int = 5, delay: float = 0.01, fail_after: int | None = None) -> None:
+        """
+        Initialize the fake backend.
+
+        Args:
+            chunks (int): PCMを分けるチャンクの数. Defaults to 5.
+            delay (float): チャンクごとの待ち時間[秒]. Defaults to 0.01.
+            fail_after (int | None): このチャンク数を返した後にRuntimeErrorを送出する. Defaults to None.
+        """
+        self.client = []
+        self.speakers_name_dict = {}
+        self.chunks = chunks
+        self.delay = delay
+        self.fail_after = fail_after
+        self.pcm = b'\x00\x01' * FRAME_RATE
+
+    async def generate_audio_query(self, text: str, tts_configs: dict[str, Any] | None = None) -> str:  # noqa: ARG002
+        """
+        Return the text as the audio query.
+        """
+        return text
+
+    async def generate_voice(self, audio_query: str, tts_configs: dict[str, Any] | None = None) -> bytes:
+        """
+        Return the joined stream.
+        """
+        return b''.join([chunk async for chunk in self.stream_voice(audio_query, tts_configs)])
+
+    async def stream_voice(
+        self,
+        audio_query: str,  # noqa: ARG002
+        tts_configs: dict[str, Any] | None = None,  # noqa: ARG002
+    ) -> AsyncIterator[bytes]:
+        """
+        Yield the header and then the PCM in chunks.
+        """
+        yield make_streaming_header()
+        chunk_size = -(-len(self.pcm) // self.chunks)
+        for i in range(self.chunks):
+            if self.fail_after is not None and i >= self.fail_after:
+                raise_message = 'The fake stream failed'
+                raise RuntimeError(raise_message)
+            await asyncio.sleep(self.delay)
+            yield self.pcm[i * chunk_size : (i + 1) * chunk_size]
+
+
+async def wait_complete(stream: ttsfunc.VoiceStream) -> None:
+    """
+    Wait until the stream has finished, including saving it to the cache.
+    """
+    done = asyncio.get_running_loop().create_future()
+    stream.add_done_callback(lambda: done.done() or done.set_result(None))
+    await done
+
+
+async def collect_chunks(stream: ttsfunc.VoiceStream, received: list[bytes]) -> None:
+    """
+    Collect the chunks of the stream, keeping the ones received before a failure.
+    """
+    async for chunk in stream.iter_chunks():
+        received.append(chunk)  # noqa: PERF401
+
+
+async def read_stream(stream: ttsfunc.VoiceStream) -> bytes:
+    """
+    Read the whole stream and wait until it has finished.
+    """
+    data = b''.join([chunk async for chunk in stream.iter_chunks()])
+    await wait_complete(stream)
+    return data
+
+
+def test_stream_is_cached_with_repaired_header(tmp_path: Path) -> None:
+    backend = FakeChunkedBackend()
+    sound_cache = SoundCache(str(tmp_path))
+
+    async def run() -> tuple[ttsfunc.VoiceStream, bytes]:
+        stream = await ttsfunc.make_sound('テスト', backend, TTS_CONFIGS, sound_cache)
+        return stream, await read_stream(stream)
+
+    stream, data = asyncio.run(run())
+
+    assert isinstance(stream, ttsfunc.VoiceStream)
+    assert sndutl.get_wav_duration(data) == 0.0
+    cached = sound_cache.get(SoundCache.make_key('テスト', TTS_CONFIGS))
+    assert cached is not None
+    assert len(cached) == len(data)
+    assert sndutl.get_wav_duration(cached) == pytest.approx(1.0)
+
+
+def test_cached_stream_is_returned_without_synthesis(tmp_path: Path) -> None:
+    backend = FakeChunkedBackend()
+    sound_cache = SoundCache(str(tmp_path))
+
+    async def run() -> bytes | str | ttsfunc.VoiceStream:
+        await read_stream(await ttsfunc.make_sound('テスト', backend, TTS_CONFIGS, sound_cache))
+        return await ttsfunc.make_sound('テスト', backend, TTS_CONFIGS, sound_cache)
+
+    assert isinstance(asyncio.run(run()), bytes)
+
+
+def test_failed_stream_raises_and_is_not_cached(tmp_path: Path) -> None:
+    backend = FakeChunkedBackend(fail_after=2)
+    sound_cache = SoundCache(str(tmp_path))
+
+    async def run() -> list[bytes]:
+        stream = await ttsfunc.make_sound('テスト', backend, TTS_CONFIGS, sound_cache)
+        received = []
+        with pytest.raises(RuntimeError, match='The fake stream failed'):
+            await collect_chunks(stream, received)
+        await wait_complete(stream)
+        return received
+
+    received = asyncio.run(run())
+
+    assert len(received) == 3
+    assert sound_cache.get(SoundCache.make_key('テスト', TTS_CONFIGS)) is None
+
+
+def test_cancelled_stream_is_not_cached(tmp_path: Path) -> None:
+    backend = FakeChunkedBackend(delay=0.05)
+    sound_cache = SoundCache(str(tmp_path))
+
+    async def run() -> None:
+        stream = await ttsfunc.make_sound('テスト', backend, TTS_CONFIGS, sound_cache)
+        await asyncio.sleep(0.07)
+        stream.cancel()
+        with pytest.raises(RuntimeError, match='cancelled'):
+            await collect_chunks(stream, [])
+
+    asyncio.run(run())
+
+    assert sound_cache.get(SoundCache.make_key('テスト', TTS_CONFIGS)) is None
+
+
+def test_stream_from_fallback_backend_is_not_cached(tmp_path: Path) -> None:
+    primary = FakeChunkedBackend(fail_after=0)
+    secondary = FakeChunkedBackend()
+    hedged = HedgedTTSWrapper([TTSBackend('primary', primary), TTSBackend('secondary', secondary)])
+    sound_cache = SoundCache(str(tmp_path))
+
+    async def run() -> bytes:
+        stream = await ttsfunc.make_sound_stream('テスト', hedged, TTS_CONFIGS, sound_cache)
+        return await read_stream(stream)
+
+    data = asyncio.run(run())
+
+    assert len(data) > 0
+    assert sound_cache.get(SoundCache.make_key('テスト', TTS_CONFIGS)) is None
+
+
+def test_iterate_in_thread_closes_iterator_on_cancel() -> None:
+    closed = []
+
+    def generate() -> Iterator[bytes]:
+        try:
+            for _ in range(10):
+                time.sleep(0.02)
+                yield b'\x00'
+        finally:
+            closed.append(True)
+
+    async def run() -> None:
+        async def consume() -> None:
+            async for _ in ttsfunc._iterate_in_thread(generate()):  # noqa: SLF001
+                pass
+
+        task = asyncio.create_task(consume())
+        await asyncio.sleep(0.05)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+    asyncio.run(run())
+
+    assert closed == [True]
+
+
+def test_iterate_in_thread_passes_empty_chunks() -> None:
+    async def run() -> list[bytes]:
+        return [chunk async for chunk in ttsfunc._iterate_in_thread(iter([b'a', b'', b'b']))]  # noqa: SLF001
+
+    assert asyncio.run(run()) == [b'a', b'', b'b']
+
+
+def test_streaming_source_waits_for_jitter_buffer() -> None:
+    async def run() -> None:
+        source = discordfunc.StreamingPcmAudioSource(jitter_buffer_sec=0.04)
+        waiter = asyncio.create_task(source.wait_ready())
+        source.feed(bytes(FRAME_SIZE))
+        await asyncio.sleep(0)
+        assert not waiter.done()
+        source.feed(bytes(FRAME_SIZE))
+        await asyncio.wait_for(waiter, 1.0)
+
+    asyncio.run(run())
+
+
+def test_streaming_source_fills_underrun_with_silence() -> None:
+    source = discordfunc.StreamingPcmAudioSource(jitter_buffer_sec=0.02, underrun_timeout=0.04)
+    source.feed(b'\x01' * FRAME_SIZE)
+
+    assert source.read() == b'\x01' * FRAME_SIZE
+    start = time.perf_counter()
+    assert source.read() == bytes(FRAME_SIZE)
+    assert time.perf_counter() - start < 0.01
+    assert source.underrun_count == 1
+
+    source.feed(b'\x02' * (FRAME_SIZE // 2))
+    assert source.read() == bytes(FRAME_SIZE)
+    source.feed(b'\x02' * (FRAME_SIZE // 2))
+    assert source.read() == b'\x02' * FRAME_SIZE
+    assert source.underrun_count == 2
+
+    for _ in range(2):
+        assert source.read() == bytes(FRAME_SIZE)
+    assert source.read() == b''
+
+
+def test_streaming_source_pads_the_rest_after_finish() -> None:
+    source = discordfunc.StreamingPcmAudioSource()
+    source.feed(b'\x01' * (FRAME_SIZE + 4))
+    source.finish()
+
+    assert source.read() == b'\x01' * FRAME_SIZE
+    assert source.read() == b'\x01' * 4 + bytes(FRAME_SIZE - 4)
+    assert source.read() == b''
+    assert source.underrun_count == 0
+
+
+def test_feed_streaming_source_plays_the_whole_stream() -> None:
+    backend = FakeChunkedBackend()
+
+    async def run() -> bytes:
+        stream = await ttsfunc.make_sound('テスト', backend, TTS_CONFIGS)
+        source = discordfunc.StreamingPcmAudioSource()
+        await discordfunc.feed_streaming_source(source, stream.iter_chunks(), CONFIGS)
+        await source.wait_ready()
+        return b''.join(iter(source.read, b''))
+
+    pcm = asyncio.run(run())
+
+    # NOTE: 24kHz monoの1秒が48kHz stereoに変換され, 20msのフレームに揃えられる.
+    assert len(pcm) == 50 * FRAME_SIZE
@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+"""
+SynthesizerPoolの貸し出し, 破棄, 上限, 接続の開き直しのテスト.
+
+偽のシンセサイザを作る関数で, 作成と接続の回数を数えて確認する.
+"""
+
+from __future__ import annotations
+
+import threading
+import time
+from typing import TYPE_CHECKING
+
+import pytest
+
+from tts.synthesizer_pool import SynthesizerPool
+
+if TYPE_CHECKING:
+    from collections.abc import Hashable
+
+
+class FakeSynthesizer:
+    """
+    The fake synthesizer which counts its connections.
+    """
+
+    def __init__(self, key: Hashable, serial: int) -> None:
+        """
+        Initialize the fake synthesizer.
+
+        Args:
+            key (Hashable): 作成時のキー
+            serial (int): 作成された順番
+        """
+        self.key = key
+        self.serial = serial
+        self.connections = 0
+
+
+class FakeFactory:
+    """
+    The fake factory which records the created synthesizers, and can fail to connect.
+    """
+
+    def __init__(self) -> None:
+        """
+        Initialize the fake factory.
+        """
+        self.created: list[FakeSynthesizer] = []
+        self.fails_to_connect = False
+
+    def __call__(self, key: Hashable) -> FakeSynthesizer:
+        """
+        Create a fake synthesizer.
+        """
+        synthesizer = FakeSynthesizer(key, len(self.created))
+        self.created.append(synthesizer)
+        return synthesizer
+
+    def connect(self, synthesizer: FakeSynthesizer) -> None:
+        """
+        Open the connection of the fake synthesizer.
+        """
+        if self.fails_to_connect:
+            raise_message = 'Failed to connect'
+            raise ConnectionError(raise_message)
+        synthesizer.connections += 1
+
+
+def test_acquire_creates_once_and_reuses() -> None:
+    factory = FakeFactory()
+    pool = SynthesizerPool(factory, factory.connect)
+
+    with pool.acquire('voice') as first:
+        assert first.connections == 1
+    with pool.acquire('voice') as second:
+        assert second is first
+
+    assert len(factory.created) == 1
+    assert pool.stats() == {'voice': {'total': 1, 'idle': 1}}
+
+
+def test_keys_have_their_own_synthesizers() -> None:
+    factory = FakeFactory()
+    pool = SynthesizerPool(factory)
+
+    with pool.acquire('a') as a, pool.acquire('b') as b:
+        assert a.key == 'a'
+        assert b.key == 'b'
+
+    assert pool.stats() == {'a': {'total': 1, 'idle': 1}, 'b': {'total': 1, 'idle': 1}}
+
+
+def test_synthesizer_is_discarded_when_use_raises() -> None:
+    factory = FakeFactory()
+    pool = SynthesizerPool(factory, factory.connect)
+
+    with pytest.raises(RuntimeError), pool.acquire('voice'):
+        raise RuntimeError
+
+    assert pool.stats() == {'voice': {'total': 0, 'idle': 0}}
+    with pool.acquire('voice') as synthesizer:
+        assert synthesizer.serial == 1
+
+
+def test_failed_creation_frees_the_slot() -> None:
+    factory = FakeFactory()
+    pool = SynthesizerPool(factory, factory.connect, max_per_key=1)
+    factory.fails_to_connect = True
+
+    with pytest.raises(ConnectionError), pool.acquire('voice'):
+        pass
+
+    factory.fails_to_connect = False
+    with pool.acquire('voice') as synthesizer:
+        assert synthesizer.connections == 1
+
+
+def test_concurrent_users_get_different_synthesizers() -> None:
+    factory = FakeFactory()
+    pool = SynthesizerPool(factory, max_per_key=2)
+
+    with pool.acquire('voice') as first, pool.acquire('voice') as second:
+        assert first is not second
+
+    assert pool.stats() == {'voice': {'total': 2, 'idle': 2}}
+
+
+def test_max_per_key_makes_callers_wait() -> None:
+    factory = FakeFactory()
+    pool = SynthesizerPool(factory, max_per_key=1)
+    acquired = threading.Event()
+    borrowed = []
+
+    def borrow() -> None:
+        with pool.acquire('voice') as synthesizer:
+            borrowed.append(synthesizer)
+        acquired.set()
+
+    with pool.acquire('voice') as first:
+        thread = threading.Thread(target=borrow)
+        thread.start()
+        assert not acquired.wait(0.1)
+    thread.join(1.0)
+
+    assert acquired.is_set()
+    assert borrowed == [first]
+    assert len(factory.created) == 1
+
+
+def test_warm_up_is_bounded_by_max_per_key() -> None:
+    factory = FakeFactory()
+    pool = SynthesizerPool(factory, factory.connect, max_per_key=2)
+
+    pool.warm_up('voice', count=3)
+
+    assert len(factory.created) == 2
+    assert all(synthesizer.connections == 1 for synthesizer in factory.created)
+    assert pool.stats() == {'voice': {'total': 2, 'idle': 2}}
+
+
+def test_failed_warm_up_is_retried_on_use() -> None:
+    factory = FakeFactory()
+    pool = SynthesizerPool(factory, factory.connect)
+    factory.fails_to_connect = True
+
+    pool.warm_up('voice')
+
+    assert pool.stats() == {'voice': {'total': 0, 'idle': 0}}
+    factory.fails_to_connect = False
+    with pool.acquire('voice') as synthesizer:
+        assert synthesizer.connections == 1
+
+
+def test_refresh_idle_reopens_only_idle_connections() -> None:
+    factory = FakeFactory()
+    pool = SynthesizerPool(factory, factory.connect, max_per_key=2, idle_refresh_sec=0.05)
+    pool.warm_up('voice', count=2)
+    time.sleep(0.06)
+
+    with pool.acquire('voice') as in_use:
+        assert pool.refresh_idle() == 1
+    idle = next(synthesizer for synthesizer in factory.created if synthesizer is not in_use)
+
+    assert idle.connections == 2
+    assert in_use.connections == 1
+    assert pool.stats() == {'voice': {'total': 2, 'idle': 2}}
+    assert pool.refresh_idle() == 0
+
+
+def test_refresh_idle_discards_failed_connections() -> None:
+    factory = FakeFactory()
+    pool = SynthesizerPool(factory, factory.connect, idle_refresh_sec=0.0)
+    pool.warm_up('voice')
+    factory.fails_to_connect = True
+
+    assert pool.refresh_idle() == 0
+    assert pool.stats() == {'voice': {'total': 0, 'idle': 0}}
+
+
+def test_refresh_idle_without_connect_does_nothing() -> None:
+    pool = SynthesizerPool(FakeFactory(), idle_refresh_sec=0.0)
+    pool.warm_up('voice')
+
+    assert pool.refresh_idle() == 0
+
+
+def test_close_drops_idle_synthesizers() -> None:
+    factory = FakeFactory()
+    pool = SynthesizerPool(factory, factory.connect, max_per_key=2)
+    pool.warm_up('voice', count=2)
+
+    pool.close()
+
+    assert pool.stats() == {'voice': {'total': 0, 'idle': 0}}
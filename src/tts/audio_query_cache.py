@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+The class for cache audio queries of VOICEVOX.
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+
+class AudioQueryCache:
+    """
+    Bounded LRU cache of audio queries, keyed by text and speaker.
+
+    speedScale and volumeScale are only fields of the audio query, so they are patched on each copy
+    and changing them does not invalidate the cache.
+    """
+
+    def __init__(self, max_entries: int = 4096, cache_file: str | None = None) -> None:
+        """
+        Initialize the audio query cache and load the persisted entries.
+
+        Args:
+            max_entries (int): The maximum number of cached queries. Defaults to 4096.
+            cache_file (str | None): The json file to persist the cache. If it is None, the cache is memory only.
+        """
+        self.max_entries = max_entries
+        self.cache_file = Path(cache_file) if cache_file is not None else None
+        # NOTE: 取り出すたびに深いコピーが必要なので, json文字列で保持してjson.loadsでコピーを作る.
+        self.entries: OrderedDict[str, str] = OrderedDict()
+        self.counters = {'hits': 0, 'misses': 0}
+        self._lock = threading.Lock()
+        self.load()
+
+    @staticmethod
+    def make_key(text: str, speaker: int) -> str:
+        """
+        Make the cache key.
+
+        Args:
+            text (str): 音声に変換する文章
+            speaker (int): 話者ID
+
+        Returns:
+            str: キャッシュのキー
+        """
+        return f'{speaker}\t{text}'
+
+    def get(self, text: str, speaker: int, speed_scale: float, volume_scale: float) -> dict | None:
+        """
+        Get a copy of the cached audio query with speed and volume patched.
+
+        Args:
+            text (str): 音声に変換する文章
+            speaker (int): 話者ID
+            speed_scale (float): 話速
+            volume_scale (float): 音量
+
+        Returns:
+            dict | None: The audio query. None if it is not cached.
+        """
+        key = self.make_key(text, speaker)
+        with self._lock:
+            serialized = self.entries.get(key)
+            if serialized is None:
+                self.counters['misses'] += 1
+                return None
+
+            self.entries.move_to_end(key)
+            self.counters['hits'] += 1
+
+        audio_query = json.loads(serialized)
+        audio_query['speedScale'] = speed_scale
+        audio_query['volumeScale'] = volume_scale
+        return audio_query
+
+    def put(self, text: str, speaker: int, audio_query: dict) -> None:
+        """
+        Store the audio query.
+
+        Args:
+            text (str): 音声に変換する文章
+            speaker (int): 話者ID
+            audio_query (dict): The audio query returned by the engine.
+        """
+        key = self.make_key(text, speaker)
+        serialized = json.dumps(audio_query, ensure_ascii=False)
+        with self._lock:
+            self.entries[key] = serialized
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def stats(self) -> dict[str, int | float]:
+        """
+        Get the hit/miss counters.
+
+        Returns:
+            dict[str, int | float]: カウンタとヒット率の辞書
+        """
+        with self._lock:
+            lookups = self.counters['hits'] + self.counters['misses']
+            return self.counters | {
+                'hit_ratio': self.counters['hits'] / lookups if lookups > 0 else 0.0,
+                'entries': len(self.entries),
+            }
+
+    def load(self) -> None:
+        """
+        Load the persisted entries from the cache file.
+        """
+        if self.cache_file is None or not self.cache_file.exists():
+            return
+
+        try:
+            with self.cache_file.open('r', encoding='utf-8') as f:
+                entries = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            logging.exception('Failed to load audio query cache "%s"', self.cache_file)
+            return
+
+        with self._lock:
+            for key, serialized in entries:
+                self.entries[key] = serialized
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def save(self) -> None:
+        """
+        Write the entries to the cache file atomically.
+        """
+        if self.cache_file is None:
+            return
+
+        with self._lock:
+            entries: list[Any] = list(self.entries.items())
+
+        self.cache_file.parent.mkdir(parents=True, exist_ok=True)
+        tmp_file = self.cache_file.with_suffix('.tmp')
+        with tmp_file.open('w', encoding='utf-8') as f:
+            json.dump(entries, f, ensure_ascii=False)
+        tmp_file.replace(self.cache_file)
@@ -3,22 +3,45 @@
 The abstract class for wrap tts.
 """
 
-import tempfile
+import io
+import wave
+from collections.abc import Iterator
 from typing import Any
 
-from azure.cognitiveservices.speech import AudioConfig, SpeechConfig, SpeechSynthesizer
+from azure.cognitiveservices.speech import (
+    AudioDataStream,
+    Connection,
+    ResultReason,
+    SpeechConfig,
+    SpeechSynthesisOutputFormat,
+    SpeechSynthesizer,
+    StreamStatus,
+)
 
-from .tts_wrapper import TTSWrapper
+from .synthesizer_pool import SynthesizerPool
+from .tts_wrapper import OUTPUT_FORMAT_OGG_OPUS, OUTPUT_FORMAT_WAV, TTSWrapper
+from .voice_profile import get_voice_profile
 
 # NOTE: https://learn.microsoft.com/ja-jp/azure/ai-services/speech-service/language-support?tabs=tts#text-to-speech .
 #       分かりにくいのでAzureの設定についての参考リンク.
 
+# NOTE: Ogg/OpusはDiscordと同じ48kHzで受け取り, 再生時に再サンプリングしない.
+SYNTHESIS_OUTPUT_FORMATS = {
+    OUTPUT_FORMAT_WAV: SpeechSynthesisOutputFormat.Riff24Khz16BitMonoPcm,
+    OUTPUT_FORMAT_OGG_OPUS: SpeechSynthesisOutputFormat.Ogg48Khz16BitMonoOpus,
+}
+STREAMING_FRAME_RATE = 24000
+STREAMING_CHUNK_BYTES = 4800
+
 
 class AzureWrapper(TTSWrapper):
     """
     AzureのTTSを利用するためのWrapper.
     """
 
+    supported_output_formats = (OUTPUT_FORMAT_WAV, OUTPUT_FORMAT_OGG_OPUS)
+    supports_streaming = True
+
     def __init__(self, tts_configs: dict[str, Any] | None = None) -> None:
         """
         Initialize the TTS wrapper.
@@ -31,23 +54,23 @@ class AzureWrapper(TTSWrapper):
         Raises:
             NotImplementedError: If not implemented in subclass.
         """
-        api_key = tts_configs["AZURE"]["API_KEY"]
-        region = tts_configs["AZURE"]["REGION"]
+        self.api_key = tts_configs["AZURE"]["API_KEY"]
         # NOTE: AzureのAPI. 東日本; japaneast, 西日本; japanwest
-        self.speech_config = SpeechConfig(
-            subscription=api_key,
-            region=region,
-            speech_recognition_language="ja-JP",
-        )
-        if tts_configs["AZURE"]["SPEAKER_ID"] != "":
-            self.speech_config.speech_synthesis_voice_name = tts_configs["AZURE"][
-                "SPEAKER_ID"
-            ]
-
-        self.audio_config = AudioConfig(filename="")
-        self.client = SpeechSynthesizer(
-            speech_config=self.speech_config, audio_config=self.audio_config
+        self.region = tts_configs["AZURE"]["REGION"]
+
+        # NOTE: シンセサイザは声と出力形式ごとに使い回し, 発話ごとの接続の確立を省く.
+        #       speech_configはシンセサイザごとに作るので, 複数スレッドから呼ばれても共有の設定を書き換えない.
+        self.synthesizer_pool = SynthesizerPool(
+            self._make_synthesizer,
+            _open_connection,
+            max_per_key=tts_configs["AZURE"].get("POOL_SIZE", 2),
+            idle_refresh_sec=tts_configs["AZURE"].get("IDLE_REFRESH_SEC", 240.0),
         )
+        if tts_configs["AZURE"].get("WARM_UP", True):
+            self.synthesizer_pool.warm_up(
+                _make_pool_key(tts_configs, SYNTHESIS_OUTPUT_FORMATS[self.get_output_format(tts_configs)]),
+            )
+            self.synthesizer_pool.start_refresher()
         self.speakers_name_dict = {
             "ja-JP-NanamiNeural": "Nanami@Normal",
             "ja-JP-KeitaNeural": "Keita@Normal",
@@ -89,19 +112,126 @@ class AzureWrapper(TTSWrapper):
             tts_configs (dict[str, Any]): Configuration options for voice generation. Defaults to None.
 
         Returns:
-            Any: The generated voice data.
+            bytes: The generated voice data in wav or Ogg/Opus format. (see get_output_format)
+
+        Raises:
+            RuntimeError: If the synthesis was not completed.
+        """
+        pool_key = _make_pool_key(tts_configs, SYNTHESIS_OUTPUT_FORMATS[self.get_output_format(tts_configs)])
+        with self.synthesizer_pool.acquire(pool_key) as synthesizer:
+            result = synthesizer.speak_text_async(audio_query).get()
+            if result.reason != ResultReason.SynthesizingAudioCompleted:
+                # NOTE: 接続が切れている場合があるので, 例外を送出してプールからこのシンセサイザを捨てる.
+                raise_message = f'Failed to generate voice: {result.reason!s}'
+                raise RuntimeError(raise_message)
+
+        return result.audio_data
+
+    def stream_voice(
+        self,
+        audio_query: str,
+        tts_configs: dict[str, Any] | None = None,
+    ) -> Iterator[bytes]:
         """
+        Generate voice data and yield it chunk by chunk while Azure is still synthesizing.
 
-        if tts_configs['AZURE']['SPEAKER_ID'] != '':
-            self.speech_config.speech_synthesis_voice_name = tts_configs['AZURE']['SPEAKER_ID']
+        Args:
+            audio_query (str): 音声変換したい文章
+            tts_configs (dict[str, Any]): Configuration options for voice generation. Defaults to None.
+
+        Yields:
+            bytes: The chunk of the voice data in wav format. The first chunk is the wav header.
+
+        Raises:
+            RuntimeError: If the synthesis was not started or was canceled.
+        """
+        # NOTE: RIFFの形式は長さの分からないヘッダになるので, 生のPCMで受け取ってwavのヘッダを自前で付ける.
+        pool_key = _make_pool_key(tts_configs, SpeechSynthesisOutputFormat.Raw24Khz16BitMonoPcm)
+        with self.synthesizer_pool.acquire(pool_key) as synthesizer:
+            result = synthesizer.start_speaking_text_async(audio_query).get()
+            if result.reason != ResultReason.SynthesizingAudioStarted:
+                raise_message = f'Failed to generate voice: {result.reason!s}'
+                raise RuntimeError(raise_message)
+
+            yield _make_streaming_wav_header()
+            stream = AudioDataStream(result)
+            buffer = bytes(STREAMING_CHUNK_BYTES)
+            while (filled_size := stream.read_data(buffer)) > 0:
+                yield buffer[:filled_size]
+
+            if stream.status == StreamStatus.Canceled:
+                raise_message = f'Failed to generate voice: {stream.cancellation_details.reason!s}'
+                raise RuntimeError(raise_message)
+
+    def close(self) -> None:
+        """
+        Stop refreshing the connections and drop the pooled synthesizers.
+        """
+        self.synthesizer_pool.close()
+
+    def _make_synthesizer(self, pool_key: tuple[str, SpeechSynthesisOutputFormat]) -> SpeechSynthesizer:
+        """
+        Make the synthesizer of the voice and the output format.
 
-        with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as wf:
-            wf.write(b"")
-            file_path = wf.name
+        Args:
+            pool_key (tuple[str, SpeechSynthesisOutputFormat]): 声の名前(空文字は既定の声)と出力形式
 
-        self.audio_config = AudioConfig(filename=file_path)
-        self.client = SpeechSynthesizer(
-            speech_config=self.speech_config, audio_config=self.audio_config
+        Returns:
+            SpeechSynthesizer: The synthesizer which keeps the result in memory.
+        """
+        voice_name, output_format = pool_key
+        speech_config = SpeechConfig(
+            subscription=self.api_key,
+            region=self.region,
+            speech_recognition_language='ja-JP',
         )
-        self.client.speak_text_async(audio_query).get()
-        return file_path
+        if voice_name != '':
+            speech_config.speech_synthesis_voice_name = voice_name
+        speech_config.set_speech_synthesis_output_format(output_format)
+
+        # NOTE: audio_configをNoneにするとファイルやスピーカーに出力せず, 結果をメモリ上に保持する.
+        return SpeechSynthesizer(speech_config=speech_config, audio_config=None)
+
+
+def _make_pool_key(
+    tts_configs: dict[str, Any],
+    output_format: SpeechSynthesisOutputFormat,
+) -> tuple[str, SpeechSynthesisOutputFormat]:
+    """
+    Make the key of the synthesizer pool.
+
+    Args:
+        tts_configs (dict[str, Any]): TTS用のconfig辞書
+        output_format (SpeechSynthesisOutputFormat): Azureの出力形式
+
+    Returns:
+        tuple[str, SpeechSynthesisOutputFormat]: 声の名前と出力形式
+    """
+    return get_voice_profile(tts_configs).azure_voice_name, output_format
+
+
+def _open_connection(synthesizer: SpeechSynthesizer) -> None:
+    """
+    Open the connection of the synthesizer to the service before the first utterance.
+
+    Args:
+        synthesizer (SpeechSynthesizer): 接続を開くシンセサイザ
+    """
+    Connection.from_speech_synthesizer(synthesizer).open(for_continuous_recognition=False)
+
+
+def _make_streaming_wav_header() -> bytes:
+    """
+    Make the wav header of the streamed PCM.
+
+    NOTE: 長さは合成が終わるまで分からないので0とする. 受け取る側はヘッダの長さを使わずに最後まで読む.
+
+    Returns:
+        bytes: 24kHz, 16bit, monoのwavのヘッダ
+    """
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as wav_file:
+        wav_file.setnchannels(1)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(STREAMING_FRAME_RATE)
+    return buffer.getvalue()
@@ -5,7 +5,6 @@ The class wrap google tts.
 
 from __future__ import annotations
 
-import copy
 import math
 from typing import TYPE_CHECKING, Any
 
@@ -15,7 +14,23 @@ from google.cloud import texttospeech  # pip install google-cloud-texttospeech
 if TYPE_CHECKING:
     from google.cloud.texttospeech import SynthesisInput  # pip install google-cloud-texttospeech
 
-from .tts_wrapper import TTSWrapper
+from .tts_wrapper import OUTPUT_FORMAT_OGG_OPUS, OUTPUT_FORMAT_WAV, AsyncTTSWrapper, TTSWrapper
+from .voice_profile import VoiceProfile, get_voice_profile
+
+AUDIO_ENCODINGS = {
+    OUTPUT_FORMAT_WAV: texttospeech.AudioEncoding.LINEAR16,
+    OUTPUT_FORMAT_OGG_OPUS: texttospeech.AudioEncoding.OGG_OPUS,
+}
+SPEAKERS_NAME_DICT = {
+    -1: 'NoVoice',
+    1: 'ja-JP-Neural2-B',
+    2: 'ja-JP-Neural2-C',
+    3: 'ja-JP-Neural2-D',
+}
+
+# NOTE: 声の設定と出力形式の組をキーに, 作成済みのパラメータを引く.
+SynthesisParamsKey = tuple[VoiceProfile, str]
+SynthesisParams = tuple[texttospeech.VoiceSelectionParams, texttospeech.AudioConfig]
 
 
 class GoogleTTSWrapper(TTSWrapper):
@@ -25,7 +40,9 @@ class GoogleTTSWrapper(TTSWrapper):
     This class provides methods to interact with the Google-TTS API.
     """
 
-    def __init__(self, credential_file_name: str | None = None, tts_configs: dict[str, Any] | None = None) -> None:
+    supported_output_formats = (OUTPUT_FORMAT_WAV, OUTPUT_FORMAT_OGG_OPUS)
+
+    def __init__(self, credential_file_name: str | None = None, tts_configs: dict[str, Any] | None = None) -> None:  # noqa: ARG002
         """
         Initialize the Google-TTS wrapper.
 
@@ -36,22 +53,15 @@ class GoogleTTSWrapper(TTSWrapper):
             tts_configs (dict[str, Any] | None, optional): Configuration options for the TTS.
                 Defaults to None.
         """
-        tts_configs = tts_configs or {}
-        tts_configs = copy.deepcopy(tts_configs)
-
         if credential_file_name is None:
             self.client = texttospeech.TextToSpeechClient()
         else:
             self.client = texttospeech.TextToSpeechClient.from_service_account_json(credential_file_name)
 
-        self.speakers_name_dict = {
-            -1: 'NoVoice',
-            1: 'ja-JP-Neural2-B',
-            2: 'ja-JP-Neural2-C',
-            3: 'ja-JP-Neural2-D',
-        }
+        self.speakers_name_dict = SPEAKERS_NAME_DICT
+        self.synthesis_params: dict[SynthesisParamsKey, SynthesisParams] = {}
 
-    def generate_audio_query(self, text: str, tts_configs: dict[str, Any] | None = None) -> SynthesisInput:
+    def generate_audio_query(self, text: str, tts_configs: dict[str, Any] | None = None) -> SynthesisInput:  # noqa: ARG002
         """
         Generate an audio query from the given text.
 
@@ -63,9 +73,6 @@ class GoogleTTSWrapper(TTSWrapper):
         Returns:
             SynthesisInput: The generated audio query for google-tts.
         """
-        tts_configs = tts_configs or {}
-        tts_configs = copy.deepcopy(tts_configs)
-
         return texttospeech.SynthesisInput(text=text)
 
     def generate_voice(self, audio_query: SynthesisInput, tts_configs: dict[str, Any] | None = None) -> bytes:
@@ -77,47 +84,172 @@ class GoogleTTSWrapper(TTSWrapper):
             tts_configs (dict[str, Any] | None, optional): Configuration options for voice generation.
 
         Returns:
-            bytes: The generated voice data in wav format.
+            bytes: The generated voice data in wav or Ogg/Opus format. (see get_output_format)
 
         Raises:
             RuntimeError: If there's an error in the API call.
         """
-        tts_configs = tts_configs or {}
-        tts_configs = copy.deepcopy(tts_configs)
+        voice, audio_config = _get_synthesis_params(
+            self.synthesis_params,
+            tts_configs,
+            self.get_output_format(tts_configs),
+        )
+        try:
+            voice_data = self.client.synthesize_speech(input=audio_query, voice=voice, audio_config=audio_config)
+        except GoogleAPICallError as e:
+            raise_message = f'Failed to generate voice: {e!s}'
+            raise RuntimeError(raise_message) from e
+        else:
+            return voice_data.audio_content
 
-        speaker_name = self.speakers_name_dict.get(tts_configs['GOOGLE'].get('SPEAKER_ID', 1))
-        speaking_rate = tts_configs['GOOGLE'].get('SPEED_SCALE', 1.25)
-        volume_gain_db = self._calculate_volume_gain(tts_configs['GOOGLE'].get('VOLUME_SCALE', 1.0))
-        language_code = tts_configs['GOOGLE'].get('LANGUAGE_CODE', 'ja-JP')
 
-        voice = texttospeech.VoiceSelectionParams(
-            name=speaker_name,
-            language_code=language_code,
-        )
+class AsyncGoogleTTSWrapper(AsyncTTSWrapper):
+    """
+    Asynchronous wrapper class for the Google-TTS API.
 
-        audio_config = texttospeech.AudioConfig(
-            audio_encoding=texttospeech.AudioEncoding.LINEAR16,
-            speaking_rate=speaking_rate,
-            volume_gain_db=volume_gain_db,
-        )
+    One TextToSpeechAsyncClient is shared by all requests, so concurrent requests are multiplexed
+    on one gRPC channel without blocking the event loop.
+    """
+
+    supported_output_formats = (OUTPUT_FORMAT_WAV, OUTPUT_FORMAT_OGG_OPUS)
+
+    def __init__(
+        self,
+        credential_file_name: str | None = None,
+        tts_configs: dict[str, Any] | None = None,  # noqa: ARG002
+        client: texttospeech.TextToSpeechAsyncClient | None = None,
+    ) -> None:
+        """
+        Initialize the asynchronous Google-TTS wrapper.
+
+        NOTE: The client is created on first use, because the gRPC channel of asyncio binds to the running event loop.
+
+        Args:
+            credential_file_name (str | None): The Google credential json file name.
+                (ex. './hoge/fuga/credential.json') If it is None, use environment value.
+                Default to None.
+            tts_configs (dict[str, Any] | None, optional): 他のAPIと合わせるために一旦受けるが捨てる
+            client (texttospeech.TextToSpeechAsyncClient | None): 使うクライアント. ベンチマークで偽のサーバに
+                繋ぐ場合などに渡す. Noneの場合は初回に作る. Defaults to None.
+        """
+        self.credential_file_name = credential_file_name
+        self.client = client
+        self.speakers_name_dict = SPEAKERS_NAME_DICT
+        self.synthesis_params: dict[SynthesisParamsKey, SynthesisParams] = {}
+
+    async def generate_audio_query(self, text: str, tts_configs: dict[str, Any] | None = None) -> SynthesisInput:  # noqa: ARG002
+        """
+        Generate an audio query from the given text.
+
+        Args:
+            text (str): The text to be converted to speech.
+            tts_configs (dict[str, Any] | None): 他のAPIと合わせるために一旦受けるが捨てる
+
+        Returns:
+            SynthesisInput: The generated audio query for google-tts.
+        """
+        return texttospeech.SynthesisInput(text=text)
+
+    async def generate_voice(self, audio_query: SynthesisInput, tts_configs: dict[str, Any] | None = None) -> bytes:
+        """
+        Generate voice data from the given audio query.
+
+        Args:
+            audio_query (SynthesisInput): The audio query to be converted to voice.
+            tts_configs (dict[str, Any] | None, optional): Configuration options for voice generation.
 
+        Returns:
+            bytes: The generated voice data in wav or Ogg/Opus format. (see get_output_format)
+
+        Raises:
+            RuntimeError: If there's an error in the API call.
+        """
+        voice, audio_config = _get_synthesis_params(
+            self.synthesis_params,
+            tts_configs,
+            self.get_output_format(tts_configs),
+        )
         try:
-            voice_data = self.client.synthesize_speech(input=audio_query, voice=voice, audio_config=audio_config)
+            voice_data = await self._get_client().synthesize_speech(
+                input=audio_query,
+                voice=voice,
+                audio_config=audio_config,
+            )
         except GoogleAPICallError as e:
             raise_message = f'Failed to generate voice: {e!s}'
             raise RuntimeError(raise_message) from e
         else:
             return voice_data.audio_content
 
-    @staticmethod
-    def _calculate_volume_gain(volume: float) -> float:
+    async def close(self) -> None:
         """
-        Calculate volume gain in dB.
+        Close the gRPC channel.
+        """
+        if self.client is not None:
+            await self.client.transport.close()
+            self.client = None
 
-        Args:
-            volume (float): Volume scale value.
+    def _get_client(self) -> texttospeech.TextToSpeechAsyncClient:
+        """
+        Get the client, creating it on first use.
 
         Returns:
-            float: volume gain in dB.
+            texttospeech.TextToSpeechAsyncClient: The shared client.
         """
-        return 20 * math.log10(volume)
+        if self.client is None:
+            if self.credential_file_name is None:
+                self.client = texttospeech.TextToSpeechAsyncClient()
+            else:
+                self.client = texttospeech.TextToSpeechAsyncClient.from_service_account_json(
+                    self.credential_file_name,
+                )
+        return self.client
+
+
+def _get_synthesis_params(
+    synthesis_params: dict[SynthesisParamsKey, SynthesisParams],
+    tts_configs: dict[str, Any],
+    output_format: str,
+) -> SynthesisParams:
+    """
+    Get the voice and the audio config of the voice settings, building them on first use.
+
+    NOTE: proto-plusのメッセージは作るのが遅いので, 同じ声の設定では使い回す.
+
+    Args:
+        synthesis_params (dict): 作成済みのパラメータ. 無い場合はここに追加する.
+        tts_configs (dict[str, Any]): TTS用のconfig辞書
+        output_format (str): 出力形式
+
+    Returns:
+        tuple[texttospeech.VoiceSelectionParams, texttospeech.AudioConfig]: 声の選択と音声の設定
+    """
+    profile = get_voice_profile(tts_configs)
+    key = (profile, output_format)
+    params = synthesis_params.get(key)
+    if params is None:
+        voice = texttospeech.VoiceSelectionParams(
+            name=SPEAKERS_NAME_DICT.get(profile.google_speaker_id),
+            language_code=profile.google_language_code,
+        )
+        audio_config = texttospeech.AudioConfig(
+            audio_encoding=AUDIO_ENCODINGS[output_format],
+            speaking_rate=profile.google_speed_scale,
+            volume_gain_db=_calculate_volume_gain(profile.google_volume_scale),
+        )
+        params = (voice, audio_config)
+        synthesis_params[key] = params
+    return params
+
+
+def _calculate_volume_gain(volume: float) -> float:
+    """
+    Calculate volume gain in dB.
+
+    Args:
+        volume (float): Volume scale value.
+
+    Returns:
+        float: volume gain in dB.
+    """
+    return 20 * math.log10(volume)
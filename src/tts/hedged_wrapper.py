@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+"""
+The class wrap many TTS backends with hedged requests and failover.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import math
+import time
+from collections import deque
+from typing import TYPE_CHECKING, Any
+
+from .tts_wrapper import AsyncTTSWrapper
+
+if TYPE_CHECKING:
+    from .tts_wrapper import TTSWrapper
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+
+class TTSBackend:
+    """
+    The state of one TTS backend: rolling latency and circuit breaker.
+
+    The circuit opens after `failure_threshold` consecutive failures and stays open for `reset_timeout` seconds.
+    After that one probe request is let through (half-open), and the circuit closes again if it succeeds.
+    """
+
+    def __init__(  # noqa: PLR0913
+        self,
+        name: str,
+        client: AsyncTTSWrapper | TTSWrapper,
+        *,
+        latency_window: int = 100,
+        default_delay: float = 1.0,
+        min_delay: float = 0.2,
+        failure_threshold: int = 3,
+        reset_timeout: float = 30.0,
+    ) -> None:
+        """
+        Initialize the backend state.
+
+        Args:
+            name (str): The name of the backend. (ex. 'VOICEVOX')
+            client (AsyncTTSWrapper | TTSWrapper): The TTS client of the backend.
+            latency_window (int): The number of latest latencies to estimate p95. Defaults to 100.
+            default_delay (float): The hedge delay until enough latencies are observed. Defaults to 1.0.
+            min_delay (float): The lower bound of the hedge delay in seconds. Defaults to 0.2.
+            failure_threshold (int): Consecutive failures to open the circuit. Defaults to 3.
+            reset_timeout (float): Seconds to keep the circuit open before probing. Defaults to 30.0.
+        """
+        self.name = name
+        self.client = client
+        self.latencies: deque[float] = deque(maxlen=latency_window)
+        self.default_delay = default_delay
+        self.min_delay = min_delay
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.consecutive_failures = 0
+        self.opened_at: float | None = None
+        self.is_probing = False
+
+    def p95(self) -> float | None:
+        """
+        The 95th percentile of the latest latencies.
+
+        Returns:
+            float | None: The p95 latency in seconds. None if too few latencies are observed.
+        """
+        # NOTE: 20件未満ではp95が最大値と同じになり当てにならないので推定しない.
+        if len(self.latencies) < 20:  # noqa: PLR2004
+            return None
+
+        latencies = sorted(self.latencies)
+        return latencies[math.ceil(len(latencies) * 0.95) - 1]
+
+    def hedge_delay(self) -> float:
+        """
+        Seconds to wait for the backend before sending a hedged request to the next one.
+
+        Returns:
+            float: The hedge delay in seconds.
+        """
+        p95 = self.p95()
+        return max(p95 if p95 is not None else self.default_delay, self.min_delay)
+
+    def is_available(self) -> bool:
+        """
+        Check the circuit lets a request through. The state is not changed until the request is sent.
+
+        Returns:
+            bool: リクエストを送ってよいか判定
+        """
+        if self.opened_at is None:
+            return True
+
+        # NOTE: half-open. 復旧確認のために1件だけ通す. 確認中の印はrecord_startで付ける.
+        return not self.is_probing and time.monotonic() - self.opened_at >= self.reset_timeout
+
+    def record_start(self) -> None:
+        """
+        Record the request sent to the backend, marking it as the probe if the circuit is half-open.
+        """
+        if self.opened_at is not None:
+            self.is_probing = True
+
+    def record_success(self, latency: float) -> None:
+        """
+        Record the successful request and close the circuit.
+
+        Args:
+            latency (float): The latency of the request in seconds.
+        """
+        self.latencies.append(latency)
+        self.consecutive_failures = 0
+        self.is_probing = False
+        if self.opened_at is not None:
+            logging.info('Closed circuit of TTS backend %s', self.name)
+            self.opened_at = None
+
+    def record_failure(self) -> None:
+        """
+        Record the failed request and open the circuit if it fails repeatedly.
+        """
+        self.consecutive_failures += 1
+        if self.is_probing or (self.opened_at is None and self.consecutive_failures >= self.failure_threshold):
+            logging.warning('Opened circuit of TTS backend %s', self.name)
+            self.opened_at = time.monotonic()
+        self.is_probing = False
+
+    def record_cancel(self) -> None:
+        """
+        Record the request cancelled because another backend answered first.
+        """
+        # NOTE: 遅かっただけで失敗ではないが, half-openの確認は終わらせて次の確認を許す.
+        self.is_probing = False
+
+
+class HedgedAudioQuery:
+    """
+    The audio query of the hedged client, and the backend that served it.
+    """
+
+    __slots__ = ('is_primary', 'served_by', 'text')
+
+    def __init__(self, text: str) -> None:
+        """
+        Initialize the hedged audio query.
+
+        Args:
+            text (str): The text to be converted to speech.
+        """
+        self.text = text
+        self.served_by: str | None = None
+        self.is_primary = False
+
+
+class HedgedTTSWrapper(AsyncTTSWrapper):
+    """
+    Wrapper class for many TTS backends in priority order.
+
+    When a backend has not answered within its observed p95 latency,
+    a hedged duplicate is sent to the next backend and whichever answers first is used.
+    Failed backends are skipped by a circuit breaker and probed again after a while.
+    """
+
+    def __init__(self, backends: list[TTSBackend], tts_configs: dict[str, Any] | None = None) -> None:
+        """
+        Initialize the hedged client.
+
+        Args:
+            backends (list[TTSBackend]): The backends in priority order. The first one is the primary.
+            tts_configs (dict[str, Any], optional): Configuration options for the TTS. Defaults to None.
+        """
+        tts_configs = tts_configs or {}
+
+        self.backends = backends
+        self.client = [backend.client for backend in backends]
+        self.speakers_name_dict = getattr(backends[0].client, 'speakers_name_dict', {})
+        # NOTE: 形式は各バックエンドが同じtts_configsから決めるので, 主のバックエンドの形式を代表とする.
+        self.supported_output_formats = backends[0].client.supported_output_formats
+
+    async def generate_audio_query(
+        self,
+        text: str,
+        tts_configs: dict[str, Any] | None = None,  # noqa: ARG002
+    ) -> HedgedAudioQuery:
+        # NOTE: audio_queryはバックエンドごとに形式が違うので, 文章を持ち回してgenerate_voiceでまとめて生成する.
+        """
+        Generate an audio query from the given text.
+
+        Args:
+            text (str): The text to be converted to speech.
+            tts_configs (dict[str, Any]): 他のAPIと合わせるために一旦受けるが捨てる
+
+        Returns:
+            HedgedAudioQuery: The text to be synthesized by the backends.
+        """
+        return HedgedAudioQuery(text)
+
+    async def generate_voice(
+        self,
+        audio_query: HedgedAudioQuery,
+        tts_configs: dict[str, Any] | None = None,
+    ) -> bytes:
+        """
+        Generate voice data on the first backend that answers.
+
+        Args:
+            audio_query (HedgedAudioQuery): The audio query to be converted to voice.
+            tts_configs (dict[str, Any]): Configuration options for voice generation. Defaults to None.
+
+        Returns:
+            bytes: The generated voice data in wav format.
+
+        Raises:
+            RuntimeError: If all backends failed.
+        """
+        # NOTE: 全てのバックエンドの回路が開いている場合は, 読み上げを落とさないよう全バックエンドを順に試す.
+        backends = [backend for backend in self.backends if backend.is_available()] or self.backends
+        running: dict[asyncio.Task, TTSBackend] = {}
+        next_index = 0
+        errors = []
+        try:
+            while next_index < len(backends) or len(running) > 0:
+                if len(running) == 0:
+                    running[self._start(backends[next_index], audio_query.text, tts_configs)] = backends[next_index]
+                    next_index += 1
+
+                # NOTE: 次のバックエンドが残っていれば, 直近に投げたバックエンドのp95だけ待ってからヘッジする.
+                hedge_delay = backends[next_index - 1].hedge_delay() if next_index < len(backends) else None
+                done, _ = await asyncio.wait(running, timeout=hedge_delay, return_when=asyncio.FIRST_COMPLETED)
+                if len(done) == 0:
+                    logging.info('Hedged TTS request to %s', backends[next_index].name)
+                    running[self._start(backends[next_index], audio_query.text, tts_configs)] = backends[next_index]
+                    next_index += 1
+                    continue
+
+                for task in done:
+                    backend = running.pop(task)
+                    if task.exception() is None:
+                        audio_query.served_by = backend.name
+                        audio_query.is_primary = backend is self.backends[0]
+                        return task.result()
+
+                    errors.append(f'{backend.name}: {task.exception()!s}')
+        finally:
+            for task, backend in running.items():
+                task.cancel()
+                backend.record_cancel()
+
+        raise_message = f'Failed to generate voice on all backends: {", ".join(errors)}'
+        raise RuntimeError(raise_message)
+
+    async def close(self) -> None:
+        """
+        Close the connections of all backends.
+        """
+        for backend in self.backends:
+            if isinstance(backend.client, AsyncTTSWrapper):
+                await backend.client.close()
+
+    def _start(self, backend: TTSBackend, text: str, tts_configs: dict[str, Any] | None) -> asyncio.Task:
+        """
+        Start the synthesis on the backend.
+
+        Args:
+            backend (TTSBackend): The backend to request.
+            text (str): The text to be converted to speech.
+            tts_configs (dict[str, Any] | None): Configuration options for voice generation.
+
+        Returns:
+            asyncio.Task: The task of the synthesis.
+        """
+        # NOTE: ヘッジされずに送らなかったバックエンドを確認中のまま残さないよう, 送る時点で印を付ける.
+        backend.record_start()
+        return asyncio.create_task(_synthesize(backend, text, tts_configs))
+
+
+async def _synthesize(backend: TTSBackend, text: str, tts_configs: dict[str, Any] | None) -> bytes:
+    """
+    Synthesize the text on the backend and record the result.
+
+    Args:
+        backend (TTSBackend): The backend to request.
+        text (str): The text to be converted to speech.
+        tts_configs (dict[str, Any] | None): Configuration options for voice generation.
+
+    Returns:
+        bytes: The generated voice data in wav format.
+    """
+    start = time.perf_counter()
+    try:
+        if isinstance(backend.client, AsyncTTSWrapper):
+            audio_query = await backend.client.generate_audio_query(text, tts_configs)
+            voice_data = await backend.client.generate_voice(audio_query, tts_configs)
+        else:
+            # NOTE: 同期APIのクライアントはイベントループを止めないようにスレッドで実行する.
+            audio_query = await asyncio.to_thread(backend.client.generate_audio_query, text, tts_configs)
+            voice_data = await asyncio.to_thread(backend.client.generate_voice, audio_query, tts_configs)
+    except asyncio.CancelledError:
+        raise
+    except Exception:
+        backend.record_failure()
+        raise
+
+    backend.record_success(time.perf_counter() - start)
+    return voice_data
@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+"""
+The class for pool long-lived synthesizers of the TTS services with a persistent connection.
+"""
+
+from __future__ import annotations
+
+import contextlib
+import logging
+import threading
+import time
+from typing import TYPE_CHECKING, Any
+
+if TYPE_CHECKING:
+    from collections.abc import Callable, Hashable, Iterator
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+
+class _PooledSynthesizer:
+    """
+    The synthesizer in the pool and when it was used last.
+    """
+
+    __slots__ = ('last_used', 'synthesizer')
+
+    def __init__(self, synthesizer: Any) -> None:  # noqa: ANN401
+        """
+        Initialize the pooled synthesizer.
+
+        Args:
+            synthesizer (Any): プールするシンセサイザ
+        """
+        self.synthesizer = synthesizer
+        self.last_used = time.monotonic()
+
+
+class SynthesizerPool:
+    """
+    Thread-safe pool of long-lived synthesizers, keyed by the settings fixed at creation (ex. voice and format).
+
+    Each synthesizer is used by one caller at a time. Up to `max_per_key` synthesizers are created per key,
+    and further callers wait for one to be returned. A synthesizer that raised while in use is discarded,
+    because its connection may be broken, and the next caller gets a new one.
+    Connections are opened when the synthesizer is created, and reopened by `refresh_idle` after idle periods
+    so that an utterance does not pay the connection setup.
+    """
+
+    def __init__(
+        self,
+        factory: Callable[[Hashable], Any],
+        connect: Callable[[Any], None] | None = None,
+        *,
+        max_per_key: int = 2,
+        idle_refresh_sec: float = 240.0,
+    ) -> None:
+        """
+        Initialize the synthesizer pool.
+
+        Args:
+            factory (Callable[[Hashable], Any]): キーからシンセサイザを作る関数
+            connect (Callable[[Any], None] | None): シンセサイザの接続を開く関数. Noneの場合は開かない.
+            max_per_key (int): キーごとのシンセサイザの最大数. Defaults to 2.
+            idle_refresh_sec (float): この秒数より長く使われていない接続を開き直す. Defaults to 240.0.
+        """
+        self.factory = factory
+        self.connect = connect
+        self.max_per_key = max(max_per_key, 1)
+        self.idle_refresh_sec = idle_refresh_sec
+        # NOTE: 使われていないシンセサイザをキーごとに積む. 最後に返されたものほど接続が生きているので後ろから使う.
+        self._idle: dict[Hashable, list[_PooledSynthesizer]] = {}
+        self._counts: dict[Hashable, int] = {}
+        self._condition = threading.Condition()
+        self._refresher: threading.Thread | None = None
+        self._stop_refresher = threading.Event()
+
+    @contextlib.contextmanager
+    def acquire(self, key: Hashable) -> Iterator[Any]:
+        """
+        Borrow a synthesizer of the key, creating it or waiting for one if all of them are in use.
+
+        Args:
+            key (Hashable): シンセサイザの設定を表すキー
+
+        Yields:
+            Any: 借りたシンセサイザ. コンテキストを抜けるとプールに返す.
+        """
+        pooled = self._take(key)
+        try:
+            if pooled is None:
+                pooled = _PooledSynthesizer(self._create(key))
+            yield pooled.synthesizer
+        except BaseException:
+            self._discard(key)
+            raise
+
+        self._give_back(key, pooled)
+
+    def warm_up(self, key: Hashable, count: int = 1) -> None:
+        """
+        Create the synthesizers of the key and open their connections in advance.
+
+        NOTE: 起動時に呼ぶ. 失敗しても最初の読み上げで作り直すので, ログに残して続ける.
+
+        Args:
+            key (Hashable): シンセサイザの設定を表すキー
+            count (int): 作っておく数. max_per_keyを超えた分は作らない. Defaults to 1.
+        """
+        for _ in range(count):
+            with self._condition:
+                if self._counts.get(key, 0) >= self.max_per_key:
+                    return
+                self._counts[key] = self._counts.get(key, 0) + 1
+
+            try:
+                pooled = _PooledSynthesizer(self._create(key))
+            except Exception:
+                logging.warning('Failed to warm up synthesizer %s', key, exc_info=True)
+                self._discard(key)
+                return
+
+            self._give_back(key, pooled)
+
+    def refresh_idle(self) -> int:
+        """
+        Reopen the connections of the synthesizers which have not been used for `idle_refresh_sec`.
+
+        Returns:
+            int: 開き直したシンセサイザの数
+        """
+        if self.connect is None:
+            return 0
+
+        now = time.monotonic()
+        stale = []
+        with self._condition:
+            # NOTE: 開き直している間に他の呼び出し元が使わないよう, 一旦プールから外す.
+            for key, idle in self._idle.items():
+                stale += [(key, pooled) for pooled in idle if now - pooled.last_used >= self.idle_refresh_sec]
+                idle[:] = [pooled for pooled in idle if now - pooled.last_used < self.idle_refresh_sec]
+
+        refreshed_count = 0
+        for key, pooled in stale:
+            try:
+                self.connect(pooled.synthesizer)
+            except Exception:
+                logging.warning('Failed to refresh synthesizer %s', key, exc_info=True)
+                self._discard(key)
+                continue
+
+            refreshed_count += 1
+            self._give_back(key, pooled)
+        return refreshed_count
+
+    def start_refresher(self) -> None:
+        """
+        Refresh the idle connections on a background thread until the pool is closed.
+        """
+        if self._refresher is not None or self.connect is None:
+            return
+
+        def refresh_periodically() -> None:
+            # NOTE: 使われなくなってから最大でidle_refresh_secの1.5倍で開き直す.
+            while not self._stop_refresher.wait(self.idle_refresh_sec / 2):
+                refreshed_count = self.refresh_idle()
+                if refreshed_count > 0:
+                    logging.debug('Refreshed %d idle synthesizers', refreshed_count)
+
+        self._refresher = threading.Thread(target=refresh_periodically, name='synthesizer-refresher', daemon=True)
+        self._refresher.start()
+
+    def close(self) -> None:
+        """
+        Stop the refresher and drop the idle synthesizers.
+        """
+        self._stop_refresher.set()
+        with self._condition:
+            for key, idle in self._idle.items():
+                self._counts[key] -= len(idle)
+            self._idle = {}
+
+    def stats(self) -> dict[Hashable, dict[str, int]]:
+        """
+        The number of the synthesizers per key.
+
+        Returns:
+            dict[Hashable, dict[str, int]]: キーごとの作成済み(total)と待機中(idle)の数
+        """
+        with self._condition:
+            return {key: {'total': count, 'idle': len(self._idle.get(key, []))} for key, count in self._counts.items()}
+
+    def _take(self, key: Hashable) -> _PooledSynthesizer | None:
+        """
+        Take an idle synthesizer, or reserve a slot to create one, waiting if all of them are in use.
+
+        Args:
+            key (Hashable): シンセサイザの設定を表すキー
+
+        Returns:
+            _PooledSynthesizer | None: 待機中だったシンセサイザ. 新しく作る枠を確保した場合はNone.
+        """
+        with self._condition:
+            while True:
+                idle = self._idle.get(key)
+                if idle:
+                    return idle.pop()
+                if self._counts.get(key, 0) < self.max_per_key:
+                    self._counts[key] = self._counts.get(key, 0) + 1
+                    return None
+                self._condition.wait()
+
+    def _create(self, key: Hashable) -> Any:  # noqa: ANN401
+        """
+        Create a synthesizer and open its connection.
+
+        Args:
+            key (Hashable): シンセサイザの設定を表すキー
+
+        Returns:
+            Any: 作ったシンセサイザ
+        """
+        # NOTE: 作成と接続は時間が掛かるので, ロックの外で行う.
+        synthesizer = self.factory(key)
+        if self.connect is not None:
+            self.connect(synthesizer)
+        return synthesizer
+
+    def _give_back(self, key: Hashable, pooled: _PooledSynthesizer) -> None:
+        """
+        Return the synthesizer to the pool and wake a waiting caller.
+
+        Args:
+            key (Hashable): シンセサイザの設定を表すキー
+            pooled (_PooledSynthesizer): 返すシンセサイザ
+        """
+        pooled.last_used = time.monotonic()
+        with self._condition:
+            self._idle.setdefault(key, []).append(pooled)
+            self._condition.notify()
+
+    def _discard(self, key: Hashable) -> None:
+        """
+        Forget the synthesizer which is broken or failed to be created, and free its slot.
+
+        Args:
+            key (Hashable): シンセサイザの設定を表すキー
+        """
+        with self._condition:
+            self._counts[key] -= 1
+            self._condition.notify()
@@ -6,7 +6,35 @@ The abstract class for wrap tts.
 from __future__ import annotations
 
 from abc import ABCMeta, abstractmethod
-from typing import Any
+from typing import TYPE_CHECKING, Any
+
+if TYPE_CHECKING:
+    from collections.abc import AsyncIterator, Iterator
+
+# NOTE: TTS.OUTPUT_FORMATで要求できる音声の形式. Ogg/OpusはDiscordへ再エンコード無しで送れる.
+OUTPUT_FORMAT_WAV = 'wav'
+OUTPUT_FORMAT_OGG_OPUS = 'ogg_opus'
+
+
+def negotiate_output_format(supported_formats: tuple[str, ...], tts_configs: dict[str, Any] | None = None) -> str:
+    """
+    Choose the output format from TTS.OUTPUT_FORMAT and the formats the backend supports.
+
+    Args:
+        supported_formats (tuple[str, ...]): The formats the backend can return.
+        tts_configs (dict[str, Any] | None): TTS用のconfig辞書. OUTPUT_FORMATは形式名か, 優先順の形式名のリスト.
+
+    Returns:
+        str: The first requested format the backend supports. Defaults to wav.
+    """
+    requested = (tts_configs or {}).get('OUTPUT_FORMAT', OUTPUT_FORMAT_WAV)
+    if isinstance(requested, str):
+        requested = [requested]
+
+    for output_format in requested:
+        if output_format in supported_formats:
+            return output_format
+    return OUTPUT_FORMAT_WAV
 
 
 class TTSWrapper(metaclass=ABCMeta):
@@ -16,6 +44,11 @@ class TTSWrapper(metaclass=ABCMeta):
     This class defines the interface for interacting with various TTS APIs.
     """
 
+    # NOTE: generate_voiceが返せる形式. wav以外も返せるサブクラスは上書きする.
+    supported_output_formats: tuple[str, ...] = (OUTPUT_FORMAT_WAV,)
+    # NOTE: stream_voiceが合成の途中から音声を返せるか. Falseの場合は合成後に1塊で返す.
+    supports_streaming: bool = False
+
     @abstractmethod
     def __init__(
         self,
@@ -74,3 +107,144 @@ class TTSWrapper(metaclass=ABCMeta):
         """
         raise_message = 'Subclasses must implement generate_voice'
         raise NotImplementedError(raise_message)
+
+    def get_output_format(self, tts_configs: dict[str, Any] | None = None) -> str:
+        """
+        Get the format of the voice data that generate_voice returns for the configs.
+
+        Args:
+            tts_configs (dict[str, Any] | None): Configuration options for voice generation. Defaults to None.
+
+        Returns:
+            str: OUTPUT_FORMAT_WAV or OUTPUT_FORMAT_OGG_OPUS.
+        """
+        return negotiate_output_format(self.supported_output_formats, tts_configs)
+
+    def stream_voice(
+        self,
+        audio_query: Any,
+        tts_configs: dict[str, Any] | None = None,
+    ) -> Iterator[bytes]:
+        """
+        Generate voice data chunk by chunk as the engine produces it.
+
+        NOTE: 連結するとgenerate_voiceと同じwavになる. 対応していないクライアントは合成後に1塊で返す.
+
+        Args:
+            audio_query (Any): The audio query to be converted to voice.
+            tts_configs (dict[str, Any]): Configuration options for voice generation. Defaults to None.
+
+        Yields:
+            bytes: The chunk of the voice data in wav format. The first chunk starts with the wav header.
+        """
+        yield self.generate_voice(audio_query, tts_configs)
+
+
+class AsyncTTSWrapper(metaclass=ABCMeta):
+    """
+    Abstract base class for asynchronous TTS (Text To Speech) API wrappers.
+
+    This class defines the awaitable counterpart of the TTSWrapper interface,
+    so that synthesis does not block the event loop of the discord bot.
+    """
+
+    # NOTE: generate_voiceが返せる形式. wav以外も返せるサブクラスは上書きする.
+    supported_output_formats: tuple[str, ...] = (OUTPUT_FORMAT_WAV,)
+    # NOTE: stream_voiceが合成の途中から音声を返せるか. Falseの場合は合成後に1塊で返す.
+    supports_streaming: bool = False
+
+    @abstractmethod
+    def __init__(
+        self,
+        tts_configs: dict[str, Any] | None = None,
+    ) -> None:
+        """
+        Initialize the TTS wrapper.
+
+        Args:
+            tts_configs (dict[str, Any] | None, optional): Configuration options for the TTS. Defaults to None.
+
+        Raises:
+            NotImplementedError: If not implemented in subclass.
+        """
+        self.client = []
+        self.speakers_name_dict = {}
+        raise_massage = 'Subclasses must implement __init__'
+        raise NotImplementedError(raise_massage)
+
+    @abstractmethod
+    async def generate_audio_query(self, text: str, tts_configs: dict[str, Any] | None = None) -> Any:
+        """
+        Generate an audio query from the given text.
+
+        Args:
+            text (str): The text to be converted to speech.
+            tts_configs (dict[str, Any] | None): Configuration options for the audio query. Defaults to None.
+
+        Returns:
+            Any: The generated audio query.
+
+        Raises:
+            NotImplementedError: If not implemented in subclass.
+        """
+        raise_message = 'Subclasses must implement generate_audio_query'
+        raise NotImplementedError(raise_message)
+
+    @abstractmethod
+    async def generate_voice(
+        self,
+        audio_query: Any,
+        tts_configs: dict[str, Any] | None = None,
+    ) -> bytes:
+        """
+        Generate voice data from the given audio query.
+
+        Args:
+            audio_query (Any): The audio query to be converted to voice.
+            tts_configs (dict[str, Any]): Configuration options for voice generation. Defaults to None.
+
+        Returns:
+            Any: The generated voice data.
+
+        Raises:
+            NotImplementedError: If not implemented in subclass.
+        """
+        raise_message = 'Subclasses must implement generate_voice'
+        raise NotImplementedError(raise_message)
+
+    def get_output_format(self, tts_configs: dict[str, Any] | None = None) -> str:
+        """
+        Get the format of the voice data that generate_voice returns for the configs.
+
+        Args:
+            tts_configs (dict[str, Any] | None): Configuration options for voice generation. Defaults to None.
+
+        Returns:
+            str: OUTPUT_FORMAT_WAV or OUTPUT_FORMAT_OGG_OPUS.
+        """
+        return negotiate_output_format(self.supported_output_formats, tts_configs)
+
+    async def stream_voice(
+        self,
+        audio_query: Any,
+        tts_configs: dict[str, Any] | None = None,
+    ) -> AsyncIterator[bytes]:
+        """
+        Generate voice data chunk by chunk as the engine produces it.
+
+        NOTE: 連結するとgenerate_voiceと同じwavになる. 対応していないクライアントは合成後に1塊で返す.
+
+        Args:
+            audio_query (Any): The audio query to be converted to voice.
+            tts_configs (dict[str, Any]): Configuration options for voice generation. Defaults to None.
+
+        Yields:
+            bytes: The chunk of the voice data in wav format. The first chunk starts with the wav header.
+        """
+        yield await self.generate_voice(audio_query, tts_configs)
+
+    async def close(self) -> None:
+        """
+        Release the connections held by the wrapper.
+        """
+        return
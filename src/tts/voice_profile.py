@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+"""
+The class of the voice settings compiled once from the TTS configs.
+"""
+
+from __future__ import annotations
+
+import types
+from typing import TYPE_CHECKING, Any
+
+if TYPE_CHECKING:
+    from collections.abc import Callable
+
+# NOTE: TTS用のconfig辞書の中で, コンパイル済みの声の設定を置くキー.
+VOICE_PROFILE_KEY = 'VOICE_PROFILE'
+
+
+class VoiceProfile:
+    """
+    Immutable voice settings of all backends, with the request parameters prepared once.
+
+    The profile is compiled when the config file is loaded and stored in the TTS configs,
+    so the wrappers read attributes by reference instead of walking nested dicts on every request.
+    Profiles with the same settings are equal and hashable, so they can key the prepared
+    parameters of a backend (ex. the voice params of Google TTS).
+    """
+
+    __slots__ = (
+        '_key',
+        'azure_voice_name',
+        'google_language_code',
+        'google_speaker_id',
+        'google_speed_scale',
+        'google_volume_scale',
+        'voicevox_speaker',
+        'voicevox_speed_scale',
+        'voicevox_synthesis_params',
+        'voicevox_volume_scale',
+    )
+
+    def __init__(  # noqa: PLR0913
+        self,
+        *,
+        voicevox_speaker: int = 1,
+        voicevox_speed_scale: float = 1.0,
+        voicevox_volume_scale: float = 1.0,
+        azure_voice_name: str = '',
+        google_speaker_id: int = 1,
+        google_speed_scale: float = 1.25,
+        google_volume_scale: float = 1.0,
+        google_language_code: str = 'ja-JP',
+    ) -> None:
+        """
+        Initialize the voice profile.
+
+        Args:
+            voicevox_speaker (int): VOICEVOXの話者ID. Defaults to 1.
+            voicevox_speed_scale (float): VOICEVOXの話速. Defaults to 1.0.
+            voicevox_volume_scale (float): VOICEVOXの音量. Defaults to 1.0.
+            azure_voice_name (str): Azureの声の名前. 空文字の場合は既定の声. Defaults to ''.
+            google_speaker_id (int): Google TTSの話者ID. Defaults to 1.
+            google_speed_scale (float): Google TTSの話速. Defaults to 1.25.
+            google_volume_scale (float): Google TTSの音量. Defaults to 1.0.
+            google_language_code (str): Google TTSの言語コード. Defaults to 'ja-JP'.
+        """
+        values = {
+            'voicevox_speaker': voicevox_speaker,
+            'voicevox_speed_scale': voicevox_speed_scale,
+            'voicevox_volume_scale': voicevox_volume_scale,
+            'azure_voice_name': azure_voice_name,
+            'google_speaker_id': google_speaker_id,
+            'google_speed_scale': google_speed_scale,
+            'google_volume_scale': google_volume_scale,
+            'google_language_code': google_language_code,
+        }
+        for name, value in values.items():
+            object.__setattr__(self, name, value)
+        # NOTE: /synthesisのパラメータは話者だけなので, リクエストごとに辞書を作らずに読み取り専用で共有する.
+        object.__setattr__(self, 'voicevox_synthesis_params', types.MappingProxyType({'speaker': voicevox_speaker}))
+        object.__setattr__(self, '_key', tuple(values.items()))
+
+    @classmethod
+    def from_tts_configs(cls, tts_configs: dict[str, Any]) -> VoiceProfile:
+        """
+        Compile the voice profile from the TTS configs.
+
+        Args:
+            tts_configs (dict[str, Any]): TTS用のconfig辞書
+
+        Returns:
+            VoiceProfile: 声の設定
+        """
+        voicevox_configs = tts_configs.get('VOICEVOX') or {}
+        azure_configs = tts_configs.get('AZURE') or {}
+        google_configs = tts_configs.get('GOOGLE') or {}
+        return cls(
+            voicevox_speaker=voicevox_configs.get('SPEAKER_ID', 1),
+            voicevox_speed_scale=voicevox_configs.get('SPEED_SCALE', 1.0),
+            voicevox_volume_scale=voicevox_configs.get('VOLUME_SCALE', 1.0),
+            azure_voice_name=azure_configs.get('SPEAKER_ID', ''),
+            google_speaker_id=google_configs.get('SPEAKER_ID', 1),
+            google_speed_scale=google_configs.get('SPEED_SCALE', 1.25),
+            google_volume_scale=google_configs.get('VOLUME_SCALE', 1.0),
+            google_language_code=google_configs.get('LANGUAGE_CODE', 'ja-JP'),
+        )
+
+    def speed_scale(self, use_tts: str) -> float:
+        """
+        Get the speaking rate of the backend, to estimate the duration of the voice.
+
+        Args:
+            use_tts (str): バックエンド名 ('VOICEVOX', 'AZURE', 'GOOGLE')
+
+        Returns:
+            float: 話速. 話速の設定が無いバックエンドは1.0.
+        """
+        if use_tts == 'VOICEVOX':
+            return self.voicevox_speed_scale
+        if use_tts == 'GOOGLE':
+            return self.google_speed_scale
+        return 1.0
+
+    def __setattr__(self, name: str, value: object) -> None:
+        """
+        Reject any change, because the profile is shared by reference.
+
+        Raises:
+            AttributeError: Always.
+        """
+        raise_message = f'VoiceProfile is immutable: cannot set {name}'
+        raise AttributeError(raise_message)
+
+    def __eq__(self, other: object) -> bool:
+        """
+        Compare the settings.
+        """
+        if not isinstance(other, VoiceProfile):
+            return NotImplemented
+        return self._key == other._key
+
+    def __hash__(self) -> int:
+        """
+        Hash the settings.
+        """
+        return hash(self._key)
+
+    def __reduce__(self) -> tuple[Callable[[dict[str, Any]], VoiceProfile], tuple[dict[str, Any]]]:
+        """
+        Pickle by the settings, to send the TTS configs to the worker processes.
+        """
+        return _restore_voice_profile, (dict(self._key),)
+
+    def __repr__(self) -> str:
+        """
+        Show the settings.
+        """
+        return f'VoiceProfile({", ".join(f"{name}={value!r}" for name, value in self._key)})'
+
+
+def _restore_voice_profile(values: dict[str, Any]) -> VoiceProfile:
+    """
+    Restore the pickled voice profile.
+
+    Args:
+        values (dict[str, Any]): 声の設定の値
+
+    Returns:
+        VoiceProfile: 声の設定
+    """
+    return VoiceProfile(**values)
+
+
+def get_voice_profile(tts_configs: dict[str, Any]) -> VoiceProfile:
+    """
+    Get the compiled voice profile of the TTS configs.
+
+    NOTE: 設定ファイルから読んだ設定には読み込み時にコンパイルしたものが入っている.
+          ベンチマークなどで直接作った辞書の場合はその場でコンパイルする.
+
+    Args:
+        tts_configs (dict[str, Any]): TTS用のconfig辞書
+
+    Returns:
+        VoiceProfile: 声の設定
+    """
+    profile = tts_configs.get(VOICE_PROFILE_KEY)
+    if profile is None:
+        return VoiceProfile.from_tts_configs(tts_configs)
+    return profile
+
+
+def compile_voice_profile(tts_configs: dict[str, Any]) -> dict[str, Any]:
+    """
+    Compile the voice profile and store it in the TTS configs.
+
+    Args:
+        tts_configs (dict[str, Any]): TTS用のconfig辞書. 声の設定を追加する.
+
+    Returns:
+        dict[str, Any]: 声の設定を追加したTTS用のconfig辞書
+    """
+    tts_configs[VOICE_PROFILE_KEY] = VoiceProfile.from_tts_configs(tts_configs)
+    return tts_configs
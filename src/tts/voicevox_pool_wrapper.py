@@ -0,0 +1,342 @@
+#!/usr/bin/env python3
+"""
+The class wrap many VOICEVOX engines as one TTS client.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import logging
+from typing import TYPE_CHECKING, Any
+
+from .tts_wrapper import AsyncTTSWrapper
+from .voicevox_wrapper import AsyncVoicevoxWrapper
+
+if TYPE_CHECKING:
+    from collections.abc import AsyncIterator, Iterator
+
+    from .audio_query_cache import AudioQueryCache
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+
+class VoicevoxEngine:
+    """
+    The state of one VOICEVOX engine in the pool.
+    """
+
+    def __init__(self, client: AsyncVoicevoxWrapper, weight: float = 1.0) -> None:
+        """
+        Initialize the engine state.
+
+        Args:
+            client (AsyncVoicevoxWrapper): The client of the engine.
+            weight (float): The relative capacity of the engine. Defaults to 1.0.
+        """
+        self.client = client
+        self.weight = weight
+        self.in_flight = 0
+        self.is_healthy = True
+        self.consecutive_failures = 0
+
+    @property
+    def load(self) -> float:
+        """
+        The number of in-flight requests relative to the weight.
+        """
+        return self.in_flight / self.weight
+
+    @contextlib.contextmanager
+    def track(self) -> Iterator[None]:
+        """
+        Count the request as in-flight while the context is active.
+        """
+        self.in_flight += 1
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+
+
+class PooledAudioQuery:
+    """
+    The audio query with the engine that made it.
+    """
+
+    __slots__ = ('audio_query', 'engine')
+
+    def __init__(self, audio_query: dict, engine: VoicevoxEngine) -> None:
+        """
+        Initialize the pooled audio query.
+
+        Args:
+            audio_query (dict): The audio query for voicevox.
+            engine (VoicevoxEngine): The engine that made the audio query.
+        """
+        self.audio_query = audio_query
+        self.engine = engine
+
+
+class VoicevoxPoolWrapper(AsyncTTSWrapper):
+    """
+    Wrapper class for many VOICEVOX engines.
+
+    Each request is routed to the healthy engine with the fewest in-flight requests relative to its weight.
+    Engines that fail repeatedly are ejected and re-admitted when the periodic /version probe succeeds.
+    """
+
+    supports_streaming = True
+
+    def __init__(  # noqa: PLR0913
+        self,
+        engines: list[tuple[str, float]],
+        tts_configs: dict[str, Any] | None = None,
+        *,
+        max_connections: int = 4,
+        keepalive_timeout: float = 30.0,
+        query_cache: AudioQueryCache | None = None,
+        health_check_interval: float = 10.0,
+        failure_threshold: int = 3,
+        pin_query_to_engine: bool = True,
+    ) -> None:
+        """
+        Initialize the engine pool.
+
+        Args:
+            engines (list[tuple[str, float]]): The engine addresses with port and their weights.
+            tts_configs (dict[str, Any], optional): Configuration options for the TTS. Defaults to None.
+            max_connections (int): The maximum number of pooled connections per engine. Defaults to 4.
+            keepalive_timeout (float): Seconds to keep an idle connection open. Defaults to 30.0.
+            query_cache (AudioQueryCache | None): The audio query cache shared by the engines.
+            health_check_interval (float): Seconds between /version probes. Defaults to 10.0.
+            failure_threshold (int): Consecutive failures to eject an engine. Defaults to 3.
+            pin_query_to_engine (bool): Synthesize on the engine that made the audio query.
+                Use it when the user dictionaries of the engines differ. Defaults to True.
+        """
+        tts_configs = tts_configs or {}
+
+        self.engines = [
+            VoicevoxEngine(
+                AsyncVoicevoxWrapper(
+                    address,
+                    max_connections=max_connections,
+                    keepalive_timeout=keepalive_timeout,
+                    query_cache=query_cache,
+                ),
+                weight,
+            )
+            for address, weight in engines
+        ]
+        self.client = [engine.client for engine in self.engines]
+        self.speakers_name_dict = {-1: 'NoVoice'}
+        self.health_check_interval = health_check_interval
+        self.failure_threshold = failure_threshold
+        self.pin_query_to_engine = pin_query_to_engine
+        self._health_check_task: asyncio.Task | None = None
+
+    async def generate_audio_query(
+        self,
+        text: str,
+        tts_configs: dict[str, Any] | None = None,
+    ) -> PooledAudioQuery:
+        """
+        Generate an audio query on the least loaded engine.
+
+        Args:
+            text (str): The text to be converted to speech.
+            tts_configs (dict[str, Any]): Configuration options for the audio query.  Defaults to None.
+
+        Returns:
+            PooledAudioQuery: The generated audio query with the engine that made it.
+
+        Raises:
+            RuntimeError: If there's an error in the API call.
+        """
+        engine = self._choose_engine()
+        try:
+            audio_query = await self._request(engine, engine.client.generate_audio_query(text, tts_configs))
+        except RuntimeError:
+            # NOTE: 他に使えるエンジンがあれば1度だけ別のエンジンで再試行する.
+            engine = self._choose_engine(exclude=engine)
+            if engine is None:
+                raise
+            audio_query = await self._request(engine, engine.client.generate_audio_query(text, tts_configs))
+
+        return PooledAudioQuery(audio_query, engine)
+
+    async def generate_voice(
+        self,
+        audio_query: PooledAudioQuery,
+        tts_configs: dict[str, Any] | None = None,
+    ) -> bytes:
+        """
+        Generate voice data from the given audio query.
+
+        Args:
+            audio_query (PooledAudioQuery): The audio query to be converted to voice.
+            tts_configs (dict[str, Any]): Configuration options for voice generation. Defaults to None.
+
+        Returns:
+            bytes: The generated voice data in wav format.
+
+        Raises:
+            RuntimeError: If there's an error in the API call.
+        """
+        if self.pin_query_to_engine:
+            engine = audio_query.engine
+        else:
+            engine = self._choose_engine()
+
+        return await self._request(engine, engine.client.generate_voice(audio_query.audio_query, tts_configs))
+
+    async def stream_voice(
+        self,
+        audio_query: PooledAudioQuery,
+        tts_configs: dict[str, Any] | None = None,
+    ) -> AsyncIterator[bytes]:
+        """
+        Generate voice data on one engine and yield it chunk by chunk.
+
+        NOTE: 途中まで返した音声はやり直せないので, 失敗しても別のエンジンでは再試行しない.
+
+        Args:
+            audio_query (PooledAudioQuery): The audio query to be converted to voice.
+            tts_configs (dict[str, Any]): Configuration options for voice generation. Defaults to None.
+
+        Yields:
+            bytes: The chunk of the voice data in wav format.
+
+        Raises:
+            RuntimeError: If there's an error in the API call.
+        """
+        engine = audio_query.engine if self.pin_query_to_engine else self._choose_engine()
+        with engine.track():
+            try:
+                async for chunk in engine.client.stream_voice(audio_query.audio_query, tts_configs):
+                    yield chunk
+            except RuntimeError:
+                self._record_failure(engine)
+                raise
+
+        engine.consecutive_failures = 0
+
+    async def generate_voices_batch(
+        self,
+        texts: list[str],
+        tts_configs: dict[str, Any] | None = None,
+    ) -> list[bytes]:
+        """
+        Generate voice data of many texts with one synthesis request on the least loaded engine.
+
+        Args:
+            texts (list[str]): The texts to be converted to speech.
+            tts_configs (dict[str, Any]): Configuration options for voice generation. Defaults to None.
+
+        Returns:
+            list[bytes]: The generated voice data in wav format, in the order of texts.
+
+        Raises:
+            RuntimeError: If there's an error in the API call.
+        """
+        engine = self._choose_engine()
+        try:
+            return await self._request(engine, engine.client.generate_voices_batch(texts, tts_configs))
+        except RuntimeError:
+            # NOTE: 他に使えるエンジンがあれば1度だけ別のエンジンで再試行する.
+            engine = self._choose_engine(exclude=engine)
+            if engine is None:
+                raise
+            return await self._request(engine, engine.client.generate_voices_batch(texts, tts_configs))
+
+    async def close(self) -> None:
+        """
+        Stop the health checks and close the connections of all engines.
+        """
+        if self._health_check_task is not None:
+            self._health_check_task.cancel()
+            await asyncio.gather(self._health_check_task, return_exceptions=True)
+            self._health_check_task = None
+
+        for engine in self.engines:
+            await engine.client.close()
+
+    def _choose_engine(self, exclude: VoicevoxEngine | None = None) -> VoicevoxEngine | None:
+        """
+        Choose the healthy engine with the fewest in-flight requests relative to its weight.
+
+        NOTE: 全てのエンジンが切り離されている場合は, 全エンジンを候補にして要求を止めない.
+
+        Args:
+            exclude (VoicevoxEngine | None): The engine not to choose. Defaults to None.
+
+        Returns:
+            VoicevoxEngine | None: The chosen engine. None if there is no other engine than exclude.
+        """
+        self._start_health_checks()
+        engines = [engine for engine in self.engines if engine is not exclude]
+        candidates = [engine for engine in engines if engine.is_healthy] or engines
+        if len(candidates) == 0:
+            return None
+
+        return min(candidates, key=lambda engine: (engine.load, -engine.weight))
+
+    async def _request(self, engine: VoicevoxEngine, request: Any) -> Any:  # noqa: ANN401
+        """
+        Await the request as in-flight on the engine and record the result of the engine.
+
+        Args:
+            engine (VoicevoxEngine): The engine to request.
+            request (Any): The awaitable request.
+
+        Returns:
+            Any: The result of the request.
+
+        Raises:
+            RuntimeError: If there's an error in the API call.
+        """
+        with engine.track():
+            try:
+                result = await request
+            except RuntimeError:
+                self._record_failure(engine)
+                raise
+
+        engine.consecutive_failures = 0
+        return result
+
+    def _record_failure(self, engine: VoicevoxEngine) -> None:
+        """
+        Record the failed request and eject the engine if it fails repeatedly.
+
+        Args:
+            engine (VoicevoxEngine): The engine that failed.
+        """
+        engine.consecutive_failures += 1
+        if engine.is_healthy and engine.consecutive_failures >= self.failure_threshold:
+            engine.is_healthy = False
+            logging.warning('Ejected VOICEVOX engine %s', engine.client.client)
+
+    def _start_health_checks(self) -> None:
+        """
+        Start the periodic health checks if not running.
+        """
+        if self._health_check_task is None or self._health_check_task.done():
+            self._health_check_task = asyncio.create_task(self._health_check_loop())
+
+    async def _health_check_loop(self) -> None:
+        """
+        Probe every engine periodically, and eject or re-admit it.
+        """
+        while True:
+            results = await asyncio.gather(*[engine.client.check_health() for engine in self.engines])
+            for engine, is_healthy in zip(self.engines, results, strict=True):
+                if is_healthy and not engine.is_healthy:
+                    logging.info('Re-admitted VOICEVOX engine %s', engine.client.client)
+                elif not is_healthy and engine.is_healthy:
+                    logging.warning('Ejected VOICEVOX engine %s', engine.client.client)
+                engine.is_healthy = is_healthy
+                if is_healthy:
+                    engine.consecutive_failures = 0
+
+            await asyncio.sleep(self.health_check_interval)
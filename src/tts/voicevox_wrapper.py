@@ -5,14 +5,27 @@ The class wrap google tts.
 
 from __future__ import annotations
 
-import copy
+import asyncio
+import io
 import json
-from typing import Any
+import zipfile
+from typing import TYPE_CHECKING, Any
 
+import aiohttp  # pip install aiohttp
 import requests  # pip install requests
 from requests.exceptions import RequestException  # pip install requests
 
-from .tts_wrapper import TTSWrapper
+from .tts_wrapper import AsyncTTSWrapper, TTSWrapper
+from .voice_profile import get_voice_profile
+
+if TYPE_CHECKING:
+    from collections.abc import AsyncIterator, Mapping
+
+    from .audio_query_cache import AudioQueryCache
+
+JSON_HEADERS = {
+    'Content-Type': 'application/json',
+}
 
 
 class VoicevoxWrapper(TTSWrapper):
@@ -25,7 +38,8 @@ class VoicevoxWrapper(TTSWrapper):
     def __init__(
         self,
         address: str = '127.0.0.1:50021',
-        tts_configs: dict[str, Any] | None = None,
+        tts_configs: dict[str, Any] | None = None,  # noqa: ARG002
+        query_cache: AudioQueryCache | None = None,
     ) -> None:
         """
         Initialize the voicevox wrapper.
@@ -33,11 +47,10 @@ class VoicevoxWrapper(TTSWrapper):
         Args:
             address (str): The Voicevox server ip address with port. Dafault in '127.0.0.1:50021'.
             tts_configs (dict[str, Any], optional): Configuration options for the TTS. Defaults to None.
+            query_cache (AudioQueryCache | None): The audio query cache. If it is None, queries are not cached.
         """
-        tts_configs = tts_configs or {}
-        tts_configs = copy.deepcopy(tts_configs)
-
         self.client = f'http://{address}'
+        self.query_cache = query_cache
         self.speakers_name_dict = {-1: 'NoVoice'}
         self.speakers_name_dict = self.speakers_name_dict | self._fetch_speakers()
 
@@ -59,13 +72,11 @@ class VoicevoxWrapper(TTSWrapper):
         Raises:
             RuntimeError: If there's an error in the API call.
         """
-        tts_configs = copy.deepcopy(tts_configs)
-        params = {
-            'text': text,
-            'speedScale': tts_configs['VOICEVOX'].get('SPEED_SCALE', 1.0),
-            'volumeScale': tts_configs['VOICEVOX'].get('VOLUME_SCALE', 1.0),
-            'speaker': tts_configs['VOICEVOX'].get('SPEAKER_ID', 1),
-        }
+        audio_query = _get_cached_audio_query(self.query_cache, text, tts_configs)
+        if audio_query is not None:
+            return audio_query
+
+        params = _make_audio_query_params(text, tts_configs)
 
         try:
             with requests.post(f'{self.client}/audio_query', params=params, timeout=5) as response:
@@ -75,7 +86,7 @@ class VoicevoxWrapper(TTSWrapper):
             raise_massage = f'Failed to generate audio query: {e!s}'
             raise RuntimeError(raise_massage) from e
         else:
-            return audio_query
+            return _store_audio_query(self.query_cache, text, audio_query, tts_configs)
 
     def generate_voice(
         self,
@@ -95,18 +106,12 @@ class VoicevoxWrapper(TTSWrapper):
         Raises:
             RuntimeError: If there's an error in the API call.
         """
-        tts_configs = copy.deepcopy(tts_configs)
-        params = {
-            'speaker': tts_configs['VOICEVOX'].get('SPEAKER_ID', 1),
-        }
-        headers = {
-            'Content-Type': 'application/json',
-        }
+        params = _make_synthesis_params(tts_configs)
 
         try:
             with requests.post(
                 f'{self.client}/synthesis',
-                headers=headers,
+                headers=JSON_HEADERS,
                 params=params,
                 data=json.dumps(audio_query),
                 timeout=30,
@@ -118,6 +123,42 @@ class VoicevoxWrapper(TTSWrapper):
         else:
             return response.content
 
+    def generate_voices_batch(
+        self,
+        texts: list[str],
+        tts_configs: dict[str, Any] | None = None,
+    ) -> list[bytes]:
+        """
+        Generate voice data of many texts with one synthesis request.
+
+        Args:
+            texts (list[str]): The texts to be converted to speech.
+            tts_configs (dict[str, Any]): Configuration options for voice generation. Defaults to None.
+
+        Returns:
+            list[bytes]: The generated voice data in wav format, in the order of texts.
+
+        Raises:
+            RuntimeError: If there's an error in the API call.
+        """
+        audio_queries = [self.generate_audio_query(text, tts_configs) for text in texts]
+        params = _make_synthesis_params(tts_configs)
+
+        try:
+            with requests.post(
+                f'{self.client}/multi_synthesis',
+                headers=JSON_HEADERS,
+                params=params,
+                data=json.dumps(audio_queries),
+                timeout=30,
+            ) as response:
+                response.raise_for_status()
+        except RequestException as e:
+            raise_message = f'Failed to generate voices: {e!s}'
+            raise RuntimeError(raise_message) from e
+        else:
+            return _unpack_multi_synthesis(response.content, len(texts))
+
     def _fetch_speakers(self) -> dict[str, str]:
         """
         Initialize the voicevox wrapper.
@@ -142,3 +183,381 @@ class VoicevoxWrapper(TTSWrapper):
             raise RuntimeError(raise_message) from e
         else:
             return speakers_name_dict
+
+
+class AsyncVoicevoxWrapper(AsyncTTSWrapper):
+    """
+    Asynchronous wrapper class for the VOICEVOX API.
+
+    All requests share one HTTP/1.1 keep-alive connection pool, so synthesis neither blocks the event loop
+    nor opens a new TCP connection per request.
+    """
+
+    supports_streaming = True
+
+    def __init__(
+        self,
+        address: str = '127.0.0.1:50021',
+        tts_configs: dict[str, Any] | None = None,
+        max_connections: int = 4,
+        keepalive_timeout: float = 30.0,
+        query_cache: AudioQueryCache | None = None,
+    ) -> None:
+        """
+        Initialize the asynchronous voicevox wrapper.
+
+        NOTE: The connection pool is created on first use, because aiohttp requires a running event loop.
+
+        Args:
+            address (str): The Voicevox server ip address with port. Dafault in '127.0.0.1:50021'.
+            tts_configs (dict[str, Any], optional): Configuration options for the TTS. Defaults to None.
+            max_connections (int): The maximum number of pooled connections. Defaults to 4.
+            keepalive_timeout (float): Seconds to keep an idle connection open. Defaults to 30.0.
+            query_cache (AudioQueryCache | None): The audio query cache. If it is None, queries are not cached.
+        """
+        tts_configs = tts_configs or {}
+
+        self.client = f'http://{address}'
+        self.query_cache = query_cache
+        self.speakers_name_dict = {-1: 'NoVoice'}
+        self.max_connections = max_connections
+        self.keepalive_timeout = keepalive_timeout
+        self._session: aiohttp.ClientSession | None = None
+
+    async def generate_audio_query(
+        self,
+        text: str,
+        tts_configs: dict[str, Any] | None = None,
+    ) -> dict:
+        """
+        Generate an audio query from the given text.
+
+        Args:
+            text (str): The text to be converted to speech.
+            tts_configs (dict[str, Any]): Configuration options for the audio query.  Defaults to None.
+
+        Returns:
+            dict: The generated audio query for voicevox.
+
+        Raises:
+            RuntimeError: If there's an error in the API call.
+        """
+        audio_query = _get_cached_audio_query(self.query_cache, text, tts_configs)
+        if audio_query is not None:
+            return audio_query
+
+        params = _make_audio_query_params(text, tts_configs)
+        session = self._get_session()
+
+        try:
+            async with session.post(
+                f'{self.client}/audio_query',
+                params=params,
+                timeout=aiohttp.ClientTimeout(total=5),
+            ) as response:
+                response.raise_for_status()
+                audio_query = await response.json()
+        except (aiohttp.ClientError, TimeoutError) as e:
+            raise_massage = f'Failed to generate audio query: {e!s}'
+            raise RuntimeError(raise_massage) from e
+        else:
+            return _store_audio_query(self.query_cache, text, audio_query, tts_configs)
+
+    async def generate_voice(
+        self,
+        audio_query: dict,
+        tts_configs: dict[str, Any] | None = None,
+    ) -> bytes:
+        """
+        Generate voice data from the given audio query.
+
+        Args:
+            audio_query (dict): The audio query to be converted to voice.
+            tts_configs (dict[str, Any]): Configuration options for voice generation. Defaults to None.
+
+        Returns:
+            bytes: The generated voice data in wav format.
+
+        Raises:
+            RuntimeError: If there's an error in the API call.
+        """
+        params = _make_synthesis_params(tts_configs)
+        session = self._get_session()
+
+        try:
+            async with session.post(
+                f'{self.client}/synthesis',
+                headers=JSON_HEADERS,
+                params=params,
+                data=json.dumps(audio_query),
+                timeout=aiohttp.ClientTimeout(total=30),
+            ) as response:
+                response.raise_for_status()
+                voice_data = await response.read()
+        except (aiohttp.ClientError, TimeoutError) as e:
+            raise_message = f'Failed to generate voice: {e!s}'
+            raise RuntimeError(raise_message) from e
+        else:
+            return voice_data
+
+    async def stream_voice(
+        self,
+        audio_query: dict,
+        tts_configs: dict[str, Any] | None = None,
+    ) -> AsyncIterator[bytes]:
+        """
+        Generate voice data and yield it chunk by chunk as the response body arrives.
+
+        NOTE: エンジンがchunkedで返す場合は合成の途中から, そうでなくても受信しながら再生を始められる.
+
+        Args:
+            audio_query (dict): The audio query to be converted to voice.
+            tts_configs (dict[str, Any]): Configuration options for voice generation. Defaults to None.
+
+        Yields:
+            bytes: The chunk of the voice data in wav format.
+
+        Raises:
+            RuntimeError: If there's an error in the API call.
+        """
+        params = _make_synthesis_params(tts_configs)
+        session = self._get_session()
+
+        try:
+            async with session.post(
+                f'{self.client}/synthesis',
+                headers=JSON_HEADERS,
+                params=params,
+                data=json.dumps(audio_query),
+                timeout=aiohttp.ClientTimeout(total=30),
+            ) as response:
+                response.raise_for_status()
+                async for chunk in response.content.iter_any():
+                    yield chunk
+        except (aiohttp.ClientError, TimeoutError) as e:
+            raise_message = f'Failed to generate voice: {e!s}'
+            raise RuntimeError(raise_message) from e
+
+    async def generate_voices_batch(
+        self,
+        texts: list[str],
+        tts_configs: dict[str, Any] | None = None,
+    ) -> list[bytes]:
+        """
+        Generate voice data of many texts with one synthesis request.
+
+        NOTE: VOICEVOXにはaudio_queryをまとめて作るAPIが無いので, クエリは並行に投げて合成だけを1回にまとめる.
+
+        Args:
+            texts (list[str]): The texts to be converted to speech.
+            tts_configs (dict[str, Any]): Configuration options for voice generation. Defaults to None.
+
+        Returns:
+            list[bytes]: The generated voice data in wav format, in the order of texts.
+
+        Raises:
+            RuntimeError: If there's an error in the API call.
+        """
+        audio_queries = await asyncio.gather(*[self.generate_audio_query(text, tts_configs) for text in texts])
+        params = _make_synthesis_params(tts_configs)
+        session = self._get_session()
+
+        try:
+            async with session.post(
+                f'{self.client}/multi_synthesis',
+                headers=JSON_HEADERS,
+                params=params,
+                data=json.dumps(audio_queries),
+                timeout=aiohttp.ClientTimeout(total=30 * len(texts)),
+            ) as response:
+                response.raise_for_status()
+                content = await response.read()
+        except (aiohttp.ClientError, TimeoutError) as e:
+            raise_message = f'Failed to generate voices: {e!s}'
+            raise RuntimeError(raise_message) from e
+        else:
+            return _unpack_multi_synthesis(content, len(texts))
+
+    async def fetch_speakers(self) -> dict[int, str]:
+        """
+        Fetch the speakers and update speakers_name_dict.
+
+        Returns:
+            dict[int, str]: The dictionary of speakers, keyed by id.
+
+        Raises:
+            RuntimeError: If there's an error in the API call.
+        """
+        session = self._get_session()
+        try:
+            async with session.get(f'{self.client}/speakers', timeout=aiohttp.ClientTimeout(total=5)) as response:
+                response.raise_for_status()
+                response_dict = await response.json()
+        except (aiohttp.ClientError, TimeoutError) as e:
+            raise_message = f'Failed to fetch speakers: {e!s}'
+            raise RuntimeError(raise_message) from e
+
+        for i in response_dict:
+            for s in i['styles']:
+                self.speakers_name_dict[int(s['id'])] = f'{i["name"]}@{s["name"]}'
+
+        return self.speakers_name_dict
+
+    async def check_health(self, probe_timeout: float = 2.0) -> bool:
+        """
+        Check the engine answers /version.
+
+        Args:
+            probe_timeout (float): The timeout of the probe in seconds. Defaults to 2.0.
+
+        Returns:
+            bool: エンジンが応答したか判定
+        """
+        session = self._get_session()
+        client_timeout = aiohttp.ClientTimeout(total=probe_timeout)
+        try:
+            async with session.get(f'{self.client}/version', timeout=client_timeout) as response:
+                response.raise_for_status()
+        except (aiohttp.ClientError, TimeoutError):
+            return False
+        else:
+            return True
+
+    async def close(self) -> None:
+        """
+        Close the pooled connections.
+        """
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        """
+        Get the shared client session, creating the connection pool on first use.
+
+        Returns:
+            aiohttp.ClientSession: The client session with keep-alive connection pool.
+        """
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.max_connections,
+                limit_per_host=self.max_connections,
+                keepalive_timeout=self.keepalive_timeout,
+            )
+            self._session = aiohttp.ClientSession(connector=connector)
+
+        return self._session
+
+
+def _make_audio_query_params(text: str, tts_configs: dict[str, Any]) -> dict[str, Any]:
+    """
+    Make the request parameters of /audio_query.
+
+    Args:
+        text (str): The text to be converted to speech.
+        tts_configs (dict[str, Any]): Configuration options for the audio query.
+
+    Returns:
+        dict[str, Any]: The request parameters.
+    """
+    profile = get_voice_profile(tts_configs)
+    return {
+        'text': text,
+        'speedScale': profile.voicevox_speed_scale,
+        'volumeScale': profile.voicevox_volume_scale,
+        'speaker': profile.voicevox_speaker,
+    }
+
+
+def _get_cached_audio_query(
+    query_cache: AudioQueryCache | None,
+    text: str,
+    tts_configs: dict[str, Any],
+) -> dict | None:
+    """
+    Get the cached audio query with speed and volume of the configs.
+
+    Args:
+        query_cache (AudioQueryCache | None): The audio query cache.
+        text (str): The text to be converted to speech.
+        tts_configs (dict[str, Any]): Configuration options for the audio query.
+
+    Returns:
+        dict | None: The audio query. None if it is not cached.
+    """
+    if query_cache is None:
+        return None
+
+    profile = get_voice_profile(tts_configs)
+    return query_cache.get(text, profile.voicevox_speaker, profile.voicevox_speed_scale, profile.voicevox_volume_scale)
+
+
+def _store_audio_query(
+    query_cache: AudioQueryCache | None,
+    text: str,
+    audio_query: dict,
+    tts_configs: dict[str, Any],
+) -> dict:
+    """
+    Store the audio query returned by the engine and apply speed and volume of the configs.
+
+    NOTE: speedScale, volumeScaleは/audio_queryのパラメータではなくクエリの値なので, 受け取ったクエリに設定する.
+
+    Args:
+        query_cache (AudioQueryCache | None): The audio query cache.
+        text (str): The text to be converted to speech.
+        audio_query (dict): The audio query returned by the engine.
+        tts_configs (dict[str, Any]): Configuration options for the audio query.
+
+    Returns:
+        dict: The audio query with speed and volume applied.
+    """
+    profile = get_voice_profile(tts_configs)
+    if query_cache is not None:
+        query_cache.put(text, profile.voicevox_speaker, audio_query)
+
+    audio_query['speedScale'] = profile.voicevox_speed_scale
+    audio_query['volumeScale'] = profile.voicevox_volume_scale
+    return audio_query
+
+
+def _make_synthesis_params(tts_configs: dict[str, Any]) -> Mapping[str, Any]:
+    """
+    Get the request parameters of /synthesis.
+
+    Args:
+        tts_configs (dict[str, Any]): Configuration options for voice generation.
+
+    Returns:
+        Mapping[str, Any]: The request parameters prepared in the voice profile. Read only.
+    """
+    return get_voice_profile(tts_configs).voicevox_synthesis_params
+
+
+def _unpack_multi_synthesis(content: bytes, expected_count: int) -> list[bytes]:
+    """
+    Unpack the zip archive returned by /multi_synthesis.
+
+    Args:
+        content (bytes): The zip archive of wav files named '001.wav', '002.wav', ...
+        expected_count (int): The number of requested texts.
+
+    Returns:
+        list[bytes]: The wav data in the order of the requested texts.
+
+    Raises:
+        RuntimeError: If the archive is broken or the number of files does not match.
+    """
+    try:
+        with zipfile.ZipFile(io.BytesIO(content)) as archive:
+            names = sorted(archive.namelist())
+            voice_data_list = [archive.read(name) for name in names]
+    except zipfile.BadZipFile as e:
+        raise_message = f'Failed to unpack voices: {e!s}'
+        raise RuntimeError(raise_message) from e
+
+    if len(voice_data_list) != expected_count:
+        raise_message = f'Failed to unpack voices: expected {expected_count} files, got {len(voice_data_list)}'
+        raise RuntimeError(raise_message)
+
+    return voice_data_list
@@ -0,0 +1,402 @@
+#!/usr/bin/env python3
+"""
+The class for cache synthesized sound data.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# NOTE: 出力音声に影響するTTSの設定値. これらが変わると別の音声になるのでキーに含める.
+VOICE_PARAMETER_KEYS = ('SPEAKER_ID', 'SPEED_SCALE', 'VOLUME_SCALE')
+
+
+class SoundCache:
+    """
+    Two-tier (memory and disk) LRU cache for synthesized sound data.
+
+    Entries are addressed by a hash of the normalized text and the voice parameters,
+    evicted by total size and by age, and the disk index is persisted so that a restarted bot starts warm.
+    """
+
+    def __init__(
+        self,
+        cache_dir: str = './data/sound_cache',
+        max_memory_bytes: int = 32 * 1024 * 1024,
+        max_disk_bytes: int = 512 * 1024 * 1024,
+        max_age_sec: float = 7 * 24 * 60 * 60,
+        index_save_interval_sec: float = 60.0,
+    ) -> None:
+        """
+        Initialize the sound cache and load the persisted index.
+
+        Args:
+            cache_dir (str): The directory to store cached sound files. Defaults to './data/sound_cache'.
+            max_memory_bytes (int): The maximum total size of the memory tier. Defaults to 32MiB.
+            max_disk_bytes (int): The maximum total size of the disk tier. Defaults to 512MiB.
+            max_age_sec (float): Entries older than this are evicted. Defaults to 7 days.
+            index_save_interval_sec (float): The minimum interval to write the index file. Defaults to 60 sec.
+        """
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.index_file = self.cache_dir / 'index.json'
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self.max_age_sec = max_age_sec
+        self.index_save_interval_sec = index_save_interval_sec
+
+        self.memory_entries: OrderedDict[str, bytes] = OrderedDict()
+        self.memory_bytes = 0
+        # NOTE: key -> {'size': int, 'created': float, 'suffix': str}. 並び順がLRUの順序(末尾が最新).
+        #       suffixが無いエントリは形式の設定を追加する前に保存したwav.
+        self.disk_entries: OrderedDict[str, dict[str, Any]] = OrderedDict()
+        self.disk_bytes = 0
+
+        self.counters = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'evictions': 0}
+        self._lock = threading.Lock()
+        # NOTE: 目次ファイルの書き込みを直列にする. 辞書のロックとは分けて, 書き込み中も読み書きできるようにする.
+        self._index_lock = threading.Lock()
+        self._is_index_dirty = False
+        self._last_index_save = time.monotonic()
+        self._load_index()
+
+    @staticmethod
+    def normalize_text(text: str) -> str:
+        """
+        Normalize the text so that trivially different inputs share one entry.
+
+        Args:
+            text (str): 音声に変換する文章
+
+        Returns:
+            str: NFKC正規化して前後の空白を除いた文章
+        """
+        return unicodedata.normalize('NFKC', text).strip()
+
+    @classmethod
+    def make_key(cls, text: str, tts_configs: dict[str, Any]) -> str:
+        """
+        Make the cache key from the text and every voice parameter that affects the output.
+
+        Args:
+            text (str): 音声に変換する文章
+            tts_configs (dict[str, Any]): TTS用のconfig辞書
+
+        Returns:
+            str: キャッシュのキー(sha256のhex文字列)
+        """
+        backend = tts_configs['USE_TTS']
+        backend_configs = tts_configs.get(backend, {})
+        key_source = {
+            'text': cls.normalize_text(text),
+            'backend': backend,
+            'params': {k: backend_configs.get(k) for k in VOICE_PARAMETER_KEYS},
+        }
+        output_format = tts_configs.get('OUTPUT_FORMAT', 'wav')
+        if output_format != 'wav':
+            # NOTE: wavの場合はキーに含めず, 形式の設定を追加する前に作ったキャッシュをそのまま使えるようにする.
+            key_source['format'] = output_format
+        key_text = json.dumps(key_source, ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(key_text.encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> bytes | None:
+        """
+        Get the sound data from the memory tier, falling back to the disk tier.
+
+        NOTE: ディスクからの読み込みはロックの外で行う. イベントループを止めないようスレッドで呼ぶこと.
+
+        Args:
+            key (str): キャッシュのキー
+
+        Returns:
+            bytes | None: 音声データ. キャッシュに無い場合はNone.
+        """
+        with self._lock:
+            data = self.memory_entries.get(key)
+            entry = self.disk_entries.get(key)
+            # NOTE: 期限切れの場合はメモリの音声を返さず, 下のディスクの検索で両方から消す.
+            if data is not None and (entry is None or not self._is_expired(entry, time.time())):
+                self.memory_entries.move_to_end(key)
+                self._touch_disk_entry(key)
+                self.counters['memory_hits'] += 1
+                return data
+
+        file_path = self._lookup_disk_file(key)
+        if file_path is None:
+            return None
+
+        try:
+            data = file_path.read_bytes()
+        except FileNotFoundError:
+            # NOTE: 読む前に追い出されたか, 外から消された場合.
+            self._forget_lost_file(key)
+            return None
+
+        with self._lock:
+            if key in self.disk_entries:
+                self._put_memory(key, data)
+            self.counters['disk_hits'] += 1
+        return data
+
+    def get_file(self, key: str) -> str | None:
+        """
+        Get the path of the cached sound file.
+
+        NOTE: ファイルの存在確認はロックの外で行う. イベントループを止めないようスレッドで呼ぶこと.
+
+        Args:
+            key (str): キャッシュのキー
+
+        Returns:
+            str | None: 音声ファイル名. キャッシュに無い場合はNone.
+        """
+        file_path = self._lookup_disk_file(key)
+        if file_path is None:
+            return None
+
+        if not file_path.exists():
+            self._forget_lost_file(key)
+            return None
+
+        with self._lock:
+            if key in self.memory_entries:
+                self.memory_entries.move_to_end(key)
+                self.counters['memory_hits'] += 1
+            else:
+                self.counters['disk_hits'] += 1
+        return str(file_path)
+
+    def put(self, key: str, data: bytes, suffix: str = '.wav') -> str:
+        """
+        Store the sound data in both tiers.
+
+        NOTE: ファイルの書き込みと削除, 目次の保存はロックの外で行い, ロックは管理用の辞書の更新だけに使う.
+
+        Args:
+            key (str): キャッシュのキー
+            data (bytes): 音声データ
+            suffix (str): 保存するファイルの拡張子. Defaults to '.wav'.
+
+        Returns:
+            str: ディスクに保存した音声ファイル名
+        """
+        file_path = self._file_path(key, suffix)
+        file_path.write_bytes(data)
+        with self._lock:
+            removed_paths = []
+            if key in self.disk_entries:
+                old_entry = self.disk_entries.pop(key)
+                self.disk_bytes -= old_entry['size']
+                old_file_path = self._file_path(key, old_entry.get('suffix', '.wav'))
+                if old_file_path != file_path:
+                    removed_paths.append(old_file_path)
+            self.disk_entries[key] = {'size': len(data), 'created': time.time(), 'suffix': suffix}
+            self.disk_bytes += len(data)
+            self._put_memory(key, data)
+            removed_paths += self._evict_disk()
+            self._is_index_dirty = True
+            index = self._snapshot_index(force=False)
+
+        _unlink_files(removed_paths)
+        if index is not None:
+            self._write_index(index)
+        return str(file_path)
+
+    def stats(self) -> dict[str, int | float]:
+        """
+        Get the hit/miss counters and the current size of the cache.
+
+        Returns:
+            dict[str, int | float]: カウンタとキャッシュサイズの辞書
+        """
+        with self._lock:
+            hits = self.counters['memory_hits'] + self.counters['disk_hits']
+            lookups = hits + self.counters['misses']
+            return self.counters | {
+                'hit_ratio': hits / lookups if lookups > 0 else 0.0,
+                'memory_entries': len(self.memory_entries),
+                'memory_bytes': self.memory_bytes,
+                'disk_entries': len(self.disk_entries),
+                'disk_bytes': self.disk_bytes,
+            }
+
+    def save_index(self) -> None:
+        """
+        Write the disk tier index to the index file.
+        """
+        with self._lock:
+            index = self._snapshot_index(force=True)
+        if index is not None:
+            self._write_index(index)
+
+    def _file_path(self, key: str, suffix: str = '.wav') -> Path:
+        """
+        Get the path of the disk tier file for the key.
+        """
+        return self.cache_dir / f'{key}{suffix}'
+
+    def _is_expired(self, entry: dict[str, Any], now: float) -> bool:
+        """
+        Check the entry is older than the max age.
+        """
+        return now - entry['created'] > self.max_age_sec
+
+    def _touch_disk_entry(self, key: str) -> None:
+        """
+        Mark the disk tier entry as recently used.
+        """
+        if key in self.disk_entries:
+            self.disk_entries.move_to_end(key)
+            self._is_index_dirty = True
+
+    def _lookup_disk_file(self, key: str) -> Path | None:
+        """
+        Look up the disk tier file for the key, counting a miss and deleting the file if expired.
+        """
+        with self._lock:
+            entry = self.disk_entries.get(key)
+            if entry is None:
+                self.counters['misses'] += 1
+                return None
+
+            file_path = self._file_path(key, entry.get('suffix', '.wav'))
+            if not self._is_expired(entry, time.time()):
+                self._touch_disk_entry(key)
+                return file_path
+
+            self._remove(key)
+            self.counters['misses'] += 1
+
+        # NOTE: 期限切れのファイルはロックの外で消す.
+        _unlink_files([file_path])
+        return None
+
+    def _forget_lost_file(self, key: str) -> None:
+        """
+        Drop the entry whose file was lost, and count the lookup as a miss.
+        """
+        with self._lock:
+            self._remove(key)
+            self.counters['misses'] += 1
+
+    def _put_memory(self, key: str, data: bytes) -> None:
+        """
+        Store the data in the memory tier and evict the least recently used entries.
+        """
+        if len(data) > self.max_memory_bytes:
+            return
+
+        if key in self.memory_entries:
+            self.memory_bytes -= len(self.memory_entries.pop(key))
+        self.memory_entries[key] = data
+        self.memory_bytes += len(data)
+        while self.memory_bytes > self.max_memory_bytes:
+            _, evicted = self.memory_entries.popitem(last=False)
+            self.memory_bytes -= len(evicted)
+
+    def _evict_disk(self) -> list[Path]:
+        """
+        Evict expired entries and the least recently used entries over the size limit.
+
+        Returns:
+            list[Path]: ロックの外で削除するファイル
+        """
+        now = time.time()
+        removed_paths = [self._remove(k) for k, v in list(self.disk_entries.items()) if self._is_expired(v, now)]
+        while self.disk_bytes > self.max_disk_bytes and len(self.disk_entries) > 0:
+            removed_paths.append(self._remove(next(iter(self.disk_entries))))
+        return [file_path for file_path in removed_paths if file_path is not None]
+
+    def _remove(self, key: str) -> Path | None:
+        """
+        Remove the entry from both tiers.
+
+        Returns:
+            Path | None: ロックの外で削除するファイル. ディスクに無かった場合はNone.
+        """
+        data = self.memory_entries.pop(key, None)
+        if data is not None:
+            self.memory_bytes -= len(data)
+
+        entry = self.disk_entries.pop(key, None)
+        if entry is None:
+            return None
+
+        self.disk_bytes -= entry['size']
+        self.counters['evictions'] += 1
+        self._is_index_dirty = True
+        return self._file_path(key, entry.get('suffix', '.wav'))
+
+    def _load_index(self) -> None:
+        """
+        Load the persisted disk tier index, ignoring entries whose file was lost.
+        """
+        if not self.index_file.exists():
+            return
+
+        try:
+            with self.index_file.open('r', encoding='utf-8') as f:
+                index = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            logging.exception('Failed to load sound cache index "%s"', self.index_file)
+            return
+
+        for key, entry in index.items():
+            if self._file_path(key, entry.get('suffix', '.wav')).exists():
+                self.disk_entries[key] = entry
+                self.disk_bytes += entry['size']
+
+        _unlink_files(self._evict_disk())
+
+    def _snapshot_index(self, *, force: bool) -> dict[str, dict[str, Any]] | None:
+        """
+        Copy the index to write if it is dirty and the save interval has passed. Called with the lock held.
+
+        Args:
+            force (bool): 保存間隔に関わらず書き出すか
+
+        Returns:
+            dict[str, dict[str, Any]] | None: 書き出す目次. 書き出さない場合はNone.
+        """
+        now = time.monotonic()
+        if not self._is_index_dirty or (not force and now - self._last_index_save < self.index_save_interval_sec):
+            return None
+
+        self._is_index_dirty = False
+        self._last_index_save = now
+        # NOTE: エントリの辞書は差し替えるだけで書き換えないので, 浅いコピーで十分.
+        return dict(self.disk_entries)
+
+    def _write_index(self, index: dict[str, dict[str, Any]]) -> None:
+        """
+        Write the index file atomically.
+
+        Args:
+            index (dict[str, dict[str, Any]]): 書き出す目次
+        """
+        with self._index_lock:
+            tmp_file = self.index_file.with_suffix('.tmp')
+            with tmp_file.open('w', encoding='utf-8') as f:
+                json.dump(index, f)
+            tmp_file.replace(self.index_file)
+
+
+def _unlink_files(file_paths: list[Path]) -> None:
+    """
+    Delete the files of the removed entries.
+
+    Args:
+        file_paths (list[Path]): 削除するファイル
+    """
+    for file_path in file_paths:
+        file_path.unlink(missing_ok=True)
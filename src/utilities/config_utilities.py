@@ -3,14 +3,48 @@
 The functions for get and set configs.
 """
 
+import asyncio
+import copy
 import logging
+from collections.abc import Callable
 from pathlib import Path
 from typing import Any
 
 import yaml
 
+from tts.voice_profile import compile_voice_profile
+
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
+# NOTE: 接続やプロセスの構成に関わる設定. 実行中に読み直しても反映できないので, 変更された場合は元の値のまま動かす.
+RESTART_REQUIRED_KEYS = (
+    ('DISCORD', 'API_KEY'),
+    ('DISCORD', 'COMMAND_PREFIX'),
+    ('DISCORD', 'AUTO_SHARD'),
+    ('DISCORD', 'MEMBERS_INTENT'),
+    ('TTS', 'USE_TTS'),
+    ('TTS', 'FALLBACK_TTS'),
+    ('TTS', 'HEDGE'),
+    ('TTS', 'CACHE'),
+    ('TTS', 'READING_DICTIONARY'),
+    ('TTS', 'CHUNKER'),
+    ('TTS', 'VOICEVOX', 'HOST_IP'),
+    ('TTS', 'VOICEVOX', 'PORT'),
+    ('TTS', 'VOICEVOX', 'ENGINES'),
+    ('TTS', 'VOICEVOX', 'MAX_CONNECTIONS'),
+    ('TTS', 'VOICEVOX', 'KEEPALIVE_TIMEOUT'),
+    ('TTS', 'VOICEVOX', 'QUERY_CACHE'),
+    ('TTS', 'AZURE', 'API_KEY'),
+    ('TTS', 'AZURE', 'REGION'),
+    ('TTS', 'AZURE', 'POOL_SIZE'),
+    ('TTS', 'GOOGLE', 'CREDENTIAL_FILE'),
+    ('WORKERS',),
+    ('PRESYNTHESIS',),
+    ('METRICS',),
+    ('CONFIG_RELOAD',),
+)
+_MISSING = object()
+
 
 def load_config(config_file_name: str = './data/config.yaml') -> dict[str, Any]:
     """
@@ -36,9 +70,139 @@ def load_config(config_file_name: str = './data/config.yaml') -> dict[str, Any]:
         logging.exception('Error parsing YAML file "%s"', config_file_name)
         raise
 
+    # NOTE: 声の設定はリクエストのたびに辞書を辿らないよう, 読み込み時に1度だけコンパイルしておく.
+    if isinstance(configs, dict) and isinstance(configs.get('TTS'), dict):
+        compile_voice_profile(configs['TTS'])
     return configs
 
 
+def merge_reloaded_configs(
+    old_configs: dict[str, Any],
+    new_configs: dict[str, Any],
+) -> tuple[dict[str, Any], list[str]]:
+    """
+    Keep the values of RESTART_REQUIRED_KEYS of the running configs in the reloaded configs.
+
+    Args:
+        old_configs (dict[str, Any]): 実行中のconfig辞書
+        new_configs (dict[str, Any]): 読み直したconfig辞書. 書き換えて返す.
+
+    Returns:
+        tuple[dict[str, Any], list[str]]: 反映するconfig辞書と, 再起動するまで反映されない変更されたキーのリスト
+    """
+    kept_keys = []
+    for path in RESTART_REQUIRED_KEYS:
+        old_value = _get_path(old_configs, path)
+        if old_value == _get_path(new_configs, path):
+            continue
+
+        kept_keys.append('.'.join(path))
+        parent = new_configs
+        for name in path[:-1]:
+            parent = parent.setdefault(name, {})
+        if old_value is _MISSING:
+            parent.pop(path[-1], None)
+        else:
+            parent[path[-1]] = copy.deepcopy(old_value)
+
+    if isinstance(new_configs.get('TTS'), dict):
+        compile_voice_profile(new_configs['TTS'])
+    return new_configs, kept_keys
+
+
+def _get_path(configs: dict[str, Any], path: tuple[str, ...]) -> Any:  # noqa: ANN401
+    """
+    Get the nested value of the configs.
+
+    Args:
+        configs (dict[str, Any]): config辞書
+        path (tuple[str, ...]): キーの並び
+
+    Returns:
+        Any: 値. 無い場合は_MISSING.
+    """
+    value = configs
+    for name in path:
+        if not isinstance(value, dict) or name not in value:
+            return _MISSING
+        value = value[name]
+    return value
+
+
+class ConfigWatcher:
+    """
+    Watch the config file and call back with the reloaded configs when it changes.
+
+    The file is polled by its modification time and size, which costs one stat per interval.
+    A file which fails to parse (ex. while being saved) is logged and skipped until it changes again.
+    """
+
+    def __init__(
+        self,
+        config_file_name: str,
+        on_reload: Callable[[dict[str, Any]], None],
+        interval_sec: float = 2.0,
+    ) -> None:
+        """
+        Initialize the config watcher.
+
+        Args:
+            config_file_name (str): 監視するconfigファイル名
+            on_reload (Callable[[dict[str, Any]], None]): 読み直したconfig辞書を受け取る処理
+            interval_sec (float): 確認する間隔[秒]. Defaults to 2.0.
+        """
+        self.config_file_name = config_file_name
+        self.on_reload = on_reload
+        self.interval_sec = interval_sec
+        self._signature = self._stat()
+
+    def check(self) -> dict[str, Any] | None:
+        """
+        Reload the config file if it has changed since the last check.
+
+        Returns:
+            dict[str, Any] | None: 読み直したconfig辞書. 変更が無い場合や読み込めない場合はNone.
+        """
+        signature = self._stat()
+        if signature == self._signature:
+            return None
+
+        self._signature = signature
+        try:
+            configs = load_config(self.config_file_name)
+        except (FileNotFoundError, yaml.YAMLError):
+            # NOTE: 保存途中のファイルを読んだ場合も含むので, 実行中の設定のまま次の変更を待つ.
+            return None
+
+        if not isinstance(configs, dict):
+            logging.warning('Ignored configuration file "%s" which is not a mapping', self.config_file_name)
+            return None
+        return configs
+
+    async def watch(self) -> None:
+        """
+        Check the config file periodically and call back when it has changed.
+        """
+        while True:
+            await asyncio.sleep(self.interval_sec)
+            configs = await asyncio.to_thread(self.check)
+            if configs is not None:
+                self.on_reload(configs)
+
+    def _stat(self) -> tuple[int, int] | None:
+        """
+        Get the modification time and the size of the config file.
+
+        Returns:
+            tuple[int, int] | None: 更新時刻[ns]とサイズ. ファイルが無い場合はNone.
+        """
+        try:
+            stat = Path(self.config_file_name).stat()
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+
 def save_config(configs: dict[str, Any], config_file_name: str = './data/config.yaml') -> None:
     """
     Load configuration from a YAML file.
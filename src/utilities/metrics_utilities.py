@@ -0,0 +1,452 @@
+#!/usr/bin/env python3
+"""
+The classes and functions for latency metrics of the read aloud pipeline.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import bisect
+import contextlib
+import contextvars
+import logging
+import math
+import threading
+import time
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from collections.abc import Iterator
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+RTF_BUCKETS = (0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1.0, 1.5, 2.0, 4.0)
+
+# NOTE: ギルドごとの再生スケジューラが合成タスクを作る前に設定する. タスクはコンテキストを引き継ぐので,
+#       合成処理の奥でギルドを引数で受け回さなくてもラベルを付けられる.
+GUILD_LABEL: contextvars.ContextVar[str] = contextvars.ContextVar('GUILD_LABEL', default='')
+
+LabelKey = tuple[tuple[str, str], ...]
+
+
+def _make_label_key(labels: dict[str, object]) -> LabelKey:
+    """
+    Make the hashable key of the labels.
+
+    Args:
+        labels (dict[str, object]): ラベル名と値の辞書
+
+    Returns:
+        LabelKey: ラベル名で並べた(ラベル名, 値)のタプル
+    """
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def _format_labels(label_key: LabelKey, extra: tuple[tuple[str, str], ...] = ()) -> str:
+    """
+    Format the labels in the Prometheus text format.
+
+    Args:
+        label_key (LabelKey): ラベルのキー
+        extra (tuple[tuple[str, str], ...]): 追加するラベル(leなど)
+
+    Returns:
+        str: '{name="value",...}'の形式の文字列. ラベルが無い場合は空文字
+    """
+    pairs = (*label_key, *extra)
+    if len(pairs) == 0:
+        return ''
+
+    escaped = (value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped, strict=True)) + '}'
+
+
+class Counter:
+    """
+    Monotonic counter with labels.
+    """
+
+    def __init__(self, name: str, documentation: str) -> None:
+        """
+        Initialize the counter.
+
+        Args:
+            name (str): メトリクス名
+            documentation (str): メトリクスの説明
+        """
+        self.name = name
+        self.documentation = documentation
+        self.values: dict[LabelKey, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels: object) -> None:
+        """
+        Increment the counter.
+
+        Args:
+            amount (float): 増やす量. Defaults to 1.0.
+            **labels (object): ラベル
+        """
+        key = _make_label_key(labels)
+        with self._lock:
+            self.values[key] = self.values.get(key, 0.0) + amount
+
+    def render(self) -> list[str]:
+        """
+        Render the counter in the Prometheus text format.
+
+        Returns:
+            list[str]: 出力する行のリスト
+        """
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} counter']
+        with self._lock:
+            values = list(self.values.items())
+        lines += [f'{self.name}{_format_labels(key)} {value}' for key, value in values]
+        return lines
+
+
+class Gauge:
+    """
+    Current value with labels, such as a queue depth.
+    """
+
+    def __init__(self, name: str, documentation: str) -> None:
+        """
+        Initialize the gauge.
+
+        Args:
+            name (str): メトリクス名
+            documentation (str): メトリクスの説明
+        """
+        self.name = name
+        self.documentation = documentation
+        self.values: dict[LabelKey, float] = {}
+        self._lock = threading.Lock()
+
+    def set(self, value: float, **labels: object) -> None:
+        """
+        Set the value.
+
+        Args:
+            value (float): 現在の値
+            **labels (object): ラベル
+        """
+        key = _make_label_key(labels)
+        with self._lock:
+            self.values[key] = value
+
+    def render(self) -> list[str]:
+        """
+        Render the gauge in the Prometheus text format.
+
+        Returns:
+            list[str]: 出力する行のリスト
+        """
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} gauge']
+        with self._lock:
+            values = list(self.values.items())
+        lines += [f'{self.name}{_format_labels(key)} {value}' for key, value in values]
+        return lines
+
+
+class Histogram:
+    """
+    Fixed bucket histogram with labels.
+
+    Observing is one bisect and a few additions under a lock, so it is cheap enough for every clip.
+    """
+
+    def __init__(self, name: str, documentation: str, buckets: tuple[float, ...] = LATENCY_BUCKETS) -> None:
+        """
+        Initialize the histogram.
+
+        Args:
+            name (str): メトリクス名
+            documentation (str): メトリクスの説明
+            buckets (tuple[float, ...]): バケットの上限値の昇順タプル. Defaults to LATENCY_BUCKETS.
+        """
+        self.name = name
+        self.documentation = documentation
+        self.buckets = buckets
+        # NOTE: ラベルごとに[バケットごとの件数(最後は+Inf), 合計, 件数]を持つ.
+        self.values: dict[LabelKey, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: object) -> None:
+        """
+        Observe the value.
+
+        Args:
+            value (float): 観測値
+            **labels (object): ラベル
+        """
+        key = _make_label_key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self.values.get(key)
+            if entry is None:
+                entry = [[0] * (len(self.buckets) + 1), 0.0, 0]
+                self.values[key] = entry
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    @contextlib.contextmanager
+    def time(self, **labels: object) -> Iterator[None]:
+        """
+        Observe the elapsed seconds of the context.
+
+        Args:
+            **labels (object): ラベル
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def quantile(self, label_key: LabelKey, q: float) -> float:
+        """
+        Estimate the quantile from the buckets by linear interpolation.
+
+        Args:
+            label_key (LabelKey): ラベルのキー
+            q (float): 分位 (0.0から1.0)
+
+        Returns:
+            float: 推定値. 最後のバケットを超える場合は最後のバケットの上限値.
+        """
+        with self._lock:
+            counts, _, count = self.values[label_key]
+            counts = list(counts)
+
+        rank = q * count
+        cumulative = 0
+        for i, bucket_count in enumerate(counts):
+            if cumulative + bucket_count >= rank and bucket_count > 0:
+                if i == len(self.buckets):
+                    return self.buckets[-1]
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                return lower + (self.buckets[i] - lower) * (rank - cumulative) / bucket_count
+            cumulative += bucket_count
+        return math.nan
+
+    def render(self) -> list[str]:
+        """
+        Render the histogram in the Prometheus text format.
+
+        Returns:
+            list[str]: 出力する行のリスト
+        """
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            values = [(key, list(counts), total, count) for key, (counts, total, count) in self.values.items()]
+
+        for key, counts, total, count in values:
+            cumulative = 0
+            for bound, bucket_count in zip((*self.buckets, math.inf), counts, strict=True):
+                cumulative += bucket_count
+                le = '+Inf' if math.isinf(bound) else repr(bound)
+                lines.append(f'{self.name}_bucket{_format_labels(key, (("le", le),))} {cumulative}')
+            lines.append(f'{self.name}_sum{_format_labels(key)} {total}')
+            lines.append(f'{self.name}_count{_format_labels(key)} {count}')
+        return lines
+
+
+class MetricsRegistry:
+    """
+    The registry of the metrics of the bot.
+    """
+
+    def __init__(self) -> None:
+        """
+        Initialize the registry.
+        """
+        self.metrics: dict[str, Counter | Gauge | Histogram] = {}
+
+    def counter(self, name: str, documentation: str) -> Counter:
+        """
+        Get the counter, registering it on first use.
+
+        Args:
+            name (str): メトリクス名
+            documentation (str): メトリクスの説明
+
+        Returns:
+            Counter: カウンタ
+        """
+        return self.metrics.setdefault(name, Counter(name, documentation))
+
+    def gauge(self, name: str, documentation: str) -> Gauge:
+        """
+        Get the gauge, registering it on first use.
+
+        Args:
+            name (str): メトリクス名
+            documentation (str): メトリクスの説明
+
+        Returns:
+            Gauge: ゲージ
+        """
+        return self.metrics.setdefault(name, Gauge(name, documentation))
+
+    def histogram(self, name: str, documentation: str, buckets: tuple[float, ...] = LATENCY_BUCKETS) -> Histogram:
+        """
+        Get the histogram, registering it on first use.
+
+        Args:
+            name (str): メトリクス名
+            documentation (str): メトリクスの説明
+            buckets (tuple[float, ...]): バケットの上限値の昇順タプル. Defaults to LATENCY_BUCKETS.
+
+        Returns:
+            Histogram: ヒストグラム
+        """
+        return self.metrics.setdefault(name, Histogram(name, documentation, buckets))
+
+    def render_prometheus(self) -> str:
+        """
+        Render all metrics in the Prometheus text exposition format.
+
+        Returns:
+            str: Prometheusのテキスト形式
+        """
+        lines = []
+        for metric in self.metrics.values():
+            lines += metric.render()
+        return '\n'.join(lines) + '\n'
+
+    def summary(self) -> list[str]:
+        """
+        Summarize the histograms in a human readable form for the log.
+
+        Returns:
+            list[str]: ヒストグラムとラベルごとの件数, 平均, p50, p95の行のリスト
+        """
+        lines = []
+        for metric in self.metrics.values():
+            if not isinstance(metric, Histogram):
+                continue
+            for key, (_, total, count) in list(metric.values.items()):
+                labels = ','.join(f'{name}={value}' for name, value in key)
+                lines.append(
+                    f'{metric.name}{{{labels}}} count={count} mean={total / count:.4f} '
+                    f'p50={metric.quantile(key, 0.5):.4f} p95={metric.quantile(key, 0.95):.4f}',
+                )
+        return lines
+
+
+METRICS = MetricsRegistry()
+
+STAGE_SECONDS = METRICS.histogram(
+    'yomiage_stage_seconds',
+    'Seconds spent in each stage of the read aloud pipeline.',
+)
+FIRST_AUDIO_SECONDS = METRICS.histogram(
+    'yomiage_message_to_first_audio_seconds',
+    'Seconds from receiving a message to starting the playback of its first clip.',
+)
+SYNTHESIS_RTF = METRICS.histogram(
+    'yomiage_synthesis_real_time_factor',
+    'Synthesis seconds divided by the duration of the synthesized audio.',
+    RTF_BUCKETS,
+)
+CLIPS_TOTAL = METRICS.counter(
+    'yomiage_clips_total',
+    'Number of clips by source (cache or tts) and result.',
+)
+ERRORS_TOTAL = METRICS.counter(
+    'yomiage_errors_total',
+    'Number of failures by stage.',
+)
+SPEECH_QUEUE_DEPTH = METRICS.gauge(
+    'yomiage_speech_queue_depth',
+    'Number of utterances waiting for synthesis per guild.',
+)
+SPEECH_QUEUE_DROPPED_TOTAL = METRICS.counter(
+    'yomiage_speech_queue_dropped_total',
+    'Number of utterances dropped without synthesis by reason (overflow, stale, collapsed, cancelled).',
+)
+SPEECH_QUEUE_SHAPED_TOTAL = METRICS.counter(
+    'yomiage_speech_queue_shaped_total',
+    'Number of utterances merged into the previous one or truncated, by policy.',
+)
+STREAM_UNDERRUN_FRAMES_TOTAL = METRICS.counter(
+    'yomiage_stream_underrun_frames_total',
+    'Number of silent 20ms frames played because the streamed synthesis fell behind the playback.',
+)
+PRESYNTHESIS_TOTAL = METRICS.counter(
+    'yomiage_presynthesis_total',
+    'Number of name and join/leave clips synthesized beforehand, by result (rendered, dropped, failed, fallback).',
+)
+
+
+def observe_stage(stage: str, **labels: object) -> contextlib.AbstractContextManager[None]:
+    """
+    Observe the elapsed seconds of the stage, labelled with the guild of the current context.
+
+    Args:
+        stage (str): 計測する処理段階の名前
+        **labels (object): 追加のラベル(backendなど)
+
+    Returns:
+        contextlib.AbstractContextManager[None]: 計測するコンテキストマネージャ
+    """
+    return STAGE_SECONDS.time(stage=stage, guild=GUILD_LABEL.get(), **labels)
+
+
+async def start_metrics_server(
+    registry: MetricsRegistry = METRICS,
+    host: str = '127.0.0.1',
+    port: int = 9464,
+) -> asyncio.Server:
+    """
+    Start the HTTP endpoint which serves the metrics in the Prometheus text format.
+
+    NOTE: GETで全パスに同じ内容を返すだけの最小限のHTTPサーバ. 外部に公開しないこと.
+
+    Args:
+        registry (MetricsRegistry): 公開するメトリクス. Defaults to METRICS.
+        host (str): 待ち受けるアドレス. Defaults to '127.0.0.1'.
+        port (int): 待ち受けるポート. Defaults to 9464.
+
+    Returns:
+        asyncio.Server: 起動したサーバ
+    """
+
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            await reader.readuntil(b'\r\n\r\n')
+            body = registry.render_prometheus().encode()
+            header = (
+                'HTTP/1.1 200 OK\r\n'
+                'Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n'
+                f'Content-Length: {len(body)}\r\n'
+                'Connection: close\r\n\r\n'
+            )
+            writer.write(header.encode() + body)
+            await writer.drain()
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle, host, port)
+    bound_host, bound_port = server.sockets[0].getsockname()[:2]
+    logging.info('Serving metrics on http://%s:%s/metrics', bound_host, bound_port)
+    return server
+
+
+async def log_metrics_periodically(registry: MetricsRegistry = METRICS, interval_sec: float = 300.0) -> None:
+    """
+    Write the summary of the metrics to the log periodically.
+
+    Args:
+        registry (MetricsRegistry): 出力するメトリクス. Defaults to METRICS.
+        interval_sec (float): 出力間隔[秒]. Defaults to 300.0.
+    """
+    while True:
+        await asyncio.sleep(interval_sec)
+        for line in registry.summary():
+            logging.info('metrics: %s', line)
@@ -3,71 +3,27 @@
 The class and functions for play wav sound.
 """
 
+import io
 import logging
+import struct
 import tempfile
-import threading
 import wave
+from pathlib import Path
 
+import numpy as np  # pip install numpy
 import pyaudio as audio  # pip install pyaudio
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-
-class SoundController:
-    """
-    The class and functions for play wav sound.
-    """
-
-    def __init__(self) -> None:
-        """
-        The class and functions for play wav sound.
-        """
-        self.thread_list = []
-        self.thread_status_list = []
-
-    def append_thread(self, func: str | None, args: tuple) -> None:
-        """
-        Apeend play wav sound thread.
-
-        Args:
-            func(Callable[[str], None]): Target function.
-            args(tuple): Function arguments.
-        """
-        self.thread_list.append(threading.Thread(target=func, args=args))
-        self.thread_status_list.append('before_start')
-
-    def thread_control(self) -> None:
-        """
-        Start thread if lataset start thread is finished.
-        """
-        if self.thread_status_list == []:
-            return
-
-        for idx, status in enumerate(self.thread_status_list):
-            if idx > 0 and self.thread_status_list[idx - 1] != 'finish':
-                break
-
-            if status == 'before_start':
-                self.thread_list[idx].start()
-                self.thread_status_list[idx] = 'running'
-                break
-            elif status == 'running':  # noqa: RET508
-                # NOTE: Do not break.
-                if not self.thread_list[idx].is_alive():
-                    self.thread_status_list[idx] = 'finish'
-                    break
-
-        return
-
-    def is_finish_all_thread(self) -> bool:
-        """
-        Check all thread finished.
-        """
-        is_fin = False
-        if self.thread_status_list[-1] == 'finish':
-            is_fin = True
-
-        return is_fin
+# NOTE: discordの音声送信は48kHz, 16bit, stereoのPCMを前提としている.
+DISCORD_SAMPLE_RATE = 48000
+DISCORD_CHANNELS = 2
+TEMP_WAV_PREFIX = 'yomiagecode_'
+# NOTE: TTSが返す音声の形式と, ファイルに保存するときの拡張子.
+AUDIO_FORMAT_WAV = 'wav'
+AUDIO_FORMAT_OGG_OPUS = 'ogg_opus'
+AUDIO_FORMAT_SUFFIXES = {AUDIO_FORMAT_WAV: '.wav', AUDIO_FORMAT_OGG_OPUS: '.ogg'}
+OPUS_SAMPLE_RATE = 48000
 
 
 def generate_wav(data: bytes, file_name: str = './sound_files/audio.wav') -> str:
@@ -91,14 +47,31 @@ def generate_temp_wav(data: bytes) -> str:
     """
     Generate wav file at temporary file.
 
+    NOTE: 作成したファイルは自動では削除されないので, 使い終わったらremove_temp_wavで削除すること.
+
     Args:
         data(bytes): sound data.
     """
-    with tempfile.NamedTemporaryFile(suffix='.wav', delete=False) as wf:
+    with tempfile.NamedTemporaryFile(prefix=TEMP_WAV_PREFIX, suffix=get_audio_suffix(data), delete=False) as wf:
         wf.write(data)
         return wf.name
 
 
+def remove_temp_wav(file_name: str) -> None:
+    """
+    Remove the wav file made by generate_temp_wav.
+
+    NOTE: キャッシュなど一時ファイル以外のファイルは削除しない.
+
+    Args:
+        file_name(str): wav file name.
+    """
+    file_path = Path(file_name)
+    is_temp_wav = file_path.parent == Path(tempfile.gettempdir()) and file_path.name.startswith(TEMP_WAV_PREFIX)
+    if is_temp_wav:
+        file_path.unlink(missing_ok=True)
+
+
 def play_wav(file_name: str) -> None:
     """
     Play wav file.
@@ -120,3 +93,433 @@ def play_wav(file_name: str) -> None:
         stream.close()
         audio_obj.terminate()
     return
+
+
+def get_wav_duration(data: bytes) -> float:
+    """
+    Get the duration of wav data from its header.
+
+    Args:
+        data(bytes): wav data.
+
+    Returns:
+        float: duration in seconds.
+
+    Raises:
+        wave.Error: If the data is not a PCM wav.
+    """
+    with wave.open(io.BytesIO(data), 'rb') as wav_obj:
+        return wav_obj.getnframes() / wav_obj.getframerate()
+
+
+def repair_wav_header(data: bytes) -> bytes:
+    """
+    Rewrite the RIFF and data chunk sizes of wav data to match its length.
+
+    NOTE: 合成しながら返すwavは長さが決まる前にヘッダを送るので, サイズが0や最大値になっている.
+          そのまま保存すると長さ0の音声として読まれるので, 連結し終えた後に書き直す.
+
+    Args:
+        data(bytes): wav data whose data chunk is the last chunk.
+
+    Returns:
+        bytes: wav data with the sizes rewritten. Data other than wav is returned as it is.
+    """
+    if detect_audio_format(data) != AUDIO_FORMAT_WAV:
+        return data
+
+    offset = 12
+    while len(data) >= offset + 8:
+        chunk_id, chunk_size = struct.unpack_from('<4sI', data, offset)
+        if chunk_id == b'data':
+            repaired = bytearray(data)
+            struct.pack_into('<I', repaired, 4, len(data) - 8)
+            struct.pack_into('<I', repaired, offset + 4, len(data) - offset - 8)
+            return bytes(repaired)
+        # NOTE: RIFFのチャンクは2バイト境界に揃えられる.
+        offset += 8 + chunk_size + chunk_size % 2
+    return data
+
+
+def detect_audio_format(data: bytes) -> str | None:
+    """
+    Detect the format of the sound data from its magic bytes.
+
+    Args:
+        data(bytes): sound data.
+
+    Returns:
+        str | None: AUDIO_FORMAT_WAV or AUDIO_FORMAT_OGG_OPUS. None if unknown.
+    """
+    if data[:4] == b'RIFF' and data[8:12] == b'WAVE':
+        return AUDIO_FORMAT_WAV
+    if data[:4] == b'OggS' and b'OpusHead' in data[:128]:
+        return AUDIO_FORMAT_OGG_OPUS
+    return None
+
+
+def get_audio_suffix(data: bytes) -> str:
+    """
+    Get the file suffix for the sound data.
+
+    Args:
+        data(bytes): sound data.
+
+    Returns:
+        str: '.wav' or '.ogg'. Unknown formats are saved as '.wav' and played by FFmpeg.
+    """
+    return AUDIO_FORMAT_SUFFIXES.get(detect_audio_format(data), '.wav')
+
+
+def get_ogg_opus_duration(data: bytes) -> float:
+    """
+    Get the duration of Ogg/Opus data from the granule position of the last page.
+
+    Args:
+        data(bytes): Ogg/Opus data.
+
+    Returns:
+        float: duration in seconds.
+
+    Raises:
+        ValueError: If the data is not Ogg/Opus.
+    """
+    head_index = data.find(b'OpusHead')
+    last_page_index = data.rfind(b'OggS')
+    if head_index < 0 or last_page_index < 0 or len(data) < last_page_index + 14:
+        raise_message = 'The data is not Ogg/Opus'
+        raise ValueError(raise_message)
+
+    # NOTE: granule positionは48kHzでのサンプル数. 先頭のpre-skip分は再生されない.
+    (granule_position,) = struct.unpack_from('<q', data, last_page_index + 6)
+    (pre_skip,) = struct.unpack_from('<H', data, head_index + 10)
+    return max(granule_position - pre_skip, 0) / OPUS_SAMPLE_RATE
+
+
+def get_opus_packet_samples(packet: bytes) -> int:
+    """
+    Get the number of 48kHz samples in the Opus packet from its TOC byte (RFC 6716 3.1).
+
+    Args:
+        packet(bytes): Opus packet.
+
+    Returns:
+        int: samples per channel at 48kHz. 0 if the packet is empty or malformed.
+    """
+    if len(packet) == 0:
+        return 0
+
+    config = packet[0] >> 3
+    if config < 12:  # noqa: PLR2004
+        # NOTE: SILK. 10, 20, 40, 60ms
+        frame_samples = (480, 960, 1920, 2880)[config % 4]
+    elif config < 16:  # noqa: PLR2004
+        # NOTE: Hybrid. 10, 20ms
+        frame_samples = (480, 960)[config % 2]
+    else:
+        # NOTE: CELT. 2.5, 5, 10, 20ms
+        frame_samples = (120, 240, 480, 960)[config % 4]
+
+    code = packet[0] & 0x03
+    if code == 0:
+        frame_count = 1
+    elif code in {1, 2}:
+        frame_count = 2
+    elif len(packet) >= 2:  # noqa: PLR2004
+        frame_count = packet[1] & 0x3F
+    else:
+        return 0
+    return frame_samples * frame_count
+
+
+def get_audio_duration(data: bytes) -> float:
+    """
+    Get the duration of wav or Ogg/Opus data.
+
+    Args:
+        data(bytes): sound data.
+
+    Returns:
+        float: duration in seconds.
+
+    Raises:
+        wave.Error: If the data is neither a PCM wav nor Ogg/Opus.
+    """
+    if detect_audio_format(data) == AUDIO_FORMAT_OGG_OPUS:
+        return get_ogg_opus_duration(data)
+    return get_wav_duration(data)
+
+
+def decode_wav(data: bytes) -> tuple[np.ndarray, int]:
+    """
+    Decode wav data to float samples.
+
+    Args:
+        data(bytes): wav data.
+
+    Returns:
+        tuple[np.ndarray, int]: samples shaped (frames, channels) in [-1.0, 1.0] and the sample rate.
+
+    Raises:
+        wave.Error: If the data is not a PCM wav with 8, 16 or 32 bit samples.
+    """
+    with wave.open(io.BytesIO(data), 'rb') as wav_obj:
+        channels = wav_obj.getnchannels()
+        sample_width = wav_obj.getsampwidth()
+        frame_rate = wav_obj.getframerate()
+        frames = wav_obj.readframes(wav_obj.getnframes())
+
+    if sample_width == 1:
+        # NOTE: 8bitのwavは符号なし.
+        samples = (np.frombuffer(frames, dtype=np.uint8).astype(np.float32) - 128.0) / 128.0
+    elif sample_width == 2:  # noqa: PLR2004
+        samples = np.frombuffer(frames, dtype='<i2').astype(np.float32) / 32768.0
+    elif sample_width == 4:  # noqa: PLR2004
+        samples = np.frombuffer(frames, dtype='<i4').astype(np.float32) / 2147483648.0
+    else:
+        raise_message = f'Unsupported sample width: {sample_width}'
+        raise wave.Error(raise_message)
+
+    return samples.reshape(-1, channels), frame_rate
+
+
+def apply_fade(samples: np.ndarray, frame_rate: int, fade_len: float) -> np.ndarray:
+    """
+    Apply linear fade-in and fade-out ramps.
+
+    Args:
+        samples(np.ndarray): samples shaped (frames, channels).
+        frame_rate(int): sample rate.
+        fade_len(float): fade length in seconds.
+
+    Returns:
+        np.ndarray: faded samples.
+    """
+    fade_frames = min(int(fade_len * frame_rate), len(samples))
+    if fade_frames <= 0:
+        return samples
+
+    gain = np.ones(len(samples), dtype=np.float32)
+    ramp = np.linspace(0.0, 1.0, fade_frames, dtype=np.float32)
+    gain[:fade_frames] *= ramp
+    gain[len(samples) - fade_frames :] *= ramp[::-1]
+    return samples * gain[:, np.newaxis]
+
+
+def resample(samples: np.ndarray, frame_rate: int, target_rate: int = DISCORD_SAMPLE_RATE) -> np.ndarray:
+    """
+    Resample by linear interpolation.
+
+    Args:
+        samples(np.ndarray): samples shaped (frames, channels).
+        frame_rate(int): sample rate of the samples.
+        target_rate(int, optional): sample rate after resampling. Defaults to 48000.
+
+    Returns:
+        np.ndarray: resampled samples.
+    """
+    if frame_rate == target_rate or len(samples) == 0:
+        return samples
+
+    target_frames = int(len(samples) * target_rate / frame_rate)
+    src_pos = np.arange(len(samples), dtype=np.float64)
+    dst_pos = np.arange(target_frames, dtype=np.float64) * (frame_rate / target_rate)
+    return np.stack([np.interp(dst_pos, src_pos, samples[:, ch]) for ch in range(samples.shape[1])], axis=1)
+
+
+def to_discord_pcm(samples: np.ndarray) -> bytes:
+    """
+    Convert float samples at 48kHz to 16bit stereo PCM for discord.
+
+    Args:
+        samples(np.ndarray): samples shaped (frames, channels) at 48kHz.
+
+    Returns:
+        bytes: 16bit little endian stereo PCM.
+    """
+    if samples.shape[1] == 1:
+        samples = np.repeat(samples, DISCORD_CHANNELS, axis=1)
+    elif samples.shape[1] > DISCORD_CHANNELS:
+        samples = samples[:, :DISCORD_CHANNELS]
+
+    pcm = np.clip(samples * 32767.0, -32768.0, 32767.0).astype('<i2')
+    return pcm.tobytes()
+
+
+def prepare_discord_pcm(data: bytes, fade_len: float) -> bytes:
+    """
+    Convert wav data to faded 48kHz 16bit stereo PCM for discord.
+
+    Args:
+        data(bytes): wav data.
+        fade_len(float): fade length in seconds.
+
+    Returns:
+        bytes: 16bit little endian stereo PCM.
+
+    Raises:
+        wave.Error: If the data is not a supported PCM wav.
+    """
+    samples, frame_rate = decode_wav(data)
+    samples = apply_fade(samples, frame_rate, fade_len)
+    samples = resample(samples, frame_rate)
+    return to_discord_pcm(samples)
+
+
+class WavStreamConverter:
+    """
+    Convert wav data arriving in chunks to faded 48kHz 16bit stereo PCM for discord.
+
+    The header is parsed from the first chunks and its data size is ignored, so streams whose length is
+    unknown until the end can be converted. Resampling keeps its position across chunk boundaries,
+    and the last `fade_len` seconds are held back until finish() to apply the fade-out.
+    """
+
+    def __init__(self, fade_len: float) -> None:
+        """
+        Initialize the converter.
+
+        Args:
+            fade_len(float): fade length in seconds.
+        """
+        self.fade_frames = int(fade_len * DISCORD_SAMPLE_RATE)
+        self.channels = 0
+        self.sample_width = 0
+        self.frame_rate = 0
+        self._pending = b''
+        self._is_header_parsed = False
+        # NOTE: 前のチャンクの最後のサンプルと, それを0とした次の出力サンプルの位置. チャンク境界で補間を繋ぐ.
+        self._previous: np.ndarray | None = None
+        self._position = 0.0
+        self._output_frames = 0
+        self._tail = np.zeros((0, DISCORD_CHANNELS), dtype=np.float32)
+
+    def feed(self, chunk: bytes) -> bytes:
+        """
+        Convert the next chunk.
+
+        Args:
+            chunk(bytes): the next chunk of the wav data.
+
+        Returns:
+            bytes: 16bit little endian stereo PCM converted so far. Empty until the header is complete.
+
+        Raises:
+            wave.Error: If the data is not a supported PCM wav.
+        """
+        self._pending += chunk
+        if not self._is_header_parsed and not self._parse_header():
+            return b''
+
+        frame_bytes = self.channels * self.sample_width
+        usable_bytes = len(self._pending) - len(self._pending) % frame_bytes
+        frames, self._pending = self._pending[:usable_bytes], self._pending[usable_bytes:]
+        if len(frames) == 0:
+            return b''
+
+        samples = self._resample(self._decode(frames))
+        return to_discord_pcm(self._fade(samples))
+
+    def finish(self) -> bytes:
+        """
+        Flush the held back samples with the fade-out.
+
+        Returns:
+            bytes: 16bit little endian stereo PCM of the rest.
+        """
+        tail, self._tail = self._tail, np.zeros((0, DISCORD_CHANNELS), dtype=np.float32)
+        if len(tail) == 0:
+            return b''
+
+        ramp = np.linspace(1.0, 0.0, len(tail), dtype=np.float32)
+        return to_discord_pcm(tail * ramp[:, np.newaxis])
+
+    def _parse_header(self) -> bool:
+        """
+        Parse the RIFF header and the fmt chunk until the data chunk starts.
+
+        Returns:
+            bool: dataチャンクの先頭まで読めたか
+
+        Raises:
+            wave.Error: If the data is not a supported PCM wav.
+        """
+        if len(self._pending) < 12:  # noqa: PLR2004
+            return False
+        if self._pending[:4] != b'RIFF' or self._pending[8:12] != b'WAVE':
+            raise_message = 'The stream is not a wav'
+            raise wave.Error(raise_message)
+
+        offset = 12
+        while len(self._pending) >= offset + 8:
+            chunk_id, chunk_size = struct.unpack_from('<4sI', self._pending, offset)
+            if chunk_id == b'data':
+                if self.frame_rate == 0:
+                    raise_message = 'The fmt chunk is missing'
+                    raise wave.Error(raise_message)
+                self._pending = self._pending[offset + 8 :]
+                self._is_header_parsed = True
+                return True
+
+            if len(self._pending) < offset + 8 + chunk_size:
+                return False
+            if chunk_id == b'fmt ':
+                audio_format, self.channels, self.frame_rate = struct.unpack_from('<HHI', self._pending, offset + 8)
+                self.sample_width = struct.unpack_from('<H', self._pending, offset + 22)[0] // 8
+                if audio_format != 1 or self.sample_width not in {1, 2, 4}:
+                    raise_message = f'Unsupported wav format: {audio_format}, {self.sample_width * 8}bit'
+                    raise wave.Error(raise_message)
+            # NOTE: RIFFのチャンクは2バイト境界に揃えられる.
+            offset += 8 + chunk_size + chunk_size % 2
+        return False
+
+    def _decode(self, frames: bytes) -> np.ndarray:
+        """
+        Decode PCM frames to float samples shaped (frames, channels).
+        """
+        if self.sample_width == 1:
+            samples = (np.frombuffer(frames, dtype=np.uint8).astype(np.float32) - 128.0) / 128.0
+        elif self.sample_width == 2:  # noqa: PLR2004
+            samples = np.frombuffer(frames, dtype='<i2').astype(np.float32) / 32768.0
+        else:
+            samples = np.frombuffer(frames, dtype='<i4').astype(np.float32) / 2147483648.0
+        return samples.reshape(-1, self.channels)
+
+    def _resample(self, samples: np.ndarray) -> np.ndarray:
+        """
+        Resample the chunk to 48kHz by linear interpolation continued from the previous chunk.
+        """
+        if self.frame_rate == DISCORD_SAMPLE_RATE:
+            return samples
+
+        source = samples if self._previous is None else np.concatenate([self._previous, samples])
+        step = self.frame_rate / DISCORD_SAMPLE_RATE
+        last_index = len(source) - 1
+        output_count = int((last_index - self._position) / step) + 1 if last_index >= self._position else 0
+        dst_pos = self._position + np.arange(output_count, dtype=np.float64) * step
+        src_pos = np.arange(len(source), dtype=np.float64)
+        resampled = np.stack([np.interp(dst_pos, src_pos, source[:, ch]) for ch in range(source.shape[1])], axis=1)
+
+        self._position += output_count * step - last_index
+        self._previous = source[-1:]
+        return resampled.astype(np.float32)
+
+    def _fade(self, samples: np.ndarray) -> np.ndarray:
+        """
+        Apply the fade-in and hold back the last samples for the fade-out.
+        """
+        if samples.shape[1] == 1:
+            samples = np.repeat(samples, DISCORD_CHANNELS, axis=1)
+        elif samples.shape[1] > DISCORD_CHANNELS:
+            samples = samples[:, :DISCORD_CHANNELS]
+
+        if self._output_frames < self.fade_frames:
+            positions = self._output_frames + np.arange(len(samples), dtype=np.float32)
+            gain = np.minimum(positions / self.fade_frames, 1.0)
+            samples = samples * gain[:, np.newaxis]
+        self._output_frames += len(samples)
+
+        samples = np.concatenate([self._tail, samples])
+        release_count = max(len(samples) - self.fade_frames, 0)
+        self._tail = samples[release_count:]
+        return samples[:release_count]
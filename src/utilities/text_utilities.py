@@ -3,7 +3,18 @@
 The class definition for check some marks in the text.
 """
 
+import json
+import logging
 import re
+from collections import deque
+from collections.abc import Iterable, Iterator
+from pathlib import Path
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+URL_PATTERN = re.compile(r'https?://\S+')
+# NOTE: 合成をまとめる時に, 改行や文末で切れていた区間の間に入れる読点.
+PAUSE_TEXT = '、'
 
 
 class WordMarks:
@@ -23,8 +34,59 @@ class WordMarks:
         self.new_line_marks = ['\n', '\r']
         self.space_marks = [' ', '　']
         # NOTE: Japanese sentence, so use Full-width letter.
+
+        # NOTE: 1文字ずつリストを線形探索しないように, 文字から種類を引く表と正規表現を一度だけ作る.
+        self.letter_kinds = {}
+        for kind, marks in (
+            ('punctuation', self.punctuation_marks),
+            ('exclamation', self.exclamation_marks),
+            ('question', self.question_marks),
+            ('new_line', self.new_line_marks),
+            ('space', self.space_marks),
+        ):
+            self.letter_kinds.update(dict.fromkeys(marks, kind))
+
+        split_marks = re.escape(''.join(self.letter_kinds))
+        # NOTE: 区切り文字以外の並びと, それに続く区切り文字の並びを1区間とする.
+        #       URLは区切り文字を含んでも1つの塊とみなす.
+        self.segment_pattern = re.compile(rf'((?:{URL_PATTERN.pattern}|[^{split_marks}h]+|h)*)([{split_marks}]*)')
+        self.new_line_table = str.maketrans('', '', ''.join(self.new_line_marks))
         return
 
+    def iter_segments(
+        self,
+        text: str,
+        alternative_text: str | None = None,
+        *,
+        keep_new_line: bool = False,
+    ) -> Iterator[tuple[str, str]]:
+        """
+        Split the input text lazily in one linear pass.
+
+        A segment is a run of non-mark letters followed by a run of split marks.
+        A URL is kept in one segment even if it includes split marks.
+
+        Args:
+            text (str): The input text to be split.
+            alternative_text (str | None): URLを置き換える代替テキスト. Noneの場合は置き換えない.
+            keep_new_line (bool): 改行を区間に残すか. Defaults to False.
+
+        Yields:
+            tuple[str, str]: The segment and the kind of its trailing split mark.
+                ('punctuation', 'exclamation', 'question', 'new_line', 'space', or 'end' if no mark)
+        """
+        for match in self.segment_pattern.finditer(text):
+            body, marks = match.groups()
+            if alternative_text is not None and '://' in body:
+                body = URL_PATTERN.sub(lambda _: alternative_text, body)
+
+            segment = body + marks
+            if not keep_new_line:
+                segment = segment.translate(self.new_line_table)
+
+            if len(segment) > 0:
+                yield segment, self.letter_kinds[marks[0]] if len(marks) > 0 else 'end'
+
     def split_text(self, text: str) -> list[str]:
         """
         Split the input text based on punctuation and new line marks.
@@ -35,24 +97,7 @@ class WordMarks:
         Returns:
             List[str]: A list of split text segments.
         """
-        is_append = False
-        split_text = []
-        txt = ''
-        for letter in text:
-            is_sp, _, _, _, _ = self.check_letter(letter)
-            if not is_sp and is_append and len(txt) > 0:
-                split_text.append(txt)
-                txt = ''
-                is_append = False
-
-            txt = txt + letter
-            if is_sp:
-                is_append = True
-
-        if len(txt) > 0:
-            split_text.append(txt)
-
-        return split_text
+        return [segment for segment, _ in self.iter_segments(text, keep_new_line=True)]
 
     def split_text_for_voice(self, text: str) -> list[str]:
         """
@@ -64,46 +109,267 @@ class WordMarks:
         Returns:
             List[str]: A list of split text segments suitable for voice processing.
         """
-        is_append = False
-        split_text = []
-        txt = ''
-        for letter in text:
-            is_sp, _, _, _, is_n = self.check_letter(letter)
-            if not is_sp and is_append and len(txt) > 0:
-                split_text.append(txt)
-                txt = ''
-                is_append = False
+        return [segment for segment, _ in self.iter_segments(text)]
+
+    def check_letter(self, letter: str) -> tuple[bool, bool, bool, bool, bool, bool]:
+        """
+        Check the type of the input letter.
 
-            if not is_n:
-                txt = txt + letter
+        Args:
+            letter (str): The input letter to be checked.
 
-            if is_sp:
-                is_append = True
+        Returns:
+            Tuple[bool, bool, bool, bool, bool, bool]: A tuple containing boolean values indicating
+            if the letter is a split mark, punctuation, exclamation, question, new line, or space mark.
+        """
+        kind = self.letter_kinds.get(letter)
+        is_p = kind == 'punctuation'
+        is_e = kind == 'exclamation'
+        is_q = kind == 'question'
+        is_n = kind == 'new_line'
+        is_s = kind == 'space'
+        is_sp = kind is not None
 
-        if len(txt) > 0:
-            split_text.append(txt)
+        return is_sp, is_p, is_e, is_q, is_n, is_s
+
+
+class AdaptiveChunker:
+    """
+    Pack the segments of WordMarks into the synthesis requests, to start the audio fast with few requests.
+
+    The first chunk is the first segment, cut at `first_max_chars`, so the audio starts as soon as possible.
+    Each following chunk is grown to the size whose synthesis is estimated to finish while the previous
+    chunk is playing, up to `target_duration_sec` of audio. The playback time is estimated from the
+    character count and SPEED_SCALE, and the synthesis time is a linear model of the character count
+    calibrated from the observed synthesis times. A segment longer than the limit is cut at the boundary
+    of the letter types (ex. after a particle), or at the limit if there is none.
+    """
 
-        return split_text
+    def __init__(  # noqa: PLR0913
+        self,
+        *,
+        first_max_chars: int = 20,
+        max_chars: int = 120,
+        target_duration_sec: float = 8.0,
+        chars_per_sec: float = 6.0,
+        overhead_sec: float = 0.3,
+        sec_per_char: float = 0.02,
+        smoothing: float = 0.1,
+    ) -> None:
+        """
+        Initialize the chunker with the prior of the synthesis time.
 
-    def check_letter(self, letter: str) -> tuple[bool, bool, bool, bool, bool]:
+        Args:
+            first_max_chars (int): 最初のチャンクの最大文字数. Defaults to 20.
+            max_chars (int): 1回の合成の最大文字数. Defaults to 120.
+            target_duration_sec (float): 2つ目以降のチャンクの目標の音声の長さ[秒]. Defaults to 8.0.
+            chars_per_sec (float): 話速1.0で1秒に読み上げる文字数. Defaults to 6.0.
+            overhead_sec (float): 文字数によらない1回の合成の時間の初期値[秒]. Defaults to 0.3.
+            sec_per_char (float): 1文字あたりの合成時間の初期値[秒]. Defaults to 0.02.
+            smoothing (float): 観測した合成時間を反映する割合(指数移動平均の係数). Defaults to 0.1.
+
+        Raises:
+            ValueError: If the limits of the characters are not positive, or max_chars < first_max_chars.
         """
-        Check the type of the input letter.
+        if first_max_chars <= 0 or max_chars < first_max_chars:
+            raise_message = f'Invalid chunk limits: first_max_chars={first_max_chars}, max_chars={max_chars}'
+            raise ValueError(raise_message)
+
+        self.first_max_chars = first_max_chars
+        self.max_chars = max_chars
+        self.target_duration_sec = target_duration_sec
+        self.chars_per_sec = chars_per_sec
+        self.smoothing = smoothing
+        # NOTE: 合成時間 = overhead + sec_per_char * 文字数 を指数移動平均の回帰で推定する.
+        #       初期値は, 初期値の直線上にある分散を持った仮の観測として置き, 観測が増えると置き換わる.
+        self._mean_chars = float(first_max_chars)
+        self._mean_sec = overhead_sec + sec_per_char * first_max_chars
+        self._var_chars = float(first_max_chars**2)
+        self._cov = sec_per_char * self._var_chars
+
+    @classmethod
+    def from_configs(cls, chunker_configs: dict) -> 'AdaptiveChunker':
+        """
+        Make the chunker from TTS.CHUNKER of the configs.
 
         Args:
-            letter (str): The input letter to be checked.
+            chunker_configs (dict): チャンカーのconfig辞書
 
         Returns:
-            Tuple[bool, bool, bool, bool, bool]: A tuple containing boolean values indicating
-            if the letter is a split mark, punctuation, exclamation, question, or new line mark.
+            AdaptiveChunker: チャンカー
+        """
+        return cls(
+            first_max_chars=chunker_configs.get('FIRST_MAX_CHARS', 20),
+            max_chars=chunker_configs.get('MAX_CHARS', 120),
+            target_duration_sec=chunker_configs.get('TARGET_DURATION_SEC', 8.0),
+            chars_per_sec=chunker_configs.get('CHARS_PER_SEC', 6.0),
+            overhead_sec=chunker_configs.get('OVERHEAD_SEC', 0.3),
+            sec_per_char=chunker_configs.get('SEC_PER_CHAR', 0.02),
+            smoothing=chunker_configs.get('SMOOTHING', 0.1),
+        )
+
+    @property
+    def sec_per_char(self) -> float:
         """
-        is_p = letter in self.punctuation_marks
-        is_e = letter in self.exclamation_marks
-        is_q = letter in self.question_marks
-        is_n = letter in self.new_line_marks
-        is_s = letter in self.space_marks
-        is_sp = is_p or is_e or is_q or is_n or is_s
+        The estimated synthesis time per character.
+        """
+        return max(self._cov / self._var_chars, 0.0) if self._var_chars > 0 else 0.0
 
-        return is_sp, is_p, is_e, is_q, is_n, is_s
+    @property
+    def overhead_sec(self) -> float:
+        """
+        The estimated synthesis time of a request which does not depend on the characters.
+        """
+        return max(self._mean_sec - self.sec_per_char * self._mean_chars, 0.0)
+
+    def observe(self, char_count: int, synthesis_sec: float) -> None:
+        """
+        Calibrate the synthesis time model by an observed synthesis.
+
+        Args:
+            char_count (int): 合成した文字数
+            synthesis_sec (float): 合成に掛かった時間[秒]
+        """
+        alpha = self.smoothing
+        delta_chars = char_count - self._mean_chars
+        delta_sec = synthesis_sec - self._mean_sec
+        self._mean_chars += alpha * delta_chars
+        self._mean_sec += alpha * delta_sec
+        self._var_chars = (1 - alpha) * (self._var_chars + alpha * delta_chars * delta_chars)
+        self._cov = (1 - alpha) * (self._cov + alpha * delta_chars * delta_sec)
+
+    def estimate_synthesis_sec(self, char_count: int) -> float:
+        """
+        Estimate the synthesis time of the text.
+
+        Args:
+            char_count (int): 文字数
+
+        Returns:
+            float: 合成時間[秒]
+        """
+        return self.overhead_sec + self.sec_per_char * char_count
+
+    def estimate_duration_sec(self, char_count: int, speed_scale: float = 1.0) -> float:
+        """
+        Estimate the playback time of the text.
+
+        Args:
+            char_count (int): 文字数
+            speed_scale (float): 話速. Defaults to 1.0.
+
+        Returns:
+            float: 音声の長さ[秒]
+        """
+        return char_count / (self.chars_per_sec * speed_scale)
+
+    def chunk_segments(self, segments: Iterable[tuple[str, str]], speed_scale: float = 1.0) -> list[str]:
+        """
+        Pack the segments into the texts of the synthesis requests.
+
+        Args:
+            segments (Iterable[tuple[str, str]]): WordMarks.iter_segmentsの区間と区切り文字の種類
+            speed_scale (float): 話速. Defaults to 1.0.
+
+        Returns:
+            list[str]: 1回ずつ合成する文章
+        """
+        chunks = []
+        texts = []
+        chunk_chars = 0
+        max_chars = self.first_max_chars
+        previous_kind = None
+        for segment, kind in segments:
+            rest = segment
+            while len(rest) > 0:
+                # NOTE: 最初のチャンクは最初の区間だけにする. 以降は入りきらない区間の前でチャンクを閉じる.
+                if len(texts) > 0 and (len(chunks) == 0 or chunk_chars + len(rest) > max_chars):
+                    chunks.append(''.join(texts))
+                    max_chars = self._next_max_chars(chunk_chars, speed_scale)
+                    texts = []
+                    chunk_chars = 0
+                if len(texts) > 0 and previous_kind in ('end', 'new_line'):
+                    texts.append(PAUSE_TEXT)
+
+                # NOTE: 1つで上限を超える区間は, 文字種の境目で切って残りを次のチャンクに回す.
+                head_length = len(rest) if len(rest) <= max_chars else _find_letter_boundary(rest, max_chars)
+                texts.append(rest[:head_length])
+                chunk_chars += head_length
+                previous_kind = kind if head_length == len(rest) else 'cut'
+                rest = rest[head_length:]
+
+        if len(texts) > 0:
+            chunks.append(''.join(texts))
+        return chunks
+
+    def _next_max_chars(self, previous_chars: int, speed_scale: float) -> int:
+        """
+        Decide the size of the next chunk from the size of the previous one.
+
+        Args:
+            previous_chars (int): 直前のチャンクの文字数
+            speed_scale (float): 話速
+
+        Returns:
+            int: 次のチャンクの最大文字数
+        """
+        target_chars = min(self.target_duration_sec * self.chars_per_sec * speed_scale, self.max_chars)
+        if self.sec_per_char * self.chars_per_sec * speed_scale >= 1.0:
+            # NOTE: 合成が再生より遅い場合は, 小さく分けても途切れは減らないので, 要求の数を減らす.
+            return max(int(target_chars), self.first_max_chars)
+
+        # NOTE: 直前のチャンクを再生している間に合成し終わる長さまで大きくする.
+        hidden_sec = self.estimate_duration_sec(previous_chars, speed_scale) - self.overhead_sec
+        hidden_chars = hidden_sec / self.sec_per_char if self.sec_per_char > 0 else target_chars
+        return max(int(min(hidden_chars, target_chars)), self.first_max_chars)
+
+
+def _find_letter_boundary(text: str, limit: int) -> int:
+    """
+    Find the position to cut the text without a split mark, at most the limit.
+
+    NOTE: 上限の後半でひらがなから他の文字種に変わる位置(助詞や送り仮名の後)を優先し, 無ければ上限に最も近い
+          文字種が変わる位置, それも無ければ上限の位置で切る. 英数字の単語は途中で切らないようにする.
+
+    Args:
+        text (str): 切る文章
+        limit (int): 切った前半の最大文字数
+
+    Returns:
+        int: 切る位置
+    """
+    fallback = None
+    for position in range(limit, 0, -1):
+        left = _letter_type(text[position - 1])
+        right = _letter_type(text[position])
+        if left == right:
+            continue
+        if left == 'hiragana' and position > limit // 2:
+            return position
+        if fallback is None:
+            fallback = position
+    return fallback if fallback is not None else limit
+
+
+def _letter_type(letter: str) -> str:
+    """
+    Classify the letter to find the boundary of the words in the text without spaces.
+
+    Args:
+        letter (str): 1文字
+
+    Returns:
+        str: 'hiragana', 'katakana', 'kanji', 'alnum'または'other'
+    """
+    if 'ぁ' <= letter <= 'ゟ':
+        return 'hiragana'
+    if 'ァ' <= letter <= 'ヿ':
+        return 'katakana'
+    if '一' <= letter <= '鿿' or letter == '々':
+        return 'kanji'
+    if letter.isalnum():
+        return 'alnum'
+    return 'other'
 
 
 class URLcontroller:
@@ -117,8 +383,7 @@ class URLcontroller:
 
         NOTE: RUF001 was ignored, assuming it may contain similar characters in Unicode.
         """
-        self.url_pattern = 'http[s]?://\S+'  # noqa: W605
-        # NOTE: 正規表現を記載しておりこれをprintするわけではないのでエスケープシークエンスのエラーは無視する.
+        self.url_pattern = URL_PATTERN
         return
 
     def is_including_url(self, text: str) -> bool:
@@ -131,7 +396,7 @@ class URLcontroller:
         Returns:
             bool: URLを文章に含むか判定
         """
-        return len(re.findall(self.url_pattern, text)) > 0
+        return self.url_pattern.search(text) is not None
 
     def url2alternative_text(self, text: str, alternative_text: str = 'URL') -> str:
         """
@@ -145,9 +410,280 @@ class URLcontroller:
         Returns:
             str: URL部分を代替テキストに変換した文章
         """
-        url_list = re.findall(self.url_pattern, text)
+        return self.url_pattern.sub(lambda _: alternative_text, text)
+
+
+class ReadingDictionary:
+    """
+    User pronunciation dictionary which rewrites words to their readings before synthesis.
+
+    The words are matched in one pass by an Aho-Corasick automaton, so the time is linear in the length of
+    the text (plus the number of matches) however many entries the dictionary has.
+    Overlapping words are resolved leftmost-longest, and English words are matched case-insensitively.
+    Entries are added and removed at runtime by editing the trie in place; the failure links are recomputed
+    once on the next match after the edits, and only the output links when no node was added.
+
+    NOTE: スレッドセーフではない. イベントループ上から使う.
+    """
+
+    def __init__(self, dictionary_file: str | None = None) -> None:
+        """
+        Initialize the reading dictionary and load the persisted entries.
+
+        Args:
+            dictionary_file (str | None): 辞書を保存するjsonファイル. Noneの場合は保存しない.
+        """
+        self.dictionary_file = Path(dictionary_file) if dictionary_file is not None else None
+        # NOTE: 大文字小文字を畳んだ単語 -> 読み.
+        self.entries: dict[str, str] = {}
+        self._compile()
+        self.load()
+
+    @staticmethod
+    def fold(text: str) -> str:
+        """
+        Fold the case of the text, keeping its length so that match positions stay valid.
+
+        Args:
+            text (str): 畳む文章
+
+        Returns:
+            str: 小文字にした文章. 長さが変わる文字(ex. 'İ')はそのまま残す.
+        """
+        folded = text.lower()
+        if len(folded) == len(text):
+            return folded
+        return ''.join(letter.lower() if len(letter.lower()) == 1 else letter for letter in text)
+
+    def __len__(self) -> int:
+        """
+        The number of the entries.
+        """
+        return len(self.entries)
+
+    def __contains__(self, word: str) -> bool:
+        """
+        Check the word is in the dictionary.
+        """
+        return self.fold(word) in self.entries
+
+    def get(self, word: str) -> str | None:
+        """
+        Get the reading of the word.
+
+        Args:
+            word (str): 単語
+
+        Returns:
+            str | None: 読み. 登録されていない場合はNone.
+        """
+        return self.entries.get(self.fold(word))
+
+    def add(self, word: str, reading: str) -> None:
+        """
+        Add the word, or update its reading.
+
+        Args:
+            word (str): 置き換える単語
+            reading (str): 読み
+
+        Raises:
+            ValueError: If the word is empty.
+        """
+        if len(word) == 0:
+            raise_message = 'The word of the reading dictionary must not be empty'
+            raise ValueError(raise_message)
+
+        key = self.fold(word)
+        node = 0
+        for letter in key:
+            child = self._goto[node].get(letter)
+            if child is None:
+                child = self._new_node(self._depth[node] + 1)
+                self._goto[node][letter] = child
+                self._needs_fail_links = True
+            node = child
+
+        if self._readings[node] is None:
+            self._needs_output_links = True
+        self._readings[node] = reading
+        self.entries[key] = reading
+
+    def remove(self, word: str) -> bool:
+        """
+        Remove the word.
+
+        Args:
+            word (str): 削除する単語
+
+        Returns:
+            bool: 削除したか. 登録されていない場合はFalse.
+        """
+        key = self.fold(word)
+        if self.entries.pop(key, None) is None:
+            return False
+
+        node = 0
+        for letter in key:
+            node = self._goto[node][letter]
+        self._readings[node] = None
+        self._needs_output_links = True
+        # NOTE: 削除した単語の節点は残すので, 使われない節点が登録数に比べて増えすぎたら作り直す.
+        if len(self._goto) > 2 * (sum(map(len, self.entries)) + 1):
+            self._compile()
+        return True
+
+    def replace(self, text: str) -> str:
+        """
+        Rewrite the words in the text to their readings.
+
+        Args:
+            text (str): 読み上げる文章
+
+        Returns:
+            str: 単語を読みに置き換えた文章
+        """
+        if len(self.entries) == 0:
+            return text
+
+        self._link()
+        goto, fail, depth, outputs = self._goto, self._fail, self._depth, self._outputs
+        search_head = self._head_pattern.search
+        # NOTE: 開始位置 -> その位置から始まる最長の単語の(終了位置, 節点).
+        #       同じ開始位置の単語は後から見つかるほど長いので上書きする.
+        longest: dict[int, tuple[int, int]] = {}
+        folded = self.fold(text)
+        text_length = len(folded)
+        node = 0
+        end = 0
+        while end < text_length:
+            if node == 0:
+                # NOTE: 根にいる間は単語の先頭になり得る文字までCで読み飛ばす.
+                head = search_head(folded, end)
+                if head is None:
+                    break
+                end = head.start()
+            letter = folded[end]
+            end += 1
+            child = goto[node].get(letter)
+            while child is None and node != 0:
+                node = fail[node]
+                child = goto[node].get(letter)
+            node = child if child is not None else 0
+
+            match = outputs[node]
+            while match != 0:
+                longest[end - depth[match]] = (end, match)
+                match = outputs[fail[match]]
+
+        if len(longest) == 0:
+            return text
+
+        parts = []
+        cursor = 0
+        for start in sorted(longest):
+            if start < cursor:
+                continue
+            end, match = longest[start]
+            parts += [text[cursor:start], self._readings[match]]
+            cursor = end
+        parts.append(text[cursor:])
+        return ''.join(parts)
+
+    def load(self) -> None:
+        """
+        Load the persisted entries from the dictionary file.
+        """
+        if self.dictionary_file is None or not self.dictionary_file.exists():
+            return
+
+        try:
+            with self.dictionary_file.open('r', encoding='utf-8') as f:
+                entries = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            logging.exception('Failed to load reading dictionary "%s"', self.dictionary_file)
+            return
+
+        for word, reading in entries.items():
+            if len(word) > 0:
+                self.add(word, reading)
+
+    def save(self) -> None:
+        """
+        Write the entries to the dictionary file atomically.
+        """
+        if self.dictionary_file is None:
+            return
+
+        # NOTE: スレッドで保存する間に登録されても壊れないよう, 先に写しを取る.
+        entries = dict(self.entries)
+        self.dictionary_file.parent.mkdir(parents=True, exist_ok=True)
+        tmp_file = self.dictionary_file.with_suffix('.tmp')
+        with tmp_file.open('w', encoding='utf-8') as f:
+            json.dump(entries, f, ensure_ascii=False, indent=2)
+        tmp_file.replace(self.dictionary_file)
+
+    def _compile(self) -> None:
+        """
+        Build the trie of the entries from scratch.
+        """
+        # NOTE: 節点は番号で表し, 各属性を番号で引くリストに持つ. 0は根.
+        self._goto: list[dict[str, int]] = []
+        self._depth: list[int] = []
+        self._readings: list[str | None] = []
+        self._fail: list[int] = []
+        self._outputs: list[int] = []
+        self._order: list[int] = []
+        self._new_node(0)
+        self._needs_fail_links = True
+        self._needs_output_links = True
+        for word, reading in list(self.entries.items()):
+            self.add(word, reading)
+
+    def _new_node(self, depth: int) -> int:
+        """
+        Append a node to the trie.
 
-        for url in url_list:
-            text = text.replace(url, alternative_text)
+        Args:
+            depth (int): 節点の深さ(根からの文字数)
 
-        return text
+        Returns:
+            int: 追加した節点の番号
+        """
+        self._goto.append({})
+        self._depth.append(depth)
+        self._readings.append(None)
+        self._fail.append(0)
+        self._outputs.append(0)
+        return len(self._goto) - 1
+
+    def _link(self) -> None:
+        """
+        Recompute the failure and output links changed by the edits since the last match.
+        """
+        goto, fail, outputs, readings = self._goto, self._fail, self._outputs, self._readings
+        if self._needs_fail_links:
+            # NOTE: 幅優先で, 各節点の失敗遷移を「自身の最長の真の接尾辞にあたる節点」にする.
+            order = []
+            queue = deque(goto[0].values())
+            for child in queue:
+                fail[child] = 0
+            while len(queue) > 0:
+                node = queue.popleft()
+                order.append(node)
+                for letter, child in goto[node].items():
+                    state = fail[node]
+                    while letter not in goto[state] and state != 0:
+                        state = fail[state]
+                    fail[child] = goto[state].get(letter, 0)
+                    queue.append(child)
+            self._order = order
+            self._head_pattern = re.compile(f'[{re.escape("".join(goto[0]))}]')
+            self._needs_fail_links = False
+            self._needs_output_links = True
+
+        if self._needs_output_links:
+            # NOTE: 出力遷移は「自身を含む最長の登録済みの接尾辞」. 単語が無い場合は根(0).
+            for node in self._order:
+                outputs[node] = node if readings[node] is not None else outputs[fail[node]]
+            self._needs_output_links = False
@@ -3,14 +3,23 @@
 discord bot用のクラス及び関数を定義したファイル.
 """
 
-import time
+import asyncio
+import io
+import logging
+import threading
+import wave
+from collections.abc import AsyncIterator
+from pathlib import Path
 from typing import Any
 
 import discord
 import ffmpeg
 
+import utilities.metrics_utilities as metutl
 import utilities.sound_utilities as sndutl
 
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
 
 async def send_message(channel: discord.TextChannel, send_text: str) -> None:
     """
@@ -35,61 +44,322 @@ async def reply_massage(message: discord.Message, reply_text: str) -> None:
     await message.channel.send(reply)
 
 
-def play_sound(guild: discord.Guild, file_name: str, configs: dict[str, Any]) -> None:
+class PcmAudioSource(discord.AudioSource):
+    """
+    The audio source of in-process prepared 48kHz 16bit stereo PCM.
+    """
+
+    def __init__(self, pcm: bytes) -> None:
+        """
+        Initialize the audio source.
+
+        Args:
+            pcm (bytes): 48kHz 16bit stereo PCM.
+        """
+        self.pcm = memoryview(pcm)
+        self.position = 0
+
+    def read(self) -> bytes:
+        """
+        Read 20ms of PCM. The last frame is padded with silence.
+
+        Returns:
+            bytes: 20ms of PCM, or empty bytes at the end.
+        """
+        frame = self.pcm[self.position : self.position + discord.opus.Encoder.FRAME_SIZE]
+        self.position += discord.opus.Encoder.FRAME_SIZE
+        if len(frame) == 0:
+            return b''
+
+        return bytes(frame).ljust(discord.opus.Encoder.FRAME_SIZE, b'\x00')
+
+    def is_opus(self) -> bool:
+        """
+        Check the source is opus encoded.
+
+        Returns:
+            bool: PCMなので常にFalse
+        """
+        return False
+
+
+class StreamingPcmAudioSource(discord.AudioSource):
+    """
+    The audio source of 48kHz 16bit stereo PCM which is still being synthesized.
+
+    The jitter buffer is filled on the event loop: await wait_ready() before the voice client plays the source.
+    read() is called by the audio thread every 20ms and never blocks. If the stream falls behind, it returns
+    a silent frame and counts the underrun, so that the player keeps its pace instead of bursting frames later.
+    """
+
+    def __init__(self, jitter_buffer_sec: float = 0.2, underrun_timeout: float = 5.0) -> None:
+        """
+        Initialize the audio source.
+
+        Args:
+            jitter_buffer_sec (float): 再生を始める前に溜める音声の長さ[秒]. Defaults to 0.2.
+            underrun_timeout (float): 無音で埋め続ける最大時間[秒]. 超えた場合は再生を終える. Defaults to 5.0.
+        """
+        frame_size = discord.opus.Encoder.FRAME_SIZE
+        self.jitter_buffer_bytes = max(int(jitter_buffer_sec / 0.02), 1) * frame_size
+        self.max_underrun_frames = max(int(underrun_timeout / 0.02), 1)
+        self.underrun_count = 0
+        self._consecutive_underruns = 0
+        self._buffer = bytearray()
+        self._is_finished = False
+        self._is_closed = False
+        self._lock = threading.Lock()
+        self._ready = asyncio.Event()
+
+    @property
+    def is_closed(self) -> bool:
+        """
+        Whether the voice client has stopped reading the source.
+        """
+        return self._is_closed
+
+    async def wait_ready(self) -> None:
+        """
+        Wait until the jitter buffer is filled or the stream ends.
+        """
+        await self._ready.wait()
+
+    def feed(self, pcm: bytes) -> None:
+        """
+        Append the converted PCM. Called from the event loop.
+
+        Args:
+            pcm (bytes): 48kHz 16bit stereo PCM.
+        """
+        if len(pcm) == 0:
+            return
+
+        with self._lock:
+            self._buffer += pcm
+            is_ready = len(self._buffer) >= self.jitter_buffer_bytes
+        if is_ready:
+            self._ready.set()
+
+    def finish(self) -> None:
+        """
+        Mark the end of the stream. The rest of the buffer is still played. Called from the event loop.
+        """
+        with self._lock:
+            self._is_finished = True
+        self._ready.set()
+
+    def read(self) -> bytes:
+        """
+        Read 20ms of PCM without waiting. A silent frame is returned while the stream is behind.
+
+        Returns:
+            bytes: 20ms of PCM, or empty bytes at the end.
+        """
+        frame_size = discord.opus.Encoder.FRAME_SIZE
+        with self._lock:
+            # NOTE: 途中の端数はフレームに満たないので次のチャンクを待ち, 終わった後の端数だけ無音で埋める.
+            if len(self._buffer) >= frame_size or (self._is_finished and len(self._buffer) > 0):
+                frame = bytes(self._buffer[:frame_size])
+                del self._buffer[:frame_size]
+                self._consecutive_underruns = 0
+                return frame.ljust(frame_size, b'\x00')
+
+            if self._is_finished or self._is_closed:
+                return b''
+
+            self.underrun_count += 1
+            self._consecutive_underruns += 1
+            if self._consecutive_underruns > self.max_underrun_frames:
+                # NOTE: 合成が止まったとみなして再生を終える.
+                return b''
+
+        return bytes(frame_size)
+
+    def is_opus(self) -> bool:
+        """
+        Check the source is opus encoded.
+
+        Returns:
+            bool: PCMなので常にFalse
+        """
+        return False
+
+    def cleanup(self) -> None:
+        """
+        Mark the source as closed when the voice client stops the playback, so that feeding stops.
+        """
+        with self._lock:
+            self._is_closed = True
+
+
+async def feed_streaming_source(
+    source: StreamingPcmAudioSource,
+    chunks: AsyncIterator[bytes],
+    configs: dict[str, Any],
+) -> None:
     """
-    Play a sound file through the Discord voice client.
+    Convert the streamed wav chunks and feed them to the streaming audio source until the end.
+
+    NOTE: 合成が途中で失敗した場合は, そこまでの音声を再生して終える.
 
     Args:
-        guild (discord.Guild): The received guild object.
-        file_name (str): The path to the sound file to play.
+        source (StreamingPcmAudioSource): 音声を渡す先
+        chunks (AsyncIterator[bytes]): wavのチャンク
+        configs (dict[str, Any]): config辞書
+    """
+    converter = sndutl.WavStreamConverter(configs['FFMPEG']['FADE_LEN'])
+    try:
+        async for chunk in chunks:
+            if source.is_closed:
+                break
+            source.feed(converter.feed(chunk))
+        source.feed(converter.finish())
+    except (RuntimeError, wave.Error):
+        logging.exception('Failed to stream voice')
+        metutl.ERRORS_TOTAL.inc(stage='stream', guild=metutl.GUILD_LABEL.get())
+    finally:
+        source.finish()
+
+
+class OggOpusAudioSource(discord.AudioSource):
+    """
+    The audio source which passes through the Opus packets of Ogg/Opus data without re-encoding.
+    """
+
+    def __init__(self, packets: list[bytes]) -> None:
+        """
+        Initialize the audio source.
+
+        Args:
+            packets (list[bytes]): 20msごとのOpusパケット. OpusHeadとOpusTagsは含まない.
+        """
+        self.packets = packets
+        self.position = 0
+
+    def read(self) -> bytes:
+        """
+        Read the next 20ms Opus packet.
+
+        Returns:
+            bytes: The Opus packet, or empty bytes at the end.
+        """
+        if self.position >= len(self.packets):
+            return b''
+
+        packet = self.packets[self.position]
+        self.position += 1
+        return packet
+
+    def is_opus(self) -> bool:
+        """
+        Check the source is opus encoded.
+
+        Returns:
+            bool: Opusパケットをそのまま送るので常にTrue
+        """
+        return True
+
+
+def read_ogg_opus_packets(data: bytes) -> list[bytes] | None:
+    """
+    Read the Opus audio packets from Ogg/Opus data.
+
+    Args:
+        data (bytes): Ogg/Opus data.
+
+    Returns:
+        list[bytes] | None: The audio packets. None if a packet is not 20ms,
+            because the voice client sends one packet every 20ms.
+
+    Raises:
+        discord.oggparse.OggError: If the data is not Ogg.
+    """
+    packets = []
+    for packet in discord.oggparse.OggStream(io.BytesIO(data)).iter_packets():
+        if packet.startswith((b'OpusHead', b'OpusTags')):
+            continue
+        if sndutl.get_opus_packet_samples(packet) != discord.opus.Encoder.SAMPLES_PER_FRAME:
+            return None
+        packets.append(packet)
+    return packets
+
+
+def make_audio_source(clip: bytes | str, configs: dict[str, Any]) -> discord.AudioSource:
+    """
+    Make an audio source of the sound data or file with fade-in/out for the Discord voice client.
+
+    NOTE: wavはプロセス内でデコードする. Ogg/Opusはパケットを再エンコードせずそのまま送るので,
+          フェードは掛けない. デコードできない形式の場合のみFFmpegを使う.
+
+    Args:
+        clip (bytes | str): The sound data, or the path to the sound file to play.
         configs(dict[str, Any]): config辞書
+
+    Returns:
+        discord.AudioSource: The audio source to pass to the voice client.
     """
-    voice_client = guild.voice_client
-    video_info = ffmpeg.probe(file_name)
-    dur = float(video_info['format']['duration'])
     fade_len = configs['FFMPEG']['FADE_LEN']
+    data = clip if isinstance(clip, bytes) else Path(clip).read_bytes()
+    if sndutl.detect_audio_format(data) == sndutl.AUDIO_FORMAT_OGG_OPUS:
+        with metutl.observe_stage('ogg_demux'):
+            packets = read_ogg_opus_packets(data)
+        if packets is not None:
+            return OggOpusAudioSource(packets)
+
+        # NOTE: 20ms以外のフレームはそのまま送れないので, FFmpegでOpusに再エンコードする.
+        with metutl.observe_stage('ffmpeg_start'):
+            if isinstance(clip, bytes):
+                return discord.FFmpegOpusAudio(io.BytesIO(clip), pipe=True)
+            return discord.FFmpegOpusAudio(clip)
+
+    try:
+        with metutl.observe_stage('pcm_decode'):
+            pcm = sndutl.prepare_discord_pcm(data, fade_len)
+    except (wave.Error, EOFError):
+        if isinstance(clip, bytes):
+            return _make_ffmpeg_pipe_audio_source(clip, fade_len)
+        return _make_ffmpeg_audio_source(clip, fade_len)
+
+    return PcmAudioSource(pcm)
+
+
+def _make_ffmpeg_audio_source(file_name: str, fade_len: float) -> discord.AudioSource:
+    """
+    Make an audio source with FFmpeg for formats that can not be decoded in-process.
+
+    Args:
+        file_name (str): The path to the sound file to play.
+        fade_len (float): The fade length in seconds.
+
+    Returns:
+        discord.AudioSource: The audio source to pass to the voice client.
+    """
+    with metutl.observe_stage('ffmpeg_probe'):
+        video_info = ffmpeg.probe(file_name)
+    dur = float(video_info['format']['duration'])
     opt = f'"afade=t=in:st=0:d={fade_len},afade=t=out:st={dur - fade_len}:d={fade_len}"'
     ffmpeg_options = {
         'options': f'-vn -af {opt}',
     }
-    voice = discord.FFmpegPCMAudio(file_name, **ffmpeg_options)
-
-    while voice_client.is_playing():
-        time.sleep(0.1)
+    with metutl.observe_stage('ffmpeg_start'):
+        return discord.FFmpegPCMAudio(file_name, **ffmpeg_options)
 
-    voice_client.play(voice)
-    while voice_client.is_playing():
-        time.sleep(0.1)
 
-    voice_client.stop()
-
-
-def play_voice(
-    guild: discord.Guild,
-    sound_controller: sndutl.SoundController,
-    sound_file_name: str,
-    configs: dict[str, Any],
-) -> sndutl.SoundController:
-    # NOTE: どのTTSクライアントを受け取るかでどのクラスかが変わるのでAny.
+def _make_ffmpeg_pipe_audio_source(data: bytes, fade_len: float) -> discord.AudioSource:
     """
-    Generate and play voice for the given text buffer.
+    Make an audio source with FFmpeg reading the sound data from stdin.
+
+    NOTE: パイプ入力では長さが分からないのでフェードインのみ掛ける.
 
     Args:
-        guild (discord.Guild): The received Guild object.
-        sound_controller (sound_util.SoundController): The sound controller object.
-        sound_file_name (str): 音声ファイル名
-        configs(dict[str, Any]): config辞書
+        data (bytes): The sound data.
+        fade_len (float): The fade length in seconds.
 
     Returns:
-        sound_util.SoundController: The updated sound controller.
-    """
-    # play voice
-    # NOTE: Play audio while generating text with GPT and generating voice with VOICEVOX.
-    #       For that purpose, we implemented parallel processing using threading.
-    sound_controller.append_thread(
-        play_sound,
-        (guild, sound_file_name, configs),
-    )
-
-    sound_controller.thread_control()
-    return sound_controller
+        discord.AudioSource: The audio source to pass to the voice client.
+    """
+    ffmpeg_options = {
+        'options': f'-vn -af "afade=t=in:st=0:d={fade_len}"',
+    }
+    with metutl.observe_stage('ffmpeg_start'):
+        return discord.FFmpegPCMAudio(io.BytesIO(data), pipe=True, **ffmpeg_options)
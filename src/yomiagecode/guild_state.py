@@ -0,0 +1,298 @@
+#!/usr/bin/env python3
+"""
+discord botのギルドごとの状態(チャンネル設定, 声の設定, 再生キュー)を定義したファイル.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import copy
+import logging
+import time
+from typing import TYPE_CHECKING, Any
+
+from tts.voice_profile import compile_voice_profile
+from yomiagecode.playback_scheduler import GuildPlaybackScheduler
+
+if TYPE_CHECKING:
+    import discord
+
+    from yomiagecode.synthesis_workers import SynthesisWorkerPool
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+
+class GuildState:
+    """
+    The compact state of one guild.
+
+    The playback scheduler is created on first use, so a guild that only receives messages
+    while the bot is out of voice costs a few attributes.
+    """
+
+    __slots__ = ('guild', 'last_active', 'scheduler', 'text_channel', 'tts_configs', 'voice_channel')
+
+    def __init__(
+        self,
+        guild: discord.Guild,
+        text_channel: int | str | None,
+        voice_channel: int | str | None,
+        tts_configs: dict[str, Any],
+    ) -> None:
+        """
+        Initialize the guild state.
+
+        Args:
+            guild (discord.Guild): 対象のギルド
+            text_channel (int | str | None): 読み上げるテキストチャンネルのIDまたは名前
+            voice_channel (int | str | None): 自動で接続するボイスチャンネルのIDまたは名前
+            tts_configs (dict[str, Any]): ギルドで使うTTS用のconfig辞書
+        """
+        self.guild = guild
+        self.text_channel = text_channel
+        self.voice_channel = voice_channel
+        self.tts_configs = tts_configs
+        self.scheduler: GuildPlaybackScheduler | None = None
+        self.last_active = time.monotonic()
+
+    def is_text_channel(self, channel: discord.abc.GuildChannel) -> bool:
+        """
+        Check the channel is the text channel to read aloud.
+
+        Args:
+            channel (discord.abc.GuildChannel): 判定するチャンネル
+
+        Returns:
+            bool: 読み上げ対象のテキストチャンネルか判定
+        """
+        return _is_channel_matched(channel, self.text_channel)
+
+    def is_voice_channel(self, channel: discord.abc.GuildChannel) -> bool:
+        """
+        Check the channel is the voice channel to join automatically.
+
+        Args:
+            channel (discord.abc.GuildChannel): 判定するチャンネル
+
+        Returns:
+            bool: 自動で接続するボイスチャンネルか判定
+        """
+        return _is_channel_matched(channel, self.voice_channel)
+
+    def is_idle(self) -> bool:
+        """
+        Check there is nothing to play and the bot is not in voice.
+
+        Returns:
+            bool: 破棄してよい状態か判定
+        """
+        is_playing = self.scheduler is not None and not self.scheduler.is_idle()
+        return not is_playing and self.guild.voice_client is None
+
+
+class GuildStates:
+    """
+    The registry of guild states, keyed by guild id.
+
+    DISCORD.GUILDS binds channels and voice settings per guild. Guilds not listed there use
+    DISCORD.TARGET_TEXT_CHANNEL, DISCORD.TARGET_VOICE_CHANNEL and the global TTS settings.
+    """
+
+    def __init__(self, configs: dict[str, Any], worker_pool: SynthesisWorkerPool | None = None) -> None:
+        """
+        Initialize the registry.
+
+        Args:
+            configs (dict[str, Any]): config辞書
+            worker_pool (SynthesisWorkerPool | None): 再生スケジューラが音声の前処理を任せるワーカープール.
+                Defaults to None.
+        """
+        self.configs = configs
+        self.worker_pool = worker_pool
+        self.states: dict[int, GuildState] = {}
+
+    def get(self, guild: discord.Guild) -> GuildState:
+        """
+        Get the state of the guild, creating it on first use.
+
+        Args:
+            guild (discord.Guild): 対象のギルド
+
+        Returns:
+            GuildState: ギルドの状態
+        """
+        state = self.states.get(guild.id)
+        if state is None:
+            state = self._make_state(guild)
+            self.states[guild.id] = state
+
+        state.last_active = time.monotonic()
+        return state
+
+    def scheduler(self, guild: discord.Guild) -> GuildPlaybackScheduler:
+        """
+        Get the playback scheduler of the guild, creating it on first use.
+
+        Args:
+            guild (discord.Guild): 再生先のギルド
+
+        Returns:
+            GuildPlaybackScheduler: ギルドの再生スケジューラ
+        """
+        state = self.get(guild)
+        if state.scheduler is None:
+            playback_configs = self.configs.get('PLAYBACK', {})
+            state.scheduler = GuildPlaybackScheduler(
+                guild,
+                self.configs,
+                prefetch_depth=playback_configs.get('PREFETCH_DEPTH', 2),
+                synthesis_concurrency=playback_configs.get('SYNTHESIS_CONCURRENCY', 1),
+                worker_pool=self.worker_pool,
+                queue_configs=playback_configs.get('QUEUE', {}),
+            )
+
+        return state.scheduler
+
+    def find_scheduler(self, guild: discord.Guild) -> GuildPlaybackScheduler | None:
+        """
+        Get the playback scheduler of the guild only if it exists, without creating the state.
+
+        Args:
+            guild (discord.Guild): 再生先のギルド
+
+        Returns:
+            GuildPlaybackScheduler | None: ギルドの再生スケジューラ. まだ読み上げていない場合はNone.
+        """
+        state = self.states.get(guild.id)
+        return state.scheduler if state is not None else None
+
+    def reload(self, configs: dict[str, Any]) -> None:
+        """
+        Swap in the reloaded configs for all guilds.
+
+        NOTE: 途中でawaitしないので, 他の処理からは一度に切り替わって見える.
+              投入済みの読み上げは投入時の設定で合成する.
+              TTSクライアントやキャッシュは作り直さないので, 接続と有効なキャッシュはそのまま使い続ける.
+
+        Args:
+            configs (dict[str, Any]): 読み直したconfig辞書
+        """
+        self.configs = configs
+        for state in self.states.values():
+            reloaded = self._make_state(state.guild)
+            state.text_channel = reloaded.text_channel
+            state.voice_channel = reloaded.voice_channel
+            state.tts_configs = reloaded.tts_configs
+            if state.scheduler is not None:
+                state.scheduler.configs = configs
+
+    async def evict_idle(self, max_idle_sec: float) -> int:
+        """
+        Drop the states of the guilds which have been idle for a while.
+
+        Args:
+            max_idle_sec (float): この秒数より長く使われていないギルドを破棄する
+
+        Returns:
+            int: 破棄したギルドの数
+        """
+        now = time.monotonic()
+        evicted = [
+            state for state in self.states.values() if now - state.last_active > max_idle_sec and state.is_idle()
+        ]
+        for state in evicted:
+            del self.states[state.guild.id]
+            if state.scheduler is not None:
+                await state.scheduler.close()
+
+        return len(evicted)
+
+    async def evict_idle_periodically(self, max_idle_sec: float, interval_sec: float = 60.0) -> None:
+        """
+        Evict the idle guilds periodically.
+
+        Args:
+            max_idle_sec (float): この秒数より長く使われていないギルドを破棄する
+            interval_sec (float): 確認する間隔[秒]. Defaults to 60.0.
+        """
+        while True:
+            await asyncio.sleep(interval_sec)
+            evicted_count = await self.evict_idle(max_idle_sec)
+            if evicted_count > 0:
+                logging.info('Evicted %d idle guild states, %d remain', evicted_count, len(self.states))
+
+    async def close(self) -> None:
+        """
+        Stop the playback schedulers of all guilds and drop the states.
+        """
+        states = list(self.states.values())
+        self.states = {}
+        for state in states:
+            if state.scheduler is not None:
+                await state.scheduler.close()
+
+    def _make_state(self, guild: discord.Guild) -> GuildState:
+        """
+        Make the state of the guild from the configs.
+
+        Args:
+            guild (discord.Guild): 対象のギルド
+
+        Returns:
+            GuildState: ギルドの状態
+        """
+        discord_configs = self.configs['DISCORD']
+        # NOTE: yamlのキーは数値でも文字列でも書けるので両方探す.
+        guilds_configs = discord_configs.get('GUILDS') or {}
+        guild_configs = guilds_configs.get(guild.id) or guilds_configs.get(str(guild.id)) or {}
+
+        tts_overrides = guild_configs.get('TTS')
+        if tts_overrides:
+            tts_configs = compile_voice_profile(_merge_configs(self.configs['TTS'], tts_overrides))
+        else:
+            # NOTE: 上書きが無いギルドは全体の設定を共有してギルドごとのコピーを持たない.
+            tts_configs = self.configs['TTS']
+
+        return GuildState(
+            guild,
+            guild_configs.get('TEXT_CHANNEL', discord_configs.get('TARGET_TEXT_CHANNEL')),
+            guild_configs.get('VOICE_CHANNEL', discord_configs.get('TARGET_VOICE_CHANNEL')),
+            tts_configs,
+        )
+
+
+def _is_channel_matched(channel: discord.abc.GuildChannel, binding: int | str | None) -> bool:
+    """
+    Check the channel matches the channel id or name in the configs.
+
+    Args:
+        channel (discord.abc.GuildChannel): 判定するチャンネル
+        binding (int | str | None): configのチャンネルIDまたは名前
+
+    Returns:
+        bool: 一致するか判定
+    """
+    if binding is None:
+        return False
+
+    return binding in {channel.id, channel.name}
+
+
+def _merge_configs(base: dict[str, Any], overrides: dict[str, Any]) -> dict[str, Any]:
+    """
+    Merge the overrides into a copy of the base configs recursively.
+
+    Args:
+        base (dict[str, Any]): 元のconfig辞書
+        overrides (dict[str, Any]): 上書きするconfig辞書
+
+    Returns:
+        dict[str, Any]: 上書きしたconfig辞書
+    """
+    merged = copy.copy(base)
+    for key, value in overrides.items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = _merge_configs(merged[key], value)
+        else:
+            merged[key] = value
+    return merged
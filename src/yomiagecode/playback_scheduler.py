@@ -0,0 +1,488 @@
+#!/usr/bin/env python3
+"""
+discord botの音声再生をギルドごとに順番に行うスケジューラを定義したファイル.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from collections.abc import Awaitable, Callable
+from typing import TYPE_CHECKING, Any
+
+import utilities.metrics_utilities as metutl
+import utilities.sound_utilities as sndutl
+import yomiagecode.discord_functions as discordfunc
+from yomiagecode.speech_queue import SpeechQueue, Utterance
+from yomiagecode.tts_functions import VoiceStream
+
+if TYPE_CHECKING:
+    import discord
+
+    from yomiagecode.synthesis_workers import SynthesisWorkerPool
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# NOTE: まとめて合成した場合は複数のクリップをリストで返す. 合成しながら再生する場合はVoiceStreamを返す.
+SynthesisJob = Callable[[], Awaitable[bytes | str | VoiceStream | list[bytes | str]]]
+
+
+class GuildPlaybackScheduler:
+    """
+    One long-lived playback queue of a guild.
+
+    Utterances wait in a bounded speech queue which sheds the backlog of a chat flood before synthesis.
+    Their synthesis jobs are started in submission order, up to `synthesis_concurrency` at once,
+    and fill a bounded reorder buffer while the current clip plays.
+    Clips are played strictly in submission order as soon as the next one is ready,
+    and the next clip is started from the `after` callback of the voice client.
+    An utterance can be cancelled at any stage: it is removed from the queue, its synthesis tasks are
+    cancelled (which aborts their requests), and its clip is stopped if it is playing.
+    """
+
+    def __init__(  # noqa: PLR0913
+        self,
+        guild: discord.Guild,
+        configs: dict[str, Any],
+        prefetch_depth: int = 2,
+        synthesis_concurrency: int = 1,
+        worker_pool: SynthesisWorkerPool | None = None,
+        *,
+        queue_configs: dict[str, Any] | None = None,
+    ) -> None:
+        """
+        Initialize the playback scheduler.
+
+        Args:
+            guild (discord.Guild): 再生先のギルド
+            configs (dict[str, Any]): config辞書
+            prefetch_depth (int): 再生待ちとして先に合成しておくクリップ数. Defaults to 2.
+            synthesis_concurrency (int): 同時に合成するクリップ数. Defaults to 1.
+            worker_pool (SynthesisWorkerPool | None): 音声の前処理を任せるワーカープール. Defaults to None.
+            queue_configs (dict[str, Any] | None): 読み上げ待ち行列のconfig辞書(PLAYBACK.QUEUE). Defaults to None.
+        """
+        self.guild = guild
+        self.configs = configs
+        self.worker_pool = worker_pool
+        # NOTE: 合成前の発話を待たせる. 捨てたりまとめたりした発話は再生待ちの数から引く.
+        self._queue = SpeechQueue.from_configs(queue_configs or {}, str(guild.id), self._finish_clip)
+        # NOTE: 合成中のタスクを投入順に並べたものを並べ替えバッファとし, 先頭から順に完了を待って再生する.
+        #       (合成タスク, 発話, 発話の最初の合成処理か)を並べる.
+        self._clips: asyncio.Queue[tuple[asyncio.Task, Utterance, bool]] = asyncio.Queue(
+            maxsize=max(prefetch_depth, synthesis_concurrency, 1),
+        )
+        # NOTE: 取り消すために, 待ち行列から取り出した後の発話を段階ごとに覚えておく.
+        self._expanding: Utterance | None = None
+        self._in_flight: dict[asyncio.Task, Utterance] = {}
+        self._playing: Utterance | None = None
+        self._synthesis_slots = asyncio.Semaphore(max(synthesis_concurrency, 1))
+        self._workers: list[asyncio.Task] = []
+        self._pending_count = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+    def submit(self, job: SynthesisJob, message_started_at: float | None = None) -> None:
+        """
+        Append the synthesis job to the end of the queue.
+
+        Args:
+            job (SynthesisJob): 音声データまたは音声ファイル名(またはそのリスト)を返す合成処理
+            message_started_at (float | None): メッセージの最初のクリップの場合, 受信時のtime.perf_counter().
+                再生開始までの時間をメトリクスに記録する. Defaults to None.
+        """
+        self.submit_utterance(Utterance(None, lambda _: [job], message_started_at=message_started_at))
+
+    def submit_utterance(self, utterance: Utterance) -> None:
+        """
+        Append the utterance to the end of the speech queue.
+
+        Args:
+            utterance (Utterance): 読み上げる発話. 待ち行列の方針で捨てたり前の発話にまとめたりする.
+        """
+        self._start_workers()
+        self._pending_count += 1
+        self._idle.clear()
+        self._queue.put(utterance)
+
+    def skip(self) -> bool:
+        """
+        Cancel the utterance being read aloud, or the next one if nothing is playing.
+
+        Returns:
+            bool: 取り消す発話があったか判定
+        """
+        utterances = self._active_utterances()
+        if len(utterances) == 0:
+            return False
+
+        self._cancel(utterances[0])
+        return True
+
+    def stop(self) -> int:
+        """
+        Flush the guild: drop the queued utterances and cancel the ones being synthesized or played.
+
+        Returns:
+            int: 取り消した発話の数
+        """
+        cancelled_count = self._queue.clear()
+        utterances = self._active_utterances()
+        for utterance in utterances:
+            self._cancel(utterance)
+        return cancelled_count + len(utterances)
+
+    def cancel_message(self, message_id: int) -> bool:
+        """
+        Cancel the reading of the message which was deleted or edited.
+
+        NOTE: 合成前ならそのメッセージの文章だけを取り除く. 合成を始めた後は, 同じ発言者の短いメッセージを
+              まとめた発話の場合も発話ごと取り消す.
+
+        Args:
+            message_id (int): 取り消すメッセージのID
+
+        Returns:
+            bool: 取り消すメッセージがあったか判定
+        """
+        if self._queue.remove_message(message_id):
+            return True
+
+        for utterance in self._active_utterances():
+            if message_id in utterance.message_ids:
+                self._cancel(utterance)
+                return True
+        return False
+
+    def is_idle(self) -> bool:
+        """
+        Check there is nothing to synthesize or play.
+
+        Returns:
+            bool: 合成待ち, 再生待ちが無いか判定
+        """
+        return self._pending_count == 0
+
+    async def wait_idle(self) -> None:
+        """
+        Wait until all submitted jobs have been played.
+        """
+        await self._idle.wait()
+
+    async def close(self) -> None:
+        """
+        Stop the workers and discard the queued jobs, including the synthesis task being awaited for playback.
+        """
+        # NOTE: 再生ワーカーが取り出して待っている合成タスクは_clipsに無いので, 合成中のタスクとして取り消す.
+        #       一時ファイルは, 取り消したタスクが終わった時点でワーカーの後始末が消す.
+        for task in list(self._in_flight):
+            _cancel_task(task)
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        while not self._clips.empty():
+            task, _, _ = self._clips.get_nowait()
+            task.add_done_callback(self._release_task)
+        self._in_flight = {}
+        self._playing = None
+        self._expanding = None
+        self._queue.clear()
+        self._pending_count = 0
+        self._idle.set()
+
+    def _start_workers(self) -> None:
+        """
+        Start the synthesis and playback workers if not running.
+        """
+        if len(self._workers) > 0 and not any(w.done() for w in self._workers):
+            return
+
+        for worker in self._workers:
+            worker.cancel()
+        self._workers = [
+            asyncio.create_task(self._synthesis_worker()),
+            asyncio.create_task(self._playback_worker()),
+        ]
+
+    async def _synthesis_worker(self) -> None:
+        """
+        Start the synthesis jobs in order and put the tasks to the reorder buffer.
+        """
+        # NOTE: 合成タスクはこのコンテキストを引き継ぐので, 合成処理のメトリクスにギルドのラベルが付く.
+        metutl.GUILD_LABEL.set(str(self.guild.id))
+        while True:
+            utterance = await self._queue.get()
+            self._expanding = utterance
+            try:
+                await self._start_jobs(utterance)
+            finally:
+                # NOTE: 発話1つ分の再生待ちを, 始めた合成処理の数に置き換える.
+                self._expanding = None
+                self._finish_clip()
+
+    async def _start_jobs(self, utterance: Utterance) -> None:
+        """
+        Split the utterance into the synthesis jobs and start them in order, unless it is cancelled.
+
+        Args:
+            utterance (Utterance): 待ち行列から取り出した発話
+        """
+        try:
+            jobs = utterance.make_jobs(utterance)
+        except Exception:
+            logging.exception('Failed to make synthesis jobs for guild %s', self.guild.id)
+            metutl.ERRORS_TOTAL.inc(stage='segmentation', guild=str(self.guild.id))
+            return
+
+        for i, job in enumerate(jobs):
+            await self._synthesis_slots.acquire()
+            if utterance.is_cancelled:
+                self._synthesis_slots.release()
+                return
+
+            metutl.STAGE_SECONDS.observe(
+                time.perf_counter() - utterance.submitted_at,
+                stage='queue_wait',
+                guild=str(self.guild.id),
+            )
+            task = asyncio.create_task(job())
+            task.add_done_callback(self._release_synthesis_slot)
+            self._in_flight[task] = utterance
+            self._pending_count += 1
+            await self._clips.put((task, utterance, i == 0))
+
+    async def _playback_worker(self) -> None:
+        """
+        Play the clips in order.
+        """
+        metutl.GUILD_LABEL.set(str(self.guild.id))
+        while True:
+            task, utterance, is_first = await self._clips.get()
+            try:
+                # NOTE: 取り消された合成タスクを待っても, このワーカー自身は取り消されないようにwaitで待つ.
+                await asyncio.wait([task])
+                await self._play_task(task, utterance, is_first)
+            finally:
+                self._playing = None
+                del self._in_flight[task]
+                # NOTE: ワーカーが取り消された場合, 合成タスクはまだ終わっていないので, 終わった時点で後始末する.
+                task.add_done_callback(self._release_task)
+                self._finish_clip()
+
+    async def _play_task(self, task: asyncio.Task, utterance: Utterance, is_first: bool) -> None:  # noqa: FBT001
+        """
+        Play the clips of the finished synthesis task, unless the utterance is cancelled.
+
+        Args:
+            task (asyncio.Task): 完了した合成タスク
+            utterance (Utterance): 合成タスクの発話
+            is_first (bool): 発話の最初の合成処理か
+        """
+        if utterance.is_cancelled or task.cancelled():
+            return
+
+        if task.exception() is not None:
+            logging.error('Failed to synthesize voice for guild %s', self.guild.id, exc_info=task.exception())
+            metutl.ERRORS_TOTAL.inc(stage='synthesis', guild=str(self.guild.id))
+            return
+
+        result = task.result()
+        clips = result if isinstance(result, list) else [result]
+        self._playing = utterance
+        try:
+            for i, clip in enumerate(clips):
+                if utterance.is_cancelled:
+                    return
+                await self._play(clip, utterance.message_started_at if is_first and i == 0 else None)
+        except Exception:
+            logging.exception('Failed to play voice for guild %s', self.guild.id)
+            metutl.ERRORS_TOTAL.inc(stage='playback', guild=str(self.guild.id))
+
+    def _active_utterances(self) -> list[Utterance]:
+        """
+        List the utterances taken from the queue and not cancelled, in the order to be read aloud.
+
+        Returns:
+            list[Utterance]: 再生中, 合成中, 分割中の順に並べた発話
+        """
+        utterances = []
+        for utterance in (self._playing, *self._in_flight.values(), self._expanding):
+            if utterance is not None and not utterance.is_cancelled and utterance not in utterances:
+                utterances.append(utterance)
+        return utterances
+
+    def _cancel(self, utterance: Utterance) -> None:
+        """
+        Cancel the utterance taken from the queue: its synthesis tasks and its clip being played.
+
+        Args:
+            utterance (Utterance): 取り消す発話
+        """
+        utterance.is_cancelled = True
+        metutl.SPEECH_QUEUE_DROPPED_TOTAL.inc(reason='cancelled_in_flight', guild=str(self.guild.id))
+        for task, owner in self._in_flight.items():
+            if owner is utterance:
+                _cancel_task(task)
+        voice_client = self.guild.voice_client
+        if self._playing is utterance and voice_client is not None:
+            # NOTE: afterが呼ばれて再生待ちが終わり, 合成しながら再生している場合は送り込みも止まる.
+            voice_client.stop()
+
+    def _release_synthesis_slot(self, task: asyncio.Task) -> None:
+        """
+        Release the synthesis slot when the synthesis job has finished.
+
+        Args:
+            task (asyncio.Task): 合成タスク
+        """
+        # NOTE: 合成しながら再生する場合, ジョブは最初のチャンクの前に返るので, 合成し終えるまで枠を空けない.
+        if not task.cancelled() and task.exception() is None and isinstance(task.result(), VoiceStream):
+            task.result().add_done_callback(self._synthesis_slots.release)
+            return
+
+        self._synthesis_slots.release()
+
+    def _release_task(self, task: asyncio.Task) -> None:
+        """
+        Remove the temporary files of the finished synthesis task.
+
+        Args:
+            task (asyncio.Task): 終わった合成タスク
+        """
+        if not task.cancelled() and task.exception() is None:
+            self._release_clip(task.result())
+
+    @staticmethod
+    def _release_clip(result: bytes | str | VoiceStream | list[bytes | str]) -> None:
+        """
+        Remove the temporary files of the clips after playback.
+
+        Args:
+            result (bytes | str | VoiceStream | list[bytes | str]): 音声データまたは音声ファイル名(またはそのリスト)
+        """
+        clips = result if isinstance(result, list) else [result]
+        for clip in clips:
+            if isinstance(clip, str):
+                sndutl.remove_temp_wav(clip)
+
+    def _finish_clip(self) -> None:
+        """
+        Count down the pending clips and notify waiters when all clips are done.
+        """
+        self._pending_count -= 1
+        if self._pending_count == 0:
+            self._idle.set()
+
+    async def _play(self, clip: bytes | str | VoiceStream, message_started_at: float | None = None) -> None:
+        """
+        Play the clip and wait for the `after` callback of the voice client.
+
+        Args:
+            clip (bytes | str | VoiceStream): 音声データ, 音声ファイル名または合成中の音声
+            message_started_at (float | None): メッセージの最初のクリップの場合, 受信時のtime.perf_counter().
+        """
+        voice_client = self.guild.voice_client
+        if voice_client is None or not voice_client.is_connected():
+            # NOTE: ボイスチャンネルから切断されている場合は読み上げずに捨てる.
+            return
+
+        loop = asyncio.get_running_loop()
+        finished = loop.create_future()
+
+        def after(error: Exception | None) -> None:
+            # NOTE: afterは音声送信スレッドから呼ばれるのでイベントループに戻して完了を通知する.
+            loop.call_soon_threadsafe(_set_finished, finished, error)
+
+        feeder = None
+        if isinstance(clip, VoiceStream):
+            jitter_buffer_ms = self.configs.get('PLAYBACK', {}).get('JITTER_BUFFER_MS', 200)
+            source = discordfunc.StreamingPcmAudioSource(jitter_buffer_sec=jitter_buffer_ms / 1000)
+            feeder = asyncio.create_task(discordfunc.feed_streaming_source(source, clip.iter_chunks(), self.configs))
+        else:
+            source = await self._make_audio_source(clip)
+        try:
+            if feeder is not None:
+                # NOTE: 音声送信スレッドを待たせないよう, ジッタバッファはイベントループ側で溜めてから再生する.
+                await source.wait_ready()
+                if not voice_client.is_connected():
+                    return
+            voice_client.play(source, after=after)
+            if message_started_at is not None:
+                metutl.FIRST_AUDIO_SECONDS.observe(
+                    time.perf_counter() - message_started_at,
+                    guild=str(self.guild.id),
+                )
+            with metutl.observe_stage('playback'):
+                await finished
+        finally:
+            if feeder is not None:
+                # NOTE: 再生が途中で止められた場合は送り込みを打ち切る. 合成自体は続けてキャッシュに残す.
+                source.cleanup()
+                feeder.cancel()
+                await asyncio.gather(feeder, return_exceptions=True)
+                if source.underrun_count > 0:
+                    metutl.STREAM_UNDERRUN_FRAMES_TOTAL.inc(source.underrun_count, guild=str(self.guild.id))
+
+    async def _make_audio_source(self, clip: bytes | str) -> discord.AudioSource:
+        """
+        Make the audio source of the clip, in a worker process if the pool is given.
+
+        Args:
+            clip (bytes | str): 音声データまたは音声ファイル名
+
+        Returns:
+            discord.AudioSource: The audio source to pass to the voice client.
+        """
+        # NOTE: Ogg/Opusはデコードせずにパケットを送るだけなので, ワーカーに任せるのはwavだけにする.
+        if isinstance(clip, bytes):
+            is_wav = sndutl.detect_audio_format(clip) == sndutl.AUDIO_FORMAT_WAV
+        else:
+            is_wav = clip.endswith(sndutl.AUDIO_FORMAT_SUFFIXES[sndutl.AUDIO_FORMAT_WAV])
+        if self.worker_pool is not None and is_wav:
+            try:
+                with metutl.observe_stage('pcm_decode'):
+                    pcm = await self.worker_pool.prepare_pcm(clip, self.configs['FFMPEG']['FADE_LEN'])
+                return discordfunc.PcmAudioSource(pcm)
+            except RuntimeError:
+                # NOTE: PCMのwavでない場合やワーカーが落ちた場合は, これまで通りFFmpegを含めてこのプロセスで作る.
+                logging.debug('Failed to prepare PCM in worker, falling back', exc_info=True)
+
+        return await asyncio.to_thread(discordfunc.make_audio_source, clip, self.configs)
+
+
+def _cancel_task(task: asyncio.Task) -> None:
+    """
+    Cancel the synthesis task, or the voice stream it returned which is still being synthesized.
+
+    Args:
+        task (asyncio.Task): 合成タスク
+    """
+    if not task.done():
+        task.cancel()
+        return
+
+    if task.cancelled() or task.exception() is not None:
+        return
+
+    result = task.result()
+    for clip in result if isinstance(result, list) else [result]:
+        if isinstance(clip, VoiceStream):
+            clip.cancel()
+
+
+def _set_finished(finished: asyncio.Future, error: Exception | None) -> None:
+    """
+    Set the result of the playback future.
+
+    Args:
+        finished (asyncio.Future): 再生完了を待つFuture
+        error (Exception | None): 再生中に発生したエラー
+    """
+    if finished.done():
+        return
+
+    if error is not None:
+        finished.set_exception(error)
+    else:
+        finished.set_result(None)
@@ -0,0 +1,358 @@
+#!/usr/bin/env python3
+"""
+discord botの名前と参加/退出の読み上げを, 読み上げる前に合成しておく処理を定義したファイル.
+
+名前と参加/退出の読み上げは, 発言や参加の直後に最初に流れる音声なので, 合成を待つと読み上げの開始が遅れる.
+ボイスチャンネルへの接続時や入力中の表示などの前触れで, 読み上げるギルドが空いている間に合成して
+上限のあるメモリ上の置き場に置いておき, 読み上げ時はそのまま再生する.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import functools
+import logging
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Any
+
+import utilities.metrics_utilities as metutl
+import yomiagecode.tts_functions as ttsfunc
+from utilities.cache_utilities import SoundCache
+
+if TYPE_CHECKING:
+    from collections.abc import Callable, Iterable
+
+    import discord
+
+    from yomiagecode.playback_scheduler import SynthesisJob
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# NOTE: 合成しておく処理のメトリクスのギルドのラベル. 読み上げのクリップと区別する.
+PRESYNTHESIS_GUILD_LABEL = 'presynthesis'
+
+
+def get_presynthesizer(
+    configs: dict[str, Any],
+    tts_client: Any,  # noqa: ANN401
+    sound_cache: SoundCache | None = None,
+    is_busy: Callable[[discord.Guild], bool] | None = None,
+) -> PreSynthesizer | None:
+    """
+    名前と参加/退出の読み上げを合成しておく処理を受け取る関数.
+
+    Args:
+        configs (dict[str, Any]): config辞書
+        tts_client (Any): TTSクライアントオブジェクト
+        sound_cache (SoundCache | None): 合成済み音声のキャッシュ. Defaults to None.
+        is_busy (Callable[[discord.Guild], bool] | None): ギルドが読み上げ中か判定する関数. Defaults to None.
+
+    Returns:
+        PreSynthesizer | None: 合成しておく処理. 無効化されている場合はNone.
+    """
+    presynthesis_configs = configs.get('PRESYNTHESIS', {})
+    if not presynthesis_configs.get('ENABLE', True):
+        return None
+
+    clip_store = ClipStore(
+        max_entries=presynthesis_configs.get('MAX_ENTRIES', 1024),
+        max_bytes=presynthesis_configs.get('MAX_BYTES', 32 * 1024 * 1024),
+    )
+    return PreSynthesizer(
+        tts_client,
+        clip_store,
+        sound_cache,
+        is_busy=is_busy,
+        max_pending=presynthesis_configs.get('MAX_PENDING', 128),
+        max_recent_authors=presynthesis_configs.get('RECENT_AUTHORS', 256),
+        busy_poll_sec=presynthesis_configs.get('BUSY_POLL_SEC', 0.2),
+    )
+
+
+class ClipStore:
+    """
+    Bounded in-memory LRU store of the synthesized clips, keyed by the sound cache key.
+    """
+
+    def __init__(self, max_entries: int = 1024, max_bytes: int = 32 * 1024 * 1024) -> None:
+        """
+        Initialize the clip store.
+
+        Args:
+            max_entries (int): 置いておくクリップの最大数. Defaults to 1024.
+            max_bytes (int): 置いておくクリップの合計の最大サイズ. Defaults to 32MiB.
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries: OrderedDict[str, bytes] = OrderedDict()
+        self.total_bytes = 0
+        self.counters = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+    def __len__(self) -> int:
+        """
+        The number of the stored clips.
+        """
+        return len(self.entries)
+
+    def __contains__(self, key: str) -> bool:
+        """
+        Check the clip is stored, without marking it as used.
+        """
+        return key in self.entries
+
+    def get(self, key: str) -> bytes | None:
+        """
+        Get the clip and mark it as recently used.
+
+        Args:
+            key (str): SoundCache.make_keyのキー
+
+        Returns:
+            bytes | None: 音声データ. 無い場合はNone.
+        """
+        data = self.entries.get(key)
+        if data is None:
+            self.counters['misses'] += 1
+            return None
+
+        self.entries.move_to_end(key)
+        self.counters['hits'] += 1
+        return data
+
+    def put(self, key: str, data: bytes) -> None:
+        """
+        Store the clip and evict the least recently used clips over the limits.
+
+        Args:
+            key (str): SoundCache.make_keyのキー
+            data (bytes): 音声データ
+        """
+        if len(data) > self.max_bytes:
+            return
+
+        if key in self.entries:
+            self.total_bytes -= len(self.entries.pop(key))
+        self.entries[key] = data
+        self.total_bytes += len(data)
+        while len(self.entries) > self.max_entries or self.total_bytes > self.max_bytes:
+            _, evicted = self.entries.popitem(last=False)
+            self.total_bytes -= len(evicted)
+            self.counters['evictions'] += 1
+
+    def stats(self) -> dict[str, int]:
+        """
+        Get the counters and the current size of the store.
+
+        Returns:
+            dict[str, int]: カウンタと置いてあるクリップの数とサイズの辞書
+        """
+        return self.counters | {'entries': len(self.entries), 'bytes': self.total_bytes}
+
+
+class PreSynthesizer:
+    """
+    Background service which synthesizes the name and join/leave clips before they are read aloud.
+
+    Requested texts are synthesized one by one in a background task, only while the guild which asked
+    for them is not reading aloud, so the pre-synthesis never delays the messages. A full request queue
+    drops the new requests. The recently active text authors of each guild are remembered, so their clips
+    can be requested again when the bot joins a voice channel.
+    """
+
+    def __init__(  # noqa: PLR0913
+        self,
+        tts_client: Any,  # noqa: ANN401
+        clip_store: ClipStore,
+        sound_cache: SoundCache | None = None,
+        *,
+        is_busy: Callable[[discord.Guild], bool] | None = None,
+        max_pending: int = 128,
+        max_recent_authors: int = 256,
+        busy_poll_sec: float = 0.2,
+    ) -> None:
+        """
+        Initialize the pre-synthesizer.
+
+        Args:
+            tts_client (Any): TTSクライアントオブジェクト
+            clip_store (ClipStore): 合成したクリップの置き場
+            sound_cache (SoundCache | None): 合成済み音声のキャッシュ. 有る場合はキャッシュから置き場に移す.
+                Defaults to None.
+            is_busy (Callable[[discord.Guild], bool] | None): ギルドが読み上げ中か判定する関数.
+                読み上げ中のギルドの合成は後回しにする. Defaults to None.
+            max_pending (int): 合成を待たせる最大数. Defaults to 128.
+            max_recent_authors (int): 覚えておく最近の発言者の最大数. Defaults to 256.
+            busy_poll_sec (float): 全ての合成が後回しになった場合に待つ秒数. Defaults to 0.2.
+        """
+        self.tts_client = tts_client
+        self.clip_store = clip_store
+        self.sound_cache = sound_cache
+        self.is_busy = is_busy
+        self.max_recent_authors = max_recent_authors
+        self.busy_poll_sec = busy_poll_sec
+        self.counters = {'rendered': 0, 'dropped': 0, 'failed': 0, 'fallback': 0}
+        # NOTE: (ギルドID, ユーザーID) -> 表示名. 並び順が発言の順序(末尾が最新).
+        self._recent_authors: OrderedDict[tuple[int, int], str] = OrderedDict()
+        self._pending: asyncio.Queue[tuple[str, str, dict, discord.Guild]] = asyncio.Queue(maxsize=max_pending)
+        self._pending_keys: set[str] = set()
+        self._task: asyncio.Task | None = None
+
+    def job(self, text: str, tts_configs: dict) -> SynthesisJob | None:
+        """
+        Get the synthesis job which returns the clip synthesized beforehand.
+
+        Args:
+            text (str): 読み上げる文章
+            tts_configs (dict): 読み上げるギルドのTTS用のconfig辞書
+
+        Returns:
+            SynthesisJob | None: 合成済みのクリップを返す合成処理. 合成していない場合はNone.
+        """
+        clip = self.clip_store.get(SoundCache.make_key(text, tts_configs))
+        if clip is None:
+            return None
+        return functools.partial(_stored_clip, clip)
+
+    def request(self, texts: Iterable[str], tts_configs: dict, guild: discord.Guild) -> int:
+        """
+        Ask to synthesize the texts in the background, skipping the ones already synthesized or waiting.
+
+        Args:
+            texts (Iterable[str]): 合成しておく文章
+            tts_configs (dict): 読み上げるギルドのTTS用のconfig辞書
+            guild (discord.Guild): 読み上げるギルド
+
+        Returns:
+            int: 新しく合成を待たせた文章の数
+        """
+        self._start()
+        requested_count = 0
+        for text in texts:
+            key = SoundCache.make_key(text, tts_configs)
+            if key in self.clip_store or key in self._pending_keys:
+                continue
+
+            try:
+                self._pending.put_nowait((key, text, tts_configs, guild))
+            except asyncio.QueueFull:
+                self.counters['dropped'] += 1
+                metutl.PRESYNTHESIS_TOTAL.inc(result='dropped')
+                continue
+            self._pending_keys.add(key)
+            requested_count += 1
+        return requested_count
+
+    def note_author(self, guild_id: int, user_id: int, display_name: str) -> None:
+        """
+        Remember the author who is active in the text channel.
+
+        Args:
+            guild_id (int): ギルドID
+            user_id (int): 発言者のID
+            display_name (str): 発言者の表示名
+        """
+        key = (guild_id, user_id)
+        self._recent_authors.pop(key, None)
+        self._recent_authors[key] = display_name
+        while len(self._recent_authors) > self.max_recent_authors:
+            self._recent_authors.popitem(last=False)
+
+    def recent_authors(self, guild_id: int) -> list[str]:
+        """
+        List the display names of the recently active authors of the guild.
+
+        Args:
+            guild_id (int): ギルドID
+
+        Returns:
+            list[str]: 新しい順の表示名
+        """
+        return [
+            name
+            for (author_guild_id, _), name in reversed(self._recent_authors.items())
+            if author_guild_id == guild_id
+        ]
+
+    def is_recent_author(self, guild_id: int, user_id: int) -> bool:
+        """
+        Check the user was active in the text channel recently.
+
+        Args:
+            guild_id (int): ギルドID
+            user_id (int): ユーザーID
+
+        Returns:
+            bool: 最近の発言者か判定
+        """
+        return (guild_id, user_id) in self._recent_authors
+
+    def stats(self) -> dict[str, int]:
+        """
+        Get the counters of the pre-synthesis and the clip store.
+
+        Returns:
+            dict[str, int]: 合成, 破棄, 失敗, 予備のバックエンドで合成した数と, 待ち数と置き場の状態の辞書
+        """
+        return self.counters | {'pending': self._pending.qsize()} | self.clip_store.stats()
+
+    def _start(self) -> None:
+        """
+        Start the background task on the running event loop.
+        """
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self) -> None:
+        """
+        Synthesize the requested texts one by one, putting off the ones of the busy guilds.
+        """
+        metutl.GUILD_LABEL.set(PRESYNTHESIS_GUILD_LABEL)
+        deferred_count = 0
+        while True:
+            key, text, tts_configs, guild = await self._pending.get()
+            if self.is_busy is not None and self.is_busy(guild):
+                # NOTE: 読み上げ中のギルドの合成は後ろに回す. 全て後回しになったら少し待つ.
+                self._pending.put_nowait((key, text, tts_configs, guild))
+                deferred_count += 1
+                if deferred_count >= self._pending.qsize():
+                    deferred_count = 0
+                    await asyncio.sleep(self.busy_poll_sec)
+                continue
+
+            deferred_count = 0
+            try:
+                voice_data, is_cacheable = await ttsfunc.make_cacheable_sound_data(
+                    text,
+                    self.tts_client,
+                    tts_configs,
+                    self.sound_cache,
+                )
+            except Exception:
+                logging.exception('Failed to pre-synthesize "%s"', text)
+                self.counters['failed'] += 1
+                metutl.PRESYNTHESIS_TOTAL.inc(result='failed')
+            else:
+                if is_cacheable:
+                    self.clip_store.put(key, voice_data)
+                    self.counters['rendered'] += 1
+                    metutl.PRESYNTHESIS_TOTAL.inc(result='rendered')
+                else:
+                    # NOTE: 予備のバックエンドの声は話者が違うので置かず, 読み上げ時に主のバックエンドで合成し直す.
+                    self.counters['fallback'] += 1
+                    metutl.PRESYNTHESIS_TOTAL.inc(result='fallback')
+            finally:
+                self._pending_keys.discard(key)
+
+
+async def _stored_clip(clip: bytes) -> bytes:
+    """
+    Return the clip synthesized beforehand, as a synthesis job.
+
+    Args:
+        clip (bytes): 合成済みの音声データ
+
+    Returns:
+        bytes: 音声データ
+    """
+    metutl.CLIPS_TOTAL.inc(source='presynthesis', guild=metutl.GUILD_LABEL.get())
+    return clip
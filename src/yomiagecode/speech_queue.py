@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+"""
+discord botのギルドごとの合成前の読み上げ待ち行列を定義したファイル.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import time
+from collections import deque
+from typing import TYPE_CHECKING, Any
+
+import utilities.metrics_utilities as metutl
+
+if TYPE_CHECKING:
+    from collections.abc import Callable
+
+    from yomiagecode.playback_scheduler import SynthesisJob
+
+OVERFLOW_DROP_OLDEST = 'DROP_OLDEST'
+OVERFLOW_DROP_NEWEST = 'DROP_NEWEST'
+
+
+class Utterance:
+    """
+    One message waiting to be read aloud, before it is split and synthesized.
+
+    The synthesis jobs are made only when the utterance leaves the queue, so an utterance which is
+    dropped, collapsed or merged while waiting costs no synthesis.
+    """
+
+    __slots__ = (
+        'author_id',
+        'author_name',
+        'is_cancelled',
+        'make_jobs',
+        'message_ids',
+        'message_started_at',
+        'submitted_at',
+        'texts',
+    )
+
+    def __init__(  # noqa: PLR0913
+        self,
+        text: str | None,
+        make_jobs: Callable[[Utterance], list[SynthesisJob]],
+        *,
+        author_id: int | None = None,
+        author_name: str | None = None,
+        message_id: int | None = None,
+        message_started_at: float | None = None,
+    ) -> None:
+        """
+        Initialize the utterance.
+
+        Args:
+            text (str | None): 読み上げる文章. 文章を持たない合成処理の場合はNone.
+            make_jobs (Callable[[Utterance], list[SynthesisJob]]): 発話を合成処理に分ける関数
+            author_id (int | None): 発言者のID. システムの読み上げの場合はNone. Defaults to None.
+            author_name (str | None): 文章の前に読み上げる発言者の名前. Defaults to None.
+            message_id (int | None): 元のメッセージのID. 削除や編集で取り消すために使う. Defaults to None.
+            message_started_at (float | None): メッセージ受信時のtime.perf_counter(). Defaults to None.
+        """
+        # NOTE: 同じ発言者の短いメッセージをまとめた場合は複数の文章を持つ. メッセージIDは文章と同じ順に並べる.
+        self.texts = [text] if text is not None else []
+        self.message_ids = [message_id] if text is not None else []
+        self.make_jobs = make_jobs
+        self.author_id = author_id
+        self.author_name = author_name
+        self.message_started_at = message_started_at
+        self.submitted_at = time.perf_counter()
+        self.is_cancelled = False
+
+    def char_count(self) -> int:
+        """
+        The number of the characters to read aloud.
+
+        Returns:
+            int: 文章の文字数の合計
+        """
+        return sum(map(len, self.texts))
+
+
+class SpeechQueue:
+    """
+    Bounded queue of the utterances of a guild, with the policies to shed the backlog of a chat flood.
+
+    On put, a message longer than `max_chars` is cut with `omission_text`. A message of the same author as
+    the last queued one is collapsed into it if identical, or merged into it if short, while the merged text
+    is at most `merge_max_chars`. When the queue is still full the oldest
+    (or the newest) utterance is dropped. On get, utterances older than `max_staleness_sec` are skipped
+    without being synthesized.
+    """
+
+    def __init__(  # noqa: PLR0913
+        self,
+        guild_label: str = '',
+        on_discard: Callable[[], None] | None = None,
+        *,
+        max_size: int = 32,
+        overflow: str = OVERFLOW_DROP_OLDEST,
+        max_staleness_sec: float = 0.0,
+        collapse_identical: bool = True,
+        max_chars: int = 0,
+        omission_text: str = '以下略',
+        merge_max_chars: int = 0,
+    ) -> None:
+        """
+        Initialize the speech queue.
+
+        Args:
+            guild_label (str): メトリクスに付けるギルドのラベル. Defaults to ''.
+            on_discard (Callable[[], None] | None): 発話を捨てたりまとめたりして減らすたびに呼ぶ関数.
+                Defaults to None.
+            max_size (int): 待たせる発話の最大数. Defaults to 32.
+            overflow (str): 溢れた場合に捨てる発話. 'DROP_OLDEST'または'DROP_NEWEST'. Defaults to 'DROP_OLDEST'.
+            max_staleness_sec (float): この秒数より長く待った発話は合成せずに飛ばす. 0の場合は飛ばさない.
+                Defaults to 0.0.
+            collapse_identical (bool): 同じ発言者の直前と同じ文章の発話を1つにまとめるか. Defaults to True.
+            max_chars (int): 1メッセージで読み上げる最大文字数. 0の場合は制限しない. Defaults to 0.
+            omission_text (str): 最大文字数で切った場合に続けて読む文章. Defaults to '以下略'.
+            merge_max_chars (int): 同じ発言者の発話をまとめる最大文字数. 0の場合はまとめない. Defaults to 0.
+
+        Raises:
+            ValueError: If the overflow policy is unknown.
+        """
+        if overflow not in (OVERFLOW_DROP_OLDEST, OVERFLOW_DROP_NEWEST):
+            raise_message = f'Unknown overflow policy of the speech queue: {overflow}'
+            raise ValueError(raise_message)
+
+        self.guild_label = guild_label
+        self.on_discard = on_discard
+        self.max_size = max(max_size, 1)
+        self.overflow = overflow
+        self.max_staleness_sec = max_staleness_sec
+        self.collapse_identical = collapse_identical
+        self.max_chars = max_chars
+        self.omission_text = omission_text
+        self.merge_max_chars = merge_max_chars
+        self.counters = {'overflow': 0, 'stale': 0, 'collapsed': 0, 'cancelled': 0, 'merged': 0, 'truncated': 0}
+        self._utterances: deque[Utterance] = deque()
+        self._not_empty = asyncio.Event()
+
+    @classmethod
+    def from_configs(
+        cls,
+        queue_configs: dict[str, Any],
+        guild_label: str = '',
+        on_discard: Callable[[], None] | None = None,
+    ) -> SpeechQueue:
+        """
+        Make the speech queue from PLAYBACK.QUEUE of the configs.
+
+        Args:
+            queue_configs (dict[str, Any]): 読み上げ待ち行列のconfig辞書
+            guild_label (str): メトリクスに付けるギルドのラベル. Defaults to ''.
+            on_discard (Callable[[], None] | None): 発話を減らすたびに呼ぶ関数. Defaults to None.
+
+        Returns:
+            SpeechQueue: 読み上げ待ち行列
+        """
+        return cls(
+            guild_label,
+            on_discard,
+            max_size=queue_configs.get('MAX_SIZE', 32),
+            overflow=queue_configs.get('OVERFLOW', OVERFLOW_DROP_OLDEST),
+            max_staleness_sec=queue_configs.get('MAX_STALENESS_SEC', 0.0),
+            collapse_identical=queue_configs.get('COLLAPSE_IDENTICAL', True),
+            max_chars=queue_configs.get('MAX_CHARS', 0),
+            omission_text=queue_configs.get('OMISSION_TEXT', '以下略'),
+            merge_max_chars=queue_configs.get('MERGE_MAX_CHARS', 0),
+        )
+
+    def __len__(self) -> int:
+        """
+        The number of the waiting utterances.
+        """
+        return len(self._utterances)
+
+    def put(self, utterance: Utterance) -> None:
+        """
+        Append the utterance, applying the policies.
+
+        Args:
+            utterance (Utterance): 追加する発話
+        """
+        if self.max_chars > 0 and len(utterance.texts) > 0 and len(utterance.texts[0]) > self.max_chars:
+            utterance.texts[0] = utterance.texts[0][: self.max_chars] + self.omission_text
+            self._count('truncated')
+
+        last = self._utterances[-1] if len(self._utterances) > 0 else None
+        if last is not None and len(last.texts) > 0 and len(utterance.texts) > 0:
+            # NOTE: 他の人が同じ文章を発言した場合は, その人の発言と名前の読み上げを落とさないようまとめない.
+            is_repeated = last.author_id == utterance.author_id and last.texts[-1] == utterance.texts[0]
+            if self.collapse_identical and is_repeated:
+                self._discard('collapsed')
+                return
+
+            is_same_author = utterance.author_id is not None and last.author_id == utterance.author_id
+            if is_same_author and last.char_count() + utterance.char_count() <= self.merge_max_chars:
+                last.texts += utterance.texts
+                last.message_ids += utterance.message_ids
+                self._discard('merged')
+                return
+
+        if len(self._utterances) >= self.max_size:
+            if self.overflow == OVERFLOW_DROP_NEWEST:
+                self._discard('overflow')
+                return
+            self._utterances.popleft()
+            self._discard('overflow')
+
+        self._utterances.append(utterance)
+        self._not_empty.set()
+        self._update_depth()
+
+    async def get(self) -> Utterance:
+        """
+        Take the oldest utterance which is not stale, waiting if the queue is empty.
+
+        Returns:
+            Utterance: 合成する発話
+        """
+        while True:
+            while len(self._utterances) == 0:
+                self._not_empty.clear()
+                await self._not_empty.wait()
+
+            utterance = self._utterances.popleft()
+            self._update_depth()
+            waited_sec = time.perf_counter() - utterance.submitted_at
+            if self.max_staleness_sec > 0 and waited_sec > self.max_staleness_sec:
+                self._discard('stale')
+                continue
+            return utterance
+
+    def remove_message(self, message_id: int) -> bool:
+        """
+        Remove the text of the message which was deleted or edited before it was synthesized.
+
+        Args:
+            message_id (int): 取り消すメッセージのID
+
+        Returns:
+            bool: 待ち行列にあって取り除いたか判定
+        """
+        for utterance in self._utterances:
+            if message_id not in utterance.message_ids:
+                continue
+
+            index = utterance.message_ids.index(message_id)
+            del utterance.texts[index]
+            del utterance.message_ids[index]
+            if len(utterance.texts) == 0:
+                self._utterances.remove(utterance)
+                self._discard('cancelled')
+            return True
+        return False
+
+    def clear(self) -> int:
+        """
+        Drop all the waiting utterances.
+
+        Returns:
+            int: 捨てた発話の数
+        """
+        count = len(self._utterances)
+        self._utterances.clear()
+        for _ in range(count):
+            self._discard('cancelled')
+        return count
+
+    def stats(self) -> dict[str, int]:
+        """
+        Get the depth and the counters of the shed utterances.
+
+        Returns:
+            dict[str, int]: 待ち数と, 方針ごとに捨てたりまとめたりした数の辞書
+        """
+        return self.counters | {'depth': len(self._utterances)}
+
+    def _count(self, reason: str) -> None:
+        """
+        Count the utterance shaped by the policy.
+
+        Args:
+            reason (str): 方針の名前
+        """
+        self.counters[reason] += 1
+        if reason in ('merged', 'truncated'):
+            metutl.SPEECH_QUEUE_SHAPED_TOTAL.inc(policy=reason, guild=self.guild_label)
+        else:
+            metutl.SPEECH_QUEUE_DROPPED_TOTAL.inc(reason=reason, guild=self.guild_label)
+
+    def _discard(self, reason: str) -> None:
+        """
+        Count the utterance dropped or merged into another one, and notify the owner.
+
+        Args:
+            reason (str): 捨てた理由
+        """
+        self._count(reason)
+        self._update_depth()
+        if self.on_discard is not None:
+            self.on_discard()
+
+    def _update_depth(self) -> None:
+        """
+        Expose the current depth of the queue.
+        """
+        metutl.SPEECH_QUEUE_DEPTH.set(len(self._utterances), guild=self.guild_label)
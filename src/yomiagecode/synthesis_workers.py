@@ -0,0 +1,649 @@
+#!/usr/bin/env python3
+"""
+discord botの音声合成と音声の前処理を別プロセスで行うワーカープールを定義したファイル.
+
+ゲートウェイのイベントループと同じプロセスで合成や変換を行うと, 負荷が高いときに
+heartbeatやコマンド処理が遅れるので, 重い処理をワーカープロセスに任せる.
+ワーカーとはワーカーごとのパイプでジョブと結果の通知をやり取りし,
+音声データ本体は共有メモリで受け渡す.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import itertools
+import logging
+import multiprocessing
+import multiprocessing.connection
+import os
+import signal
+import threading
+from multiprocessing import shared_memory
+from pathlib import Path
+from typing import TYPE_CHECKING, Any
+
+import utilities.metrics_utilities as metutl
+import utilities.sound_utilities as sndutl
+import yomiagecode.tts_functions as ttsfunc
+from tts.audio_query_cache import AudioQueryCache
+from tts.hedged_wrapper import HedgedAudioQuery
+from tts.tts_wrapper import AsyncTTSWrapper
+
+if TYPE_CHECKING:
+    from multiprocessing.connection import Connection
+    from multiprocessing.context import SpawnProcess
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+JOB_SYNTHESIZE = 'synthesize'
+JOB_PREPARE_PCM = 'prepare_pcm'
+JOB_CANCEL = 'cancel'
+
+
+def get_worker_pool(configs: dict[str, Any]) -> SynthesisWorkerPool | None:
+    """
+    合成ワーカープールを受け取る関数.
+
+    Args:
+        configs (dict[str, Any]): config辞書
+
+    Returns:
+        SynthesisWorkerPool | None: ワーカープール. 無効化されている場合はNone.
+    """
+    worker_configs = configs.get('WORKERS', {})
+    if not worker_configs.get('ENABLE', False):
+        return None
+
+    return SynthesisWorkerPool(
+        configs,
+        pool_size=worker_configs.get('POOL_SIZE') or os.cpu_count() or 1,
+        concurrency=worker_configs.get('CONCURRENCY', 2),
+        max_pending=worker_configs.get('MAX_PENDING', 64),
+        job_timeout=worker_configs.get('JOB_TIMEOUT_SEC', 60.0),
+    )
+
+
+class _WorkerHandle:
+    """
+    One worker process, its pipes and the jobs sent to it.
+    """
+
+    __slots__ = ('index', 'job_conn', 'job_ids', 'process', 'result_conn')
+
+    def __init__(self, index: int, process: SpawnProcess, job_conn: Connection, result_conn: Connection) -> None:
+        """
+        Initialize the worker handle.
+
+        Args:
+            index (int): ワーカーの番号
+            process (SpawnProcess): ワーカープロセス
+            job_conn (Connection): ジョブを送るパイプ
+            result_conn (Connection): 結果を受け取るパイプ
+        """
+        self.index = index
+        self.process = process
+        self.job_conn = job_conn
+        self.result_conn = result_conn
+        self.job_ids: set[int] = set()
+
+
+class SynthesisWorkerPool(AsyncTTSWrapper):
+    """
+    The pool of worker processes which own the TTS clients and the audio post-processing.
+
+    It can be used as the TTS client of the bot. Each job is sent to the worker with the fewest outstanding jobs,
+    crashed workers are restarted and their running jobs fail, and at most `max_pending` jobs are
+    in flight so that a burst of messages waits in the bot instead of piling up in the workers.
+    """
+
+    def __init__(  # noqa: PLR0913
+        self,
+        configs: dict[str, Any],
+        *,
+        pool_size: int = 2,
+        concurrency: int = 2,
+        max_pending: int = 64,
+        job_timeout: float = 60.0,
+        monitor_interval: float = 1.0,
+    ) -> None:
+        """
+        Start the worker processes.
+
+        Args:
+            configs (dict[str, Any]): config辞書. ワーカーはTTSの設定から自分のTTSクライアントを作る.
+            pool_size (int): ワーカープロセス数. Defaults to 2.
+            concurrency (int): 1ワーカーが同時に処理するジョブ数. Defaults to 2.
+            max_pending (int): 処理中と待ちを合わせたジョブ数の上限. Defaults to 64.
+            job_timeout (float): 1ジョブのタイムアウト[秒]. Defaults to 60.0.
+            monitor_interval (float): ワーカーの死活を確認する間隔[秒]. Defaults to 1.0.
+        """
+        self.configs = configs
+        self.client = []
+        self.speakers_name_dict = {}
+        self.pool_size = pool_size
+        self.concurrency = concurrency
+        self.max_pending = max_pending
+        self.job_timeout = job_timeout
+        self.monitor_interval = monitor_interval
+
+        # NOTE: forkはイベントループやスレッドの状態を引き継いでしまうのでspawnで起動する.
+        self._context = multiprocessing.get_context('spawn')
+        self._workers: list[_WorkerHandle] = [self._start_worker(i) for i in range(pool_size)]
+        self._job_ids = itertools.count()
+        # NOTE: job_id -> (結果を待つFuture, 入力に使った共有メモリ, 担当ワーカーの番号)
+        self._jobs: dict[int, tuple[asyncio.Future, shared_memory.SharedMemory | None, int]] = {}
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._slots: asyncio.Semaphore | None = None
+        self._monitor_task: asyncio.Task | None = None
+        self._is_closed = False
+        self._reader = threading.Thread(target=self._read_results, daemon=True)
+        self._reader.start()
+
+    @property
+    def pending_count(self) -> int:
+        """
+        The number of jobs waiting or running in the workers.
+        """
+        return len(self._jobs)
+
+    def is_saturated(self) -> bool:
+        """
+        Check new jobs have to wait for a free slot.
+
+        Returns:
+            bool: ワーカーが処理しきれずジョブを待たせている状態か判定
+        """
+        return self.pending_count >= self.max_pending
+
+    async def generate_audio_query(
+        self,
+        text: str,
+        tts_configs: dict[str, Any] | None = None,  # noqa: ARG002
+    ) -> HedgedAudioQuery:
+        # NOTE: audio_queryはワーカーのTTSクライアントが作るので, 文章を持ち回してgenerate_voiceでまとめて生成する.
+        """
+        Generate an audio query from the given text.
+
+        Args:
+            text (str): The text to be converted to speech.
+            tts_configs (dict[str, Any]): 他のAPIと合わせるために一旦受けるが捨てる
+
+        Returns:
+            HedgedAudioQuery: The text, and the backend that served it after generate_voice.
+        """
+        return HedgedAudioQuery(text)
+
+    async def generate_voice(
+        self,
+        audio_query: HedgedAudioQuery,
+        tts_configs: dict[str, Any] | None = None,
+    ) -> bytes:
+        """
+        Generate voice data in a worker process.
+
+        Args:
+            audio_query (HedgedAudioQuery): The audio query to be converted to voice.
+            tts_configs (dict[str, Any]): Configuration options for voice generation. Defaults to None.
+
+        Returns:
+            bytes: The generated voice data in wav format.
+
+        Raises:
+            RuntimeError: If the worker failed, crashed or timed out.
+        """
+        voice_data, meta = await self._submit(JOB_SYNTHESIZE, audio_query.text, None, tts_configs)
+        audio_query.served_by = meta['served_by']
+        audio_query.is_primary = meta['is_primary']
+        return voice_data
+
+    async def prepare_pcm(self, clip: bytes | str, fade_len: float) -> bytes:
+        """
+        Decode, fade and resample the clip to the PCM for the Discord voice client in a worker process.
+
+        Args:
+            clip (bytes | str): 音声データまたは音声ファイル名
+            fade_len (float): フェードの長さ[秒]
+
+        Returns:
+            bytes: 48kHz, 16bit, stereoのPCM
+
+        Raises:
+            RuntimeError: If the clip is not a PCM wav, or the worker failed.
+        """
+        if isinstance(clip, str):
+            pcm, _ = await self._submit(JOB_PREPARE_PCM, clip, None, fade_len)
+        else:
+            pcm, _ = await self._submit(JOB_PREPARE_PCM, None, clip, fade_len)
+        return pcm
+
+    async def close(self) -> None:
+        """
+        Stop the worker processes.
+        """
+        if self._monitor_task is not None:
+            self._monitor_task.cancel()
+            await asyncio.gather(self._monitor_task, return_exceptions=True)
+            self._monitor_task = None
+        await asyncio.to_thread(self.shutdown)
+
+    def shutdown(self, timeout: float = 5.0) -> None:
+        """
+        Stop the worker processes without an event loop.
+
+        Args:
+            timeout (float): ワーカーの終了を待つ時間[秒]. Defaults to 5.0.
+        """
+        if self._is_closed:
+            return
+
+        self._is_closed = True
+        for worker in self._workers:
+            with contextlib.suppress(OSError):
+                worker.job_conn.send(None)
+        for worker in self._workers:
+            worker.process.join(timeout)
+            if worker.process.is_alive():
+                worker.process.terminate()
+        self._reader.join(timeout)
+        for worker in self._workers:
+            worker.job_conn.close()
+            worker.result_conn.close()
+        for _, input_memory, _ in self._jobs.values():
+            _release_memory(input_memory)
+        self._jobs.clear()
+
+    async def _submit(
+        self,
+        kind: str,
+        payload: str | None,
+        data: bytes | None,
+        options: Any,  # noqa: ANN401
+    ) -> tuple[bytes, dict[str, Any]]:
+        """
+        Send the job to the least busy worker and wait for the result.
+
+        Args:
+            kind (str): ジョブの種類
+            payload (str | None): 文章またはファイル名
+            data (bytes | None): 共有メモリで渡す入力データ
+            options (Any): ジョブの種類ごとの設定
+
+        Returns:
+            tuple[bytes, dict[str, Any]]: 出力データと付随情報
+
+        Raises:
+            RuntimeError: If the worker failed, crashed or timed out.
+        """
+        self._start_monitor()
+        if self._slots.locked():
+            # NOTE: ワーカーが追いついていないことをメトリクスで知らせる. 呼び出し側は空きが出るまで待つ.
+            metutl.ERRORS_TOTAL.inc(stage='worker_backpressure', guild=metutl.GUILD_LABEL.get())
+
+        async with self._slots:
+            job_id = next(self._job_ids)
+            input_memory = None
+            input_size = 0
+            if data is not None:
+                input_memory = shared_memory.SharedMemory(create=True, size=max(len(data), 1))
+                input_memory.buf[: len(data)] = data
+                input_size = len(data)
+
+            worker = min(self._workers, key=lambda worker: len(worker.job_ids))
+            future = self._loop.create_future()
+            self._jobs[job_id] = (future, input_memory, worker.index)
+            worker.job_ids.add(job_id)
+            input_name = input_memory.name if input_memory is not None else None
+            try:
+                worker.job_conn.send((job_id, kind, payload, input_name, input_size, options))
+                return await asyncio.wait_for(future, self.job_timeout)
+            except asyncio.CancelledError:
+                # NOTE: 読み上げが取り消された場合は, ワーカー側の合成も止めてTTSへの要求を打ち切る.
+                _send_cancel(worker, job_id)
+                raise
+            except OSError as e:
+                raise_message = f'Failed to send the job to synthesis worker {worker.index}'
+                raise RuntimeError(raise_message) from e
+            except TimeoutError as e:
+                # NOTE: 待つのを諦めた合成がワーカーの枠とTTSへの要求を使い続けないように止める.
+                _send_cancel(worker, job_id)
+                raise_message = f'Synthesis worker timed out: {kind}'
+                raise RuntimeError(raise_message) from e
+            finally:
+                # NOTE: タイムアウトした場合も, 後から届く結果の共有メモリは_on_resultで解放する.
+                self._forget_job(job_id)
+
+    def _start_monitor(self) -> None:
+        """
+        Bind the pool to the running event loop and start watching the workers.
+        """
+        if self._loop is None:
+            self._loop = asyncio.get_running_loop()
+            self._slots = asyncio.Semaphore(self.max_pending)
+        if self._monitor_task is None or self._monitor_task.done():
+            self._monitor_task = asyncio.create_task(self._monitor_workers())
+
+    def _start_worker(self, worker_index: int) -> _WorkerHandle:
+        """
+        Start one worker process.
+
+        Args:
+            worker_index (int): ワーカーの番号
+
+        Returns:
+            _WorkerHandle: 起動したワーカー
+        """
+        # NOTE: ワーカー間で共有するキューは, ロックを持ったままワーカーが落ちると全体が止まるので,
+        #       ワーカーごとに専用のパイプを使う.
+        job_reader, job_writer = self._context.Pipe(duplex=False)
+        result_reader, result_writer = self._context.Pipe(duplex=False)
+        process = self._context.Process(
+            target=_worker_main,
+            args=(worker_index, self.configs, self.concurrency, job_reader, result_writer),
+            name=f'synthesis-worker-{worker_index}',
+            daemon=True,
+        )
+        process.start()
+        job_reader.close()
+        result_writer.close()
+        return _WorkerHandle(worker_index, process, job_writer, result_reader)
+
+    async def _monitor_workers(self) -> None:
+        """
+        Restart crashed workers and fail the jobs they were running.
+        """
+        while True:
+            await asyncio.sleep(self.monitor_interval)
+            for worker in list(self._workers):
+                if worker.process.is_alive():
+                    continue
+
+                exitcode = worker.process.exitcode
+                logging.warning('Synthesis worker %d exited with %s, restarting', worker.index, exitcode)
+                metutl.ERRORS_TOTAL.inc(stage='worker_crash', guild='')
+                for job_id in list(worker.job_ids):
+                    self._fail_job(job_id, f'Synthesis worker {worker.index} crashed')
+                # NOTE: 結果のパイプは読み込みスレッドが閉じる.
+                worker.job_conn.close()
+                self._workers[worker.index] = self._start_worker(worker.index)
+
+    def _read_results(self) -> None:
+        """
+        Receive the results from the workers on a background thread and pass them to the event loop.
+        """
+        while not self._is_closed:
+            conns = [worker.result_conn for worker in self._workers if not worker.result_conn.closed]
+            for conn in multiprocessing.connection.wait(conns, timeout=self.monitor_interval):
+                try:
+                    message = conn.recv()
+                except (EOFError, OSError):
+                    # NOTE: 落ちたワーカーのパイプ. 再起動は監視タスクが行う.
+                    conn.close()
+                    continue
+
+                if self._loop is not None and not self._loop.is_closed():
+                    self._loop.call_soon_threadsafe(self._on_result, message)
+                elif message[0] == 'done':
+                    _release_memory(_attach_memory(message[2]))
+
+    def _on_result(self, message: tuple) -> None:
+        """
+        Resolve the future of the job.
+
+        Args:
+            message (tuple): ワーカーからの通知
+        """
+        kind, job_id = message[0], message[1]
+        if kind == 'error':
+            self._fail_job(job_id, message[2])
+            return
+
+        _, _, output_name, output_size, meta = message
+        output_memory = _attach_memory(output_name)
+        job = self._jobs.get(job_id)
+        if output_memory is None or job is None or job[0].done():
+            # NOTE: タイムアウトなどで待つ人がいないジョブの結果は捨てる.
+            _release_memory(output_memory)
+            self._fail_job(job_id, 'The result of synthesis worker was lost')
+            return
+
+        # NOTE: 共有メモリから1回だけコピーしてすぐ解放する. パイプで音声データをpickleして送ることはしない.
+        output = bytes(output_memory.buf[:output_size])
+        _release_memory(output_memory)
+        job[0].set_result((output, meta))
+        self._forget_job(job_id)
+
+    def _fail_job(self, job_id: int, reason: str) -> None:
+        """
+        Fail the job with RuntimeError.
+
+        Args:
+            job_id (int): ジョブID
+            reason (str): 失敗の理由
+        """
+        job = self._jobs.get(job_id)
+        if job is not None and not job[0].done():
+            job[0].set_exception(RuntimeError(reason))
+        self._forget_job(job_id)
+
+    def _forget_job(self, job_id: int) -> None:
+        """
+        Drop the bookkeeping of the job and release its input memory.
+
+        Args:
+            job_id (int): ジョブID
+        """
+        job = self._jobs.pop(job_id, None)
+        if job is None:
+            return
+
+        _, input_memory, worker_index = job
+        self._workers[worker_index].job_ids.discard(job_id)
+        _release_memory(input_memory)
+
+
+def _send_cancel(worker: _WorkerHandle, job_id: int) -> None:
+    """
+    Ask the worker to stop the job which is no longer awaited.
+
+    Args:
+        worker (_WorkerHandle): ジョブを送ったワーカー
+        job_id (int): 止めるジョブのID
+    """
+    # NOTE: ワーカーが落ちている場合は送れないが, 再起動で合成も止まっているので無視する.
+    with contextlib.suppress(OSError):
+        worker.job_conn.send((job_id, JOB_CANCEL, None, None, 0, None))
+
+
+def _attach_memory(name: str) -> shared_memory.SharedMemory | None:
+    """
+    Attach the shared memory made by another process.
+
+    Args:
+        name (str): 共有メモリの名前
+
+    Returns:
+        shared_memory.SharedMemory | None: 共有メモリ. 既に解放されている場合はNone.
+    """
+    try:
+        return shared_memory.SharedMemory(name=name)
+    except FileNotFoundError:
+        return None
+
+
+def _release_memory(memory: shared_memory.SharedMemory | None) -> None:
+    """
+    Close and unlink the shared memory.
+
+    Args:
+        memory (shared_memory.SharedMemory | None): 解放する共有メモリ
+    """
+    if memory is None:
+        return
+
+    memory.close()
+    with contextlib.suppress(FileNotFoundError):
+        memory.unlink()
+
+
+def _worker_main(
+    worker_index: int,
+    configs: dict[str, Any],
+    concurrency: int,
+    job_conn: Connection,
+    result_conn: Connection,
+) -> None:
+    """
+    The entry point of a worker process.
+
+    Args:
+        worker_index (int): ワーカーの番号
+        configs (dict[str, Any]): config辞書
+        concurrency (int): 同時に処理するジョブ数
+        job_conn (Connection): ジョブを受け取るパイプ
+        result_conn (Connection): 結果を通知するパイプ
+    """
+    # NOTE: Ctrl+Cはbot本体が受けてワーカーを止めるので, ワーカーでは無視する.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    asyncio.run(_worker_loop(worker_index, configs, concurrency, job_conn, result_conn))
+
+
+async def _worker_loop(
+    worker_index: int,
+    configs: dict[str, Any],
+    concurrency: int,
+    job_conn: Connection,
+    result_conn: Connection,
+) -> None:
+    """
+    Receive jobs and run them concurrently until the stop signal.
+
+    Args:
+        worker_index (int): ワーカーの番号
+        configs (dict[str, Any]): config辞書
+        concurrency (int): 同時に処理するジョブ数
+        job_conn (Connection): ジョブを受け取るパイプ
+        result_conn (Connection): 結果を通知するパイプ
+    """
+    # NOTE: audio_queryのキャッシュはワーカーごとにメモリ上だけで持ち, ファイルへの保存はしない.
+    query_cache_configs = configs['TTS'].get('VOICEVOX', {}).get('QUERY_CACHE', {})
+    query_cache = None
+    if query_cache_configs.get('ENABLE', True):
+        query_cache = AudioQueryCache(max_entries=query_cache_configs.get('MAX_ENTRIES', 4096))
+    tts_client = ttsfunc.get_tts_client(configs['TTS'], query_cache)
+
+    loop = asyncio.get_running_loop()
+    slots = asyncio.Semaphore(concurrency)
+    tasks: dict[int, asyncio.Task] = {}
+    while True:
+        try:
+            job = await loop.run_in_executor(None, job_conn.recv)
+        except EOFError:
+            # NOTE: bot本体が落ちた場合. 残ったジョブの結果は受け取る人がいないので終了する.
+            break
+        if job is None:
+            break
+
+        job_id, kind = job[0], job[1]
+        if kind == JOB_CANCEL:
+            # NOTE: 取り消されたジョブは結果を送らない. 既に終わっていれば何もしない.
+            if job_id in tasks:
+                tasks[job_id].cancel()
+            continue
+
+        task = asyncio.create_task(_run_job(worker_index, tts_client, job, slots, result_conn))
+        tasks[job_id] = task
+        task.add_done_callback(lambda _, job_id=job_id: tasks.pop(job_id, None))
+
+    await asyncio.gather(*tasks.values(), return_exceptions=True)
+    if isinstance(tts_client, AsyncTTSWrapper):
+        await tts_client.close()
+
+
+async def _run_job(
+    worker_index: int,
+    tts_client: Any,  # noqa: ANN401
+    job: tuple,
+    slots: asyncio.Semaphore,
+    result_conn: Connection,
+) -> None:
+    """
+    Run one job and put the result to the shared memory.
+
+    Args:
+        worker_index (int): ワーカーの番号
+        tts_client (Any): TTSクライアントオブジェクト
+        job (tuple): (job_id, 種類, 文章またはファイル名, 入力の共有メモリ名, 入力のサイズ, 設定)
+        slots (asyncio.Semaphore): 同時に処理するジョブ数を制限するセマフォ
+        result_conn (Connection): 結果を通知するパイプ
+    """
+    job_id, kind, payload, input_name, input_size, options = job
+    try:
+        async with slots:
+            if kind == JOB_SYNTHESIZE:
+                output, meta = await _synthesize(tts_client, payload, options)
+            else:
+                output = await asyncio.to_thread(_prepare_pcm, payload, input_name, input_size, options)
+                meta = {}
+
+        output_memory = shared_memory.SharedMemory(create=True, size=max(len(output), 1))
+        output_memory.buf[: len(output)] = output
+        output_memory.close()
+    except Exception as e:  # noqa: BLE001
+        # NOTE: ワーカーは落とさずに失敗をbot本体へ知らせる.
+        result_conn.send(('error', job_id, f'{kind} failed in worker {worker_index}: {e!r}'))
+        return
+
+    result_conn.send(('done', job_id, output_memory.name, len(output), meta))
+
+
+async def _synthesize(
+    tts_client: Any,  # noqa: ANN401
+    text: str,
+    tts_configs: dict[str, Any] | None,
+) -> tuple[bytes, dict[str, Any]]:
+    """
+    Synthesize the text with the TTS client of the worker.
+
+    Args:
+        tts_client (Any): TTSクライアントオブジェクト
+        text (str): TTSで音声に変換する文章
+        tts_configs (dict[str, Any] | None): TTS用のconfig辞書
+
+    Returns:
+        tuple[bytes, dict[str, Any]]: voiceデータと, 合成したバックエンドの情報
+    """
+    if isinstance(tts_client, AsyncTTSWrapper):
+        audio_query = await tts_client.generate_audio_query(text, tts_configs)
+        voice_data = await tts_client.generate_voice(audio_query, tts_configs)
+    else:
+        audio_query = await asyncio.to_thread(tts_client.generate_audio_query, text, tts_configs)
+        voice_data = await asyncio.to_thread(tts_client.generate_voice, audio_query, tts_configs)
+
+    if isinstance(audio_query, HedgedAudioQuery):
+        return voice_data, {'served_by': audio_query.served_by, 'is_primary': audio_query.is_primary}
+    return voice_data, {'served_by': (tts_configs or {}).get('USE_TTS', ''), 'is_primary': True}
+
+
+def _prepare_pcm(file_name: str | None, input_name: str | None, input_size: int, fade_len: float) -> bytes:
+    """
+    Make the PCM for the Discord voice client from the file or the shared memory.
+
+    Args:
+        file_name (str | None): 音声ファイル名
+        input_name (str | None): 音声データの共有メモリ名
+        input_size (int): 音声データのサイズ
+        fade_len (float): フェードの長さ[秒]
+
+    Returns:
+        bytes: 48kHz, 16bit, stereoのPCM
+    """
+    if file_name is not None:
+        return sndutl.prepare_discord_pcm(Path(file_name).read_bytes(), fade_len)
+
+    input_memory = shared_memory.SharedMemory(name=input_name)
+    try:
+        # NOTE: bot本体が解放するので, ワーカーはcloseだけする.
+        return sndutl.prepare_discord_pcm(bytes(input_memory.buf[:input_size]), fade_len)
+    finally:
+        input_memory.close()
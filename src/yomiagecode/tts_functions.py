@@ -3,20 +3,137 @@
 discord bot用のTTSに関する関数を載せたファイル.
 """
 
+import asyncio
+import logging
+import time
+import wave
+from collections.abc import AsyncIterator, Awaitable, Callable, Iterator
 from typing import Any
 
+import utilities.metrics_utilities as metutl
 import utilities.sound_utilities as sndutl
+from tts.audio_query_cache import AudioQueryCache
 from tts.azure_wrapper import AzureWrapper
-from tts.voicevox_wrapper import VoicevoxWrapper
+from tts.google_tts_wrapper import AsyncGoogleTTSWrapper
+from tts.hedged_wrapper import HedgedAudioQuery, HedgedTTSWrapper, TTSBackend
+from tts.tts_wrapper import OUTPUT_FORMAT_WAV, AsyncTTSWrapper
+from tts.voicevox_pool_wrapper import VoicevoxPoolWrapper
+from tts.voicevox_wrapper import AsyncVoicevoxWrapper
+from utilities.cache_utilities import SoundCache
+from utilities.text_utilities import AdaptiveChunker, ReadingDictionary
 
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-def get_tts_client(tts_configs: dict | None = None) -> Any:  # noqa: ANN401
+# NOTE: TTSで合成するたびに(文字数, 合成時間[秒])で呼ぶ処理. 適応チャンカーの較正に使う.
+_synthesis_observers: list[Callable[[int, float], None]] = []
+
+
+class VoiceStream:
+    """
+    The voice which is still being synthesized.
+
+    Chunks are received in the background as soon as the stream is made, so a queued stream keeps
+    synthesizing ahead of the playback like a prefetched clip. The player iterates the chunks from the start.
+    """
+
+    def __init__(
+        self,
+        chunks: AsyncIterator[bytes],
+        on_complete: Callable[[bytes], Awaitable[None]] | None = None,
+    ) -> None:
+        """
+        Start receiving the chunks.
+
+        Args:
+            chunks (AsyncIterator[bytes]): wavのチャンク
+            on_complete (Callable[[bytes], Awaitable[None]] | None): 最後まで受け取れた場合に,
+                連結した音声データで呼ぶ処理(キャッシュへの保存など). Defaults to None.
+        """
+        self.chunks: list[bytes] = []
+        self.error: Exception | None = None
+        self._is_done = False
+        self._condition = asyncio.Condition()
+        self._task = asyncio.create_task(self._receive(chunks, on_complete))
+
+    def add_done_callback(self, callback: Callable[[], None]) -> None:
+        """
+        Call the callback when the synthesis has finished or failed.
+
+        Args:
+            callback (Callable[[], None]): 呼び出す処理
+        """
+        self._task.add_done_callback(lambda _: callback())
+
+    def cancel(self) -> None:
+        """
+        Stop receiving the chunks and abort the request. The partial voice is not cached.
+        """
+        self._task.cancel()
+
+    async def iter_chunks(self) -> AsyncIterator[bytes]:
+        """
+        Iterate the chunks from the start, waiting for the ones not received yet.
+
+        Yields:
+            bytes: wavのチャンク
+
+        Raises:
+            RuntimeError: If the synthesis failed.
+        """
+        index = 0
+        while True:
+            async with self._condition:
+                await self._condition.wait_for(lambda index=index: index < len(self.chunks) or self._is_done)
+                new_chunks = self.chunks[index:]
+            for chunk in new_chunks:
+                yield chunk
+            index += len(new_chunks)
+
+            if self._is_done and index == len(self.chunks):
+                if self.error is not None:
+                    raise_message = f'Failed to stream voice: {self.error!s}'
+                    raise RuntimeError(raise_message) from self.error
+                return
+
+    async def _receive(
+        self,
+        chunks: AsyncIterator[bytes],
+        on_complete: Callable[[bytes], Awaitable[None]] | None,
+    ) -> None:
+        """
+        Receive the chunks and notify the player.
+        """
+        try:
+            async for chunk in chunks:
+                async with self._condition:
+                    self.chunks.append(chunk)
+                    self._condition.notify_all()
+        except asyncio.CancelledError:
+            self.error = RuntimeError('The voice stream was cancelled')
+            raise
+        except Exception as e:  # noqa: BLE001
+            # NOTE: 失敗は再生側のiter_chunksで送出する.
+            self.error = e
+        finally:
+            async with self._condition:
+                self._is_done = True
+                self._condition.notify_all()
+
+        if self.error is None and on_complete is not None:
+            try:
+                await on_complete(b''.join(self.chunks))
+            except Exception:
+                logging.exception('Failed to complete the voice stream')
+
+
+def get_tts_client(tts_configs: dict | None = None, query_cache: AudioQueryCache | None = None) -> Any:  # noqa: ANN401
     # NOTE: どのTTSクライアントを受け取るかでどのクラスが戻るかは変わるのでAnyで返す.
     """
     TTSクライアントのクラスを受け取る関数.
 
     Args:
         tts_configs (dict or None): TTS用のconfig辞書
+        query_cache (AudioQueryCache | None): VOICEVOXのaudio_queryのキャッシュ
 
     Returns:
         Any: TTSクライアントオブジェクト
@@ -33,32 +150,538 @@ def get_tts_client(tts_configs: dict | None = None) -> Any:  # noqa: ANN401
             },
         }
 
-    if tts_configs['USE_TTS'] == 'VOICEVOX':
+    fallback_names = tts_configs.get('FALLBACK_TTS', [])
+    if len(fallback_names) == 0:
+        return _build_tts_client(tts_configs['USE_TTS'], tts_configs, query_cache)
+
+    # NOTE: 予備のバックエンドが指定された場合は, 遅延時にヘッジし失敗時に切り替える複合クライアントにまとめる.
+    hedge_configs = tts_configs.get('HEDGE', {})
+    backends = [
+        TTSBackend(
+            name,
+            _build_tts_client(name, tts_configs, query_cache),
+            latency_window=hedge_configs.get('LATENCY_WINDOW', 100),
+            default_delay=hedge_configs.get('DEFAULT_DELAY_SEC', 1.0),
+            min_delay=hedge_configs.get('MIN_DELAY_SEC', 0.2),
+            failure_threshold=hedge_configs.get('FAILURE_THRESHOLD', 3),
+            reset_timeout=hedge_configs.get('RESET_TIMEOUT_SEC', 30.0),
+        )
+        for name in [tts_configs['USE_TTS'], *fallback_names]
+    ]
+    return HedgedTTSWrapper(backends, tts_configs)
+
+
+def _build_tts_client(use_tts: str, tts_configs: dict, query_cache: AudioQueryCache | None = None) -> Any:  # noqa: ANN401
+    # NOTE: どのTTSクライアントを受け取るかでどのクラスが戻るかは変わるのでAnyで返す.
+    """
+    1つのバックエンドのTTSクライアントを作る.
+
+    Args:
+        use_tts (str): バックエンド名 ('VOICEVOX', 'AZURE', 'GOOGLE')
+        tts_configs (dict): TTS用のconfig辞書
+        query_cache (AudioQueryCache | None): VOICEVOXのaudio_queryのキャッシュ
+
+    Returns:
+        Any: TTSクライアントオブジェクト
+    """
+    if use_tts == 'VOICEVOX' and 'ENGINES' in tts_configs['VOICEVOX']:
+        # NOTE: 複数のエンジンが指定された場合はプールにまとめて負荷分散する.
+        engines = [
+            (f'{engine["HOST_IP"]}:{engine["PORT"]}', engine.get('WEIGHT', 1.0))
+            for engine in tts_configs['VOICEVOX']['ENGINES']
+        ]
+        tts_client = VoicevoxPoolWrapper(
+            engines,
+            max_connections=tts_configs['VOICEVOX'].get('MAX_CONNECTIONS', 4),
+            keepalive_timeout=tts_configs['VOICEVOX'].get('KEEPALIVE_TIMEOUT', 30.0),
+            query_cache=query_cache,
+            health_check_interval=tts_configs['VOICEVOX'].get('HEALTH_CHECK_INTERVAL', 10.0),
+            pin_query_to_engine=tts_configs['VOICEVOX'].get('PIN_QUERY_TO_ENGINE', True),
+        )
+    elif use_tts == 'VOICEVOX':
         tts_address = f'{tts_configs["VOICEVOX"]["HOST_IP"]}:{tts_configs["VOICEVOX"]["PORT"]}'
-        tts_client = VoicevoxWrapper(tts_address)
-    elif tts_configs['USE_TTS'] == 'AZURE':
+        tts_client = AsyncVoicevoxWrapper(
+            tts_address,
+            max_connections=tts_configs['VOICEVOX'].get('MAX_CONNECTIONS', 4),
+            keepalive_timeout=tts_configs['VOICEVOX'].get('KEEPALIVE_TIMEOUT', 30.0),
+            query_cache=query_cache,
+        )
+    elif use_tts == 'AZURE':
         tts_client = AzureWrapper(tts_configs)
+    elif use_tts == 'GOOGLE':
+        tts_client = AsyncGoogleTTSWrapper(tts_configs['GOOGLE'].get('CREDENTIAL_FILE'), tts_configs)
+    else:
+        raise_message = f'Unknown TTS backend: {use_tts}'
+        raise ValueError(raise_message)
 
     return tts_client
 
 
-async def make_sound_file(text: str, tts_client: Any, tts_configs: dict | None) -> str:  # noqa: ANN401
+def get_audio_query_cache(tts_configs: dict | None = None) -> AudioQueryCache | None:
+    """
+    VOICEVOXのaudio_queryのキャッシュを受け取る関数.
+
+    Args:
+        tts_configs (dict or None): TTS用のconfig辞書
+
+    Returns:
+        AudioQueryCache | None: キャッシュオブジェクト. 無効化されている場合はNone.
+    """
+    cache_configs = (tts_configs or {}).get('VOICEVOX', {}).get('QUERY_CACHE', {})
+    if not cache_configs.get('ENABLE', True):
+        return None
+
+    return AudioQueryCache(
+        max_entries=cache_configs.get('MAX_ENTRIES', 4096),
+        cache_file=cache_configs.get('FILE'),
+    )
+
+
+def get_sound_cache(tts_configs: dict | None = None) -> SoundCache | None:
+    """
+    合成済み音声のキャッシュを受け取る関数.
+
+    Args:
+        tts_configs (dict or None): TTS用のconfig辞書
+
+    Returns:
+        SoundCache | None: キャッシュオブジェクト. 無効化されている場合はNone.
+    """
+    cache_configs = (tts_configs or {}).get('CACHE', {})
+    if not cache_configs.get('ENABLE', True):
+        return None
+
+    return SoundCache(
+        cache_dir=cache_configs.get('DIRECTORY', './data/sound_cache'),
+        max_memory_bytes=int(cache_configs.get('MAX_MEMORY_MB', 32) * 1024 * 1024),
+        max_disk_bytes=int(cache_configs.get('MAX_DISK_MB', 512) * 1024 * 1024),
+        max_age_sec=cache_configs.get('MAX_AGE_HOURS', 7 * 24) * 60 * 60,
+    )
+
+
+def get_reading_dictionary(tts_configs: dict | None = None) -> ReadingDictionary | None:
+    """
+    読み上げ前に単語を読みに置き換える辞書を受け取る関数.
+
+    Args:
+        tts_configs (dict or None): TTS用のconfig辞書
+
+    Returns:
+        ReadingDictionary | None: 辞書オブジェクト. 無効化されている場合はNone.
+    """
+    dictionary_configs = (tts_configs or {}).get('READING_DICTIONARY', {})
+    if not dictionary_configs.get('ENABLE', True):
+        return None
+
+    return ReadingDictionary(dictionary_configs.get('FILE', './data/reading_dictionary.json'))
+
+
+def get_chunker(tts_configs: dict | None = None) -> AdaptiveChunker | None:
+    """
+    区間を合成の単位にまとめるチャンカーを受け取る関数.
+
+    NOTE: TTSで合成するたびに合成時間を観測して較正する.
+
+    Args:
+        tts_configs (dict or None): TTS用のconfig辞書
+
+    Returns:
+        AdaptiveChunker | None: チャンカー. 無効化されている場合はNone.
+    """
+    chunker_configs = (tts_configs or {}).get('CHUNKER', {})
+    if not chunker_configs.get('ENABLE', True):
+        return None
+
+    chunker = AdaptiveChunker.from_configs(chunker_configs)
+    add_synthesis_observer(chunker.observe)
+    return chunker
+
+
+def add_synthesis_observer(observer: Callable[[int, float], None]) -> None:
+    """
+    TTSで合成するたびに, 合成した文字数と合成時間[秒]で呼ぶ処理を登録する.
+
+    Args:
+        observer (Callable[[int, float], None]): 呼び出す処理
+    """
+    _synthesis_observers.append(observer)
+
+
+async def make_sound(
+    text: str,
+    tts_client: Any,  # noqa: ANN401
+    tts_configs: dict | None,
+    sound_cache: SoundCache | None = None,
+) -> bytes | str | VoiceStream:
+    # NOTE: どのTTSクライアントを受け取るかでどのクラスかが変わるのでAny.
+    """
+    TTS.AUDIO_MODEに従って音声データまたは音声ファイルを生成する.
+
+    Args:
+        text (str): TTSで音声に変換する文章
+        tts_client (Any): TTSクライアントオブジェクト
+        tts_configs (dict or None): TTS用のconfig辞書
+        sound_cache (SoundCache | None): 合成済み音声のキャッシュ. Noneの場合は毎回TTSで生成する.
+
+    Returns:
+        bytes | str | VoiceStream: 'memory'の場合は音声データ, 'file'の場合は音声ファイル名.
+            TTS.STREAMINGが有効でキャッシュに無い場合は合成中の音声.
+    """
+    if _is_streamable(tts_client, tts_configs):
+        return await make_sound_stream(text, tts_client, tts_configs, sound_cache)
+
+    if tts_configs.get('AUDIO_MODE', 'memory') == 'file':
+        return await make_sound_file(text, tts_client, tts_configs, sound_cache)
+
+    return await make_sound_data(text, tts_client, tts_configs, sound_cache)
+
+
+async def make_sounds(
+    texts: list[str],
+    tts_client: Any,  # noqa: ANN401
+    tts_configs: dict | None,
+    sound_cache: SoundCache | None = None,
+) -> list[bytes | str]:
+    # NOTE: どのTTSクライアントを受け取るかでどのクラスかが変わるのでAny.
+    """
+    複数の文章の音声を, 対応しているTTSクライアントではまとめて1回の合成で生成する.
+
+    NOTE: キャッシュに有る文章はキャッシュを使い, 無い文章だけをまとめて合成する.
+
+    Args:
+        texts (list[str]): TTSで音声に変換する文章のリスト
+        tts_client (Any): TTSクライアントオブジェクト
+        tts_configs (dict or None): TTS用のconfig辞書
+        sound_cache (SoundCache | None): 合成済み音声のキャッシュ. Noneの場合は毎回TTSで生成する.
+
+    Returns:
+        list[bytes | str]: textsの順に並んだ音声データまたは音声ファイル名. 形式はmake_soundと同じ.
+    """
+    if not hasattr(tts_client, 'generate_voices_batch'):
+        return list(await asyncio.gather(*[make_sound(t, tts_client, tts_configs, sound_cache) for t in texts]))
+
+    voice_data_list = [None] * len(texts)
+    if sound_cache is not None:
+        cache_keys = [sound_cache.make_key(text, tts_configs) for text in texts]
+        voice_data_list = [await asyncio.to_thread(sound_cache.get, cache_key) for cache_key in cache_keys]
+
+    missing_indices = [i for i, voice_data in enumerate(voice_data_list) if voice_data is None]
+    guild = metutl.GUILD_LABEL.get()
+    metutl.CLIPS_TOTAL.inc(len(texts) - len(missing_indices), source='cache', guild=guild)
+    if len(missing_indices) > 0:
+        missing_texts = [texts[i] for i in missing_indices]
+        backend = tts_configs.get('USE_TTS', '')
+        start = time.perf_counter()
+        if isinstance(tts_client, AsyncTTSWrapper):
+            generated_list = await tts_client.generate_voices_batch(missing_texts, tts_configs)
+        else:
+            generated_list = await asyncio.to_thread(tts_client.generate_voices_batch, missing_texts, tts_configs)
+        elapsed = time.perf_counter() - start
+        metutl.STAGE_SECONDS.observe(elapsed, stage='voices_batch', backend=backend, guild=guild)
+        metutl.CLIPS_TOTAL.inc(len(missing_indices), source='tts', guild=guild)
+        _observe_real_time_factor(elapsed, generated_list, backend)
+        _notify_synthesis(sum(map(len, missing_texts)), elapsed)
+
+        for i, voice_data in zip(missing_indices, generated_list, strict=True):
+            voice_data_list[i] = voice_data
+            if sound_cache is not None:
+                with metutl.observe_stage('wav_write'):
+                    suffix = sndutl.get_audio_suffix(voice_data)
+                    await asyncio.to_thread(sound_cache.put, cache_keys[i], voice_data, suffix)
+
+    if tts_configs.get('AUDIO_MODE', 'memory') != 'file':
+        return voice_data_list
+
+    file_names = []
+    for i, voice_data in enumerate(voice_data_list):
+        file_name = await asyncio.to_thread(sound_cache.get_file, cache_keys[i]) if sound_cache is not None else None
+        if file_name is None:
+            with metutl.observe_stage('wav_write'):
+                file_name = await asyncio.to_thread(sndutl.generate_temp_wav, voice_data)
+        file_names.append(file_name)
+
+    return file_names
+
+
+async def make_sound_data(
+    text: str,
+    tts_client: Any,  # noqa: ANN401
+    tts_configs: dict | None,
+    sound_cache: SoundCache | None = None,
+) -> bytes:
+    # NOTE: どのTTSクライアントを受け取るかでどのクラスかが変わるのでAny.
+    """
+    Generate voice data for the given text buffer without writing a temporary file.
+
+    Args:
+        text (str): TTSで音声に変換する文章
+        tts_client (Any): TTSクライアントオブジェクト
+        tts_configs (dict or None): TTS用のconfig辞書
+        sound_cache (SoundCache | None): 合成済み音声のキャッシュ. Noneの場合は毎回TTSで生成する.
+
+    Returns:
+        bytes: voiceデータ
+    """
+    voice_data, _ = await make_cacheable_sound_data(text, tts_client, tts_configs, sound_cache)
+    return voice_data
+
+
+async def make_cacheable_sound_data(
+    text: str,
+    tts_client: Any,  # noqa: ANN401
+    tts_configs: dict | None,
+    sound_cache: SoundCache | None = None,
+) -> tuple[bytes, bool]:
+    # NOTE: どのTTSクライアントを受け取るかでどのクラスかが変わるのでAny.
+    """
+    make_sound_dataと同じく音声データを生成し, 合わせてキャッシュキーの声として残してよいかを返す.
+
+    Args:
+        text (str): TTSで音声に変換する文章
+        tts_client (Any): TTSクライアントオブジェクト
+        tts_configs (dict or None): TTS用のconfig辞書
+        sound_cache (SoundCache | None): 合成済み音声のキャッシュ. Noneの場合は毎回TTSで生成する.
+
+    Returns:
+        tuple[bytes, bool]: voiceデータと, キャッシュしてよいか. 予備のバックエンドの声の場合はFalse.
+    """
+    if sound_cache is not None:
+        cache_key = sound_cache.make_key(text, tts_configs)
+        voice_data = await asyncio.to_thread(sound_cache.get, cache_key)
+        if voice_data is not None:
+            metutl.CLIPS_TOTAL.inc(source='cache', guild=metutl.GUILD_LABEL.get())
+            return voice_data, True
+
+    voice_data, is_cacheable = await _generate_voice_data(text, tts_client, tts_configs)
+    if sound_cache is not None and is_cacheable:
+        with metutl.observe_stage('wav_write'):
+            await asyncio.to_thread(sound_cache.put, cache_key, voice_data, sndutl.get_audio_suffix(voice_data))
+
+    return voice_data, is_cacheable
+
+
+async def make_sound_file(
+    text: str,
+    tts_client: Any,  # noqa: ANN401
+    tts_configs: dict | None,
+    sound_cache: SoundCache | None = None,
+) -> str:
     # NOTE: どのTTSクライアントを受け取るかでどのクラスかが変わるのでAny.
     """
     Generate and play voice for the given text buffer.
 
+    NOTE: キャッシュが無い場合は一時ファイルを作るので, 再生後にsndutl.remove_temp_wavで削除すること.
+
     Args:
         text (str): TTSで音声に変換する文章
         tts_client (Any): TTSクライアントオブジェクト
         tts_configs (dict or None): TTS用のconfig辞書
+        sound_cache (SoundCache | None): 合成済み音声のキャッシュ. Noneの場合は毎回TTSで生成する.
 
     Returns:
         str: voiceデータのファイルネーム
     """
-    audio_query = tts_client.generate_audio_query(text, tts_configs)
-    voice_data = tts_client.generate_voice(audio_query, tts_configs)
-    if type(voice_data) is str:
-        # NOTE: Azureの場合はファイル名が返ってくるのでそのまま返す.
-        return voice_data
+    if sound_cache is not None:
+        cache_key = sound_cache.make_key(text, tts_configs)
+        cached_file_name = await asyncio.to_thread(sound_cache.get_file, cache_key)
+        if cached_file_name is not None:
+            metutl.CLIPS_TOTAL.inc(source='cache', guild=metutl.GUILD_LABEL.get())
+            return cached_file_name
+
+    voice_data, is_cacheable = await _generate_voice_data(text, tts_client, tts_configs)
+    with metutl.observe_stage('wav_write'):
+        if sound_cache is not None and is_cacheable:
+            return await asyncio.to_thread(sound_cache.put, cache_key, voice_data, sndutl.get_audio_suffix(voice_data))
+
+        return await asyncio.to_thread(sndutl.generate_temp_wav, voice_data)
+
+
+async def make_sound_stream(
+    text: str,
+    tts_client: Any,  # noqa: ANN401
+    tts_configs: dict | None,
+    sound_cache: SoundCache | None = None,
+) -> bytes | str | VoiceStream:
+    # NOTE: どのTTSクライアントを受け取るかでどのクラスかが変わるのでAny.
+    """
+    キャッシュに無い音声を, 合成しながら再生できるように生成する.
+
+    Args:
+        text (str): TTSで音声に変換する文章
+        tts_client (Any): TTSクライアントオブジェクト
+        tts_configs (dict or None): TTS用のconfig辞書
+        sound_cache (SoundCache | None): 合成済み音声のキャッシュ. 合成し終えた音声を保存する.
+
+    Returns:
+        bytes | str | VoiceStream: キャッシュに有る場合はmake_soundと同じ形式, 無い場合は合成中の音声
+    """
+    is_file_mode = tts_configs.get('AUDIO_MODE', 'memory') == 'file'
+    if sound_cache is not None:
+        cache_key = sound_cache.make_key(text, tts_configs)
+        cached = await asyncio.to_thread(sound_cache.get_file if is_file_mode else sound_cache.get, cache_key)
+        if cached is not None:
+            metutl.CLIPS_TOTAL.inc(source='cache', guild=metutl.GUILD_LABEL.get())
+            return cached
 
-    return sndutl.generate_temp_wav(voice_data)
+    backend = tts_configs.get('USE_TTS', '')
+    guild = metutl.GUILD_LABEL.get()
+    start = time.perf_counter()
+    if isinstance(tts_client, AsyncTTSWrapper):
+        audio_query = await tts_client.generate_audio_query(text, tts_configs)
+        chunks = tts_client.stream_voice(audio_query, tts_configs)
+    else:
+        audio_query = await asyncio.to_thread(tts_client.generate_audio_query, text, tts_configs)
+        chunks = _iterate_in_thread(tts_client.stream_voice(audio_query, tts_configs))
+    query_end = time.perf_counter()
+    metutl.STAGE_SECONDS.observe(query_end - start, stage='audio_query', backend=backend, guild=guild)
+
+    async def on_complete(voice_data: bytes) -> None:
+        end = time.perf_counter()
+        voice_data = sndutl.repair_wav_header(voice_data)
+        is_cacheable = True
+        served_by = backend
+        if isinstance(audio_query, HedgedAudioQuery):
+            # NOTE: 予備のバックエンドの声はキャッシュキーの話者と違うのでキャッシュしない.
+            is_cacheable = audio_query.is_primary
+            served_by = audio_query.served_by
+
+        metutl.STAGE_SECONDS.observe(end - query_end, stage='voice', backend=served_by, guild=guild)
+        metutl.CLIPS_TOTAL.inc(source='tts', guild=guild)
+        _observe_real_time_factor(end - start, [voice_data], served_by)
+        if not is_cacheable:
+            return
+
+        _notify_synthesis(len(text), end - start)
+        if sound_cache is not None:
+            with metutl.observe_stage('wav_write'):
+                suffix = sndutl.get_audio_suffix(voice_data)
+                await asyncio.to_thread(sound_cache.put, cache_key, voice_data, suffix)
+
+    return VoiceStream(chunks, on_complete)
+
+
+def _is_streamable(tts_client: Any, tts_configs: dict) -> bool:  # noqa: ANN401
+    """
+    TTS.STREAMINGが有効で, クライアントが合成の途中から音声を返せるか判定する.
+
+    NOTE: 流しながらデコードできるのはwavだけなので, Ogg/Opusを要求している場合は流さない.
+
+    Args:
+        tts_client (Any): TTSクライアントオブジェクト
+        tts_configs (dict): TTS用のconfig辞書
+
+    Returns:
+        bool: 合成しながら再生するか
+    """
+    if not tts_configs.get('STREAMING', False) or not getattr(tts_client, 'supports_streaming', False):
+        return False
+
+    return tts_client.get_output_format(tts_configs) == OUTPUT_FORMAT_WAV
+
+
+async def _iterate_in_thread(iterator: Iterator[bytes]) -> AsyncIterator[bytes]:
+    """
+    同期APIのクライアントが返すイテレータを, イベントループを止めないようにスレッドで回す.
+
+    NOTE: 読み上げが取り消された場合も, イテレータを閉じてクライアントの資源(Azureのシンセサイザなど)を返す.
+
+    Args:
+        iterator (Iterator[bytes]): 音声のチャンクのイテレータ
+
+    Yields:
+        bytes: 音声のチャンク
+    """
+    sentinel = object()
+    pending: asyncio.Task | None = None
+    try:
+        while True:
+            pending = asyncio.create_task(asyncio.to_thread(next, iterator, sentinel))
+            # NOTE: 取り消されてもスレッドのnextは止まらない. 実行中のイテレータは閉じられないので,
+            #       shieldで包んで, 閉じる前にnextの終わりを待てるようにする.
+            chunk = await asyncio.shield(pending)
+            if chunk is sentinel:
+                return
+            yield chunk
+    finally:
+        if pending is not None:
+            await asyncio.gather(pending, return_exceptions=True)
+        close = getattr(iterator, 'close', None)
+        if close is not None:
+            await asyncio.to_thread(close)
+
+
+async def _generate_voice_data(
+    text: str,
+    tts_client: Any,  # noqa: ANN401
+    tts_configs: dict | None,
+) -> tuple[bytes, bool]:
+    """
+    TTSクライアントで音声データを生成する.
+
+    Args:
+        text (str): TTSで音声に変換する文章
+        tts_client (Any): TTSクライアントオブジェクト
+        tts_configs (dict or None): TTS用のconfig辞書
+
+    Returns:
+        tuple[bytes, bool]: voiceデータと, キャッシュしてよいか
+    """
+    backend = tts_configs.get('USE_TTS', '')
+    guild = metutl.GUILD_LABEL.get()
+    start = time.perf_counter()
+    if isinstance(tts_client, AsyncTTSWrapper):
+        audio_query = await tts_client.generate_audio_query(text, tts_configs)
+        query_end = time.perf_counter()
+        voice_data = await tts_client.generate_voice(audio_query, tts_configs)
+    else:
+        # NOTE: 同期APIのクライアントはイベントループを止めないようにスレッドで実行する.
+        audio_query = await asyncio.to_thread(tts_client.generate_audio_query, text, tts_configs)
+        query_end = time.perf_counter()
+        voice_data = await asyncio.to_thread(tts_client.generate_voice, audio_query, tts_configs)
+    end = time.perf_counter()
+
+    is_cacheable = True
+    if isinstance(audio_query, HedgedAudioQuery):
+        # NOTE: 予備のバックエンドの声はキャッシュキーの話者と違うのでキャッシュしない.
+        is_cacheable = audio_query.is_primary
+        backend = audio_query.served_by
+
+    metutl.STAGE_SECONDS.observe(query_end - start, stage='audio_query', backend=backend, guild=guild)
+    metutl.STAGE_SECONDS.observe(end - query_end, stage='voice', backend=backend, guild=guild)
+    metutl.CLIPS_TOTAL.inc(source='tts', guild=guild)
+    _observe_real_time_factor(end - start, [voice_data], backend)
+    if is_cacheable:
+        # NOTE: チャンクの大きさは主のバックエンドで決めるので, 予備のバックエンドの時間は学習しない.
+        _notify_synthesis(len(text), end - start)
+    return voice_data, is_cacheable
+
+
+def _observe_real_time_factor(elapsed: float, voice_data_list: list[bytes], backend: str) -> None:
+    """
+    合成時間を音声の長さで割った実時間比を記録する.
+
+    Args:
+        elapsed (float): 合成に掛かった時間[秒]
+        voice_data_list (list[bytes]): 合成した音声データのリスト
+        backend (str): TTSのバックエンド名
+    """
+    try:
+        duration = sum(sndutl.get_audio_duration(voice_data) for voice_data in voice_data_list)
+    except (wave.Error, EOFError, ValueError):
+        # NOTE: wavとOgg/Opus以外の形式では長さが分からないので記録しない.
+        return
+
+    if duration > 0:
+        metutl.SYNTHESIS_RTF.observe(elapsed / duration, backend=backend)
+
+
+def _notify_synthesis(char_count: int, elapsed: float) -> None:
+    """
+    合成した文字数と合成時間を, 登録された処理に知らせる.
+
+    Args:
+        char_count (int): 合成した文字数
+        elapsed (float): 合成に掛かった時間[秒]
+    """
+    for observer in _synthesis_observers:
+        observer(char_count, elapsed)